@@ -8,15 +8,19 @@ printHelpAndExit() {
     echo "-t TOPFILE : path of top file (required)"
     echo "-T TOPLATESTFILE : path of top_latest file (required)"
     echo "-k S3_ENCRYPT_KEY_ID : KMS key to encrypt s3 files with"
+    echo "-i JOBID : awsem job id (for the status document of the job)"
+    echo "-s JOBSTATUSFILE : path of the local status document of the job"
     exit "$1"
 }
-while getopts "l:L:t:T:k:" opt; do
+while getopts "l:L:t:T:k:i:s:" opt; do
     case $opt in
         l) export LOGBUCKET=$OPTARG;;  # bucket for sending log file
         L) export LOGFILE=$OPTARG;;  # path of log file
         t) export TOPFILE=$OPTARG;;  # path of top file
         T) export TOPLATESTFILE=$OPTARG;;  # path of top_latest file
         k) export S3_ENCRYPT_KEY_ID=$OPTARG;;  # KMS key ID to encrypt s3 files with
+        i) export JOBID=$OPTARG;;  # awsem job id
+        s) export JOBSTATUSFILE=$OPTARG;;  # path of the local status document of the job
         h) printHelpAndExit 0;;
         [?]) printHelpAndExit 1;;
         esac
@@ -46,10 +50,20 @@ send_log(){
   fi
 }
 
+# function that refreshes the heartbeat of the status document of the job on s3
+update_job_status(){
+  if [ -z "$S3_ENCRYPT_KEY_ID" ];
+  then
+    /usr/local/bin/awsf3 update_job_status -j $JOBID -l $LOGBUCKET -s $JOBSTATUSFILE -L $LOGFILE;
+  else
+    /usr/local/bin/awsf3 update_job_status -j $JOBID -l $LOGBUCKET -s $JOBSTATUSFILE -L $LOGFILE -k $S3_ENCRYPT_KEY_ID;
+  fi
+}
+
 # add margin and timestamp to a command
 stamp_command() { echo; echo -n 'Timestamp: '; date +%F-%H:%M:%S; $@; echo; }
 
 extp stamp_command top -b -n 1 -i -c -w512
 send_top
 send_log
-
+if [ ! -z "$JOBSTATUSFILE" ]; then update_job_status; fi
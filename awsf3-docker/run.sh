@@ -4,18 +4,21 @@ export SINGULARITY_OPTION=
 export STATUS=0
 export LOGBUCKET=
 export S3_ENCRYPT_KEY_ID=
+export PACKED=false
+export DOCKER_NET_OPTION=
 
 printHelpAndExit() {
-    echo "Usage: ${0##*/} -i JOBID -l LOGBUCKET -f EBS_DEVICE [-S STATUS] [-g]"
+    echo "Usage: ${0##*/} -i JOBID -l LOGBUCKET -f EBS_DEVICE [-S STATUS] [-g] [-k S3_ENCRYPT_KEY_ID] [-n]"
     echo "-i JOBID : awsem job id (required)"
     echo "-l LOGBUCKET : bucket for sending log file (required)"
     echo "-f EBS_DEVICE : file system (/dev/xxxx) for data EBS"
     echo "-S STATUS: inherited status environment variable, if any"
     echo "-g : use singularity"
     echo "-k S3_ENCRYPT_KEY_ID : KMS key to encrypt s3 files with"
+    echo "-n : the instance is shared with other jobs (packed jobs), each in its own awsf container"
     exit "$1"
 }
-while getopts "i:l:f:S:gk:" opt; do
+while getopts "i:l:f:S:gk:n" opt; do
     case $opt in
         i) export JOBID=$OPTARG;;
         l) export LOGBUCKET=$OPTARG;;  # bucket for sending log file
@@ -23,6 +26,7 @@ while getopts "i:l:f:S:gk:" opt; do
         S) export STATUS=$OPTARG;;  # inherited STATUS env
         g) export SINGULARITY_OPTION=--singularity;;  # use singularity
         k) export S3_ENCRYPT_KEY_ID=$OPTARG;;  # KMS key ID to encrypt s3 files with
+        n) export PACKED=true;;  # the instance is shared with other jobs
         h) printHelpAndExit 0;;
         [?]) printHelpAndExit 1;;
         esac
@@ -45,6 +49,7 @@ export LOGJSONFILE=$LOCAL_OUTDIR/$JOBID.log.json
 export ERRFILE=$LOCAL_OUTDIR/$JOBID.error  # if this is found on s3, that means something went wrong.
 export TOPFILE=$LOCAL_OUTDIR/$JOBID.top  # now top command output goes to a separate file
 export TOPLATESTFILE=$LOCAL_OUTDIR/$JOBID.top_latest  # this one includes only the latest top command output
+export JOBSTATUSFILE=$LOCAL_OUTDIR/$JOBID.status.json  # local copy of the status document of the job
 # IMDSv2-safe metadata
 export INSTANCE_ID=$(python3 -c "from ec2_metadata import ec2_metadata; print(ec2_metadata.instance_id)")
 export INSTANCE_AVAILABILITY_ZONE=$(python3 -c "from ec2_metadata import ec2_metadata; print(ec2_metadata.availability_zone)")
@@ -110,8 +115,25 @@ send_success(){
   fi
 }
 
+# function that resumes the step function execution waiting for the end of the job (wait_for_completion_event), if any
+notify_job_completion(){
+  awsf3 notify_job_completion -j $JOBID -l $LOGBUCKET >> /dev/null 2>&1;
+}
+
+# function that updates the status document of the job (<jobid>.status.json) on s3
+## usage: update_job_status <phase> [<exit_status>]
+update_job_status(){
+  if [ -z "$2" ]; then _EXIT_STATUS_OPTION=; else _EXIT_STATUS_OPTION="-e $2"; fi
+  if [ -z "$S3_ENCRYPT_KEY_ID" ];
+  then
+    awsf3 update_job_status -j $JOBID -l $LOGBUCKET -s $JOBSTATUSFILE -L $LOGFILE -p $1 $_EXIT_STATUS_OPTION >> /dev/null 2>&1;
+  else
+    awsf3 update_job_status -j $JOBID -l $LOGBUCKET -s $JOBSTATUSFILE -L $LOGFILE -p $1 $_EXIT_STATUS_OPTION -k $S3_ENCRYPT_KEY_ID >> /dev/null 2>&1;
+  fi
+}
+
 # function that handles errors - this function calls send_error and send_log
-handle_error() {  ERRCODE=$1; export STATUS+=,$ERRCODE; if [ "$ERRCODE" -ne 0 ]; then send_error; send_log; exit $ERRCODE; fi; }  ## usage: handle_error <error_code>
+handle_error() {  ERRCODE=$1; export STATUS+=,$ERRCODE; if [ "$ERRCODE" -ne 0 ]; then send_error; send_log; update_job_status failed $ERRCODE; notify_job_completion; exit $ERRCODE; fi; }  ## usage: handle_error <error_code>
 
 
 # make sure log bucket is defined
@@ -136,10 +158,18 @@ exl echo
 exl echo "## AWSF Docker container created"
 exl echo "## instance id: $INSTANCE_ID"
 exl echo "## instance region: $INSTANCE_REGION"
+update_job_status started
 
 # docker start
 exl echo
 exl echo "## Starting docker in the AWSF container"
+if [ "$PACKED" = true ]; then
+  # the docker daemons of the jobs that share the instance cannot all create the default bridge network
+  # in the host network namespace, so the containers of a packed job use the host network instead.
+  exl echo "## Packed job: docker uses the host network"
+  echo '{"data-root": "/mnt/data1/docker", "bridge": "none", "iptables": false}' > /etc/docker/daemon.json
+  export DOCKER_NET_OPTION="--net host"
+fi
 exl service docker start
 
 
@@ -211,6 +241,7 @@ send_log
 
 
 ### download data & reference files from s3
+update_job_status downloading
 exl echo
 exl echo "## Downloading data & reference files from S3"
 exl date
@@ -248,14 +279,15 @@ exl echo "## Setting up and starting cron job for top commands"
 exl service cron start
 if [ -z "$S3_ENCRYPT_KEY_ID" ];
 then
-  echo "*/1 * * * * /usr/local/bin/cron.sh -l $LOGBUCKET -L $LOGFILE -t $TOPFILE -T $TOPLATESTFILE" | crontab -
+  echo "*/1 * * * * AWS_REGION=$AWS_REGION /usr/local/bin/cron.sh -l $LOGBUCKET -L $LOGFILE -t $TOPFILE -T $TOPLATESTFILE -i $JOBID -s $JOBSTATUSFILE" | crontab -
 else
-  echo "*/1 * * * * /usr/local/bin/cron.sh -l $LOGBUCKET -L $LOGFILE -t $TOPFILE -T $TOPLATESTFILE -k $S3_ENCRYPT_KEY_ID" | crontab -
+  echo "*/1 * * * * AWS_REGION=$AWS_REGION /usr/local/bin/cron.sh -l $LOGBUCKET -L $LOGFILE -t $TOPFILE -T $TOPLATESTFILE -i $JOBID -s $JOBSTATUSFILE -k $S3_ENCRYPT_KEY_ID" | crontab -
 fi
 
 
 
 ### run command
+update_job_status running
 exl echo
 exl echo "## Running CWL/WDL/Snakemake/Shell commands"
 exl echo
@@ -291,13 +323,13 @@ then
 elif [[ $LANGUAGE == 'snakemake' ]]
 then
   exl echo "running $COMMAND in docker image $CONTAINER_IMAGE..."
-  docker run --privileged -v $EBS_DIR:$EBS_DIR:rw -w $LOCAL_WFDIR $DOCKER_ENV_OPTION $CONTAINER_IMAGE sh -c "$COMMAND" >> $LOGFILE 2>> $LOGFILE;
+  docker run --privileged $DOCKER_NET_OPTION -v $EBS_DIR:$EBS_DIR:rw -w $LOCAL_WFDIR $DOCKER_ENV_OPTION $CONTAINER_IMAGE sh -c "$COMMAND" >> $LOGFILE 2>> $LOGFILE;
   handle_error $?
 elif [[ $LANGUAGE == 'shell' ]]
 then
   exl echo "running $COMMAND in docker image $CONTAINER_IMAGE..."
-  exl echo "docker run --privileged -v $EBS_DIR:$EBS_DIR:rw -w $LOCAL_WFDIR $DOCKER_ENV_OPTION $CONTAINER_IMAGE sh -c \"$COMMAND\""
-  docker run --privileged -v $EBS_DIR:$EBS_DIR:rw -w $LOCAL_WFDIR $DOCKER_ENV_OPTION $CONTAINER_IMAGE sh -c "$COMMAND" >> $LOGFILE 2>> $LOGFILE;
+  exl echo "docker run --privileged $DOCKER_NET_OPTION -v $EBS_DIR:$EBS_DIR:rw -w $LOCAL_WFDIR $DOCKER_ENV_OPTION $CONTAINER_IMAGE sh -c \"$COMMAND\""
+  docker run --privileged $DOCKER_NET_OPTION -v $EBS_DIR:$EBS_DIR:rw -w $LOCAL_WFDIR $DOCKER_ENV_OPTION $CONTAINER_IMAGE sh -c "$COMMAND" >> $LOGFILE 2>> $LOGFILE;
   handle_error $?
 else
   if [[ $LANGUAGE == 'cwl_draft3' ]]
@@ -369,6 +401,7 @@ then
   cd $cwd0
 fi
 
+update_job_status uploading
 exl echo
 exl echo "## Uploading output files to S3"
 if [[ $LANGUAGE == 'snakemake' || $LANGUAGE == 'shell' ]]
@@ -407,4 +440,9 @@ exl date
 send_log
 
 # send success message
-if [ ! -z $JOB_STATUS -a $JOB_STATUS == 0 ]; then touch $JOBID.success; send_success; fi
+if [ ! -z $JOB_STATUS -a $JOB_STATUS == 0 ]; then
+  update_job_status succeeded 0; touch $JOBID.success; send_success;
+else
+  update_job_status failed $JOB_STATUS;
+fi
+notify_job_completion
@@ -25,7 +25,10 @@ class Subcommands(object):
             'update_postrun_json_init': 'update json json with instance ID and file system',
             'upload_postrun_json': 'upload postrun json file',
             'update_postrun_json_upload_output': 'update json json with output paths/target/md5 and upload outupt',
-            'update_postrun_json_final': 'update postrun json with status, time stamp etc'
+            'update_postrun_json_final': 'update postrun json with status, time stamp etc',
+            'wait_for_pool_job': 'wait in the warm pool for the next job and print its job id',
+            'notify_job_completion': 'resume the step function execution waiting for the end of the job, if any',
+            'update_job_status': 'update the status document of the job (phase, heartbeat) and upload it to s3'
         }
 
     @property
@@ -54,6 +57,21 @@ class Subcommands(object):
                 [{'flag': ["-i", "--input-json"], 'help': "input run/postrun json file"},
                  {'flag': ["-o", "--output-json"], 'help': "output postrun json file"},
                  {'flag': ["-l", "--logfile"], 'help': "Tibanna awsem log file"}],
+            'wait_for_pool_job':
+                [{'flag': ["-i", "--input-json"], 'help': "run json file of the previous job"},
+                 {'flag': ["-I", "--instance-id"], 'help': "instance id"},
+                 {'flag': ["-T", "--instance-type"], 'help': "instance type"}],
+            'notify_job_completion':
+                [{'flag': ["-j", "--jobid"], 'help': "job id"},
+                 {'flag': ["-l", "--logbucket"], 'help': "log bucket"}],
+            'update_job_status':
+                [{'flag': ["-j", "--jobid"], 'help': "job id"},
+                 {'flag': ["-l", "--logbucket"], 'help': "log bucket"},
+                 {'flag': ["-s", "--status-file"], 'help': "local status document of the job"},
+                 {'flag': ["-p", "--phase"], 'help': "new phase of the job (only a heartbeat if not specified)"},
+                 {'flag': ["-e", "--exit-status"], 'help': "exit status of the job"},
+                 {'flag': ["-L", "--logfile"], 'help': "Tibanna awsem log file (for the last activity)"},
+                 {'flag': ["-k", "--kms-key-id"], 'help': "kms-key-id to use for encrypting s3 files"}],
         }
 
 
@@ -81,6 +99,21 @@ def update_postrun_json_final(input_json, output_json, logfile):
     utils.update_postrun_json_final(input_json, output_json, logfile)
 
 
+def wait_for_pool_job(input_json, instance_id, instance_type):
+    jobid = utils.wait_for_pool_job(input_json, instance_id, instance_type)
+    if jobid:
+        print(jobid)
+
+
+def notify_job_completion(jobid, logbucket):
+    utils.notify_job_completion(jobid, logbucket)
+
+
+def update_job_status(jobid, logbucket, status_file, phase=None, exit_status=None, logfile=None, kms_key_id=None):
+    utils.update_job_status(jobid, logbucket, status_file, phase=phase, exit_status=exit_status,
+                            logfile=logfile, kms_key_id=kms_key_id)
+
+
 def main(Subcommands=Subcommands):
     """
     Execute the program from the command line
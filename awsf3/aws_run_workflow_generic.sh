@@ -10,9 +10,12 @@ export REGION=
 export SINGULARITY_OPTION_TO_PASS=
 export DISABLE_METRICS_COLLECTION=false
 export S3_ENCRYPT_KEY_ID=
+export PACKED_JOBS=
+export WARM_POOL=false
+export PACKED_JOB_WAIT_TRIES=60  # wait up to 30 min for the run json of a packed job
 
 printHelpAndExit() {
-    echo "Usage: ${0##*/} -i JOBID -l LOGBUCKET -V VERSION -A AWSF_IMAGE [-m SHUTDOWN_MIN] [-p PASSWORD] [-a ACCESS_KEY] [-s SECRET_KEY] [-r REGION] [-g] [-c] [-k S3_ENCRYPT_KEY_ID]"
+    echo "Usage: ${0##*/} -i JOBID -l LOGBUCKET -V VERSION -A AWSF_IMAGE [-m SHUTDOWN_MIN] [-p PASSWORD] [-a ACCESS_KEY] [-s SECRET_KEY] [-r REGION] [-g] [-c] [-k S3_ENCRYPT_KEY_ID] [-P PACKED_JOBS] [-w]"
     echo "-i JOBID : awsem job id (required)"
     echo "-l LOGBUCKET : bucket for sending log file (required)"
     echo "-V TIBANNA_VERSION : tibanna version (used in the run_task lambda that launched this instance)"
@@ -25,9 +28,11 @@ printHelpAndExit() {
     echo "-g : use singularity"
     echo "-c : Metrics collection is disabled if flag is set"
     echo "-k S3_ENCRYPT_KEY_ID : KMS key to encrypt s3 files with"
+    echo "-P PACKED_JOBS : jobs that share this instance, as JOBID:CPU:MEM,JOBID:CPU:MEM,... (including JOBID)"
+    echo "-w : after the job, wait in the warm pool of the job (config.warm_pool) for the next job"
     exit "$1"
 }
-while getopts "i:m:l:p:a:s:r:gcV:A:k:" opt; do
+while getopts "i:m:l:p:a:s:r:gcV:A:k:P:w" opt; do
     case $opt in
         i) export JOBID=$OPTARG;;
         l) export LOGBUCKET=$OPTARG;;  # bucket for sending log file
@@ -41,6 +46,8 @@ while getopts "i:m:l:p:a:s:r:gcV:A:k:" opt; do
         g) export SINGULARITY_OPTION_TO_PASS=-g;;  # use singularity
         c) export DISABLE_METRICS_COLLECTION=true;;  # disable metrics collection
         k) export S3_ENCRYPT_KEY_ID=$OPTARG;;  # KMS key ID to encrypt s3 files with
+        P) export PACKED_JOBS=$OPTARG;;  # jobs that share this instance (JOBID:CPU:MEM,...)
+        w) export WARM_POOL=true;;  # wait for the next job of the warm pool after the job
         h) printHelpAndExit 0;;
         [?]) printHelpAndExit 1;;
         esac
@@ -102,19 +109,115 @@ send_error(){
 }
 
 # function that sends job_started file to s3, notifying that the job successfully started
-## usage: send_job_started (no argument)
+## usage: send_job_started [JOBID] (default $JOBID)
 send_job_started() {
-  touch $JOBID.job_started;
+  _jobid=${1:-$JOBID}
+  touch $_jobid.job_started;
   if [ -z "$S3_ENCRYPT_KEY_ID" ];
   then
-    aws s3 cp $JOBID.job_started s3://$LOGBUCKET/$JOBID.job_started
+    aws s3 cp $_jobid.job_started s3://$LOGBUCKET/$_jobid.job_started
   else
-    aws s3 cp $JOBID.job_started s3://$LOGBUCKET/$JOBID.job_started --sse aws:kms --sse-kms-key-id "$S3_ENCRYPT_KEY_ID";
+    aws s3 cp $_jobid.job_started s3://$LOGBUCKET/$_jobid.job_started --sse aws:kms --sse-kms-key-id "$S3_ENCRYPT_KEY_ID";
+  fi
+}
+
+# function that resumes the step function execution waiting for the end of a job (wait_for_completion_event), if any.
+# The awsf container does it at the end of a job; this is for the errors outside of the container.
+## usage: notify_job_completion [JOBID] (default $JOBID)
+notify_job_completion() {
+  _jobid=${1:-$JOBID}
+  _task_token=$(aws s3 cp s3://$LOGBUCKET/$_jobid.task_token - 2>/dev/null)
+  if [ ! -z "$_task_token" ]; then
+    aws stepfunctions send-task-success --task-token "$_task_token" --task-output '{}' --region $INSTANCE_REGION &>/dev/null;
   fi
 }
 
 # function that handles errors - this function calls send_error and send_log
-handle_error() {  ERRCODE=$1; STATUS+=,$ERRCODE; if [ "$ERRCODE" -ne 0 ]; then send_error; send_log; shutdown -h $SHUTDOWN_MIN; fi; }  ## usage: handle_error <error_code>
+handle_error() {  ERRCODE=$1; STATUS+=,$ERRCODE; if [ "$ERRCODE" -ne 0 ]; then send_error; send_log; notify_job_completion; shutdown -h $SHUTDOWN_MIN; fi; }  ## usage: handle_error <error_code>
+
+# job ids of the jobs running on this instance
+packed_jobids() { if [ -z "$PACKED_JOBS" ]; then echo $JOBID; else echo $PACKED_JOBS | tr ',' '\n' | cut -d: -f1; fi; }
+
+# function that runs one of the packed jobs in its own awsf container, limited to its cpu and memory,
+# with its own data directory (mounted as /mnt/$EBS_DIR in the container), working directory and docker daemon.
+# Errors of a packed job are reported for that job only and do not stop the instance.
+## usage: run_packed_job JOBID CPU MEM
+run_packed_job() {
+  _jobid=$1; _cpu=$2; _mem=$3
+  _packed_dir=/mnt/$EBS_DIR/packed/$_jobid
+  _packed_home=$INSTANCE_HOME/packed/$_jobid
+  # the run json of a job is uploaded by its own run_task, which may start later than this one
+  _tries=0
+  until aws s3 ls s3://$LOGBUCKET/$_jobid.run.json >/dev/null 2>&1; do
+    _tries=$((_tries+1))
+    if [ $_tries -ge $PACKED_JOB_WAIT_TRIES ]; then
+      exl_no_error echo "## Error: run json of packed job $_jobid not found - skipping the job"
+      return 1
+    fi
+    sleep 30
+  done
+  mkdir -p $_packed_dir/out $_packed_home
+  ln -sfn $INSTANCE_HOME/.aws $_packed_home/.aws
+  chown -R $INSTANCE_USER $_packed_dir $_packed_home
+  if [ "$_jobid" = "$JOBID" ]; then
+    cp $LOGFILE $_packed_dir/out/$_jobid.log
+  else
+    echo "## Packed onto the instance of job $JOBID ($INSTANCE_ID)" > $_packed_dir/out/$_jobid.log
+  fi
+  send_job_started $_jobid
+  exl_no_error echo "## Starting packed job $_jobid ($_cpu vCPUs, ${_mem}GB)"
+  $CONTAINER_CMD run --privileged --net host --cpus $_cpu --memory ${_mem}g -e HOST_HOME=$_packed_home -v $INSTANCE_HOME/:$INSTANCE_HOME/:rw -v $_packed_dir/:/mnt/$EBS_DIR/:rw $AWSF_IMAGE run.sh -i $_jobid -l $LOGBUCKET -f $EBS_DEVICE -S $STATUS -n $SINGULARITY_OPTION_TO_PASS $S3_ENCRYPT_KEY_OPTION
+  _errcode=$?
+  exl_no_error echo "## Packed job $_jobid finished with exit code $_errcode"
+  if [ $_errcode -ne 0 ]; then
+    # in case the container did not get to report the error itself
+    ( ERRFILE=$_packed_dir/out/$_jobid.error; LOGFILE=$_packed_dir/out/$_jobid.log; send_error; send_log; notify_job_completion $_jobid )
+  fi
+}
+
+# function that runs the dockerized awsf scripts for $JOBID
+## usage: run_awsf (no argument)
+run_awsf() {
+  if [ -z "$S3_ENCRYPT_KEY_ID" ];
+  then
+    $CONTAINER_CMD run --privileged --net host -e HOST_HOME=$INSTANCE_HOME -v $INSTANCE_HOME/:$INSTANCE_HOME/:rw -v /mnt/:/mnt/:rw $AWSF_IMAGE run.sh -i $JOBID -l $LOGBUCKET -f $EBS_DEVICE -S $STATUS $SINGULARITY_OPTION_TO_PASS
+  else
+    $CONTAINER_CMD run --privileged --net host -e HOST_HOME=$INSTANCE_HOME -v $INSTANCE_HOME/:$INSTANCE_HOME/:rw -v /mnt/:/mnt/:rw $AWSF_IMAGE run.sh -i $JOBID -l $LOGBUCKET -f $EBS_DEVICE -S $STATUS $SINGULARITY_OPTION_TO_PASS -k $S3_ENCRYPT_KEY_ID
+  fi
+}
+
+# function that keeps the instance in the warm pool: after each job, the data directory is cleaned
+# (keeping the docker images) and the instance waits for the next job handed to it by run_task.
+# Errors of a job are reported by the job itself and do not stop the instance.
+## usage: run_warm_pool (no argument)
+run_warm_pool() {
+  while true; do
+    _prev_jobid=$JOBID
+    exl_no_error echo "## Job $JOBID finished - waiting for the next job of the warm pool"
+    send_log
+    export LOGFILE=$INSTANCE_HOME/warm_pool.log
+    find /mnt/$EBS_DIR -mindepth 1 -maxdepth 1 ! -name docker -exec rm -rf {} +
+    export JOBID=$($CONTAINER_CMD run --rm --net host -v $INSTANCE_HOME/:$INSTANCE_HOME/:rw -w $INSTANCE_HOME $AWSF_IMAGE awsf3 wait_for_pool_job -i $_prev_jobid.run.json -I $INSTANCE_ID -T $INSTANCE_TYPE 2>> $LOGFILE)
+    if [ -z "$JOBID" ]; then
+      export JOBID=$_prev_jobid
+      break
+    fi
+    mkdir -p $LOCAL_OUTDIR
+    chown -R $INSTANCE_USER $EBS_DIR
+    export LOGFILE=$LOCAL_OUTDIR/$JOBID.log
+    export ERRFILE=$LOCAL_OUTDIR/$JOBID.error
+    send_job_started
+    exl echo "## Tibanna version: $TIBANNA_VERSION"
+    exl echo "## job id: $JOBID (warm pool, after job $_prev_jobid)"
+    exl echo "## instance type: $INSTANCE_TYPE"
+    exl echo "## instance id: $INSTANCE_ID"
+    exl date
+    # spot failure detection for the new job
+    crontab -l 2>/dev/null | sed "s/ -j $_prev_jobid / -j $JOBID /" | crontab -
+    send_log
+    run_awsf || exl_no_error echo "## Job $JOBID failed"
+  done
+}
 
 # used to compare Tibanna version strings
 version() { echo "$@" | awk -F. '{ printf("%d%03d%03d%03d\n", $1,$2,$3,$4); }'; }
@@ -296,14 +399,16 @@ if [ $(version $TIBANNA_VERSION) -ge $(version "1.6.0") ]; then
     cd ~
     curl https://raw.githubusercontent.com/4dn-dcic/tibanna/master/awsf3/spot_failure_detection.sh -O
     chmod +x spot_failure_detection.sh
-    if [ -z "$S3_ENCRYPT_KEY_ID" ];
-    then
-      echo "* * * * * ~/spot_failure_detection.sh -s 0 -l $LOGBUCKET -j $JOBID  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
-      echo "* * * * * ~/spot_failure_detection.sh -s 30 -l $LOGBUCKET -j $JOBID  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
-    else
-      echo "* * * * * ~/spot_failure_detection.sh -s 0 -l $LOGBUCKET -j $JOBID -k $S3_ENCRYPT_KEY_ID  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
-      echo "* * * * * ~/spot_failure_detection.sh -s 30 -l $LOGBUCKET -j $JOBID -k $S3_ENCRYPT_KEY_ID  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
-    fi
+    for _jobid in $(packed_jobids); do
+      if [ -z "$S3_ENCRYPT_KEY_ID" ];
+      then
+        echo "* * * * * ~/spot_failure_detection.sh -s 0 -l $LOGBUCKET -j $_jobid  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
+        echo "* * * * * ~/spot_failure_detection.sh -s 30 -l $LOGBUCKET -j $_jobid  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
+      else
+        echo "* * * * * ~/spot_failure_detection.sh -s 0 -l $LOGBUCKET -j $_jobid -k $S3_ENCRYPT_KEY_ID  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
+        echo "* * * * * ~/spot_failure_detection.sh -s 30 -l $LOGBUCKET -j $_jobid -k $S3_ENCRYPT_KEY_ID  >> /var/log/spot_failure_detection.log 2>&1" >> ~/recurring.jobs
+      fi
+    done
   fi
 fi
 
@@ -386,15 +491,26 @@ done
 send_log
 # will fail here now if docker pull is not successful after multiple attempts
 # pass S3_ENCRYPT_KEY_ID if desired
-if [ -z "$S3_ENCRYPT_KEY_ID" ];
+if [ ! -z "$PACKED_JOBS" ];
 then
-  $CONTAINER_CMD run --privileged --net host -e HOST_HOME=$INSTANCE_HOME -v $INSTANCE_HOME/:$INSTANCE_HOME/:rw -v /mnt/:/mnt/:rw $AWSF_IMAGE run.sh -i $JOBID -l $LOGBUCKET -f $EBS_DEVICE -S $STATUS $SINGULARITY_OPTION_TO_PASS
+  # several jobs share this instance - run them concurrently and wait for all of them
+  exl echo "## Packed jobs: $PACKED_JOBS"
+  if [ -z "$S3_ENCRYPT_KEY_ID" ]; then export S3_ENCRYPT_KEY_OPTION=; else export S3_ENCRYPT_KEY_OPTION="-k $S3_ENCRYPT_KEY_ID"; fi
+  for _job in $(echo $PACKED_JOBS | tr ',' ' '); do
+    run_packed_job $(echo $_job | tr ':' ' ') &
+  done
+  wait
+  exl echo "## All packed jobs finished"
+  send_log
+elif [ "$WARM_POOL" = true ];
+then
+  run_awsf || exl_no_error echo "## Job $JOBID failed"
+  run_warm_pool
 else
-  $CONTAINER_CMD run --privileged --net host -e HOST_HOME=$INSTANCE_HOME -v $INSTANCE_HOME/:$INSTANCE_HOME/:rw -v /mnt/:/mnt/:rw $AWSF_IMAGE run.sh -i $JOBID -l $LOGBUCKET -f $EBS_DEVICE -S $STATUS $SINGULARITY_OPTION_TO_PASS -k $S3_ENCRYPT_KEY_ID
+  run_awsf
+  handle_error $?
 fi
 
-handle_error $?
-
 ### self-terminate
 # (option 1)  ## This is the easiest if the 'shutdown behavior' set to 'terminate' for the instance at launch.
 shutdown -h $SHUTDOWN_MIN
@@ -1,10 +1,10 @@
 import re
 import os
-import boto3
 import copy
 from zipfile import ZipFile
 from io import BytesIO
 import mimetypes
+from tibanna.aws_utils import get_client
 
 
 class Target(object):
@@ -19,6 +19,7 @@ class Target(object):
         self.unzip = False
         self.tag = None
         self.s3 = None  # boto3 client
+        self.uploaded_bytes = 0  # total size of the files uploaded by upload_to_s3
 
     @property
     def source_name(self):
@@ -97,7 +98,7 @@ class Target(object):
 
     @property
     def exclude_from_dict(self):
-        return ['s3']
+        return ['s3', 'uploaded_bytes']
 
     def unzip_source(self):
         if not self.unzip:
@@ -117,9 +118,9 @@ class Target(object):
             raise Exception('Upload Error: source / dest must be specified first')
         if not self.s3:
             if endpoint_url:
-                self.s3 = boto3.client('s3', endpoint_url=endpoint_url)
+                self.s3 = get_client('s3', endpoint_url=endpoint_url)
             else:
-                self.s3 = boto3.client('s3')
+                self.s3 = get_client('s3')
         err_msg = "failed to upload output file %s to %s. %s"
         upload_extra_args = {}
         if encrypt_s3_upload:
@@ -149,6 +150,7 @@ class Target(object):
                         self.s3.upload_file(source_f, self.bucket, dest_f, ExtraArgs=upload_extra_args)
                     except Exception as e:
                         raise Exception(err_msg % (source_f, self.bucket + '/' + dest_f, str(e)))
+                    self.uploaded_bytes += os.path.getsize(source_f)
         elif self.unzip:
             # unzip the content files to S3
             try:
@@ -175,6 +177,7 @@ class Target(object):
                     self.s3.put_object(**put_object_args)
                 except Exception as e:
                     raise Exception("failed to put unzipped content %s for file %s. %s" % (arcfile['name'], self.source, str(e)))
+                self.uploaded_bytes += len(arcfile['content'])
                 arcfile = next(zip_content)
         else:
             print("source " + self.source + " is an ordinary file.")
@@ -192,6 +195,7 @@ class Target(object):
                     self.s3.upload_file(self.source, self.bucket, self.dest, ExtraArgs=upload_extra_args)
                 except Exception as e:
                     raise Exception(err_msg % (self.source, self.bucket + '/' + self.dest, str(e)))
+            self.uploaded_bytes += os.path.getsize(self.source)
 
 
 class SecondaryTarget(Target):
@@ -1,14 +1,20 @@
+import fcntl
 import json
 import os
 import subprocess
-import boto3
 import re
 import time
+from contextlib import contextmanager
 from tibanna.awsem import (
     AwsemRunJson,
     AwsemPostRunJson,
     AwsemPostRunJsonOutput
 )
+from tibanna.aws_utils import get_client
+from tibanna.warm_pool import WarmPool, WARM_POOL_IDLE_MIN
+from tibanna.task_token import notify_job_completion as notify_step_function
+from tibanna.job_status import new_job_status, set_phase, write_job_status
+from tibanna.vars import AWSEM_TIME_STAMP_FORMAT
 from tibanna.nnested_array import (
     run_on_nested_arrays2,
     flatten,
@@ -65,7 +71,7 @@ def create_mount_command_list(mountlist_filename, runjson_input,
     """
     key_arn = None
     if kms_key_id and region:
-        kms = boto3.client("kms", region_name=region)
+        kms = get_client("kms", region_name=region)
         response = kms.describe_key(KeyId=kms_key_id)
         key_arn = response["KeyMetadata"]["Arn"]
         
@@ -118,9 +124,9 @@ def add_download_cmd(data_file, rename, data_bucket, profile, f, unzip, target_t
 def determine_key_type(bucket, key, profile):
     """Return values : 'File', 'Folder' or 'Does not exist'"""
     if profile:
-        s3 = boto3.session(profile_name=profile).client('s3')
+        s3 = get_client('s3', profile_name=profile)
     else:
-        s3 = boto3.client('s3')
+        s3 = get_client('s3')
     if not key:
         raise Exception("Cannot determine key type - no key is specified")
     if not bucket:
@@ -262,7 +268,7 @@ def download_workflow():
     print("main workflow file: %s" % main_wf)
     print("workflow files: " + str(wf_files))
 
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     for wf_file in wf_files:
         target = "%s/%s" % (local_wfdir, wf_file)
         source = "%s/%s" % (wf_url, wf_file)
@@ -392,12 +398,15 @@ def update_postrun_json_upload_output(json_old, execution_metadata_file, md5file
 
 def upload_output(prj, endpoint_url=None):
     # parsing output_target and uploading output files to output target
-    upload_to_output_target(prj.Job.Output, prj.config.encrypt_s3_upload,
-                            kms_key_id=prj.config.kms_key_id, endpoint_url=endpoint_url)
+    uploaded_bytes = upload_to_output_target(prj.Job.Output, prj.config.encrypt_s3_upload,
+                                             kms_key_id=prj.config.kms_key_id, endpoint_url=endpoint_url)
+    add_uploaded_bytes(uploaded_bytes)
 
 
 def upload_to_output_target(prj_out, encrypt_s3_upload=False, kms_key_id=None, endpoint_url=None):
-    # parsing output_target and uploading output files to output target
+    """parsing output_target and uploading output files to output target.
+    Returns the total size of the uploaded files"""
+    uploaded_bytes = 0
     output_bucket = prj_out.output_bucket_directory
     output_argnames = prj_out.output_files.keys()
     output_target = prj_out.alt_output_target(output_argnames)
@@ -412,6 +421,7 @@ def upload_to_output_target(prj_out, encrypt_s3_upload=False, kms_key_id=None, e
             if target.is_valid:
                 print("Target is valid. Uploading..")
                 target.upload_to_s3(encrypt_s3_upload=encrypt_s3_upload, endpoint_url=endpoint_url)
+                uploaded_bytes += target.uploaded_bytes
             else:
                 raise Exception("Invalid target %s -> %s: failed to upload" % k, output_target[k])
         else:
@@ -422,6 +432,7 @@ def upload_to_output_target(prj_out, encrypt_s3_upload=False, kms_key_id=None, e
                 print("Target is valid. Uploading..")
                 target.upload_to_s3(encrypt_s3_upload=encrypt_s3_upload,
                                     kms_key_id=kms_key_id, endpoint_url=endpoint_url)
+                uploaded_bytes += target.uploaded_bytes
                 prj_out.output_files[k].add_target(target.dest)
 
                 # upload secondary files
@@ -433,10 +444,12 @@ def upload_to_output_target(prj_out, encrypt_s3_upload=False, kms_key_id=None, e
                     for st in stlist.secondary_targets:
                         st.upload_to_s3(encrypt_s3_upload=encrypt_s3_upload,
                                         kms_key_id=kms_key_id, endpoint_url=endpoint_url)
+                        uploaded_bytes += st.uploaded_bytes
                     for i, sf in enumerate(secondary_output_files):
                         sf.add_target(stlist.secondary_targets[i].dest)
             else:
                 raise Exception("Failed to upload to output target %s" % k)
+    return uploaded_bytes
 
 
 def save_total_sizes():
@@ -484,7 +497,7 @@ def upload_postrun_json(jsonfile):
         acl = 'public-read'
     else:
         acl = 'private'
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     upload_arg = {
         "Body": format_postrun_json(prj).encode('utf-8'),
         "Bucket": bucket,
@@ -496,3 +509,82 @@ def upload_postrun_json(jsonfile):
         if prj.config.kms_key_id:
             upload_arg['SSEKMSKeyId'] = prj.config.kms_key_id
     s3.put_object(**upload_arg)
+
+
+def wait_for_pool_job(input_json, instance_id, instance_type):
+    """wait in the warm pool of the previous job (run json) for the next job.
+    Returns the job id of the next job, or None if the instance should terminate."""
+    with open(input_json, 'r') as f:
+        cfg = json.load(f)['config']
+    if not cfg.get('warm_pool'):
+        return None
+    pool = WarmPool(cfg['warm_pool'], cfg['log_bucket'],
+                    encrypt_s3_upload=cfg.get('encrypt_s3_upload', False), kms_key_id=cfg.get('kms_key_id'))
+    return pool.wait_for_job(instance_id, instance_type, cfg,
+                             idle_min=cfg.get('warm_pool_idle_min', WARM_POOL_IDLE_MIN))
+
+
+def notify_job_completion(jobid, logbucket):
+    """resume the step function execution waiting for the end of the job (wait_for_completion_event)"""
+    try:
+        notify_step_function(logbucket, jobid)
+    except Exception as e:
+        # the execution will check the job after completion_check_interval anyway
+        print("cannot notify the step function of the end of job %s : %s" % (jobid, str(e)))
+
+
+def update_job_status(jobid, logbucket, status_file, phase=None, exit_status=None, logfile=None, kms_key_id=None):
+    """update the status document of the job (tibanna.job_status) and upload it to the log bucket.
+    Without a phase, it only refreshes the heartbeat (update time, last activity, bytes downloaded).
+    The local copy (status_file) is rewritten atomically and under a lock, since the cron job
+    updates it at the same time as the job."""
+    with local_job_status(status_file) as status:
+        if not status:
+            status.update(new_job_status(jobid, logbucket, instance_id=os.getenv('INSTANCE_ID', ''),
+                                         instance_type=os.getenv('INSTANCE_TYPE', ''),
+                                         filesystem=os.getenv('EBS_DEVICE', '')))
+        if phase:
+            set_phase(status, phase, exit_status=exit_status)
+        if os.path.exists(INPUT_DIR):
+            status['bytes_downloaded'] = directory_size(INPUT_DIR)
+        if logfile and os.path.exists(logfile):
+            status['last_activity'] = time.strftime(AWSEM_TIME_STAMP_FORMAT, time.gmtime(os.path.getmtime(logfile)))
+        write_job_status(status, encrypt_s3_upload=bool(kms_key_id), kms_key_id=kms_key_id)
+
+
+def add_uploaded_bytes(nbytes, status_file=None):
+    """add the size of the uploaded output files to the local status document of the job
+    (JOBSTATUSFILE), to be uploaded at the next update"""
+    status_file = status_file or os.getenv('JOBSTATUSFILE')
+    if not status_file or not os.path.exists(status_file):
+        return
+    with local_job_status(status_file) as status:
+        status['bytes_uploaded'] = status.get('bytes_uploaded', 0) + nbytes
+
+
+@contextmanager
+def local_job_status(status_file):
+    """the local status document of the job (an empty dictionary if there is none yet),
+    written back when the block exits without error"""
+    with open(status_file + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        status = dict()
+        if os.path.exists(status_file):
+            with open(status_file, 'r') as f:
+                status = json.load(f)
+        yield status
+        with open(status_file + '.tmp', 'w') as f:
+            json.dump(status, f, indent=4)
+        os.replace(status_file + '.tmp', status_file)
+
+
+def directory_size(directory):
+    """total size of the files under directory (not following symlinks)"""
+    total = 0
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            try:
+                total += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass  # removed in the meantime
+    return total
@@ -17,7 +17,10 @@ from awsf3.utils import (
     postrun_json_final,
     upload_postrun_json,
     upload_to_output_target,
-    upload_output
+    upload_output,
+    wait_for_pool_job,
+    update_job_status,
+    add_uploaded_bytes
 )
 from awsf3.log import (
     parse_commands,
@@ -724,3 +727,47 @@ def test_upload_output_encrypt_s3_upload():
     s3.delete_object(Bucket="tibanna-test-bucket", Key='tibanna-test/some_zip_file_to_upload/dir1/file1')
     s3.delete_object(Bucket="tibanna-test-bucket", Key='tibanna-test/some_zip_file_to_upload/file1')
     s3.delete_object(Bucket="tibanna-test-bucket", Key='tibanna-test/some_zip_file_to_upload/file2')
+
+
+def test_wait_for_pool_job(tmpdir):
+    from unittest import mock
+    runjson = tmpdir.join('job1.run.json')
+    runjson.write(json.dumps({'config': {'log_bucket': 'logbucket', 'warm_pool': 'pool1', 'warm_pool_idle_min': 5}}))
+    with mock.patch('tibanna.warm_pool.WarmPool.wait_for_job', return_value='job2') as wait:
+        assert wait_for_pool_job(str(runjson), 'i-1', 't3.medium') == 'job2'
+    assert wait.call_args[0][:2] == ('i-1', 't3.medium')
+    assert wait.call_args[1] == {'idle_min': 5}
+    # not in a warm pool
+    runjson.write(json.dumps({'config': {'log_bucket': 'logbucket'}}))
+    assert wait_for_pool_job(str(runjson), 'i-1', 't3.medium') is None
+
+
+def test_update_job_status(tmpdir):
+    from unittest import mock
+    status_file = str(tmpdir.join('job1.status.json'))
+    logfile = tmpdir.join('job1.log')
+    logfile.write('some log')
+    input_dir = tmpdir.mkdir('input')
+    input_dir.join('file1').write('x' * 10)
+    uploaded = []
+    with mock.patch('awsf3.utils.write_job_status', side_effect=lambda status, **kwargs: uploaded.append(dict(status))), \
+         mock.patch('awsf3.utils.INPUT_DIR', str(input_dir)), \
+         mock.patch.dict(os.environ, {'INSTANCE_ID': 'i-1', 'JOBSTATUSFILE': status_file}):
+        update_job_status('job1', 'logbucket', status_file, phase='started')
+        update_job_status('job1', 'logbucket', status_file, phase='running', logfile=str(logfile))
+        input_dir.join('file2').write('x' * 5)
+        update_job_status('job1', 'logbucket', status_file)  # heartbeat
+        add_uploaded_bytes(100)
+        add_uploaded_bytes(20)
+        update_job_status('job1', 'logbucket', status_file, phase='succeeded', exit_status='0')
+    assert [s['phase'] for s in uploaded] == ['started', 'running', 'running', 'succeeded']
+    assert uploaded[0]['instance_id'] == 'i-1' and uploaded[0]['log_bucket'] == 'logbucket'
+    assert uploaded[1]['bytes_downloaded'] == 10 and uploaded[2]['bytes_downloaded'] == 15
+    assert uploaded[1]['last_activity']
+    final = uploaded[-1]
+    assert final['exit_status'] == '0' and final['bytes_uploaded'] == 120
+    assert sorted(final['phases']) == ['running', 'started', 'succeeded']
+    assert final['ended_at'] == final['phases']['succeeded']
+    # the local copy is the latest document
+    with open(status_file) as f:
+        assert json.load(f)['phase'] == 'succeeded'
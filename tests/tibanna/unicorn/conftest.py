@@ -8,6 +8,19 @@ def pytest_runtest_setup(item):
     print("Running lambda tests for: ", item)
 
 
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: timing benchmark, skipped unless TIBANNA_BENCHMARK is set")
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get('TIBANNA_BENCHMARK'):
+        return
+    skip = pytest.mark.skip(reason="benchmark, set TIBANNA_BENCHMARK=1 to run it")
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture()
 def run_task_awsem_event_data():
     return get_event_file_for('run_task_awsem')
@@ -0,0 +1,81 @@
+from tibanna.async_api import AsyncAPI
+from unittest import mock
+import asyncio
+import threading
+import time
+import pytest
+
+
+class SlowAPI(object):
+    """fake API that records the maximum number of concurrent calls"""
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.called = []
+
+    def check_status(self, exec_arn=None, job_id=None):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.called.append(job_id)
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        if job_id == 'bad':
+            raise Exception("Cannot find job bad")
+        return 'SUCCEEDED'
+
+
+def test_check_status_many_is_bounded():
+    api = SlowAPI()
+
+    async def main():
+        async with AsyncAPI(max_concurrency=4, api=api) as aapi:
+            return await aapi.check_status_many(['j%d' % i for i in range(20)] + ['bad'])
+
+    res = asyncio.run(main())
+    assert res[:20] == ['SUCCEEDED'] * 20
+    assert str(res[20]) == "Cannot find job bad"
+    assert api.max_running == 4
+
+
+def test_cancellation():
+    api = SlowAPI(delay=0.2)
+
+    async def main():
+        aapi = AsyncAPI(max_concurrency=1, api=api)
+        tasks = [asyncio.ensure_future(aapi.check_status(job_id='j%d' % i)) for i in range(5)]
+        await asyncio.sleep(0.05)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        aapi.close()
+        return tasks
+
+    tasks = asyncio.run(main())
+    assert all(t.cancelled() for t in tasks)
+    # only the call that had started reached AWS
+    assert api.called == ['j0']
+
+
+def test_run_workflow_defaults():
+    api = mock.Mock()
+    api.run_workflow.return_value = {'jobid': 'abc'}
+
+    async def main():
+        async with AsyncAPI(api=api, rate=100) as aapi:
+            return await aapi.run_workflows(['a.json', 'b.json'], sfn='sfn1')
+
+    assert asyncio.run(main()) == [{'jobid': 'abc'}, {'jobid': 'abc'}]
+    kwargs = api.run_workflow.call_args[1]
+    assert kwargs['open_browser'] is False
+    assert kwargs['sleep'] == 0
+    assert kwargs['sfn'] == 'sfn1'
+    assert kwargs['rate_limiter'] is not None
+
+
+def test_invalid_concurrency():
+    with pytest.raises(ValueError):
+        AsyncAPI(max_concurrency=0, api=mock.Mock())
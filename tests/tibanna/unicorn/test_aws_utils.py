@@ -0,0 +1,98 @@
+from tibanna import aws_utils
+from tibanna.aws_utils import (
+    get_client,
+    get_bucket_fact,
+    put_object_with_acl,
+    upload_file_with_acl
+)
+from tibanna.utils import put_object_s3
+from botocore.exceptions import ClientError
+from boto3.exceptions import S3UploadFailedError
+from unittest import mock
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def reset_registry():
+    aws_utils.reset()
+    yield
+    aws_utils.reset()
+
+
+def acl_error():
+    return ClientError({'Error': {'Code': 'AccessControlListNotSupported'}}, 'PutObject')
+
+
+def test_get_client_is_cached():
+    s3 = get_client('s3', region_name='us-east-1')
+    assert get_client('s3', region_name='us-east-1') is s3
+    assert get_client('s3', region_name='us-west-2') is not s3
+    assert get_client('s3', region_name='us-east-1', endpoint_url='http://localhost:9000') is not s3
+    assert get_client('ec2', region_name='us-east-1') is not s3
+    assert get_client('s3', region_name='us-west-2').meta.region_name == 'us-west-2'
+
+
+def test_put_object_with_acl_memoizes_rejection():
+    s3 = mock.Mock()
+
+    def put_object(**kwargs):
+        if kwargs['ACL'] != 'private':
+            raise acl_error()
+
+    s3.put_object.side_effect = put_object
+    put_object_with_acl(s3, 'somebucket', 'public-read', Key='a', Body=b'')
+    assert s3.put_object.call_count == 2
+    assert get_bucket_fact('somebucket', 'accepts_acl') is False
+    put_object_with_acl(s3, 'somebucket', 'public-read', Key='b', Body=b'')
+    assert s3.put_object.call_count == 3
+    s3.put_object.assert_called_with(Bucket='somebucket', ACL='private', Key='b', Body=b'')
+    # other buckets are not affected
+    put_object_with_acl(s3, 'otherbucket', 'public-read', Key='c', Body=b'')
+    assert s3.put_object.call_count == 5
+
+
+def test_put_object_with_acl_accepted():
+    s3 = mock.Mock()
+    put_object_with_acl(s3, 'somebucket', 'public-read', Key='a', Body=b'')
+    s3.put_object.assert_called_once_with(Bucket='somebucket', ACL='public-read', Key='a', Body=b'')
+    assert get_bucket_fact('somebucket', 'accepts_acl') is None
+
+
+def test_put_object_with_acl_not_memoized_if_private_fails():
+    s3 = mock.Mock()
+    s3.put_object.side_effect = ClientError({'Error': {'Code': 'AccessDenied'}}, 'PutObject')
+    with pytest.raises(ClientError):
+        put_object_with_acl(s3, 'somebucket', 'public-read', Key='a', Body=b'')
+    assert get_bucket_fact('somebucket', 'accepts_acl') is None
+
+
+def test_put_object_with_acl_not_memoized_on_throttling():
+    s3 = mock.Mock()
+    s3.put_object.side_effect = [ClientError({'Error': {'Code': 'SlowDown'}}, 'PutObject'), None, None]
+    put_object_with_acl(s3, 'somebucket', 'public-read', Key='a', Body=b'')
+    s3.put_object.assert_called_with(Bucket='somebucket', ACL='private', Key='a', Body=b'')
+    assert get_bucket_fact('somebucket', 'accepts_acl') is None
+    # the next write tries the acl again
+    put_object_with_acl(s3, 'somebucket', 'public-read', Key='b', Body=b'')
+    s3.put_object.assert_called_with(Bucket='somebucket', ACL='public-read', Key='b', Body=b'')
+
+
+def test_upload_file_with_acl():
+    s3 = mock.Mock()
+    # upload_file wraps the ClientError
+    rejected = S3UploadFailedError('Failed to upload somefile to somebucket/somekey: %s' % acl_error())
+    s3.upload_file.side_effect = [rejected, None, None]
+    upload_file_with_acl(s3, 'somefile', 'somebucket', 'somekey', 'public-read', {'ContentType': 'text/plain'})
+    upload_file_with_acl(s3, 'somefile', 'somebucket', 'somekey2', 'public-read', {'ContentType': 'text/plain'})
+    assert s3.upload_file.call_count == 3
+    s3.upload_file.assert_called_with('somefile', 'somebucket', 'somekey2',
+                                      ExtraArgs={'ContentType': 'text/plain', 'ACL': 'private'})
+
+
+def test_put_object_s3_single_request_after_rejection():
+    s3 = mock.Mock()
+    s3.put_object.side_effect = [acl_error(), None, None]
+    with mock.patch('tibanna.utils.get_client', return_value=s3):
+        put_object_s3('haha', 'key1.txt', 'somebucket')
+        put_object_s3('haha', 'key2.txt', 'somebucket')
+    assert s3.put_object.call_count == 3
@@ -0,0 +1,162 @@
+from tibanna.batch import (
+    TokenBucket,
+    BatchSubmitter,
+    call_with_backoff,
+    is_throttling_error,
+    DEFAULT_SUBMISSION_RATE
+)
+from tibanna.core import API
+from tibanna.exceptions import BatchSubmissionException
+from botocore.exceptions import ClientError
+from unittest import mock
+import pytest
+
+
+def throttling_error():
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                       'StartExecution')
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, t):
+        self.now += t
+
+
+def test_is_throttling_error():
+    assert is_throttling_error(throttling_error())
+    assert not is_throttling_error(Exception('ThrottlingException'))
+    err = ClientError({'Error': {'Code': 'ExecutionAlreadyExists'}}, 'StartExecution')
+    assert not is_throttling_error(err)
+
+
+def test_call_with_backoff():
+    func = mock.Mock(side_effect=[throttling_error(), throttling_error(), 'ok'])
+    limiter = TokenBucket(10)
+    with mock.patch('time.sleep'):
+        assert call_with_backoff(func, 1, a=2, max_retries=3, rate_limiter=limiter) == 'ok'
+    assert func.call_count == 3
+    func.assert_called_with(1, a=2)
+    assert limiter.rate < 10
+
+
+def test_call_with_backoff_takes_a_token_per_call():
+    clock = FakeClock()
+    bucket = TokenBucket(2, capacity=1, clock=clock, sleep=clock.sleep)
+    func = mock.Mock(return_value='ok')
+    # e.g. the main and the cost updater start_execution of two jobs
+    for _ in range(4):
+        call_with_backoff(func, rate_limiter=bucket)
+    assert clock.now == pytest.approx(1.5)
+    # a retry takes a token too
+    func = mock.Mock(side_effect=[throttling_error(), 'ok'])
+    with mock.patch('time.sleep'), mock.patch.object(bucket, 'acquire') as acquire:
+        call_with_backoff(func, max_retries=1, rate_limiter=bucket)
+    assert acquire.call_count == 2
+
+
+def test_call_with_backoff_gives_up():
+    func = mock.Mock(side_effect=throttling_error())
+    with mock.patch('time.sleep'):
+        with pytest.raises(ClientError):
+            call_with_backoff(func, max_retries=2)
+    assert func.call_count == 3
+
+
+def test_call_with_backoff_other_error():
+    func = mock.Mock(side_effect=ValueError('bad input'))
+    with pytest.raises(ValueError):
+        call_with_backoff(func, max_retries=5)
+    assert func.call_count == 1
+
+
+def test_token_bucket_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(2, capacity=1, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        bucket.acquire()
+    # first token is free, the remaining 4 come at 2 per second
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_token_bucket_adapts():
+    bucket = TokenBucket(4, min_rate=1, recovery=1)
+    bucket.throttled()
+    assert bucket.rate == 2
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 1
+    for _ in range(10):
+        bucket.succeeded()
+    assert bucket.rate == 4
+
+
+def test_batch_submitter():
+    api = mock.Mock()
+
+    def run_workflow(input_json, **kwargs):
+        if input_json == 'bad.json':
+            raise Exception('input json must be either a file or a dictionary')
+        return {'jobid': input_json, '_tibanna': {'run_name': 'run-' + input_json,
+                                                  'exec_arn': 'arn-' + input_json}}
+
+    api.run_workflow.side_effect = run_workflow
+    report = BatchSubmitter(api, concurrency=3, rate=100).submit(['a', 'bad.json', 'b', 'c'], sfn='sfn1')
+    assert [r.status for r in report.results] == ['SUBMITTED', 'FAILED', 'SUBMITTED', 'SUBMITTED']
+    assert [r.jobid for r in report.succeeded] == ['a', 'b', 'c']
+    assert report.failed[0].input_json == 'bad.json'
+    assert report.failed[0].error == 'input json must be either a file or a dictionary'
+    assert len(report.run_infos) == 3
+    kwargs = api.run_workflow.call_args[1]
+    assert kwargs['sfn'] == 'sfn1'
+    assert kwargs['open_browser'] is False
+    d = report.as_dict()
+    assert d['n_submitted'] == 3
+    assert d['n_failed'] == 1
+    assert 'run_info' not in d['results'][0]
+    assert d['results'][1]['error_type'] == 'Exception'
+
+
+def fake_run_workflow(input_json, **kwargs):
+    if input_json == 'bad.json':
+        raise Exception('input json must be either a file or a dictionary')
+    return {'jobid': input_json, '_tibanna': {'run_name': 'run-' + input_json, 'exec_arn': 'arn-' + input_json}}
+
+
+def test_run_batch_workflows():
+    with mock.patch.object(API, 'run_workflow', side_effect=fake_run_workflow):
+        run_infos = API().run_batch_workflows(['a', 'b'], sfn='sfn1', sleep=0, verbose=False)
+    # a list of run infos, as before BatchReport
+    assert [run_info['jobid'] for run_info in run_infos] == ['a', 'b']
+
+
+def test_run_batch_workflows_pacing():
+    # paced by the rate limiter by default, without sleeping after each start_execution
+    with mock.patch.object(API, 'run_workflow', side_effect=fake_run_workflow) as run_workflow:
+        API().run_batch_workflows(['a', 'b'], sfn='sfn1', verbose=False)
+    kwargs = run_workflow.call_args[1]
+    assert kwargs['rate_limiter'].max_rate == DEFAULT_SUBMISSION_RATE and kwargs['sleep'] == 0
+    # a fixed sleep is an opt-in
+    with mock.patch.object(API, 'run_workflow', side_effect=fake_run_workflow) as run_workflow:
+        API().run_batch_workflows(['a', 'b'], sfn='sfn1', sleep=3, concurrency=1, verbose=False)
+    kwargs = run_workflow.call_args[1]
+    assert kwargs['rate_limiter'] is None and kwargs['sleep'] == 3
+
+
+def test_run_batch_workflows_failure():
+    with mock.patch.object(API, 'run_workflow', side_effect=fake_run_workflow) as run_workflow:
+        with pytest.raises(BatchSubmissionException) as e:
+            API().run_batch_workflows(['a', 'bad.json', 'b'], sfn='sfn1', sleep=0, verbose=False)
+    # the jobs after the failed one are still submitted
+    assert run_workflow.call_count == 3
+    assert [r.jobid for r in e.value.report.succeeded] == ['a', 'b']
+    assert 'bad.json' in str(e.value)
+    with mock.patch.object(API, 'run_workflow', side_effect=fake_run_workflow):
+        report = API().run_batch_workflows(['a', 'bad.json'], sfn='sfn1', sleep=0, verbose=False,
+                                           return_report=True)
+    assert len(report.succeeded) == 1 and len(report.failed) == 1
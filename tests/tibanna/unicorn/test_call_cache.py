@@ -0,0 +1,160 @@
+from tibanna.call_cache import CallCache, recorded_outputs, planned_copies
+from tibanna.awsem import AwsemPostRunJson
+from tibanna.ec2_utils import Execution
+from tibanna.check_task import CheckTask
+from unittest import mock
+import copy
+import json
+import pytest
+
+
+def input_dict(**args):
+    d = {'args': {'input_files': {'input_file': {'bucket_name': 'inbucket', 'object_key': 'in.fastq.gz'}},
+                  'input_parameters': {'nthreads': 4},
+                  'output_S3_bucket': 'outbucket',
+                  'output_target': {'out_bam': 'new/out.bam', 'out_txt': 's3://otherbucket/new/out.txt'},
+                  'secondary_output_target': {'out_bam': 'new/out.bam.bai'},
+                  'cwl_main_filename': 'main.cwl',
+                  'cwl_child_filenames': ['child.cwl'],
+                  'cwl_directory_url': 's3://cwlbucket/cwl/'},
+         'jobid': args.pop('jobid', 'newjob'),
+         'config': {'log_bucket': 'logbucket', 'instance_type': 't3.micro', 'ebs_size': 10,
+                    'call_cache': True}}
+    d['args'].update(args)
+    return d
+
+
+def postrun_json():
+    return {'Job': {'JOBID': 'oldjob', 'start_time': '20240101-00:00:00-UTC',
+                    'App': {'language': 'cwl_v1'}, 'Input': {},
+                    'Log': {'log_bucket_directory': 'logbucket'},
+                    'Output': {'output_bucket_directory': 'outbucket',
+                               'output_target': {'out_bam': 'old/out.bam', 'out_txt': 's3://otherbucket/old/out.txt'},
+                               'secondary_output_target': {'out_bam': 'old/out.bam.bai'},
+                               'Output files': {
+                                   'out_bam': {'class': 'File', 'path': '/data1/out/out.bam', 'target': 'old/out.bam',
+                                               'secondaryFiles': [{'class': 'File', 'path': '/data1/out/out.bam.bai',
+                                                                   'target': 'old/out.bam.bai'}]},
+                                   'out_txt': {'class': 'File', 'path': '/data1/out/out.txt',
+                                               'target': 'old/out.txt'}}}},
+            'config': {'log_bucket': 'logbucket'}}
+
+
+@pytest.fixture
+def etags():
+    etags = {'cwlbucket/cwl/main.cwl': 'a1', 'cwlbucket/cwl/child.cwl': 'b1', 'inbucket/in.fastq.gz': 'c1'}
+    with mock.patch.object(CallCache, 'object_digest', side_effect=lambda b, k: etags[b + '/' + k]):
+        yield etags
+
+
+def execution(d):
+    # no network calls for input sizes and instance types
+    with mock.patch('tibanna.ec2_utils.Execution.get_input_size_in_bytes', return_value={}), \
+         mock.patch('tibanna.ec2_utils.Execution.create_instance_type_list'):
+        return Execution(d)
+
+
+def runjson(d):
+    return execution(d).create_run_json_dict()
+
+
+def test_cache_key(etags):
+    cache = CallCache('logbucket')
+    key = cache.key(runjson(input_dict()))
+    assert len(key) == 64
+    # job-specific fields do not affect the key
+    assert cache.key(runjson(input_dict(jobid='otherjob', output_target={}))) == key
+    # workflow files, input objects and parameters do
+    assert cache.key(runjson(input_dict(input_parameters={'nthreads': 8}))) != key
+    etags['cwlbucket/cwl/child.cwl'] = 'b2'
+    assert cache.key(runjson(input_dict())) != key
+    etags['cwlbucket/cwl/child.cwl'] = 'b1'
+    etags['inbucket/in.fastq.gz'] = 'c2'
+    assert cache.key(runjson(input_dict())) != key
+
+
+def test_cache_key_unresolvable_input(etags):
+    del etags['inbucket/in.fastq.gz']
+    assert CallCache('logbucket').key(runjson(input_dict())) is None
+
+
+def test_recorded_outputs_and_planned_copies():
+    prj = AwsemPostRunJson(**postrun_json())
+    outputs = recorded_outputs(prj.Job.Output)
+    assert outputs['out_bam']['bucket'] == 'outbucket'
+    assert outputs['out_txt'] == {'bucket': 'otherbucket', 'key': 'old/out.txt', 'path': '/data1/out/out.txt',
+                                  'argname': 'out_txt', 'secondary': []}
+    entry = {'jobid': 'oldjob', 'outputs': outputs, 'Output files': prj.Job.Output.as_dict()['Output files']}
+    output = runjson(input_dict())['Job']['Output']
+    copies, output_files = planned_copies(entry, output)
+    assert copies == [('outbucket', 'old/out.bam', 'outbucket', 'new/out.bam'),
+                      ('outbucket', 'old/out.bam.bai', 'outbucket', 'new/out.bam.bai'),
+                      ('otherbucket', 'old/out.txt', 'otherbucket', 'new/out.txt')]
+    assert output_files['out_bam']['target'] == 'new/out.bam'
+    assert output_files['out_bam']['secondaryFiles'][0]['target'] == 'new/out.bam.bai'
+    # targets that are not in the cached result
+    output['output_target']['out_other'] = 'new/other'
+    with pytest.raises(Exception):
+        planned_copies(entry, output)
+
+
+def test_recorded_outputs_not_cacheable():
+    prjd = postrun_json()
+    prjd['Job']['Output']['output_target']['file:///data1/out/some'] = 'some'
+    assert CallCache('logbucket').record('somekey', AwsemPostRunJson(**prjd)) is None
+
+
+def test_prelaunch_reuses_cached_result(etags):
+    prj = AwsemPostRunJson(**postrun_json())
+    entry = {'jobid': 'oldjob', 'outputs': recorded_outputs(prj.Job.Output),
+             'Output files': prj.Job.Output.as_dict()['Output files']}
+    s3 = mock.Mock()
+    with mock.patch('tibanna.ec2_utils.Execution.upload_run_json') as upload_run_json, \
+         mock.patch('tibanna.ec2_utils.Execution.launch_and_get_instance_id') as launch, \
+         mock.patch.object(CallCache, 'lookup', return_value=entry), \
+         mock.patch('tibanna.call_cache.get_client', return_value=s3), \
+         mock.patch('tibanna.call_cache.put_object_s3') as put_object_s3:
+        ex = execution(input_dict(jobid='newjob'))
+        ex.prelaunch()
+        ex.launch()
+        ex.postlaunch()
+    launch.assert_not_called()
+    assert s3.copy.call_count == 3
+    assert upload_run_json.call_args[0][0]['config']['call_cache_key'] == ex.cfg.call_cache_key
+    assert [c[0][1] for c in put_object_s3.call_args_list] == \
+        ['newjob.postrun.json', 'newjob.log', 'newjob.job_started', 'newjob.success']
+    cfg = ex.input_dict['config']
+    assert cfg['cached_from'] == 'oldjob'
+    assert cfg['instance_id'] == ''
+
+
+def test_check_task_cached_result():
+    prjd = postrun_json()
+    prjd['config']['cached_from'] = 'oldjob0'
+    input_json = {'jobid': 'oldjob', 'args': {},
+                  'config': {'log_bucket': 'logbucket', 'cached_from': 'oldjob0', 'instance_id': ''}}
+    with mock.patch('tibanna.check_task.does_key_exist', side_effect=lambda b, k: not k.endswith(('error', 'aborted'))), \
+         mock.patch('tibanna.check_task.read_s3', return_value=json.dumps(prjd)), \
+         mock.patch('tibanna.check_task.put_object_s3'), \
+         mock.patch('tibanna.check_task.get_client') as get_client, \
+         mock.patch.object(CheckTask, 'handle_metrics') as handle_metrics, \
+         mock.patch.object(CallCache, 'record') as record:
+        res = CheckTask(copy.deepcopy(input_json)).run()
+    assert res['postrunjson']['Job']['JOBID'] == 'oldjob'
+    handle_metrics.assert_not_called()
+    get_client.assert_not_called()
+    record.assert_not_called()
+
+
+def test_check_task_records_successful_job():
+    input_json = {'jobid': 'oldjob', 'args': {},
+                  'config': {'log_bucket': 'logbucket', 'call_cache_key': 'somekey', 'instance_id': 'i-1'}}
+    with mock.patch('tibanna.check_task.does_key_exist', side_effect=lambda b, k: not k.endswith(('error', 'aborted'))), \
+         mock.patch('tibanna.check_task.read_s3', return_value=json.dumps(postrun_json())), \
+         mock.patch('tibanna.check_task.put_object_s3'), \
+         mock.patch('tibanna.check_task.get_client'), \
+         mock.patch.object(CheckTask, 'handle_metrics'), \
+         mock.patch.object(CallCache, 'record') as record:
+        CheckTask(input_json).run()
+    assert record.call_args[0][0] == 'somekey'
+    assert record.call_args[0][1].Job.JOBID == 'oldjob'
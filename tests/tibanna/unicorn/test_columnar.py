@@ -0,0 +1,129 @@
+import math
+import time
+import pytest
+import random
+import tracemalloc
+from tibanna.columnar import (
+    write_table,
+    read_table,
+    load_table,
+    split_columns,
+    TABLE_SIDECAR_SUFFIX
+)
+
+
+def test_split_columns():
+    header, columns = split_columns('interval\ta\tb\n1\t2\t3\n2\t4\n')
+    assert header == ['interval', 'a', 'b']
+    assert columns == [['1', '2'], ['2', '4'], ['3', None]]
+    assert split_columns('interval\ta\n') == (['interval', 'a'], [[], []])
+
+
+def test_write_table(tmpdir):
+    filename = str(tmpdir.join('metrics.tsv'))
+    write_table(filename, 'interval', range(1, 4), [('a', [1.5, 2, 3]), ('b', [10]), ('c', [1, 2, 3, 4])])
+    with open(filename) as f:
+        content = f.read()
+    # a short column is padded, a long one is cut
+    assert content == 'interval\ta\tb\tc\n1\t1.5\t10\t1\n2\t2\t-\t2\n3\t3\t-\t3\n'
+    names, index, data = read_table(content)
+    assert names == ['a', 'b', 'c']
+    assert list(index) == [1, 2, 3]
+    assert list(data['a']) == [1.5, 2, 3]
+    assert data['b'][0] == 10 and math.isnan(data['b'][1])
+
+
+def test_load_table_sidecar(tmpdir):
+    filename = str(tmpdir.join('top_cpu.tsv'))
+    write_table(filename, 'interval', range(1, 3), [('"sh -c"', [0.1, 0.2])], sidecar=True)
+    assert tmpdir.join('top_cpu.tsv' + TABLE_SIDECAR_SUFFIX).check()
+    with open(filename) as f:
+        table = read_table(f.read())
+    assert load_table(filename) == table
+    # the sidecar is read rather than the tsv
+    with open(filename, 'w') as f:
+        f.write('interval\n')
+    assert load_table(filename) == table
+
+
+def legacy_write_tsv(filename, columns):
+    """cell by cell writer of metrics.tsv, as it was before columnar"""
+    with open(filename, 'w') as fo:
+        fo.write('interval\t' + '\t'.join(columns.keys()) + '\n')
+        for i in range(len(list(columns.values())[0])):
+            fo.write(str(i + 1))
+            for values in columns.values():
+                try:
+                    fo.write('\t' + str(values[i]))
+                except IndexError:
+                    fo.write('\t' + '-')
+            fo.write('\n')
+
+
+def legacy_read_tsv(contents):
+    """cell by cell parser of a tsv file, as the report generation was before columnar"""
+    lines = contents.rstrip().split('\n')
+    columns = lines[0].split('\t')[1:]
+    intervals, data = [], {col: [] for col in columns}
+    for line in lines[1:]:
+        fields = line.split('\t')
+        intervals.append(float(fields[0]))
+        for col, field in zip(columns, fields[1:]):
+            try:
+                data[col].append(float(field))
+            except ValueError:
+                data[col].append(None)
+    return columns, intervals, data
+
+
+def write_read(directory, version, tables):
+    """write and read the tables {name: {column: values}} with the cell by cell writer and parser (legacy),
+    with columnar, or with columnar and a sidecar (read from the sidecar rather than parsed)"""
+    for name, columns in tables.items():
+        filename = str(directory.join('%s_%s.tsv' % (version, name)))
+        if version == 'legacy':
+            legacy_write_tsv(filename, columns)
+            with open(filename) as f:
+                legacy_read_tsv(f.read())
+        else:
+            write_table(filename, 'interval', range(1, len(list(columns.values())[0]) + 1), list(columns.items()),
+                        sidecar=version == 'sidecar')
+            load_table(filename)
+
+
+def report_tables(days):
+    """the tables of the report of a job (metrics every 2 minutes, top of 20 processes every minute)"""
+    random.seed(0)
+    n_metrics, n_top = days * 720, days * 1440
+    metrics = {'metric_%d' % j: [round(random.uniform(0, 100), 4) for _ in range(n_metrics)] for j in range(7)}
+    top = {'"process %d"' % j: [round(random.uniform(0, 100), 1) for _ in range(n_top)] for j in range(20)}
+    return {'metrics': metrics, 'top': top}
+
+
+def test_write_read_same_format(tmpdir):
+    tables = report_tables(days=1)
+    for version in ['legacy', 'columnar', 'sidecar']:
+        write_read(tmpdir, version, tables)
+    for name in tables:
+        with open(str(tmpdir.join('legacy_%s.tsv' % name))) as f1, open(str(tmpdir.join('columnar_%s.tsv' % name))) as f2:
+            assert f1.read() == f2.read()
+        assert load_table(str(tmpdir.join('sidecar_%s.tsv' % name))) == load_table(str(tmpdir.join('columnar_%s.tsv' % name)))
+
+
+@pytest.mark.benchmark
+def test_write_read_benchmark(tmpdir, capsys):
+    """time and peak memory of writing and reading the tables of the report of a 7-day job,
+    compared to the cell by cell writer and parser"""
+    tables = report_tables(days=7)
+    results = {}
+    for version in ['legacy', 'columnar', 'sidecar']:
+        start = time.time()
+        write_read(tmpdir, version, tables)
+        seconds = time.time() - start
+        tracemalloc.start()
+        write_read(tmpdir, version, tables)
+        results[version] = (seconds, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    with capsys.disabled():
+        for version, (seconds, peak) in results.items():
+            print("\n7-day job, %s : %.2fs, peak memory %.1fMB" % (version, seconds, peak / 1e6))
@@ -1,8 +1,18 @@
 import pytest
 import os
+import json
+import math
+import time
+import threading
+from datetime import datetime, timezone, timedelta
+from unittest import mock
 from tibanna.cw_utils import (
-    TibannaResource
+    TibannaResource,
+    METRICS_REPORT_MAX_POINTS
 )
+from tibanna.metrics_store import MetricsStore, METRIC_QUERIES, clear_metrics_stores
+from tibanna.columnar import write_table, read_table, read_sidecar
+from tibanna.vars import METRICS_COLLECTION_INTERVAL
 
 
 def test_extract_metrics_data():
@@ -22,3 +32,169 @@ def test_extract_metrics_data():
 
 
 
+
+
+class FakeCloudWatch(object):
+    """stand-in for a cloudwatch client : one point per metric every METRICS_COLLECTION_INTERVAL,
+    the value being the minutes since start. Each call takes latency seconds."""
+
+    def __init__(self, start, latency=0.0, page_size=None):
+        self.start = start
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, ScanBy, NextToken=None):
+        with self._lock:
+            self.calls.append((StartTime, EndTime, NextToken))
+        time.sleep(self.latency)
+        n = int((EndTime - StartTime).total_seconds() // METRICS_COLLECTION_INTERVAL)
+        timestamps = [StartTime + timedelta(seconds=METRICS_COLLECTION_INTERVAL * k) for k in range(n)]
+        first = int(NextToken or 0)
+        last = n if not self.page_size else min(n, first + self.page_size)
+        res = {'MetricDataResults': [{'Id': q['Id'], 'StatusCode': 'Complete',
+                                      'Timestamps': timestamps[first:last],
+                                      'Values': [(t - self.start).total_seconds() / 60
+                                                 for t in timestamps[first:last]]}
+                                     for q in MetricDataQueries]}
+        if last < n:
+            res['NextToken'] = str(last)
+        return res
+
+
+def tibanna_resource(days, **kwargs):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    client = FakeCloudWatch(start, **kwargs)
+    clear_metrics_stores()
+    with mock.patch('tibanna.cw_utils.get_client', return_value=client):
+        resource = TibannaResource('i-1', '/dev/nvme1n1', start, start + timedelta(days=days))
+    return resource, client
+
+
+def test_get_metrics_single_request():
+    resource, client = tibanna_resource(days=2.5, page_size=1000)
+    # one request and its next pages
+    assert len(client.calls) == math.ceil(2.5 * 1440 * 60 / METRICS_COLLECTION_INTERVAL / 1000)
+    assert resource.max_cpu_utilization_percent == (2.5 * 1440 * 60 - METRICS_COLLECTION_INTERVAL) / 60
+    # the points of a time chunk
+    resource.starttime, resource.endtime = resource.starttimes[1], resource.endtimes[1]
+    pts = resource.max_cpu_utilization_all_pts()
+    assert len(pts) == 1440 * 60 / METRICS_COLLECTION_INTERVAL and pts[0] == 1440
+    assert 'store' not in resource.as_dict()
+
+
+def test_plot_metrics(tmpdir):
+    resource, client = tibanna_resource(days=1.5)
+    resource.plot_metrics('t3.medium', directory=str(tmpdir))
+    with open(str(tmpdir.join('metrics.tsv'))) as f:
+        rows = f.read().rstrip().split('\n')
+    assert rows[0].split('\t')[:2] == ['interval', 'max_mem_used_MB']
+    assert len(rows) == 1 + 1.5 * 1440 * 60 / METRICS_COLLECTION_INTERVAL
+    # no more call to plot the metrics
+    assert len(client.calls) == 1
+    # the store is saved with the report
+    assert str(tmpdir.join('metrics_store.bin')) in resource.list_files
+    with open(str(tmpdir.join('metrics_store.bin')), 'rb') as f:
+        assert MetricsStore.from_bytes(f.read()).timestamps == resource.store.timestamps
+    # the page comes with its summary and its downsampled data
+    assert resource.list_files[-1] == str(tmpdir.join('metrics.html'))
+    with open(str(tmpdir.join('metrics_summary.json'))) as f:
+        summary = json.load(f)
+    assert summary['instance_type'] == 't3.medium'
+    assert summary['max_cpu_utilization_percent'] == str(resource.max_cpu_utilization_percent)
+    with open(str(tmpdir.join('metrics_data.json'))) as f:
+        data = json.load(f)
+    assert data['n_intervals'] == len(rows) - 1
+    assert len(data['metrics']['max_cpu_utilization_percent']) == METRICS_REPORT_MAX_POINTS
+    # the first and last points are kept
+    assert data['metrics']['max_cpu_utilization_percent'][0] == [1, 0]
+    assert data['metrics']['max_cpu_utilization_percent'][-1] == [len(rows) - 1, resource.max_cpu_utilization_percent]
+
+
+def test_plot_metrics_sidecar(tmpdir):
+    resource, client = tibanna_resource(days=1)
+    resource.plot_metrics('t3.medium', directory=str(tmpdir), sidecar=True)
+    for name in ['metrics.tsv', 'top_cpu.tsv', 'top_mem.tsv']:
+        assert str(tmpdir.join(name + '.bin')) in resource.list_files
+    with open(str(tmpdir.join('metrics.tsv'))) as f:
+        names, intervals, data = read_table(f.read())
+    with open(str(tmpdir.join('metrics.tsv.bin')), 'rb') as f:
+        assert read_sidecar(f.read()) == (names, intervals, data)
+
+
+def test_tibanna_resource_shares_the_store():
+    # e.g. CheckTask.handle_metrics then API.plot_metrics for the same job
+    resource, client = tibanna_resource(days=2)
+    with mock.patch('tibanna.cw_utils.get_client', return_value=client):
+        other = TibannaResource('i-1', '/dev/nvme1n1', resource.starttime, resource.endtime)
+    assert other.store is resource.store
+    assert other.as_dict() == resource.as_dict()
+    assert len(client.calls) == 1
+
+
+def test_get_metrics_call_count():
+    # a GetMetricData call per window, instead of a get_metric_statistics call per metric per day
+    for days in [10, 60]:
+        resource, client = tibanna_resource(days=days)
+        assert len(client.calls) == len(MetricsStore.windows(resource.starttime, resource.endtime))
+
+
+@pytest.mark.benchmark
+def test_get_metrics_benchmark(capsys):
+    """call count and latency of the retrieval of the metrics of a 10-day job,
+    with 50ms per call, compared to a get_metric_statistics call per metric per day"""
+    latency = 0.05
+    for days in [10, 60]:
+        start = time.time()
+        resource, client = tibanna_resource(days=days, latency=latency)
+        seconds = time.time() - start
+        with capsys.disabled():
+            print("\n%d-day job : %d GetMetricData call(s) in %.2fs (was %d get_metric_statistics calls, %.2fs)"
+                  % (days, len(client.calls), seconds, days * len(METRIC_QUERIES), days * len(METRIC_QUERIES) * latency))
+
+
+def test_downsample_top():
+    top = 'interval\t"java -jar x.jar"\t"sh -c ""a b"""\n1\t10.5\t0\n2\t-\t3\n'
+    res = TibannaResource.downsample_top(read_table(top))
+    assert res['columns'] == ['java -jar x.jar', 'sh -c "a b"']
+    assert res['intervals'] == [1, 2]
+    assert res['data'] == [[10.5, 0], [0, 3]]
+
+
+def test_read_table_s3(tmpdir):
+    filename = str(tmpdir.join('metrics.tsv'))
+    write_table(filename, 'interval', range(1, 3), [('max_cpu_utilization_percent', [10, 20])], sidecar=True)
+    with open(filename + '.bin', 'rb') as f:
+        sidecar = f.read()
+    s3 = mock.Mock()
+    s3.get_object.return_value = {'Body': mock.Mock(read=mock.Mock(return_value=sidecar))}
+    with mock.patch('tibanna.cw_utils.get_client', return_value=s3), \
+         mock.patch('tibanna.cw_utils.read_s3') as read_s3:
+        names, intervals, data = TibannaResource.read_table_s3('logbucket', 'job1.metrics/metrics.tsv')
+    # the sidecar is read rather than the tsv file
+    read_s3.assert_not_called()
+    assert s3.get_object.call_args[1]['Key'] == 'job1.metrics/metrics.tsv.bin'
+    assert names == ['max_cpu_utilization_percent'] and list(data[names[0]]) == [10, 20]
+    # no sidecar
+    s3.get_object.side_effect = Exception('NoSuchKey')
+    with open(filename) as f, \
+         mock.patch('tibanna.cw_utils.get_client', return_value=s3), \
+         mock.patch('tibanna.cw_utils.read_s3', return_value=f.read()):
+        assert TibannaResource.read_table_s3('logbucket', 'job1.metrics/metrics.tsv')[0] == names
+
+
+def test_update_html():
+    report = ('Metric\tValue\nMaximum_Memory_Used_Mb\t100\nMinimum_Memory_Available_Mb\t900\n'
+              'Maximum_Disk_Used_Gb\t1\nMaximum_Memory_Utilization\t10\nMaximum_CPU_Utilization\t50\n'
+              'Maximum_Disk_Utilization\t5\nStart_Time\t2026-01-01 10:00:00\nEnd_Time\t2026-01-01 12:00:00\n'
+              'Instance_Type\tt3.medium\nCost\t0.1234\n')
+    with mock.patch('tibanna.cw_utils.read_s3', return_value=report), \
+         mock.patch('tibanna.cw_utils.does_key_exist', return_value=True), \
+         mock.patch('tibanna.cw_utils.put_object_s3') as put:
+        TibannaResource.update_html('logbucket', 'job1.metrics/')
+    # only the summary is rewritten
+    assert put.call_count == 1
+    assert put.call_args[1]['key'] == 'job1.metrics/metrics_summary.json'
+    summary = json.loads(put.call_args[1]['content'])
+    assert summary['cost'] == '0.1234' and summary['total_time'] == '2:00:00'
@@ -0,0 +1,91 @@
+from tibanna.dd_utils import BatchWriter, item2dict
+from tibanna.job import Job
+from unittest import mock
+import pytest
+
+
+@pytest.fixture
+def dd():
+    client = mock.Mock()
+    client.batch_write_item.return_value = {'UnprocessedItems': {}}
+    with mock.patch('tibanna.dd_utils.get_client', return_value=client), \
+         mock.patch('tibanna.dd_utils.does_dynamo_table_exist', return_value=True):
+        yield client
+
+
+def items(n):
+    return [Job.dd_item('jid%d' % i, 'exec%d' % i, 'sfn1', 'bucket1') for i in range(n)]
+
+
+def written_job_ids(dd):
+    return [req['PutRequest']['Item']['Job Id']['S']
+            for call in dd.batch_write_item.call_args_list
+            for req in call[1]['RequestItems']['table1']]
+
+
+def test_dd_item():
+    item = Job.dd_item('jid1', 'exec1', 'sfn1', 'bucket1', time_stamp='20240101-00:00:00-UTC')
+    assert item2dict(item) == {'Job Id': 'jid1', 'Execution Name': 'exec1', 'Step Function': 'sfn1',
+                               'Log Bucket': 'bucket1', 'Time Stamp': '20240101-00:00:00-UTC'}
+
+
+def test_batch_writer_chunks(dd):
+    with BatchWriter('table1', max_delay=None) as writer:
+        for item in items(60):
+            writer.put(item)
+        # two full batches are written as soon as they are filled
+        assert dd.batch_write_item.call_count == 2
+    assert dd.batch_write_item.call_count == 3
+    assert [len(call[1]['RequestItems']['table1']) for call in dd.batch_write_item.call_args_list] == [25, 25, 10]
+    assert written_job_ids(dd) == ['jid%d' % i for i in range(60)]
+    assert writer.n_written == 60
+    assert writer.n_failed == 0
+
+
+def test_batch_writer_retries_unprocessed_items(dd):
+    unprocessed = [{'PutRequest': {'Item': item}} for item in items(3)]
+    dd.batch_write_item.side_effect = [{'UnprocessedItems': {'table1': unprocessed}},
+                                       {'UnprocessedItems': {'table1': unprocessed[2:]}},
+                                       {'UnprocessedItems': {}}]
+    writer = BatchWriter('table1', max_delay=None, base_delay=0)
+    for item in items(5):
+        writer.put(item)
+    writer.close()
+    assert dd.batch_write_item.call_count == 3
+    assert dd.batch_write_item.call_args[1]['RequestItems'] == {'table1': unprocessed[2:]}
+    assert writer.n_written == 5
+
+
+def test_batch_writer_gives_up(dd):
+    dd.batch_write_item.side_effect = lambda RequestItems: {'UnprocessedItems': RequestItems}
+    writer = BatchWriter('table1', max_delay=None, max_retries=2, base_delay=0)
+    writer.put(items(1)[0])
+    writer.close()
+    assert dd.batch_write_item.call_count == 3
+    assert writer.n_failed == 1
+
+
+def test_batch_writer_flushes_stale_items(dd):
+    with BatchWriter('table1', max_delay=0.05) as writer:
+        writer.put(items(1)[0])
+        for _ in range(100):
+            if dd.batch_write_item.called:
+                break
+            writer._stop.wait(0.01)
+        assert dd.batch_write_item.call_count == 1
+    assert dd.batch_write_item.call_count == 1
+
+
+def test_batch_writer_no_table():
+    with mock.patch('tibanna.dd_utils.get_client') as get_client, \
+         mock.patch('tibanna.dd_utils.does_dynamo_table_exist', return_value=False):
+        with BatchWriter('table1', max_delay=None) as writer:
+            writer.put(items(1)[0])
+        get_client.return_value.batch_write_item.assert_not_called()
+    assert writer.n_failed == 1
+
+
+def test_add_to_dd_with_writer():
+    writer = mock.Mock()
+    Job.add_to_dd('jid1', 'exec1', 'sfn1', 'bucket1', dd_writer=writer)
+    assert writer.put.call_args[0][0]['Job Id'] == {'S': 'jid1'}
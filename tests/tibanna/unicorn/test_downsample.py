@@ -0,0 +1,17 @@
+from tibanna.downsample import lttb
+
+
+def test_lttb_short_series():
+    assert lttb([1, 2, 3], [1, 2, 3], 10) == [0, 1, 2]
+
+
+def test_lttb_keeps_the_peaks():
+    xs = list(range(1000))
+    ys = [0] * 1000
+    ys[123] = 50
+    ys[789] = -50
+    kept = lttb(xs, ys, 20)
+    assert len(kept) == 20
+    assert kept[0] == 0 and kept[-1] == 999
+    assert 123 in kept and 789 in kept
+    assert kept == sorted(kept)
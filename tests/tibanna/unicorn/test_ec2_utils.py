@@ -1,4 +1,5 @@
 import boto3
+from botocore.exceptions import ClientError
 import pytest
 import base64
 import os
@@ -11,7 +12,11 @@ from tibanna.ec2_utils import (
     Config,
     Execution,
     upload_workflow_to_s3,
-    get_file_size
+    get_file_size,
+    known_launch_templates,
+    launch_template_name,
+    delete_old_launch_template_versions,
+    cleanup_launch_templates
 )
 from tibanna.pricing_utils import (
     get_cost_estimate
@@ -26,6 +31,7 @@ from tibanna.exceptions import (
     DependencyFailedException
 )
 from tibanna.awsem import AwsemRunJson, AwsemPostRunJson
+from datetime import datetime, timedelta, timezone
 
 
 def fun():
@@ -627,7 +633,7 @@ def test_upload_run_json_encrypt_s3_upload():
 
 
 @mock.patch.object(Execution, 'create_launch_template')
-@mock.patch.object(Execution, 'delete_launch_template')
+@mock.patch.object(Execution, 'delete_launch_template_version')
 @mock.patch.object(Execution, 'create_fleet')
 @mock.patch.object(Execution, 'delete_fleet')
 def test_launch_and_get_instance_id(test_delete_fleet, test_create_fleet, test_create_launch_template, test_delete_launch_template):
@@ -745,6 +751,61 @@ def test_create_fleet_spec():
     assert len(potential_ec2s) == 4
     assert potential_ec2s[0]["InstanceType"] == potential_ec2s[1]["InstanceType"]
     assert potential_ec2s[0]["ImageId"] != potential_ec2s[2]["ImageId"]
+    # the instance types are prioritized in the given order
+    assert [ec2["Priority"] for ec2 in potential_ec2s] == [1.0, 1.0, 2.0, 2.0]
+    assert fleet_spec["OnDemandOptions"]["AllocationStrategy"] == "prioritized"
+    assert fleet_spec["SpotOptions"]["AllocationStrategy"] == "capacity-optimized-prioritized"
+
+
+def test_instance_types_ranked_by_price():
+    """instance types chosen by cpu and mem are ranked by price and the launched one is recorded"""
+    input_dict = {'args': {'output_S3_bucket': 'somebucket',
+                           'cwl_main_filename': 'md5.cwl',
+                           'cwl_directory_url': 'someurl'},
+                  'config': {'log_bucket': 'tibanna-output', 'cpu': 2, 'mem': 3, 'spot_instance': True,
+                             'subnet': 'subnet-1', 'security_group': 'sg-1'},
+                  'jobid': 'job1'}
+    infos = {'t3.medium': {'EBS_optimized': True, 'arch': 'x86_64'},
+             't4g.medium': {'EBS_optimized': True, 'arch': 'arm64'},
+             't3.large': {'EBS_optimized': True, 'arch': 'x86_64'}}
+    prices = {'t3.medium': {'ondemand': 0.0416, 'spot': {'us-east-1a': 0.02, 'us-east-1b': 0.015}},
+              't4g.medium': {'ondemand': 0.0336, 'spot': {'us-east-1a': 0.012}},
+              't3.large': {'ondemand': 0.0832, 'spot': {}}}
+    with mock.patch('Benchmark.classes.get_instance_types',
+                    return_value=[{'instance_type': it, 'cpu': 2, 'mem_in_gb': 4 if 'medium' in it else 8,
+                                   'cost_in_usd': prices[it]['ondemand']} for it in infos]), \
+         mock.patch.object(Execution, 'describe_instance_types', return_value=infos), \
+         mock.patch.object(Execution, 'get_instance_prices', return_value=prices):
+        execution = Execution(input_dict)
+    assert execution.instance_type_list == ['t4g.medium', 't3.medium', 't3.large']
+    assert execution.cfg.instance_candidates == [{'instance_type': 't4g.medium', 'rank': 1, 'price': 0.012},
+                                                 {'instance_type': 't3.medium', 'rank': 2, 'price': 0.015},
+                                                 {'instance_type': 't3.large', 'rank': 3, 'price': 0.0832}]
+    execution.launch_template_name = "LT"
+    fleet_spec = execution.create_fleet_spec()
+    assert [(ec2["InstanceType"], ec2["Priority"]) for ec2 in fleet_spec["LaunchTemplateConfigs"][0]["Overrides"]] == \
+        [('t4g.medium', 1.0), ('t3.medium', 2.0), ('t3.large', 3.0)]
+    assert fleet_spec["SpotOptions"]["AllocationStrategy"] == "capacity-optimized-prioritized"
+    execution.cached = False
+    execution.runjson = {'config': {}}
+
+    def launch_and_get_instance_id():
+        # the fleet launched the second candidate
+        execution.launched_instance_type = 't3.medium'
+        return 'i-1'
+    with mock.patch.object(execution, 'launch_and_get_instance_id', side_effect=launch_and_get_instance_id), \
+         mock.patch.object(Execution, 'get_instance_info',
+                           return_value={'instance_id': 'i-1', 'availability_zone': 'us-east-1a'}), \
+         mock.patch.object(Execution, 'add_instance_id_to_dynamodb'):
+        execution.launch()
+    # the spot price in the availability zone of the instance
+    assert execution.cfg.instance_rank == 2 and execution.cfg.instance_price == 0.02
+    with mock.patch.object(Execution, 'upload_run_json') as upload_run_json:
+        execution.postlaunch()
+    upload_run_json.assert_called_once()
+    runjson_config = upload_run_json.call_args[0][0]['config']
+    assert runjson_config['instance_rank'] == 2 and runjson_config['instance_price'] == 0.02
+    assert 'get_instance_info' in runjson_config['launch_timing']['phases']
 
 
 def test_create_fleet():
@@ -1038,3 +1099,124 @@ def test_check_dependency_failed():
     assert 'failed' in str(exec_info.value)
     assert 'jid1' not in str(exec_info.value)
     assert 'jid2' in str(exec_info.value)
+
+
+def launch_template_execution(**cfg):
+    input_dict = {'args': {'output_S3_bucket': 'somebucket',
+                           'cwl_main_filename': 'md5.cwl',
+                           'cwl_directory_url': 'someurl'},
+                  'config': dict({'log_bucket': 'tibanna-output', 'instance_type': 't3.micro', 'ebs_size': 10}, **cfg),
+                  'jobid': create_jobid()}
+    with mock.patch('tibanna.ec2_utils.Execution.get_input_size_in_bytes', return_value={}), \
+         mock.patch('tibanna.ec2_utils.Execution.create_instance_type_list'):
+        execution = Execution(input_dict)
+    execution.userdata = 'userdata'
+    return execution
+
+
+def test_shared_launch_templates():
+    known_launch_templates.clear()
+    ec2 = mock.Mock()
+    ec2.create_launch_template_version.side_effect = \
+        [{'LaunchTemplateVersion': {'VersionNumber': n}} for n in range(2, 6)]
+    with mock.patch('tibanna.ec2_utils.get_client', return_value=ec2):
+        executions = [launch_template_execution(), launch_template_execution(ebs_size=20),
+                      launch_template_execution(spot_instance=True)]
+        for execution in executions:
+            execution.create_launch_template()
+    # jobs with the same configuration share a launch template, which is created only once
+    assert executions[0].launch_template_name == executions[1].launch_template_name
+    assert executions[0].launch_template_name != executions[2].launch_template_name
+    assert executions[0].launch_template_name.startswith('TibannaLaunchTemplate_')
+    assert ec2.create_launch_template.call_count == 2
+    # job-specific settings are in the version
+    version_data = ec2.create_launch_template_version.call_args_list[1][1]['LaunchTemplateData']
+    assert version_data['UserData'] == 'userdata'
+    assert version_data['BlockDeviceMappings'][0]['Ebs']['VolumeSize'] == 25
+    assert version_data['TagSpecifications'][0]['Tags'][0]['Value'] == 'awsem-' + executions[1].jobid
+    base_data = ec2.create_launch_template.call_args[1]['LaunchTemplateData']
+    assert 'UserData' not in base_data
+    assert base_data['InstanceMarketOptions']['MarketType'] == 'spot'
+    executions[1].instance_type_list = ['t3.micro']
+    executions[1].instance_type_infos = {'t3.micro': {'ami_id': 'ami-1'}}
+    spec = executions[1].create_fleet_spec()['LaunchTemplateConfigs'][0]['LaunchTemplateSpecification']
+    assert spec == {'LaunchTemplateName': executions[1].launch_template_name, 'Version': '3'}
+    known_launch_templates.clear()
+
+
+def test_launch_template_recreated_if_deleted():
+    execution = launch_template_execution()
+    base_data, _ = execution.launch_template_data()
+    # e.g. a warm lambda that does not know that the template was deleted by cleanup_launch_templates
+    known_launch_templates.add(launch_template_name(base_data))
+    ec2 = mock.Mock()
+    ec2.create_launch_template_version.side_effect = \
+        [Exception('InvalidLaunchTemplateName.NotFoundException'), {'LaunchTemplateVersion': {'VersionNumber': 2}}]
+    with mock.patch('tibanna.ec2_utils.get_client', return_value=ec2):
+        execution.create_launch_template()
+    assert execution.launch_template_version == 2
+    assert ec2.create_launch_template.call_count == 1
+    known_launch_templates.clear()
+
+
+def test_launch_template_version_deleted_after_create_fleet():
+    # the version has the user data of the job, which may include credentials
+    fleets = [{'FleetId': 'fleet-1', 'Instances': [{'InstanceIds': ['i-1'], 'InstanceType': 't3.micro'}]},
+              {'FleetId': 'fleet-1', 'Errors': [{'ErrorCode': 'Unhandled_error', 'ErrorMessage': 'error'}]}]
+    for fleet in fleets:
+        known_launch_templates.clear()
+        execution = launch_template_execution()
+        execution.instance_type_list = ['t3.micro']
+        execution.instance_type_infos = {'t3.micro': {'ami_id': 'ami-1'}}
+        ec2 = mock.Mock()
+        ec2.create_launch_template_version.return_value = {'LaunchTemplateVersion': {'VersionNumber': 7}}
+        with mock.patch('tibanna.ec2_utils.get_client', return_value=ec2), \
+             mock.patch.object(Execution, 'create_fleet', return_value=fleet), \
+             mock.patch.object(Execution, 'delete_fleet'):
+            if 'Instances' in fleet:
+                assert execution.launch_and_get_instance_id() == 'i-1'
+            else:
+                with pytest.raises(Exception) as ex:
+                    execution.launch_and_get_instance_id()
+                assert 'Unexpected result from create_fleet command' in str(ex.value)
+        ec2.delete_launch_template_versions.assert_called_once_with(
+            DryRun=False, LaunchTemplateName=execution.launch_template_name, Versions=['7'])
+    known_launch_templates.clear()
+
+
+def test_launch_template_version_limit():
+    known_launch_templates.clear()
+    execution = launch_template_execution()
+    ec2 = mock.Mock()
+    limit = ClientError({'Error': {'Code': 'VersionLimitExceeded', 'Message': 'too many versions'}},
+                        'CreateLaunchTemplateVersion')
+    ec2.create_launch_template_version.side_effect = [limit, {'LaunchTemplateVersion': {'VersionNumber': 2}}]
+    with mock.patch('tibanna.ec2_utils.get_client', return_value=ec2), \
+         mock.patch('tibanna.ec2_utils.delete_old_launch_template_versions') as delete_old_versions:
+        execution.create_launch_template()
+    # the versions left behind are deleted before the version of the job is created again
+    delete_old_versions.assert_called_once_with(execution.launch_template_name)
+    assert execution.launch_template_version == 2
+    known_launch_templates.clear()
+
+
+def test_cleanup_launch_templates():
+    now = datetime.now(timezone.utc)
+    ec2 = mock.Mock()
+    versions = [{'VersionNumber': 1, 'DefaultVersion': True, 'CreateTime': now - timedelta(days=3)},
+                {'VersionNumber': 2, 'DefaultVersion': False, 'CreateTime': now - timedelta(hours=2)},
+                {'VersionNumber': 3, 'DefaultVersion': False, 'CreateTime': now}]
+    ec2.get_paginator.return_value.paginate.side_effect = lambda **kwargs: \
+        [{'LaunchTemplates': [{'LaunchTemplateName': 'TibannaLaunchTemplate_old'},
+                              {'LaunchTemplateName': 'TibannaLaunchTemplate_new'}]}] \
+        if 'Filters' in kwargs else [{'LaunchTemplateVersions': versions}]
+    ec2.describe_launch_template_versions.side_effect = lambda LaunchTemplateName, Versions: \
+        {'LaunchTemplateVersions': [versions[0] if LaunchTemplateName.endswith('old') else versions[2]]}
+    with mock.patch('tibanna.ec2_utils.get_client', return_value=ec2):
+        assert delete_old_launch_template_versions('TibannaLaunchTemplate_new') == ['2']
+        assert cleanup_launch_templates(older_than_hours=24, dryrun=True) == ['TibannaLaunchTemplate_old']
+        ec2.delete_launch_template.assert_not_called()
+        assert cleanup_launch_templates(older_than_hours=24) == ['TibannaLaunchTemplate_old']
+    ec2.delete_launch_template.assert_called_once_with(LaunchTemplateName='TibannaLaunchTemplate_old')
+    ec2.delete_launch_template_versions.assert_called_with(LaunchTemplateName='TibannaLaunchTemplate_new',
+                                                           Versions=['2'])
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+
+# budget (in microseconds) for the cumulative import time of tibanna.core
+IMPORT_TIME_BUDGET = int(os.environ.get('TIBANNA_IMPORT_TIME_BUDGET', 1000000))
+
+
+def importtime(module):
+    """run `python -X importtime -c "import <module>"` without any AWS credentials or network
+    and return {module_name: cumulative_import_time_in_microseconds}"""
+    env = {k: v for k, v in os.environ.items() if not k.startswith('AWS_')}
+    env.update({'AWS_CONFIG_FILE': os.devnull, 'AWS_SHARED_CREDENTIALS_FILE': os.devnull})
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                         env=env, capture_output=True, text=True)
+    assert res.returncode == 0, res.stderr
+    times = dict()
+    for line in res.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_tibanna_core_is_lazy():
+    importtime('tibanna.core')  # warm up (compiling .pyc files)
+    times = importtime('tibanna.core')
+    assert 'tibanna.core' in times
+    # no network call and no heavy dependency at import time
+    for heavy in ['boto3', 'botocore', 'Benchmark']:
+        assert heavy not in times
+    assert times['tibanna.core'] < IMPORT_TIME_BUDGET
+
+
+def test_import_awsf3_is_lazy():
+    times = importtime('awsf3.utils')
+    assert 'awsf3.utils' in times
+    for heavy in ['boto3', 'botocore', 'Benchmark']:
+        assert heavy not in times
+
+
+def test_config_is_resolved_lazily(monkeypatch):
+    from tibanna.vars import TibannaConfig, STEP_FUNCTION_ARN, config
+    monkeypatch.setenv('AWS_ACCOUNT_NUMBER', '123456789012')
+    monkeypatch.setenv('TIBANNA_AWS_REGION', 'us-west-2')
+    cfg = TibannaConfig()
+    assert cfg.aws_region == 'us-west-2'
+    assert cfg.base_exec_arn == 'arn:aws:states:us-west-2:123456789012:execution:%s:%s'
+    assert cfg.s3_access_arn.startswith('arn:aws:iam::123456789012:instance-profile/')
+    monkeypatch.setattr(config, '_aws_region', 'us-east-2')
+    monkeypatch.setattr(config, '_aws_account_number', '210987654321')
+    assert STEP_FUNCTION_ARN('sfn1') == 'arn:aws:states:us-east-2:210987654321:stateMachine:sfn1'
+    from tibanna import vars
+    assert vars.AWS_REGION == 'us-east-2'
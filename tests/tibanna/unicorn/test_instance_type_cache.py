@@ -0,0 +1,130 @@
+from tibanna.instance_type_cache import InstanceTypeCache, INSTANCE_TYPE_CACHE_VERSION, benchmark_instance_list
+from tibanna.ec2_utils import Execution
+from unittest import mock
+import json
+import time
+import threading
+
+
+INFOS = {'t3.medium': {'EBS_optimized': True, 'arch': 'x86_64'},
+         'm6g.large': {'EBS_optimized': True, 'arch': 'arm64'},
+         't2.micro': {'EBS_optimized': False, 'arch': 'x86_64'}}
+
+
+def fetch(instance_types):
+    return {it: INFOS[it] for it in instance_types}
+
+
+class FakeBucket(object):
+    def __init__(self):
+        self.objects = dict()
+
+    def read_s3(self, bucket, key):
+        return self.objects[bucket + '/' + key]
+
+    def put_object_s3(self, content, key, bucket, **kwargs):
+        self.objects[bucket + '/' + key] = content
+
+
+def patch_s3(s3):
+    return mock.patch.multiple('tibanna.instance_type_cache', read_s3=mock.Mock(side_effect=s3.read_s3),
+                               put_object_s3=mock.Mock(side_effect=s3.put_object_s3))
+
+
+def test_in_process_cache():
+    fetch_mock = mock.Mock(side_effect=fetch)
+    cache = InstanceTypeCache(fetch_mock)
+    assert cache.describe(['t3.medium'], 'us-east-1') == {'t3.medium': INFOS['t3.medium']}
+    assert cache.describe(['t3.medium', 'm6g.large'], 'us-east-1') == fetch(['t3.medium', 'm6g.large'])
+    assert cache.describe(['m6g.large', 't3.medium'], 'us-east-1') == fetch(['t3.medium', 'm6g.large'])
+    # only the missing instance types are fetched
+    assert fetch_mock.call_args_list == [mock.call(['t3.medium']), mock.call(['m6g.large'])]
+    # regions are cached separately
+    cache.describe(['t3.medium'], 'us-west-2')
+    assert fetch_mock.call_count == 3
+
+
+def test_cache_expires():
+    fetch_mock = mock.Mock(side_effect=fetch)
+    cache = InstanceTypeCache(fetch_mock, ttl=60)
+    cache.describe(['t3.medium'], 'us-east-1')
+    cache.regions['us-east-1']['created'] -= 61
+    cache.describe(['t3.medium'], 'us-east-1')
+    assert fetch_mock.call_count == 2
+    # ttl 0 disables the cache
+    cache = InstanceTypeCache(fetch_mock, ttl=0)
+    cache.describe(['t3.medium'], 'us-east-1')
+    cache.describe(['t3.medium'], 'us-east-1')
+    assert fetch_mock.call_count == 4
+
+
+def test_snapshot_shared_between_processes():
+    s3 = FakeBucket()
+    fetch_mock = mock.Mock(side_effect=fetch)
+    with patch_s3(s3):
+        InstanceTypeCache(fetch_mock).describe(['t3.medium', 'm6g.large'], 'us-east-1', bucket='logbucket')
+        snapshot = json.loads(s3.objects['logbucket/.tibanna_cache/instance_types/us-east-1.json'])
+        assert snapshot['version'] == INSTANCE_TYPE_CACHE_VERSION
+        assert snapshot['instance_types'] == fetch(['t3.medium', 'm6g.large'])
+        # a new process (e.g. a cold lambda) reads the snapshot instead of calling the API
+        res = InstanceTypeCache(fetch_mock).describe(['m6g.large', 't2.micro'], 'us-east-1', bucket='logbucket')
+        assert res == fetch(['m6g.large', 't2.micro'])
+        assert fetch_mock.call_args_list[1] == mock.call(['t2.micro'])
+        snapshot = json.loads(s3.objects['logbucket/.tibanna_cache/instance_types/us-east-1.json'])
+        assert sorted(snapshot['instance_types']) == sorted(INFOS)
+
+
+def test_outdated_snapshot_is_ignored():
+    s3 = FakeBucket()
+    fetch_mock = mock.Mock(side_effect=fetch)
+    for snapshot in [{'version': INSTANCE_TYPE_CACHE_VERSION - 1, 'region': 'us-east-1', 'created': time.time()},
+                     {'version': INSTANCE_TYPE_CACHE_VERSION, 'region': 'us-east-1', 'created': time.time() - 100}]:
+        snapshot['instance_types'] = {'t3.medium': {'EBS_optimized': False, 'arch': 'arm64'}}
+        s3.objects['logbucket/.tibanna_cache/instance_types/us-east-1.json'] = json.dumps(snapshot)
+        with patch_s3(s3):
+            res = InstanceTypeCache(fetch_mock, ttl=60).describe(['t3.medium'], 'us-east-1', bucket='logbucket')
+        assert res == fetch(['t3.medium'])
+    assert fetch_mock.call_count == 2
+
+
+def test_fetch_does_not_block_other_callers():
+    # e.g. the parallel prefetch of Planner
+    fetching, release = threading.Event(), threading.Event()
+
+    def slow_fetch(instance_types):
+        if 'm6g.large' in instance_types:
+            fetching.set()
+            release.wait(10)
+        return fetch(instance_types)
+
+    cache = InstanceTypeCache(slow_fetch)
+    cache.describe(['t3.medium'], 'us-east-1')
+    thread = threading.Thread(target=cache.describe, args=(['m6g.large'], 'us-east-1'))
+    thread.start()
+    assert fetching.wait(10)
+    # the cached instance type is returned while m6g.large is being fetched
+    done = []
+    other = threading.Thread(target=lambda: done.append(cache.describe(['t3.medium'], 'us-east-1')))
+    other.start()
+    other.join(5)
+    assert done == [{'t3.medium': INFOS['t3.medium']}]
+    release.set()
+    thread.join(10)
+    assert cache.describe(['m6g.large', 't3.medium'], 'us-east-1') == fetch(['m6g.large', 't3.medium'])
+
+
+def test_benchmark_instance_list_is_copied():
+    list1 = benchmark_instance_list()
+    list1[0]['ami_id'] = 'ami-1'
+    assert 'ami_id' not in benchmark_instance_list()[0]
+
+
+def test_create_instance_type_list_uses_cache():
+    input_dict = {'args': {'output_S3_bucket': 'somebucket', 'cwl_main_filename': 'main.cwl',
+                           'cwl_directory_url': 's3://cwlbucket/cwl/'},
+                  'config': {'log_bucket': 'logbucket', 'mem': 2, 'cpu': 1, 'ebs_size': 10}}
+    with mock.patch('tibanna.ec2_utils.instance_type_cache') as cache:
+        cache.describe.side_effect = lambda its, *args, **kwargs: {it: INFOS['t3.medium'] for it in its}
+        execution = Execution(input_dict, dryrun=True)
+    assert len(execution.instance_type_list) == 10
+    assert cache.describe.call_args[1]['bucket'] == 'logbucket'
@@ -0,0 +1,71 @@
+from tibanna.job_status import new_job_status, set_phase, mark_job_aborted
+from tibanna.check_task import CheckTask
+from tibanna.exceptions import StillRunningException, JobAbortedException
+from unittest import mock
+import pytest
+
+
+def test_set_phase():
+    status = new_job_status('job1', 'logbucket')
+    set_phase(status, 'started', timestamp='20260101-10:00:00-UTC')
+    set_phase(status, 'running', timestamp='20260101-10:05:00-UTC')
+    set_phase(status, 'running', timestamp='20260101-10:06:00-UTC')  # no change
+    set_phase(status, 'failed', exit_status='1', timestamp='20260101-10:10:00-UTC')
+    assert status['phase'] == 'failed' and status['exit_status'] == '1'
+    assert status['started_at'] == '20260101-10:00:00-UTC'
+    assert status['phases']['running'] == '20260101-10:05:00-UTC'
+    assert status['ended_at'] == '20260101-10:10:00-UTC'
+    with pytest.raises(Exception):
+        set_phase(status, 'sleeping')
+
+
+def test_mark_job_aborted():
+    status = set_phase(new_job_status('job1', 'logbucket'), 'running')
+    with mock.patch('tibanna.job_status.read_job_status', return_value=status), \
+         mock.patch('tibanna.job_status.put_object_s3') as put:
+        mark_job_aborted('logbucket', 'job1')
+    assert put.call_args[0][1] == 'job1.status.json'
+    assert '"aborted"' in put.call_args[0][0]
+    # a job that ended is left as it is
+    status = set_phase(new_job_status('job1', 'logbucket'), 'succeeded')
+    with mock.patch('tibanna.job_status.read_job_status', return_value=status), \
+         mock.patch('tibanna.job_status.put_object_s3') as put:
+        mark_job_aborted('logbucket', 'job1')
+    put.assert_not_called()
+
+
+def check_task_input():
+    return {'jobid': 'job1', 'args': {},
+            'config': {'log_bucket': 'logbucket', 'instance_id': 'i-1', 'start_time': '20260101-10:00:00-UTC'}}
+
+
+def ec2_client(state):
+    ec2 = mock.Mock()
+    ec2.describe_instances.return_value = {'Reservations': [{'Instances': [{'State': {'Name': state}}]}]}
+    return ec2
+
+
+def test_check_task_reads_the_status_document():
+    status = set_phase(new_job_status('job1', 'logbucket', instance_id='i-1'), 'running')
+    status['started_at'] = '20260101-10:00:00-UTC'
+    with mock.patch('tibanna.check_task.read_job_status', return_value=status), \
+         mock.patch('tibanna.check_task.does_key_exist') as does_key_exist, \
+         mock.patch('tibanna.check_task.get_client', return_value=ec2_client('running')), \
+         mock.patch.object(CheckTask, 'terminate_idle_instance'), \
+         mock.patch.object(CheckTask, 'TibannaResource'):
+        with pytest.raises(StillRunningException):
+            CheckTask(check_task_input()).run()
+    # no marker is looked up
+    does_key_exist.assert_not_called()
+
+
+def test_check_task_falls_back_to_the_markers():
+    # the status document says running but the job was killed
+    status = set_phase(new_job_status('job1', 'logbucket', instance_id='i-1'), 'running')
+    markers = ['job1.job_started', 'job1.aborted']
+    with mock.patch('tibanna.check_task.read_job_status', return_value=status), \
+         mock.patch('tibanna.check_task.does_key_exist', side_effect=lambda bucket, key: key in markers), \
+         mock.patch('tibanna.check_task.get_client', return_value=ec2_client('terminated')), \
+         mock.patch.object(CheckTask, 'handle_postrun_json'):
+        with pytest.raises(JobAbortedException):
+            CheckTask(check_task_input()).run()
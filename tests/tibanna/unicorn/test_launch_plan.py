@@ -0,0 +1,111 @@
+from tibanna.launch_plan import LaunchPlan, LAUNCH_RETRY_BASE, LAUNCH_RETRY_CAP, LAUNCH_RETRY_BUDGET
+from tibanna.ec2_utils import Execution
+from tibanna.exceptions import EC2InstanceLimitWaitException
+from unittest import mock
+import json
+import pytest
+
+
+def input_dict():
+    return {'args': {'output_S3_bucket': 'outbucket', 'cwl_main_filename': 'main.cwl',
+                     'cwl_directory_url': 's3://cwlbucket/cwl/'},
+            'config': {'log_bucket': 'logbucket', 'instance_type': ['t3.medium', 't3.large'], 'ebs_size': 10,
+                       'subnet': ['subnet-1', 'subnet-2'], 'security_group': 'sg-1',
+                       'behavior_on_capacity_limit': 'wait_and_retry'},
+            'jobid': 'job1'}
+
+
+def execution(**kwargs):
+    infos = {'t3.medium': {'EBS_optimized': True, 'arch': 'x86_64'},
+             't3.large': {'EBS_optimized': True, 'arch': 'x86_64'}}
+    with mock.patch.object(Execution, 'describe_instance_types', return_value=infos):
+        ex = Execution(input_dict(), **kwargs)
+    ex.launch_template_name = 'LT'
+    ex.runjson = {'config': {}}
+    return ex
+
+
+def no_capacity(*pairs):
+    return {'FleetId': 'fleet-1',
+            'Errors': [{'ErrorCode': 'InsufficientInstanceCapacity', 'ErrorMessage': 'no capacity',
+                        'LaunchTemplateAndOverrides': {'Overrides': {'InstanceType': it, 'SubnetId': subnet}}}
+                       for it, subnet in pairs]}
+
+
+def launched(instance_type):
+    return {'FleetId': 'fleet-1', 'Instances': [{'InstanceIds': ['i-1'], 'InstanceType': instance_type}]}
+
+
+def test_decorrelated_jitter():
+    plan = LaunchPlan('job1')
+    delays = [plan.next_delay() for _ in range(20)]
+    assert all(LAUNCH_RETRY_BASE <= d <= LAUNCH_RETRY_CAP for d in delays)
+    assert all(d <= 3 * max(LAUNCH_RETRY_BASE, prev) for prev, d in zip(delays, delays[1:]))
+
+
+def test_pairs_without_capacity_are_excluded():
+    ex = execution()
+    results = [no_capacity(('t3.medium', 'subnet-1')), launched('t3.medium')]
+    requested = []
+
+    def create_fleet():
+        requested.append([(o['InstanceType'], o['SubnetId']) for o in ex.fleet_overrides()])
+        return results.pop(0)
+    with mock.patch.object(Execution, 'create_launch_template'), \
+         mock.patch.object(Execution, 'delete_fleet'), \
+         mock.patch('tibanna.ec2_utils.time.sleep') as sleep, \
+         mock.patch.object(ex, 'create_fleet', side_effect=create_fleet):
+        assert ex.launch_and_get_instance_id() == 'i-1'
+    assert requested[1] == [('t3.medium', 'subnet-2'), ('t3.large', 'subnet-1'), ('t3.large', 'subnet-2')]
+    # the other pairs are requested without waiting
+    sleep.assert_not_called()
+    assert ex.launched_instance_type == 't3.medium'
+
+
+def test_launch_retries_are_short():
+    # the vCPU limit of the account excludes no pair : run_task waits a little, then leaves it to the step function
+    ex = execution()
+    clock = [1000.0]
+    limit = {'FleetId': 'fleet-1', 'Errors': [{'ErrorCode': 'InstanceLimitExceeded', 'ErrorMessage': 'limit'}]}
+    with mock.patch.object(Execution, 'create_launch_template'), \
+         mock.patch.object(Execution, 'delete_fleet'), \
+         mock.patch.object(Execution, 'save_launch_plan'), \
+         mock.patch.object(Execution, 'create_fleet', return_value=limit) as create_fleet, \
+         mock.patch('tibanna.ec2_utils.time.time', side_effect=lambda: clock[0]), \
+         mock.patch('tibanna.ec2_utils.time.sleep', side_effect=lambda s: clock.__setitem__(0, clock[0] + s)):
+        with pytest.raises(EC2InstanceLimitWaitException):
+            ex.launch_and_get_instance_id()
+    assert create_fleet.call_count > 1
+    assert clock[0] - 1000.0 <= LAUNCH_RETRY_BUDGET
+
+
+def test_plan_saved_and_resumed():
+    ex = execution()
+    saved = dict()
+    everything = [(it, s) for it in ['t3.medium', 't3.large'] for s in ['subnet-1', 'subnet-2']]
+    with mock.patch.object(Execution, 'create_launch_template'), \
+         mock.patch.object(Execution, 'delete_fleet'), \
+         mock.patch('tibanna.ec2_utils.LAUNCH_RETRY_BUDGET', 0), \
+         mock.patch.object(Execution, 'create_fleet', return_value=no_capacity(*everything)), \
+         mock.patch('tibanna.launch_plan.put_object_s3',
+                    side_effect=lambda content, key, bucket, **kwargs: saved.update({key: content})):
+        with pytest.raises(EC2InstanceLimitWaitException):
+            ex.launch_and_get_instance_id()
+    plan = json.loads(saved['job1.launch_plan.json'])
+    assert plan['attempts'] == 1 and len(plan['excluded']) == 4
+    assert plan['instance_type_list'] == ['t3.medium', 't3.large']
+
+    # the next run_task does not size inputs or rank instance types and does not upload the run json again
+    with mock.patch('tibanna.launch_plan.read_s3', return_value=saved['job1.launch_plan.json']), \
+         mock.patch.object(Execution, 'get_input_size_in_bytes') as get_input_size_in_bytes, \
+         mock.patch.object(Execution, 'create_instance_type_list') as create_instance_type_list:
+        ex = Execution(input_dict(), launch_plan=LaunchPlan.load('logbucket', 'job1'))
+    get_input_size_in_bytes.assert_not_called()
+    create_instance_type_list.assert_not_called()
+    assert ex.resumed and ex.instance_type_list == ['t3.medium', 't3.large']
+    with mock.patch.object(Execution, 'upload_run_json') as upload_run_json:
+        ex.prelaunch()
+    upload_run_json.assert_not_called()
+    # all the pairs are still excluded
+    assert ex.fleet_overrides() == []
+    assert ex.launch_plan.next_expiry() > 0
@@ -0,0 +1,106 @@
+from tibanna import aws_utils
+from tibanna.aws_utils import get_client
+from tibanna.launch_timer import LaunchTimer
+from tibanna.object_sizes import ObjectSizeResolver, ObjectSizeCache
+from tibanna.ec2_utils import Execution
+from unittest import mock
+import threading
+import pytest
+
+
+def test_launch_timer_counts_aws_calls():
+    aws_utils.reset()
+    s3 = get_client('s3', region_name='us-east-1')
+    timer = LaunchTimer()
+    with mock.patch('botocore.endpoint.Endpoint.make_request', side_effect=Exception('offline')):
+        with timer.phase('upload'):
+            for _ in range(2):
+                with pytest.raises(Exception):
+                    s3.head_object(Bucket='somebucket', Key='somekey')
+        with timer.phase('upload'):
+            with pytest.raises(Exception):
+                s3.put_object(Bucket='somebucket', Key='somekey', Body=b'')
+        # calls outside of a phase are not counted
+        with pytest.raises(Exception):
+            s3.put_object(Bucket='somebucket', Key='somekey', Body=b'')
+    aws_utils.reset()
+    timing = timer.as_dict()
+    assert timing['phases']['upload']['count'] == 2
+    assert timing['phases']['upload']['aws_calls'] == {'s3.HeadObject': 2, 's3.PutObject': 1}
+    assert timing['aws_calls'] == {'s3.HeadObject': 2, 's3.PutObject': 1}
+
+
+def test_launch_timer_counts_aws_calls_of_thread_pools():
+    aws_utils.reset()
+    timer = LaunchTimer()
+    # one object per directory : a head_object (and a listing when it fails) per object, from a thread pool
+    objects = [('somebucket', 'dir%d/somekey' % i) for i in range(4)]
+    with mock.patch('botocore.endpoint.Endpoint.make_request', side_effect=Exception('offline')):
+        with timer.phase('input_size'):
+            sizes = ObjectSizeResolver(concurrency=4, cache=ObjectSizeCache()).sizes(objects)
+    aws_utils.reset()
+    assert sizes == {o: None for o in objects}
+    assert timer.as_dict()['phases']['input_size']['aws_calls'] == {'s3.HeadObject': 4, 's3.ListObjectsV2': 4}
+
+
+def test_launch_timer_concurrently():
+    timer = LaunchTimer()
+    barrier = threading.Barrier(2, timeout=5)
+    # both phases must be running at the same time to get through the barrier
+    assert timer.concurrently(('a', lambda: barrier.wait() is not None and 'a'),
+                              ('b', lambda: barrier.wait() is not None and 'b')) == ['a', 'b']
+    with pytest.raises(ZeroDivisionError):
+        timer.concurrently(('c', lambda: 1 / 0), ('d', lambda: 'd'))
+    assert sorted(timer.as_dict()['phases']) == ['a', 'b', 'c', 'd']
+
+
+def input_dict():
+    return {'args': {'output_S3_bucket': 'outbucket', 'cwl_main_filename': 'main.cwl',
+                     'cwl_directory_url': 's3://cwlbucket/cwl/'},
+            'config': {'log_bucket': 'logbucket', 'instance_type': 't3.medium', 'ebs_size': 10,
+                       'subnet': 'subnet-1', 'security_group': 'sg-1'},
+            'jobid': 'job1'}
+
+
+def test_launch_records_timing():
+    with mock.patch.object(Execution, 'describe_instance_types',
+                           return_value={'t3.medium': {'EBS_optimized': True, 'arch': 'x86_64'}}):
+        ex = Execution(input_dict())
+    barrier = threading.Barrier(2, timeout=5)
+    uploaded = []
+    fleet = {'FleetId': 'fleet-1', 'Instances': [{'InstanceIds': ['i-1'], 'InstanceType': 't3.medium'}]}
+    with mock.patch.object(Execution, 'check_dependency'), \
+         mock.patch.object(Execution, 'create_userdata'), \
+         mock.patch.object(Execution, 'create_launch_template', side_effect=lambda: barrier.wait()), \
+         mock.patch.object(Execution, 'upload_run_json',
+                           side_effect=lambda runjson: uploaded.append(barrier.wait() if not uploaded else 0)), \
+         mock.patch.object(Execution, 'create_fleet', return_value=fleet), \
+         mock.patch.object(Execution, 'get_instance_info', return_value={'instance_id': 'i-1'}), \
+         mock.patch.object(Execution, 'add_instance_id_to_dynamodb'):
+        ex.prelaunch()
+        assert not uploaded  # uploaded together with the launch template
+        ex.launch()
+        ex.postlaunch()
+    assert len(uploaded) == 2  # once more with the launch timing
+    phases = ex.cfg.launch_timing['phases']
+    assert {'input_size', 'instance_types', 'check_dependency', 'create_launch_template', 'upload_run_json',
+            'create_fleet', 'get_instance_info', 'update_dynamodb'} <= set(phases)
+    assert ex.input_dict['config']['launch_timing'] == ex.cfg.launch_timing
+    assert ex.runjson['config']['launch_timing'] == ex.cfg.launch_timing
+
+
+def test_get_instance_info_gives_up():
+    with mock.patch.object(Execution, 'describe_instance_types',
+                           return_value={'t3.medium': {'EBS_optimized': True, 'arch': 'x86_64'}}):
+        ex = Execution(input_dict())
+    ex.instance_id = 'i-1'
+    ec2 = mock.Mock()
+    ec2.describe_instances.side_effect = Exception('InvalidInstanceID.NotFound')
+    with mock.patch('tibanna.ec2_utils.get_client', return_value=ec2), \
+         mock.patch('tibanna.ec2_utils.INSTANCE_INFO_TIMEOUT', 10), \
+         mock.patch('tibanna.ec2_utils.time.sleep') as sleep:
+        info = ex.get_instance_info()
+    assert info['instance_ip'] == '' and info['availability_zone'] == ''
+    delays = [c[0][0] for c in sleep.call_args_list]
+    assert delays == [0.5, 1, 2, 4]
+    assert ec2.describe_instances.call_count == 5
@@ -0,0 +1,103 @@
+from tibanna.metrics_store import (
+    MetricsStore,
+    get_metrics_store,
+    clear_metrics_stores,
+    percentile,
+    METRIC_QUERIES,
+    GET_METRIC_DATA_MAX_POINTS,
+    METRICS_REFETCH_MARGIN
+)
+from tibanna.vars import METRICS_COLLECTION_INTERVAL
+from datetime import datetime, timezone, timedelta
+from unittest import mock
+import math
+
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def minutes(*m):
+    return [START + timedelta(minutes=k) for k in m]
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([1, 2, 3, 4], 100) == 4
+    assert percentile([5], 95) == 5
+
+
+def test_store_aligns_the_metrics():
+    t = minutes(0, 2, 4)
+    store = MetricsStore.from_points('i-1', START, t[-1] + timedelta(minutes=2),
+                                     {'cpu_usage_active': [(t[2], 30.0), (t[0], 10.0), (t[1], 20.0)],
+                                      'mem_used': [(t[0], 100.0), (t[2], 300.0)],
+                                      'mem_available': [(t[0], 900.0), (t[2], 700.0)]})
+    assert store.timestamps == t
+    assert store.values('cpu_usage_active') == [10.0, 20.0, 30.0]
+    # the missing point of mem_used is skipped
+    assert store.values('mem_used') == [100.0, 300.0]
+    assert store.values('cpu_usage_active', t[1], t[2]) == [20.0]
+    summary = store.summary()
+    assert summary['cpu_usage_active'] == {'max': 30.0, 'min': 10.0, 'p50': 20.0, 'p95': 29.0}
+    assert summary['disk_used'] == {'max': None, 'min': None, 'p50': None, 'p95': None}
+    assert summary['max_mem_utilization_percent'] == 300.0 / (300.0 + 700.0) * 100
+    assert summary['mem_used']['max'] == 300.0 and summary['mem_available']['min'] == 700.0
+
+
+def test_store_windows():
+    points_per_query = GET_METRIC_DATA_MAX_POINTS // len(METRIC_QUERIES)
+    days = int(points_per_query * METRICS_COLLECTION_INTERVAL // 86400)
+    windows = MetricsStore.windows(START, START + timedelta(days=50))
+    assert windows[0] == (START, START + timedelta(days=days))
+    assert windows[-1][1] == START + timedelta(days=50)
+    assert len(windows) == math.ceil(50 / days)
+
+
+def test_get_metrics_store_is_shared():
+    clear_metrics_stores()
+    store = MetricsStore('i-1', START, START + timedelta(days=2))
+    with mock.patch.object(MetricsStore, 'fetch', return_value=store) as fetch:
+        assert get_metrics_store(None, 'i-1', START, START + timedelta(days=2)) is store
+        # a window that the store covers
+        assert get_metrics_store(None, 'i-1', START + timedelta(hours=1), START + timedelta(days=1)) is store
+        assert fetch.call_count == 1
+        # another instance, or a later end
+        get_metrics_store(None, 'i-2', START, START + timedelta(days=1))
+        get_metrics_store(None, 'i-1', START, START + timedelta(days=3))
+        assert fetch.call_count == 3
+    clear_metrics_stores()
+
+
+def test_store_to_bytes():
+    t = minutes(0, 2, 4)
+    store = MetricsStore.from_points('i-1', START, t[-1], {'cpu_usage_active': [(t[0], 10.0), (t[2], 30.5)],
+                                                           'mem_used': [(t[1], 100.0)]})
+    restored = MetricsStore.from_bytes(store.to_bytes())
+    assert restored.instance_id == 'i-1'
+    assert (restored.starttime, restored.endtime) == (START, t[-1])
+    assert restored.timestamps == t
+    assert restored.values('cpu_usage_active') == [10.0, 30.5]
+    assert restored.values('mem_used') == [100.0]
+    assert restored.values('disk_used') == []
+
+
+def test_get_metrics_store_appends_to_the_saved_store():
+    clear_metrics_stores()
+    t = minutes(0, 30, 60)
+    saved = MetricsStore.from_points('i-1', START, t[-1], {'cpu_usage_active': [(t[0], 1.0), (t[1], 2.0), (t[2], 3.0)]})
+    since = t[-1] - timedelta(seconds=METRICS_REFETCH_MARGIN)
+    new = MetricsStore.from_points('i-1', since, START + timedelta(hours=2),
+                                   {'cpu_usage_active': [(t[2], 4.0), (START + timedelta(hours=2), 5.0)]})
+    with mock.patch.object(MetricsStore, 'fetch', return_value=new) as fetch:
+        store = get_metrics_store(None, 'i-1', START, START + timedelta(hours=2), saved=saved)
+    # only the metrics after the high-water mark (minus the margin) are fetched
+    assert fetch.call_args[0][2:] == (since, START + timedelta(hours=2))
+    assert store.values('cpu_usage_active') == [1.0, 2.0, 4.0, 5.0]
+    assert store.starttime == START and store.endtime == START + timedelta(hours=2)
+    # a saved store that covers the window is used as it is
+    clear_metrics_stores()
+    with mock.patch.object(MetricsStore, 'fetch') as fetch:
+        assert get_metrics_store(None, 'i-1', START, t[-1], saved=saved) is saved
+        fetch.assert_not_called()
+    clear_metrics_stores()
@@ -0,0 +1,105 @@
+from tibanna.object_sizes import ObjectSizeResolver, ObjectSizeCache, get_object_etag, object_size_cache
+from tibanna.ec2_utils import Execution
+from unittest import mock
+import pytest
+
+
+class FakeS3(object):
+    """s3 client with head_object and a list_objects_v2 paginator"""
+    def __init__(self, objects, page_size=1000):
+        self.objects = objects  # {key: size} in one bucket
+        self.etags = dict()  # ETags of the overwritten objects
+        self.page_size = page_size
+        self.n_head = 0
+        self.n_pages = 0
+
+    def head_object(self, Bucket, Key):
+        self.n_head += 1
+        if Key not in self.objects:
+            raise Exception('Not Found')
+        return {'ContentLength': self.objects[Key], 'ETag': '"%s"' % self.etags.get(Key, 'etag-' + Key)}
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        paginator = mock.Mock()
+        paginator.paginate.side_effect = self.paginate
+        return paginator
+
+    def paginate(self, Bucket, Prefix, StartAfter=''):
+        keys = sorted(k for k in self.objects if k.startswith(Prefix) and k > StartAfter)
+        for i in range(0, len(keys), self.page_size):
+            self.n_pages += 1
+            yield {'Contents': [{'Key': k, 'Size': self.objects[k], 'ETag': '"etag-%s"' % k}
+                                for k in keys[i:i + self.page_size]]}
+
+
+@pytest.fixture
+def s3():
+    objects = {'scatter/file%05d.fastq' % i: i for i in range(2000)}
+    objects.update({'scatter/dir/a': 1, 'scatter/dir/b': 2, 'other/single.bam': 100,
+                    'other/folder/x': 10, 'other/folder/y': 20})
+    s3 = FakeS3(objects)
+    object_size_cache.clear()
+    with mock.patch('tibanna.object_sizes.get_client', return_value=s3):
+        yield s3
+    object_size_cache.clear()
+
+
+def test_sizes_from_prefix_listing(s3):
+    objects = [('bucket', 'scatter/file%05d.fastq' % i) for i in range(0, 2000, 2)]
+    objects += [('bucket', 'scatter/dir'), ('bucket', 'scatter/missing'),
+                ('bucket', 'other/single.bam'), ('bucket', 'other/folder')]
+    sizes = ObjectSizeResolver(cache=ObjectSizeCache()).sizes(objects)
+    assert sizes[('bucket', 'scatter/file01998.fastq')] == 1998
+    assert sizes[('bucket', 'scatter/dir')] == 3  # prefix
+    assert sizes[('bucket', 'scatter/missing')] == 0
+    assert sizes[('bucket', 'other/single.bam')] == 100
+    assert sizes[('bucket', 'other/folder')] == 30
+    # one listing for the 1002 scatter keys, head_object for the other directory
+    # (and a listing for the folder)
+    assert s3.n_head == 2
+    assert s3.n_pages == 3 + 1
+
+
+def test_sparse_listing_falls_back_to_head_object(s3):
+    s3.page_size = 100
+    objects = [('bucket', 'scatter/file%05d.fastq' % i) for i in range(0, 2000, 400)]
+    sizes = ObjectSizeResolver(cache=ObjectSizeCache()).sizes(objects)
+    assert sizes == {o: int(o[1][12:17]) for o in objects}
+    # only one page is listed for five keys
+    assert s3.n_pages == 1
+    assert s3.n_head == 4
+
+
+def test_sizes_are_memoized(s3):
+    objects = [('bucket', 'scatter/file%05d.fastq' % i) for i in range(10)]
+    ObjectSizeResolver().sizes(objects)
+    n_pages = s3.n_pages
+    assert ObjectSizeResolver().sizes(objects) == {o: int(o[1][12:17]) for o in objects}
+    assert s3.n_pages == n_pages
+    assert s3.n_head == 0
+
+
+def test_etags_are_not_memoized(s3):
+    objects = [('bucket', 'scatter/file%05d.fastq' % i) for i in range(10)]
+    ObjectSizeResolver().sizes(objects)
+    assert get_object_etag('bucket', 'scatter/file00003.fastq') == 'etag-scatter/file00003.fastq'
+    # the object is overwritten : the call cache must see the new ETag
+    s3.etags['scatter/file00003.fastq'] = 'etag-new'
+    assert get_object_etag('bucket', 'scatter/file00003.fastq') == 'etag-new'
+    assert s3.n_head == 2
+
+
+def test_get_input_size_in_bytes(s3):
+    input_dict = {'args': {'input_files': {'scatter': {'bucket_name': 'bucket',
+                                                       'object_key': [['scatter/file%05d.fastq' % i for i in range(3)],
+                                                                      ['scatter/file00003.fastq']]},
+                                           'bam': {'bucket_name': 'bucket', 'object_key': 'other/single.bam'}},
+                           'secondary_files': {'bam': {'bucket_name': 'bucket', 'object_key': 'other/folder'}},
+                           'output_S3_bucket': 'somebucket', 'cwl_main_filename': 'main.cwl',
+                           'cwl_directory_url': 's3://cwlbucket/cwl/'},
+                  'config': {'log_bucket': 'logbucket', 'instance_type': 't3.micro', 'ebs_size': '2x'}}
+    with mock.patch('tibanna.ec2_utils.Execution.create_instance_type_list'):
+        execution = Execution(input_dict)
+    assert execution.input_size_in_bytes == {'scatter': [0, 1, 2, 3], 'bam': 100, 'bam_secondary': 30}
+    assert execution.cfg.ebs_size == 10
@@ -0,0 +1,128 @@
+from tibanna.packing import JobPacker, host_instance
+from tibanna.instance_type_cache import benchmark_instance_list
+from tibanna.ec2_utils import Execution
+from tibanna.check_task import CheckTask
+from tibanna.exceptions import EC2UnintendedTerminationException, EC2LaunchException, EC2StartingException
+from unittest import mock
+import base64
+import pytest
+
+
+def input_dict(cpu=2, mem=4, language=None, **config):
+    d = {'args': {'output_S3_bucket': 'outbucket',
+                  'cwl_main_filename': 'main.cwl',
+                  'cwl_directory_url': 's3://cwlbucket/cwl/'},
+         'config': {'log_bucket': 'logbucket', 'cpu': cpu, 'mem': mem, 'ebs_size': 10}}
+    if language:
+        d['args'].update({'language': language, 'wdl_main_filename': 'main.wdl',
+                          'wdl_directory_url': 's3://wdlbucket/wdl/'})
+    d['config'].update(config)
+    return d
+
+
+@pytest.fixture
+def aws():
+    infos = {i['instance_type']: {'EBS_optimized': True, 'arch': 'x86_64'} for i in benchmark_instance_list()}
+    with mock.patch('tibanna.plan.get_object_sizes', return_value={}), \
+         mock.patch('tibanna.plan.describe_instance_types', return_value=infos):
+        yield
+
+
+def test_pack(aws):
+    inputs = [input_dict() for _ in range(5)] + \
+             [input_dict(language='wdl'), input_dict(instance_type='t3.medium'),
+              input_dict(log_bucket='otherbucket'), input_dict(cpu=16, mem=4)]
+    packed = JobPacker(max_cpu=8, max_mem=32).pack(inputs)
+    assert all(d['jobid'] for d in packed)
+    primary = packed[0]['config']
+    assert primary['cpu'] == 8 and primary['mem'] == 16
+    assert primary['ebs_size'] == 4 * 15 and primary['ebs_size_as_is']
+    assert primary['packed_jobs'] == [{'jobid': d['jobid'], 'cpu': 2, 'mem': 4} for d in packed[:4]]
+    assert [d['config'].get('packed_into') for d in packed[1:4]] == [packed[0]['jobid']] * 3
+    # the fifth job does not fit, the others are not compatible or not packable
+    for d in packed[4:]:
+        assert 'packed_into' not in d['config'] and 'packed_jobs' not in d['config']
+    # the input dictionaries are not modified
+    assert 'jobid' not in inputs[0] and inputs[0]['config']['cpu'] == 2
+
+
+def test_pack_unreadable_input(aws, tmpdir):
+    missing = str(tmpdir.join('missing.json'))
+    packed = JobPacker(max_cpu=8, max_mem=32).pack([input_dict(), missing, input_dict()])
+    # the other jobs are still packed, the unreadable one is left to fail on its own
+    assert packed[1] == missing
+    assert packed[2]['config']['packed_into'] == packed[0]['jobid']
+
+
+def test_first_fit_decreasing():
+    packer = JobPacker(max_cpu=4, max_mem=8, max_jobs=3)
+    # (index, cpu, mem, ebs_size)
+    jobs = [(0, 1, 1, 10), (1, 2, 6, 10), (2, 1, 2, 10), (3, 2, 2, 10), (4, 1, 1, 10)]
+    # the largest jobs (by memory) are placed first, each bin keeps the input order
+    assert packer.first_fit(jobs) == [[(1, 2, 6, 10), (3, 2, 2, 10)],
+                                      [(0, 1, 1, 10), (2, 1, 2, 10), (4, 1, 1, 10)]]
+
+
+def execution(**config):
+    with mock.patch('tibanna.ec2_utils.Execution.create_instance_type_list'):
+        return Execution(dict(input_dict(**config), jobid='job1'), dryrun=True)
+
+
+def test_packed_job_does_not_launch():
+    ex = execution(packed_into='job0')
+    ex.cached = False
+    with mock.patch.object(Execution, 'launch_and_get_instance_id') as launch:
+        ex.launch()
+    launch.assert_not_called()
+    assert ex.instance_id == '' and ex.cfg.instance_id == ''
+
+
+def test_userdata_of_packed_instance():
+    ex = execution(packed_jobs=[{'jobid': 'job1', 'cpu': 2, 'mem': 4}, {'jobid': 'job2', 'cpu': 1, 'mem': 2}])
+    userdata = base64.b64decode(ex.create_userdata()).decode()
+    assert ' -P job1:2:4,job2:1:2' in userdata
+    assert ' -P ' not in base64.b64decode(execution().create_userdata()).decode()
+
+
+def test_shared_instance_is_not_terminated_by_check_task():
+    for config, n_calls in [({}, 1), ({'packed_into': 'job0'}, 0), ({'packed_jobs': [{'jobid': 'job1'}]}, 0)]:
+        with mock.patch('tibanna.check_task.get_client') as get_client:
+            CheckTask({'jobid': 'job1', 'config': config}).terminate_instance('i-1')
+        assert get_client.return_value.terminate_instances.call_count == n_calls
+
+
+def test_host_instance():
+    with mock.patch('tibanna.packing.Job.info', return_value={'Execution Name': 'job0', 'instance_id': 'i-0'}):
+        assert host_instance('job0') == ('i-0', False)
+    for status, failed in [('RUNNING', False), ('FAILED', True)]:
+        with mock.patch('tibanna.packing.Job.info', return_value={'Execution Name': 'job0', 'Step Function': 'sfn'}), \
+             mock.patch('tibanna.packing.EXECUTION_ARN', return_value='arn'), \
+             mock.patch('tibanna.packing.Job.describe_exec', return_value={'status': status}) as describe_exec:
+            assert host_instance('job0') == ('', failed)
+        describe_exec.assert_called_once_with('arn')
+
+
+def check_packed_job(host, markers=('job1.job_started',), ec2_state='terminated'):
+    """CheckTask.run of a packed job whose primary job has the given (instance id, launch failed)"""
+    ec2 = mock.Mock()
+    ec2.describe_instances.return_value = {'Reservations': [{'Instances': [{'State': {'Name': ec2_state}}]}]}
+    input_json = {'jobid': 'job1', 'args': {},
+                  'config': {'log_bucket': 'logbucket', 'instance_id': '', 'packed_into': 'job0',
+                             'start_time': '20260101-10:00:00-UTC'}}
+    with mock.patch('tibanna.check_task.read_job_status', return_value=None), \
+         mock.patch('tibanna.check_task.does_key_exist', side_effect=lambda bucket, key: key in markers), \
+         mock.patch('tibanna.check_task.get_client', return_value=ec2), \
+         mock.patch.object(CheckTask, 'host_instance', return_value=host), \
+         mock.patch.object(CheckTask, 'handle_postrun_json'):
+        CheckTask(input_json).run()
+
+
+def test_packed_job_checks_the_host_instance():
+    with pytest.raises(EC2UnintendedTerminationException):
+        check_packed_job(('i-0', False))
+    # the primary job failed to launch its instance
+    with pytest.raises(EC2LaunchException):
+        check_packed_job(('', True))
+    # the primary job is still launching its instance (e.g. waiting for capacity)
+    with pytest.raises(EC2StartingException):
+        check_packed_job(('', False), markers=())
@@ -0,0 +1,82 @@
+from tibanna.plan import Planner
+from unittest import mock
+import json
+import pytest
+
+
+def input_dict(key, instance_type='t3.medium', ebs_size='3x', spot_instance=False):
+    return {'args': {'input_files': {'input_file': {'bucket_name': 'inbucket', 'object_key': key},
+                                     'ref': {'bucket_name': 'inbucket', 'object_key': ['ref1', 'ref2']}},
+                     'output_S3_bucket': 'outbucket',
+                     'cwl_main_filename': 'main.cwl',
+                     'cwl_directory_url': 's3://cwlbucket/cwl/'},
+            'config': {'log_bucket': 'logbucket', 'instance_type': instance_type, 'ebs_size': ebs_size,
+                       'spot_instance': spot_instance}}
+
+
+@pytest.fixture
+def aws():
+    sizes = {'in1': 10 * 1024 ** 3, 'in2': 20 * 1024 ** 3, 'ref1': 0, 'ref2': 0}
+
+    def get_object_sizes(objects, concurrency=32):
+        return {(bucket, key): sizes.get(key) for bucket, key in objects}
+
+    infos = {'t3.medium': {'EBS_optimized': True, 'arch': 'x86_64'},
+             'm6g.large': {'EBS_optimized': True, 'arch': 'arm64'}}
+    with mock.patch('tibanna.plan.get_object_sizes', side_effect=get_object_sizes) as file_size, \
+         mock.patch('tibanna.plan.describe_instance_types', return_value=infos) as describe, \
+         mock.patch('tibanna.plan.get_ec2_ondemand_price', return_value=0.05) as ondemand, \
+         mock.patch('tibanna.plan.get_ec2_spot_price', return_value=0.02), \
+         mock.patch('tibanna.plan.get_ebs_storage_price', return_value=0.08) as ebs:
+        yield {'file_size': file_size, 'describe': describe, 'ondemand': ondemand, 'ebs': ebs}
+
+
+def test_plan(aws, tmpdir):
+    inputs = [input_dict('in1'), input_dict('in2'), input_dict('in1', instance_type='m6g.large', spot_instance=True),
+              input_dict('in1', instance_type='nonexisting.large')] + \
+             [input_dict('in2') for _ in range(100)]
+    report = Planner(hours=2).plan(inputs)
+    jobs = report.jobs
+    assert [j.status for j in jobs[:4]] == ['PLANNED', 'PLANNED', 'PLANNED', 'FAILED']
+    assert jobs[0].ebs_size == 35  # 3x 10GB + 5GB
+    assert jobs[1].ebs_size == 65
+    assert jobs[0].hourly_price == 0.05
+    assert jobs[2].hourly_price == 0.02
+    # ec2 for two hours + root and data EBS
+    assert jobs[0].estimated_cost == pytest.approx(0.05 * 2 + 0.08 * (10 + 35) * 2 / 720)
+    # every object, instance type and price is fetched once for the whole plan
+    assert aws['file_size'].call_count == 1
+    assert len(aws['file_size'].call_args[0][0]) == 4
+    assert aws['describe'].call_count == 1
+    assert aws['ondemand'].call_count == 1
+    assert aws['ebs'].call_count == 1
+    totals = report.totals
+    assert totals['n_planned'] == 103
+    assert totals['n_failed'] == 1
+    assert totals['instance_types'] == {'t3.medium': 102, 'm6g.large': 1}
+    assert totals['total_estimated_cost'] == pytest.approx(sum(j.estimated_cost for j in report.planned))
+    # output files
+    report.write_tsv(str(tmpdir.join('plan.tsv')))
+    lines = tmpdir.join('plan.tsv').read().splitlines()
+    assert len(lines) == 106
+    assert lines[0].startswith('input_json\tjobid')
+    assert lines[-1].startswith('TOTAL')
+    report.write_json(str(tmpdir.join('plan.json')))
+    assert json.loads(tmpdir.join('plan.json').read())['totals']['n_jobs'] == 104
+
+
+def test_plan_directory(aws, tmpdir):
+    for i in range(3):
+        tmpdir.join('input%d.json' % i).write(json.dumps(input_dict('in1')))
+    tmpdir.join('broken.json').write('{')
+    report = Planner().plan(str(tmpdir))
+    assert [j.status for j in report.jobs] == ['FAILED', 'PLANNED', 'PLANNED', 'PLANNED']
+    assert report.jobs[1].input_json.endswith('input0.json')
+
+
+def test_plan_without_prices(aws):
+    aws['ondemand'].side_effect = Exception('no access to the pricing API')
+    report = Planner().plan([input_dict('in1')])
+    assert report.jobs[0].status == 'PLANNED'
+    assert report.jobs[0].estimated_cost is None
+    assert report.totals['n_jobs_without_cost_estimate'] == 1
@@ -0,0 +1,63 @@
+from tibanna.polling import next_poll_interval, poll_job
+from tibanna.check_task import check_task, CheckTask
+from tibanna.stepfunction import StepFunctionUnicorn
+from tibanna.exceptions import StillRunningException, EC2StartingException
+from datetime import datetime, timedelta
+from dateutil.tz import tzutc
+from unittest import mock
+
+
+def test_next_poll_interval():
+    # booting
+    assert next_poll_interval('starting', 60) == 30
+    # short and early jobs are checked often, long jobs rarely
+    assert next_poll_interval('running', 120) == 30
+    assert next_poll_interval('running', 3600) == 360
+    assert next_poll_interval('running', 3 * 24 * 3600) == 1800
+    # half way to the predicted end, and by elapsed time after it
+    assert next_poll_interval('running', 600, predicted_runtime=3000) == 1200
+    assert next_poll_interval('running', 2900, predicted_runtime=3000) == 50
+    assert next_poll_interval('running', 6000, predicted_runtime=3000) == 600
+    # configurable bounds
+    assert next_poll_interval('starting', 60, min_interval=10, max_interval=60) == 10
+    assert next_poll_interval('running', 36000, min_interval=10, max_interval=60) == 60
+
+
+def check_task_input(minutes_ago=60, **config):
+    start_time = (datetime.now(tzutc()) - timedelta(minutes=minutes_ago)).strftime('%Y%m%d-%H:%M:%S-UTC')
+    return {'jobid': 'job1', 'args': {},
+            'config': dict({'log_bucket': 'logbucket', 'start_time': start_time}, **config),
+            'poll': {'state': 'starting', 'interval': 0, 'n_checks': 0}}
+
+
+def test_poll_job():
+    assert poll_job(check_task_input(minutes_ago=60), 'running') == {'state': 'running', 'interval': 360,
+                                                                     'n_checks': 1}
+    poll = poll_job(check_task_input(minutes_ago=10, resource_prediction={'runtime': 30},
+                                     poll_max_interval=300), 'running')
+    assert 290 <= poll['interval'] <= 300
+
+
+def test_check_task_poll():
+    with mock.patch.object(CheckTask, 'run', side_effect=StillRunningException('still running')):
+        res = check_task(check_task_input(minutes_ago=60))
+    assert res['poll']['state'] == 'running' and res['poll']['n_checks'] == 1
+    assert 355 <= res['poll']['interval'] <= 365
+    with mock.patch.object(CheckTask, 'run', side_effect=EC2StartingException('booting')):
+        res = check_task(dict(check_task_input(minutes_ago=1), poll=res['poll']))
+    assert res['poll'] == {'state': 'starting', 'interval': 30, 'n_checks': 2}
+    # the job is over : no more polls
+    with mock.patch.object(CheckTask, 'run', autospec=True, side_effect=lambda self: self.input_json):
+        res = check_task(check_task_input())
+    assert 'poll' not in res
+
+
+def test_state_machine_polling_loop():
+    states = StepFunctionUnicorn(region_name='us-east-1', aws_acc='123456789012').sfn_state_defs
+    assert states['StartPollingAwsem']['ResultPath'] == '$.poll'
+    assert states['StartPollingAwsem']['Next'] == 'CheckTaskAwsem'
+    assert states['CheckTaskAwsem']['Next'] == 'PollAwsem'
+    choice = states['PollAwsem']['Choices'][0]
+    assert choice['Variable'] == '$.poll' and choice['Next'] == 'WaitAwsem'
+    assert states['PollAwsem']['Default'] == 'JobDoneAwsem'
+    assert states['WaitAwsem'] == {'Type': 'Wait', 'SecondsPath': '$.poll.interval', 'Next': 'CheckTaskAwsem'}
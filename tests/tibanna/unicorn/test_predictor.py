@@ -0,0 +1,112 @@
+from tibanna.predictor import (
+    ModelStore,
+    ResourceModel,
+    build_models,
+    job_record,
+    parse_size_in_gb,
+    fit
+)
+from tibanna.ec2_utils import Execution
+from tibanna.exceptions import MissingFieldInInputJsonException
+from unittest import mock
+import pytest
+
+
+def postrunjson(app_name, input_size, mem_mb, cpu_percent, disk_gb, read_bytes=0, instance_type='t3.xlarge'):
+    return {'Job': {'App': {'App_name': app_name}, 'instance_type': instance_type,
+                    'total_input_size': input_size,
+                    'Metrics': {'max_mem_used_MB': mem_mb, 'max_cpu_utilization_percent': cpu_percent,
+                                'max_disk_space_used_GB': disk_gb, 'max_ebs_read_bytes': read_bytes}}}
+
+
+PRJS = [postrunjson('bwa', '10G', 4096, 50, 30),
+        postrunjson('bwa', '20G', 6144, 50, 50),
+        postrunjson('bwa', '30G', 8192, 100, 70, read_bytes=200 * 120 * 1024 ** 2),
+        postrunjson('md5', '1G', 512, 25, 5),
+        {'Job': {'App': {'App_name': 'md5'}, 'total_input_size': '1G'}}]  # no metrics
+
+
+def test_parse_size_in_gb():
+    assert parse_size_in_gb('1.5G') == 1.5
+    assert parse_size_in_gb('512M') == 0.5
+    assert parse_size_in_gb('2T') == 2048
+    assert parse_size_in_gb('0') == 0
+    assert parse_size_in_gb(None) is None
+
+
+def test_fit():
+    f = fit([(1, 2), (2, 3), (3, 5)])
+    assert f['slope'] == pytest.approx(1.5)
+    assert f['intercept'] + f['slope'] * 3 + f['residual'] >= 5
+    # the slope is never negative
+    assert fit([(1, 3), (2, 2)])['slope'] == 0
+    assert fit([(1, 3)]) == {'intercept': 3, 'slope': 0, 'residual': 0, 'n': 1}
+
+
+def test_build_and_predict(tmpdir):
+    models = build_models(PRJS)
+    assert sorted(models) == ['bwa', 'md5']
+    assert models['bwa'].n_jobs == 3 and models['md5'].n_jobs == 1
+    # the models can be stored and read back locally
+    store = ModelStore(directory=str(tmpdir))
+    for model in models.values():
+        store.put(model)
+    bwa = store.get('bwa')
+    assert store.get('unknown') is None
+    prediction = bwa.predict(20, margin=0)
+    # memory grows 2GB per 10GB of input, 6GB at 20GB (plus the largest under-prediction)
+    assert 6 <= prediction['mem'] <= 6.1
+    assert prediction['ebs_size'] == 50
+    assert prediction['cpu'] == 3  # 100% of 4 vCPUs at 30GB, 50% at 10 and 20GB
+    assert prediction['ebs_throughput'] is None  # below the gp3 baseline
+    assert bwa.predict(30, margin=0)['ebs_throughput'] >= 200
+    assert bwa.predict(20, margin=0.5)['mem'] >= 9
+    assert build_models(PRJS, app_name='md5', min_jobs=2) == {}
+
+
+def test_predict_runtime():
+    prjs = []
+    for input_size, minutes in [('10G', 10), ('20G', 20), ('30G', 30)]:
+        prj = postrunjson('bwa', input_size, 4096, 50, 30)
+        prj['Job'].update(start_time='20260101-10:00:00-UTC', end_time='20260101-10:%02d:00-UTC' % minutes)
+        prjs.append(prj)
+    assert job_record(prjs[0], vcpus={})['runtime'] == 10
+    assert job_record(PRJS[0], vcpus={})['runtime'] is None  # no end time
+    assert build_models(prjs)['bwa'].predict(40, margin=0)['runtime'] == 40
+
+
+def execution(model, app_name='bwa', **config):
+    input_dict = {'args': {'output_S3_bucket': 'outbucket', 'app_name': app_name,
+                           'cwl_main_filename': 'main.cwl', 'cwl_directory_url': 's3://cwlbucket/cwl/',
+                           'input_files': {'fastq': {'bucket_name': 'inbucket', 'object_key': 'a.fastq'}}},
+                  'config': dict({'log_bucket': 'logbucket'}, **config)}
+    benchmark = {'aws': {'recommended_instance_type': 't3.large', 'EBS_optimized': True}, 'total_size_in_GB': 20}
+    with mock.patch.object(Execution, 'get_file_sizes', return_value={('inbucket', 'a.fastq'): 30 * 1024 ** 3}), \
+         mock.patch('tibanna.ec2_utils.get_resource_model', return_value=model), \
+         mock.patch.object(Execution, 'create_instance_type_list'), \
+         mock.patch('Benchmark.run.benchmark', return_value=benchmark) as benchmark:
+        ex = Execution(input_dict, dryrun=True)
+    return ex, benchmark
+
+
+def test_execution_uses_resource_model():
+    # an app that Benchmark does not know
+    ex, benchmark = execution(build_models(PRJS)['bwa'], prediction_margin=0)
+    benchmark.assert_not_called()
+    assert ex.cfg.cpu == 4 and 8 <= ex.cfg.mem <= 8.1
+    assert ex.cfg.ebs_size == 70 + 5  # docker overhead
+    assert ex.cfg.ebs_throughput >= 200
+    assert ex.cfg.resource_prediction['n_jobs'] == 3
+    # the model replaces Benchmark for an app that Benchmark knows
+    ex, benchmark = execution(build_models(PRJS)['bwa'], app_name='md5')
+    benchmark.assert_not_called()
+    # without a model of enough jobs, Benchmark is used, or the input is incomplete
+    for model in [ResourceModel('bwa', n_jobs=1), None]:
+        ex, benchmark = execution(model, app_name='md5')
+        benchmark.assert_called_once()
+        assert not ex.cfg.cpu and ex.cfg.ebs_size == 21 + 5
+        with pytest.raises(MissingFieldInInputJsonException):
+            execution(model)
+    # the model can be turned off
+    ex, benchmark = execution(build_models(PRJS)['bwa'], app_name='md5', use_resource_model=False)
+    benchmark.assert_called_once()
@@ -0,0 +1,46 @@
+from tibanna.pricing_utils import get_ec2_prices, get_instance_price, rank_instance_types
+from unittest import mock
+
+
+PRICES = {'t3.large': {'ondemand': 0.0832, 'spot': {'us-east-1a': 0.03, 'us-east-1b': 0.025}},
+          'm6g.large': {'ondemand': 0.077, 'spot': {'us-east-1a': 0.035}},
+          'c5.xlarge': {'ondemand': 0.17, 'spot': {'us-east-1a': 0.06}}}
+INSTANCES = [{'instance_type': 't3.large', 'cpu': 2, 'mem_in_gb': 8, 'cost_in_usd': 0.08},
+             {'instance_type': 'm6g.large', 'cpu': 2, 'mem_in_gb': 8, 'cost_in_usd': 0.09},
+             {'instance_type': 'c5.xlarge', 'cpu': 4, 'mem_in_gb': 8, 'cost_in_usd': 0.17}]
+
+
+def test_get_instance_price():
+    assert get_instance_price(PRICES['t3.large']) == 0.0832
+    assert get_instance_price(PRICES['t3.large'], spot_instance=True) == 0.025
+    assert get_instance_price(PRICES['t3.large'], spot_instance=True, availability_zone='us-east-1a') == 0.03
+    assert get_instance_price(PRICES['m6g.large'], spot_instance=True, availability_zone='us-east-1b') is None
+    assert get_instance_price(None) is None
+
+
+def test_rank_instance_types():
+    # on-demand: the Graviton instance is cheaper than the benchmark says
+    ranked = rank_instance_types(INSTANCES, 2, 5, PRICES)
+    assert ranked == [{'instance_type': 'm6g.large', 'rank': 1, 'price': 0.077},
+                      {'instance_type': 't3.large', 'rank': 2, 'price': 0.0832},
+                      {'instance_type': 'c5.xlarge', 'rank': 3, 'price': 0.17}]
+    # spot, in a given availability zone
+    ranked = rank_instance_types(INSTANCES, 2, 5, PRICES, spot_instance=True, availability_zone='us-east-1a')
+    assert [c['instance_type'] for c in ranked] == ['t3.large', 'm6g.large', 'c5.xlarge']
+    # without prices, the benchmark cost is used and the instance with less headroom comes first
+    instances = INSTANCES + [{'instance_type': 'c5.large', 'cpu': 2, 'mem_in_gb': 4, 'cost_in_usd': 0.17}]
+    ranked = rank_instance_types(instances, 2, 3, {})
+    assert [c['instance_type'] for c in ranked] == ['t3.large', 'm6g.large', 'c5.large', 'c5.xlarge']
+
+
+def test_get_ec2_prices():
+    history = [{'InstanceType': 't3.large', 'AvailabilityZone': 'us-east-1a', 'SpotPrice': '0.03'},
+               {'InstanceType': 't3.large', 'AvailabilityZone': 'us-east-1a', 'SpotPrice': '0.04'},
+               {'InstanceType': 'm6g.large', 'AvailabilityZone': 'us-east-1b', 'SpotPrice': '0.035'}]
+    with mock.patch('tibanna.pricing_utils.get_client') as get_client, \
+         mock.patch('tibanna.pricing_utils.get_ec2_ondemand_price',
+                    side_effect=lambda it: PRICES[it]['ondemand'] if it == 't3.large' else 1 / 0):
+        get_client.return_value.get_paginator.return_value.paginate.return_value = [{'SpotPriceHistory': history}]
+        prices = get_ec2_prices(['t3.large', 'm6g.large'])
+    assert prices == {'t3.large': {'ondemand': 0.0832, 'spot': {'us-east-1a': 0.03}},
+                      'm6g.large': {'ondemand': None, 'spot': {'us-east-1b': 0.035}}}
@@ -0,0 +1,112 @@
+from tibanna.status_checker import JobStatusChecker, check_jobs, split_marker
+from tibanna.check_task import check_task
+from tibanna.vars import AWSEM_TIME_STAMP_FORMAT
+from datetime import datetime, timedelta
+from dateutil.tz import tzutc
+from unittest import mock
+import pytest
+
+
+class LocalBucket(object):
+    """stand-in for list_objects over a log bucket : pages of sorted keys"""
+
+    def __init__(self, keys, page_size=1000):
+        self.keys = sorted(keys)
+        self.page_size = page_size
+        self.listings = []
+
+    def list_objects(self, bucket, prefix, start_after=None):
+        self.listings.append(prefix)
+        keys = [k for k in self.keys if k.startswith(prefix) and (not start_after or k > start_after)]
+        for i in range(0, len(keys), self.page_size):
+            yield [{'Key': k, 'LastModified': datetime(2026, 1, 1, tzinfo=tzutc())}
+                   for k in keys[i:i + self.page_size]]
+
+
+def ec2_client(states):
+    ec2 = mock.Mock()
+    described = []
+
+    def paginate(Filters):
+        described.append(Filters[0]['Values'])
+        yield {'Reservations': [{'Instances': [{'InstanceId': i, 'State': {'Name': states[i]}}
+                                               for i in Filters[0]['Values'] if i in states]}]}
+    ec2.get_paginator.return_value.paginate.side_effect = paginate
+    return ec2, described
+
+
+def run_task_output(jobid, instance_id, minutes_ago=1):
+    start_time = (datetime.now(tzutc()) - timedelta(minutes=minutes_ago)).strftime(AWSEM_TIME_STAMP_FORMAT)
+    return {'jobid': jobid, 'config': {'log_bucket': 'logbucket', 'instance_id': instance_id,
+                                       'start_time': start_time}}
+
+
+def test_split_marker():
+    assert split_marker('job1.postrun.json') == ('job1', 'postrun.json')
+    assert split_marker('job1.success') == ('job1', 'success')
+    assert split_marker('job1.log') == (None, None)
+
+
+def test_check_jobs():
+    bucket = LocalBucket(['job0.log', 'job1.job_started', 'job2.job_started', 'job2.success',
+                          'job3.job_started', 'job3.error', 'job4.job_started', 'job4.aborted',
+                          'job5.job_started', 'job9.job_started'])
+    ec2, described = ec2_client({'i-1': 'running', 'i-5': 'terminated'})
+    jobs = [run_task_output('job%d' % i, 'i-%d' % i) for i in range(1, 8)]
+    jobs[6] = run_task_output('job7', 'i-7', minutes_ago=20)
+    with mock.patch('tibanna.status_checker.list_objects', side_effect=bucket.list_objects), \
+         mock.patch('tibanna.status_checker.get_client', return_value=ec2):
+        status = check_jobs(jobs)
+    assert {jobid: s['state'] for jobid, s in status.items()} == \
+        {'job1': 'running', 'job2': 'succeeded', 'job3': 'failed', 'job4': 'aborted',
+         'job5': 'instance_lost', 'job6': 'starting', 'job7': 'boot_timeout'}
+    assert status['job1']['instance_state'] == 'running'
+    assert sorted(status['job2']['markers']) == ['job_started', 'success']
+    # a single listing and a single describe_instances for the batch
+    assert bucket.listings == ['']
+    assert len(described) == 1 and len(described[0]) == 7
+
+
+def test_check_jobs_sparse_listing():
+    # many other objects between the jobs : the listing gives up and the jobs are listed one by one
+    keys = ['job1.job_started', 'job2.job_started', 'job2.success'] + ['job1.x%04d' % i for i in range(50)]
+    bucket = LocalBucket(keys, page_size=10)
+    ec2, described = ec2_client({'i-1': 'running'})
+    with mock.patch('tibanna.status_checker.list_objects', side_effect=bucket.list_objects), \
+         mock.patch('tibanna.status_checker.get_client', return_value=ec2), \
+         mock.patch('tibanna.status_checker.batch_get_items',
+                    return_value={'job1': {'Job Id': 'job1', 'instance_id': 'i-1'}}) as batch_get_items:
+        status = JobStatusChecker().check(['job1', 'job2'], log_bucket='logbucket')
+    assert batch_get_items.call_args[0][2] == ['job1', 'job2']
+    assert status['job1']['state'] == 'running' and status['job2']['state'] == 'succeeded'
+    assert bucket.listings == ['', 'job1.', 'job2.']
+
+
+def test_check_packed_jobs():
+    # job2 runs on the instance of job1, which was terminated
+    bucket = LocalBucket(['job1.job_started', 'job2.job_started', 'job3.job_started'])
+    ec2, described = ec2_client({'i-1': 'terminated'})
+    job2 = run_task_output('job2', '')
+    job2['config']['packed_into'] = 'job1'
+    items = {'job1': {'Job Id': 'job1', 'instance_id': 'i-1'}, 'job3': {'Job Id': 'job3', 'packed_into': 'job1'}}
+    with mock.patch('tibanna.status_checker.list_objects', side_effect=bucket.list_objects), \
+         mock.patch('tibanna.status_checker.get_client', return_value=ec2), \
+         mock.patch('tibanna.status_checker.batch_get_items',
+                    side_effect=lambda table, key, jobids: {j: items[j] for j in jobids if j in items}):
+        # job3 is given by job id : the job table tells which job's instance it runs on
+        status = JobStatusChecker().check([job2, 'job3'], log_bucket='logbucket')
+    assert status['job2'] == status['job3'] == \
+        dict(status['job2'], state='instance_lost', instance_id='i-1', instance_state='terminated')
+    assert described == [['i-1']]
+
+
+def test_check_task_batch():
+    with mock.patch('tibanna.check_task.check_jobs', return_value={'job1': {'state': 'running'}}) as cj:
+        assert check_task({'jobs': ['job1'], 'log_bucket': 'logbucket'}) == {'job1': {'state': 'running'}}
+    cj.assert_called_once_with(['job1'], log_bucket='logbucket')
+
+
+def test_check_jobs_requires_log_bucket():
+    with pytest.raises(Exception) as ex:
+        check_jobs(['job1'])
+    assert 'log_bucket' in str(ex.value)
@@ -0,0 +1,93 @@
+from tibanna.task_token import register_task_token, notify_job_completion
+from tibanna.check_task import check_task
+from tibanna.stepfunction import StepFunctionUnicorn
+from unittest import mock
+import pytest
+
+
+class LocalStepFunctions(object):
+    """stand-in for the step functions service : tokens of the waiting tasks"""
+
+    def __init__(self):
+        self.waiting = set()
+        self.resumed = []
+
+    def send_task_success(self, taskToken, output):
+        if taskToken not in self.waiting:
+            e = Exception('TaskTimedOut')
+            e.response = {'Error': {'Code': 'TaskTimedOut'}}
+            raise e
+        self.waiting.remove(taskToken)
+        self.resumed.append(taskToken)
+
+
+class LocalS3(dict):
+    """stand-in for the log bucket : {key: content}"""
+
+    def patches(self):
+        return [mock.patch('tibanna.task_token.put_object_s3',
+                           side_effect=lambda content, key, bucket, **kwargs: self.update({key: content})),
+                mock.patch('tibanna.task_token.read_s3', side_effect=lambda bucket, key: self[key]),
+                mock.patch('tibanna.task_token.does_key_exist', side_effect=lambda bucket, key, **kwargs: key in self),
+                mock.patch('tibanna.task_token.delete_keys',
+                           side_effect=lambda keys, bucket: [self.pop(k, None) for k in keys])]
+
+
+@pytest.fixture
+def aws():
+    sfn, s3 = LocalStepFunctions(), LocalS3()
+    patches = s3.patches() + [mock.patch('tibanna.task_token.get_client', return_value=sfn)]
+    for p in patches:
+        p.start()
+    yield sfn, s3
+    for p in patches:
+        p.stop()
+
+
+def input_json():
+    return {'jobid': 'job1', 'config': {'log_bucket': 'logbucket'}, 'args': {}}
+
+
+def test_completion_event(aws):
+    sfn, s3 = aws
+    sfn.waiting.add('token1')
+    # the WaitForCompletionAwsem state invokes check_task with the token
+    assert check_task({'input': input_json(), 'task_token': 'token1'}) == {}
+    assert s3['job1.task_token'] == 'token1' and not sfn.resumed
+    # the instance sends the event at the end of the job
+    s3['job1.success'] = ''
+    assert notify_job_completion('logbucket', 'job1') is True
+    assert sfn.resumed == ['token1'] and 'job1.task_token' not in s3
+    # no token, no event
+    assert notify_job_completion('logbucket', 'job1') is False
+
+
+def test_completion_event_after_timeout(aws):
+    sfn, s3 = aws
+    register_task_token(input_json(), 'token1')
+    # the wait timed out and the execution went on polling
+    assert notify_job_completion('logbucket', 'job1') is False
+    assert 'job1.task_token' not in s3
+
+
+def test_job_ended_before_the_token_was_registered(aws):
+    sfn, s3 = aws
+    sfn.waiting.add('token1')
+    s3['job1.error'] = ''
+    register_task_token(input_json(), 'token1')
+    assert sfn.resumed == ['token1']
+
+
+def test_state_machine_completion_mode():
+    states = StepFunctionUnicorn(region_name='us-east-1', aws_acc='123456789012').sfn_state_defs
+    assert states['RunTaskAwsem']['Next'] == 'CompletionMode'
+    assert states['CompletionMode']['Default'] == 'StartPollingAwsem'
+    assert states['CompletionMode']['Choices'][0]['Next'] == 'WaitForCompletionAwsem'
+    wait = states['WaitForCompletionAwsem']
+    assert wait['Resource'].endswith('waitForTaskToken')
+    assert wait['Parameters']['Payload'] == {'input.$': '$', 'task_token.$': '$$.Task.Token'}
+    assert wait['TimeoutSecondsPath'] == '$.config.completion_check_interval'
+    assert wait['Next'] == wait['Catch'][0]['Next'] == 'CheckCompletionAwsem'
+    # a job that is still running goes back to waiting
+    catch = states['CheckCompletionAwsem']['Catch'][0]
+    assert 'StillRunningException' in catch['ErrorEquals'] and catch['Next'] == 'WaitForCompletionAwsem'
@@ -94,6 +94,12 @@ def test_digest():
     assert len(top1.processes) == 2
     assert top1.timestamps == [timestamp1, timestamp3]
 
+def test_as_minutes():
+    assert top.Top.as_minutes('2020-12-18-18:57:37', '2020-12-18-18:55:37') == 2
+    assert top.Top.as_minutes('2020-12-18-18:54:37', '2020-12-18-18:55:37') == -1
+    # a job longer than a day
+    assert top.Top.as_minutes('2020-12-20-18:56:37', '2020-12-18-18:55:37') == 2 * 1440 + 1
+
 def test_write_to_csv():
     top1 = top.Top(top_contents)
     top1.digest()
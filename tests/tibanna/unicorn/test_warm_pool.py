@@ -0,0 +1,142 @@
+from tibanna.warm_pool import WarmPool, is_compatible
+from tibanna.ec2_utils import Execution
+from tibanna.check_task import CheckTask
+from botocore.exceptions import ClientError
+from unittest import mock
+import base64
+import io
+import json
+import pytest
+
+
+class FakeS3(object):
+    """s3 client with conditional put_object"""
+    def __init__(self):
+        self.objects = dict()
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, **kwargs):
+        if IfNoneMatch == '*' and Key in self.objects:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def get_paginator(self, name):
+        paginator = mock.Mock()
+        paginator.paginate.side_effect = lambda Bucket, Prefix: \
+            [{'Contents': [{'Key': k} for k in sorted(self.objects) if k.startswith(Prefix)]}]
+        return paginator
+
+
+@pytest.fixture
+def s3():
+    s3 = FakeS3()
+    with mock.patch('tibanna.warm_pool.get_client', return_value=s3), \
+         mock.patch('tibanna.warm_pool.time.sleep'):
+        yield s3
+
+
+CONFIG = {'awsf_image': 'awsf3:1.0', 'spot_instance': False, 'ebs_type': 'gp3', 'ebs_iops': '',
+          'ebs_throughput': '', 'subnet': 'subnet-1', 'security_group': 'sg-1', 'encrypt_s3_upload': False,
+          'kms_key_id': None, 'disable_metrics_collection': False, 'ebs_size': 20}
+
+
+def test_hand_off_to_one_instance_only(s3):
+    pool = WarmPool('pool1', 'logbucket')
+    handed_off = []
+
+    def submit_jobs(seconds):
+        # two jobs are submitted while the instance waits
+        assert [i['instance_id'] for i in pool.idle_instances()] == ['i-1']
+        handed_off.append(pool.hand_off('job1', lambda i: True))
+        handed_off.append(pool.hand_off('job2', lambda i: True))
+    with mock.patch('tibanna.warm_pool.time.sleep', side_effect=submit_jobs):
+        assert pool.wait_for_job('i-1', 't3.medium', CONFIG) == 'job1'
+    assert handed_off[0]['instance_id'] == 'i-1'
+    assert handed_off[1] is None  # the instance already has a job
+    assert pool.idle_instances() == []
+
+
+def test_idle_instance_terminates_after_timeout(s3):
+    pool = WarmPool('pool1', 'logbucket')
+    assert pool.wait_for_job('i-1', 't3.medium', CONFIG, idle_min=0) is None
+    # the mailbox is closed and the instance is no longer idle
+    assert pool.idle_instances() == []
+    assert pool.hand_off('job1', lambda i: True) is None
+    assert json.loads(s3.objects['.tibanna_pool/pool1/assign/i-1.json'])['status'] == 'closed'
+
+
+def test_job_handed_off_while_closing(s3):
+    pool = WarmPool('pool1', 'logbucket')
+    real_get = pool.get
+    calls = []
+
+    def get(key):
+        # a job arrives right after the instance finds its mailbox empty at the deadline
+        if not calls:
+            calls.append(key)
+            pool.put(key, {'jobid': 'job1'}, create_only=True)
+            return None
+        return real_get(key)
+    with mock.patch.object(pool, 'get', side_effect=get):
+        assert pool.wait_for_job('i-1', 't3.medium', CONFIG, idle_min=0) == 'job1'
+
+
+def test_is_compatible():
+    with mock.patch('tibanna.ec2_utils.Execution.create_instance_type_list'):
+        cfg = Execution({'args': {'output_S3_bucket': 'outbucket', 'cwl_main_filename': 'main.cwl',
+                                  'cwl_directory_url': 's3://cwlbucket/cwl/'},
+                         'config': dict(CONFIG, log_bucket='logbucket', instance_type='t3.medium', ebs_size=10,
+                                        ebs_size_as_is=True)}, dryrun=True).cfg
+    instance = {'instance_id': 'i-1', 'instance_type': 't3.medium', 'config': CONFIG}
+    assert is_compatible(instance, ['t3.medium'], cfg)
+    assert not is_compatible(instance, ['t3.large'], cfg)
+    assert not is_compatible(dict(instance, config=dict(CONFIG, ebs_size=5)), ['t3.medium'], cfg)
+    assert not is_compatible(dict(instance, config=dict(CONFIG, awsf_image='awsf3:2.0')), ['t3.medium'], cfg)
+    cfg.key_name = 'mykey'
+    assert not is_compatible(instance, ['t3.medium'], cfg)
+
+
+def execution(**config):
+    input_dict = {'args': {'output_S3_bucket': 'outbucket', 'cwl_main_filename': 'main.cwl',
+                           'cwl_directory_url': 's3://cwlbucket/cwl/'},
+                  'config': dict({'log_bucket': 'logbucket', 'instance_type': 't3.medium', 'ebs_size': 10}, **config),
+                  'jobid': 'job1'}
+    with mock.patch('tibanna.ec2_utils.Execution.create_instance_type_list'):
+        ex = Execution(input_dict)
+    ex.instance_type_list = ['t3.medium']
+    ex.cached = False
+    return ex
+
+
+def test_launch_hands_off_to_warm_pool():
+    ex = execution(warm_pool='pool1')
+    with mock.patch('tibanna.ec2_utils.WarmPool.hand_off', return_value={'instance_id': 'i-1',
+                                                                         'instance_type': 't3.medium'}), \
+         mock.patch.object(Execution, 'launch_and_get_instance_id') as launch, \
+         mock.patch.object(Execution, 'get_instance_info', return_value={'instance_id': 'i-1'}), \
+         mock.patch.object(Execution, 'add_instance_id_to_dynamodb'):
+        ex.launch()
+    launch.assert_not_called()
+    assert ex.instance_id == 'i-1'
+    # no idle instance
+    ex = execution(warm_pool='pool1')
+    with mock.patch('tibanna.ec2_utils.WarmPool.hand_off', return_value=None), \
+         mock.patch.object(Execution, 'launch_and_get_instance_id', return_value='i-2'), \
+         mock.patch.object(Execution, 'get_instance_info', return_value={'instance_id': 'i-2'}), \
+         mock.patch.object(Execution, 'add_instance_id_to_dynamodb'):
+        ex.launch()
+    assert ex.instance_id == 'i-2'
+    assert ' -w' in base64.b64decode(ex.create_userdata()).decode()
+
+
+def test_warm_pool_instance_is_not_terminated_by_check_task():
+    with mock.patch('tibanna.check_task.get_client') as get_client:
+        CheckTask({'jobid': 'job1', 'config': {'warm_pool': 'pool1'}}).terminate_instance('i-1')
+    get_client.return_value.terminate_instances.assert_not_called()
@@ -6,9 +6,12 @@ CLI for tibanna package
 import argparse
 import inspect
 import json
+import os
 from ._version import __version__
 # from botocore.errorfactory import ExecutionAlreadyExists
 from .core import API
+from .exceptions import BatchSubmissionException
+from .batch import DEFAULT_SUBMISSION_RATE, DEFAULT_SUBMISSION_CONCURRENCY
 from .vars import (
     TIBANNA_DEFAULT_STEP_FUNCTION_NAME,
     S3_ENCRYT_KEY_ID
@@ -38,6 +41,9 @@ class Subcommands(object):
             'rerun_many': 'rerun all the jobs that failed after a given time point',
             'run_workflow': 'run a workflow',
             'run_batch_workflows': 'run many workflows in a batch',
+            'plan': 'print out the instance types, EBS sizes and estimated costs of many jobs without running them',
+            'build_resource_models': 'fit the resources of apps on the metrics of their past jobs, ' +
+                                     'to be used instead of Benchmark',
             'setup_tibanna_env': 'set up usergroup environment on AWS.' +
                                  'This function is called automatically by deploy_tibanna or deploy_unicorn.' +
                                  'Use it only when the IAM permissions need to be reset',
@@ -47,6 +53,7 @@ class Subcommands(object):
             'cost': 'print out the EC2/EBS cost of a job - it may not be ready for a day after a job finishes',
             'cost_estimate': 'print out the EC2/EBS estimated cost of a job - available as soon as the job finished. Returns the exact costs, if available',
             'cleanup': 'remove all tibanna component for a usergroup (and suffix) including step function, lambdas IAM groups',
+            'cleanup_launch_templates': 'delete the EC2 launch templates and launch template versions that are no longer used',
             'create_ami': 'create tibanna ami (Most users do not need this - tibanna AMIs are publicly available.)'
         }
 
@@ -67,7 +74,11 @@ class Subcommands(object):
                  {'flag': ["-S", "--sleep"],
                   'help': "number of seconds between submission, to avoid drop-out (default 3)",
                   'type': int,
-                  'default': 3}],
+                  'default': 3},
+                 {'flag': ["-C", "--call-cache"],
+                  'help': "reuse the outputs of a previous successful job with the identical workflow, " +
+                          "inputs and parameters instead of launching an instance",
+                  'action': "store_true"}],
             'run_batch_workflows':
                 [{'flag': ["-i", "--input-json-list"],
                   'help': "list of tibanna input json files, e.g. -i input1.json [input2.json] [...]",
@@ -77,9 +88,58 @@ class Subcommands(object):
                           "your current default is %s)" % TIBANNA_DEFAULT_STEP_FUNCTION_NAME,
                   'default': TIBANNA_DEFAULT_STEP_FUNCTION_NAME},
                  {'flag': ["-S", "--sleep"],
-                  'help': "number of seconds between submission, to avoid drop-out (default 3)",
+                  'help': "sleep this number of seconds after each submission instead of using " +
+                          "the rate limiter (e.g. -S 3 -c 1 as in earlier versions)",
+                  'type': int},
+                 {'flag': ["-c", "--concurrency"],
+                  'help': "number of jobs to submit in parallel (default %d)" % DEFAULT_SUBMISSION_CONCURRENCY,
+                  'type': int,
+                  'default': DEFAULT_SUBMISSION_CONCURRENCY},
+                 {'flag': ["-r", "--rate"],
+                  'help': "maximum number of StartExecution requests per second (two per job if the " +
+                          "cost updater is deployed), for the adaptive rate limiter that paces " +
+                          "the submissions (default %s)" % DEFAULT_SUBMISSION_RATE,
+                  'type': float,
+                  'default': DEFAULT_SUBMISSION_RATE},
+                 {'flag': ["-R", "--report"],
+                  'help': "write a json report of the per-job results and errors to this file"},
+                 {'flag': ["-p", "--pack"],
+                  'help': "run compatible small jobs (with cpu and mem specified) together " +
+                          "on shared instances",
+                  'action': "store_true"}],
+            'build_resource_models':
+                [{'flag': ["-l", "--log-bucket"],
+                  'help': "log bucket to read the postrun jsons from and to save the models to"},
+                 {'flag': ["-a", "--app-name"],
+                  'help': "build the model of this app only"},
+                 {'flag': ["-D", "--postrunjson-dir"],
+                  'help': "read the postrun jsons from this local directory instead of the log bucket"},
+                 {'flag': ["-o", "--output-dir"],
+                  'help': "save the models to this local directory instead of the log bucket"},
+                 {'flag': ["-n", "--max-jobs"],
+                  'help': "number of the most recent jobs to read from the log bucket (default 500)",
+                  'type': int,
+                  'default': 500},
+                 {'flag': ["-m", "--min-jobs"],
+                  'help': "minimum number of jobs with metrics for an app to get a model (default 1)",
                   'type': int,
-                  'default': 3}],
+                  'default': 1}],
+            'plan':
+                [{'flag': ["-i", "--input-json-list"],
+                  'help': "list of tibanna input json files or a directory containing input json files",
+                  "nargs": "+"},
+                 {'flag': ["-H", "--hours"],
+                  'help': "assumed run time of each job in hours, for the cost estimate (default 1)",
+                  'type': float,
+                  'default': 1.0},
+                 {'flag': ["-c", "--concurrency"],
+                  'help': "number of parallel AWS requests to fetch input sizes and prices (default 32)",
+                  'type': int,
+                  'default': 32},
+                 {'flag': ["-o", "--output-tsv"],
+                  'help': "write the plan to this tsv file (printed out if not specified)"},
+                 {'flag': ["-J", "--output-json"],
+                  'help': "write the plan as json to this file"}],
             'stat':
                 [{'flag': ["-s", "--sfn"],
                   'help': "tibanna step function name (e.g. 'tibanna_unicorn_monty'); " +
@@ -137,7 +197,10 @@ class Subcommands(object):
                  {'flag': ["-t", "--top"],
                   'help': "print out top file (log file containing top command output) instead", 'action': "store_true"},
                  {'flag': ["-T", "--top-latest"],
-                  'help': "print out the latest content of the top file", 'action': "store_true"}],
+                  'help': "print out the latest content of the top file", 'action': "store_true"},
+                 {'flag': ["-S", "--status"],
+                  'help': "print out the status document of the job (phase, exit status, time stamps, " +
+                          "bytes downloaded/uploaded, last activity) instead", 'action': "store_true"}],
             'info':
                 [{'flag': ["-j", "--job-id"],
                   'help': "job id of the specific job to log (alternative to --exec-arn/-e)"}],
@@ -362,6 +425,14 @@ class Subcommands(object):
                  {'flag': ["-E", "--do-not-ignore-errors"],
                   'action': 'store_true',
                   'help': "do not ignore errors that occur due to a resource already deleted or non-existent"}],
+            'cleanup_launch_templates':
+                [{'flag': ["-H", "--older-than-hours"],
+                  'help': "delete the launch templates that have not been used for this many hours (default 24)",
+                  'type': float,
+                  'default': 24},
+                 {'flag': ["-d", "--dryrun"],
+                  'action': 'store_true',
+                  'help': "print out the launch templates to be deleted without deleting them"}],
             'create_ami':
                 [{'flag': ["-p", "--make-public"],
                   'help': "Make the Tibanna AMI public (most users do not need this)",
@@ -408,14 +479,45 @@ def deploy_core(name, suffix=None, usergroup='', quiet=False, subnets=None, secu
                       security_groups=security_groups, quiet=quiet)
 
 
-def run_workflow(input_json, sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME, jobid='', do_not_open_browser=False, sleep=3):
+def run_workflow(input_json, sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME, jobid='', do_not_open_browser=False, sleep=3,
+                 call_cache=False):
     """run a workflow"""
-    API().run_workflow(input_json, sfn=sfn, jobid=jobid, sleep=sleep, open_browser=not do_not_open_browser, verbose=True)
-
-
-def run_batch_workflows(input_json_list, sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME, sleep=3):
-    """run a workflow"""
-    API().run_batch_workflows(input_json_list, sfn=sfn, sleep=sleep, verbose=True)
+    API().run_workflow(input_json, sfn=sfn, jobid=jobid, sleep=sleep, open_browser=not do_not_open_browser, verbose=True,
+                       call_cache=call_cache)
+
+
+def build_resource_models(log_bucket=None, app_name=None, postrunjson_dir=None, output_dir=None,
+                          max_jobs=500, min_jobs=1):
+    models = API().build_resource_models(log_bucket=log_bucket, app_name=app_name, postrunjson_dir=postrunjson_dir,
+                                         output_dir=output_dir, max_jobs=max_jobs, min_jobs=min_jobs)
+    for app_name, model in models.items():
+        print("%s\t%d jobs" % (app_name, model.n_jobs))
+
+
+def plan(input_json_list, hours=1.0, concurrency=32, output_tsv=None, output_json=None):
+    """print out the instance types, EBS sizes and estimated costs of many jobs without running them"""
+    if len(input_json_list) == 1 and os.path.isdir(input_json_list[0]):
+        input_json_list = input_json_list[0]
+    report = API().plan(input_json_list, hours=hours, concurrency=concurrency)
+    if output_json:
+        report.write_json(output_json)
+    if output_tsv:
+        report.write_tsv(output_tsv)
+    else:
+        print(report.as_tsv(), end='')
+
+
+def run_batch_workflows(input_json_list, sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME, sleep=None,
+                        concurrency=DEFAULT_SUBMISSION_CONCURRENCY, rate=DEFAULT_SUBMISSION_RATE,
+                        report=None, pack=False):
+    """run many workflows in a batch"""
+    res = API().run_batch_workflows(input_json_list, sfn=sfn, sleep=sleep, verbose=True,
+                                    concurrency=concurrency, rate=rate, pack=pack, return_report=True)
+    if report:
+        with open(report, 'w') as f:
+            json.dump(res.as_dict(), f, indent=4)
+    if res.failed:
+        raise BatchSubmissionException(res)
 
 
 def setup_tibanna_env(buckets='', usergroup_tag='default', no_randomize=False,
@@ -453,10 +555,10 @@ def list_sfns(numbers=False):
 
 
 def log(exec_arn=None, job_id=None, exec_name=None, sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME,
-        runjson=False, postrunjson=False, top=False, top_latest=False):
-    """print execution log, run json (-r), postrun json (-p) or top (-t) for a job"""
+        runjson=False, postrunjson=False, top=False, top_latest=False, status=False):
+    """print execution log, run json (-r), postrun json (-p), top (-t) or status document (-S) for a job"""
     print(API().log(exec_arn, job_id, exec_name, sfn, runjson=runjson, postrunjson=postrunjson,
-                    top=top, top_latest=top_latest))
+                    top=top, top_latest=top_latest, status=status))
 
 
 def kill_all(sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME, soft=False):
@@ -538,6 +640,11 @@ def cleanup(usergroup, suffix='', purge_history=False, do_not_remove_iam_group=F
                   ignore_errors=not do_not_ignore_errors, purge_history=purge_history, verbose=not quiet)
 
 
+def cleanup_launch_templates(older_than_hours=24, dryrun=False):
+    for name in API().cleanup_launch_templates(older_than_hours=older_than_hours, dryrun=dryrun):
+        print(name)
+
+
 def create_ami(make_public=False, build_from_scratch=False, source_image_to_copy_from=None, source_image_region=None,
                ubuntu_base_image=None, replicate=False, architecture="x86", userdata_file=None,
                subnet=None, security_group=None):
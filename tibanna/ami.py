@@ -1,8 +1,8 @@
-import boto3
 import time
 import os
 from datetime import datetime
 from tibanna import create_logger
+from tibanna.aws_utils import get_client
 from tibanna.vars import AMI_PER_REGION
 
 
@@ -78,7 +78,7 @@ class AMI(object):
             launch_args.update({'SecurityGroupIds': [security_group]})
 
         logger.debug("launch_args=" + str(launch_args))
-        ec2 = boto3.client('ec2')
+        ec2 = get_client('ec2')
         res = ec2.run_instances(**launch_args)
         logger.debug("response from EC2 run_instances :" + str(res) + '\n\n')
         instance_id = res['Instances'][0]['InstanceId']
@@ -117,7 +117,7 @@ class AMI(object):
         # the AMI to be registered, then modify attribution to public.
         ami_per_region = {}
         for region in target_regions:
-            region_session = boto3.client('ec2', region_name=region)
+            region_session = get_client('ec2', region_name=region)
             response = region_session.copy_image(
                 Name=ami_name,
                 Description=f'{ami_name} replicated from {source_region}',
@@ -133,7 +133,7 @@ class AMI(object):
             logger.info('Provisioning PUBLIC AMIs - sleeping 5 mins, ctrl-c now if unintended')
             time.sleep(5 * 60)
             for region, image_id in ami_per_region.items():
-                region_session = boto3.client('ec2', region_name=region)  # re-create since its been some time
+                region_session = get_client('ec2', region_name=region)
                 region_session.modify_image_attribute(ImageId=image_id,
                                                       LaunchPermission={'Add': [{'Group': 'all'}]})
         else:
@@ -155,7 +155,7 @@ class AMI(object):
         """ Helper function that creates the Tibanna AMI from a base image. """
         if not userdata_file:
             logger.info("no userdata.. no need to launch an instance.. just copying image")
-            ec2 = boto3.client('ec2')
+            ec2 = get_client('ec2')
             try:
                 res_copy = ec2.copy_image(Name=ami_name, SourceImageId=base_ami, SourceRegion=base_region)
             except:
@@ -186,7 +186,7 @@ class AMI(object):
         # Create an image from the instance
         try:
             create_image_args = {'InstanceId': instance_id, 'Name':  ami_name}
-            ec2 = boto3.client('ec2')
+            ec2 = get_client('ec2')
             logger.info("creating an image...")
             res_create = ec2.create_image(**create_image_args)
         except:
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""awaitable versions of the core job operations of API, for asyncio applications.
+boto3 is blocking, so each call runs on a bounded thread pool; the number of
+calls in flight is limited by a semaphore so that thousands of coroutines can
+await status checks or log fetches without creating thousands of threads.
+Cancelling a coroutine that is still waiting for a slot does not make any AWS call."""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from . import create_logger
+from .core import API
+from .batch import TokenBucket
+
+
+logger = create_logger(__name__)
+
+
+class AsyncAPI(object):
+    """asyncio wrapper of API, e.g.
+
+        async with AsyncAPI(max_concurrency=64) as api:
+            statuses = await api.check_status_many(job_ids)
+
+    max_concurrency is the maximum number of AWS calls in flight,
+    rate (per second) optionally limits the StartExecution requests of run_workflow."""
+    API = API
+
+    def __init__(self, max_concurrency=32, rate=None, max_retries=8, api=None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.api = api or self.API()
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(rate) if rate else None
+        self.max_retries = max_retries
+        self._executor = None
+        self._semaphore = None
+        self._loop = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """shut down the thread pool (calls already running are not interrupted)"""
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    @property
+    def executor(self):
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                thread_name_prefix='tibanna-async')
+        return self._executor
+
+    def _get_semaphore(self):
+        # a semaphore is bound to the event loop it is used in
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    async def _call(self, func, *args, **kwargs):
+        async with self._get_semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _many(self, func, kwargs_list, return_exceptions=True):
+        return await asyncio.gather(*[func(**kwargs) for kwargs in kwargs_list],
+                                    return_exceptions=return_exceptions)
+
+    async def run_workflow(self, input_json, **kwargs):
+        """same as API.run_workflow, but it does not open a browser or sleep after submission by default"""
+        kwargs.setdefault('open_browser', False)
+        kwargs.setdefault('sleep', 0)
+        if self.rate_limiter:
+            kwargs.setdefault('rate_limiter', self.rate_limiter)
+            kwargs.setdefault('max_retries', self.max_retries)
+        return await self._call(self.api.run_workflow, input_json, **kwargs)
+
+    async def check_status(self, exec_arn=None, job_id=None):
+        return await self._call(self.api.check_status, exec_arn=exec_arn, job_id=job_id)
+
+    async def check_output(self, exec_arn=None, job_id=None):
+        return await self._call(self.api.check_output, exec_arn=exec_arn, job_id=job_id)
+
+    async def info(self, job_id):
+        return await self._call(self.api.info, job_id)
+
+    async def log(self, exec_arn=None, job_id=None, **kwargs):
+        return await self._call(self.api.log, exec_arn=exec_arn, job_id=job_id, **kwargs)
+
+    async def kill(self, exec_arn=None, job_id=None, **kwargs):
+        return await self._call(self.api.kill, exec_arn=exec_arn, job_id=job_id, **kwargs)
+
+    async def stat(self, **kwargs):
+        return await self._call(self.api.stat, **kwargs)
+
+    async def run_workflows(self, input_json_list, return_exceptions=True, **kwargs):
+        """submit many workflows concurrently. Returns the results in the same order,
+        with the exception in place of the result for a failed submission
+        (unless return_exceptions is False)"""
+        return await asyncio.gather(*[self.run_workflow(input_json, **kwargs) for input_json in input_json_list],
+                                    return_exceptions=return_exceptions)
+
+    async def check_status_many(self, job_ids, return_exceptions=True):
+        """check the status of many jobs concurrently (in the same order as job_ids)"""
+        return await self._many(self.check_status, [{'job_id': j} for j in job_ids], return_exceptions)
+
+    async def log_many(self, job_ids, return_exceptions=True, **kwargs):
+        """fetch the logs (or postrun json etc. depending on kwargs) of many jobs concurrently"""
+        return await self._many(self.log, [dict(kwargs, job_id=j) for j in job_ids], return_exceptions)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""process-wide registry of boto3 clients and of facts learned about S3 buckets.
+boto3 clients are thread-safe but expensive to create (and the lazy creation of
+the default session is not thread-safe), so every module should get its
+clients from here instead of calling boto3.client directly."""
+import threading
+import contextvars
+from concurrent import futures
+
+
+_lock = threading.Lock()
+_clients = dict()
+_bucket_facts = dict()
+
+# error codes of a write with an ACL that the bucket refuses (e.g. object ownership enforced, public access blocked)
+ACL_REJECTION_CODES = ['AccessControlListNotSupported', 'AccessDenied']
+
+
+def get_client(service, region_name=None, endpoint_url=None, profile_name=None):
+    """return a cached boto3 client for (service, region, endpoint, profile).
+    Clients follow the boto3 default session, so they are re-created if
+    boto3.setup_default_session is called again."""
+    import boto3  # imported on first use, since it is slow to import
+    with _lock:
+        if profile_name:
+            session = None
+        else:
+            if boto3.DEFAULT_SESSION is None:
+                boto3.setup_default_session()
+            session = boto3.DEFAULT_SESSION
+        key = (service, region_name, endpoint_url, profile_name, session)
+        if key not in _clients:
+            if not session:
+                session = boto3.session.Session(profile_name=profile_name)
+            kwargs = dict()
+            if region_name:
+                kwargs['region_name'] = region_name
+            if endpoint_url:
+                kwargs['endpoint_url'] = endpoint_url
+            client = session.client(service, **kwargs)
+            client.meta.events.register('before-call', _count_call)
+            _clients[key] = client
+        return _clients[key]
+
+
+_call_counter = contextvars.ContextVar('aws_call_counter', default=None)
+_call_counter_lock = threading.Lock()
+
+
+def set_call_counter(counter):
+    """count the AWS calls made by the current thread with the clients of get_client
+    in counter ({'<service>.<operation>': n}), or stop counting if counter is None.
+    The calls of the tasks of a ThreadPoolExecutor (below) count in the counter of the
+    thread that submitted them. Returns the previous counter of the thread."""
+    previous = _call_counter.get()
+    _call_counter.set(counter)
+    return previous
+
+
+def _count_call(event_name='', **kwargs):
+    counter = _call_counter.get()
+    if counter is not None:
+        op = event_name.split('.', 1)[-1]  # before-call.<service>.<operation>
+        with _call_counter_lock:
+            counter[op] = counter.get(op, 0) + 1
+
+
+class ThreadPoolExecutor(futures.ThreadPoolExecutor):
+    """a thread pool whose tasks run in a copy of the context of the submitting thread,
+    so that their AWS calls are counted with the calls of that thread"""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def get_bucket_fact(bucket, fact, default=None):
+    """return what was previously learned about a bucket (e.g. whether it accepts ACLs)"""
+    with _lock:
+        return _bucket_facts.get(bucket, {}).get(fact, default)
+
+
+def set_bucket_fact(bucket, fact, value):
+    with _lock:
+        _bucket_facts.setdefault(bucket, dict())[fact] = value
+
+
+def reset():
+    """forget all the cached clients and bucket facts
+    (e.g. after forking or switching credentials)"""
+    with _lock:
+        _clients.clear()
+        _bucket_facts.clear()
+
+
+def put_object_with_acl(s3, bucket, acl, **kwargs):
+    """put_object with the given ACL, falling back to 'private' if the bucket rejects it.
+    A bucket that rejected a non-private ACL once (e.g. because object ownership is
+    enforced or public access is blocked) is remembered, so that later writes
+    cost a single request."""
+    _write_with_acl(lambda acl: s3.put_object(Bucket=bucket, ACL=acl, **kwargs), bucket, acl)
+
+
+def upload_file_with_acl(s3, filepath, bucket, key, acl, extra_args=None):
+    """same as put_object_with_acl, for s3.upload_file"""
+    extra_args = extra_args or dict()
+    _write_with_acl(lambda acl: s3.upload_file(filepath, bucket, key, ExtraArgs=dict(extra_args, ACL=acl)),
+                    bucket, acl)
+
+
+def _write_with_acl(write, bucket, acl):
+    if acl == 'private' or get_bucket_fact(bucket, 'accepts_acl') is False:
+        return write('private')
+    try:
+        return write(acl)
+    except Exception as e:
+        res = write('private')
+        # only a bucket that accepts a private write has rejected the acl itself,
+        # other errors (e.g. throttling) only make this write private
+        if _rejects_acl(e):
+            set_bucket_fact(bucket, 'accepts_acl', False)
+        return res
+
+
+def _rejects_acl(e):
+    from botocore.exceptions import ClientError
+    if isinstance(e, ClientError):
+        return e.response.get('Error', {}).get('Code') in ACL_REJECTION_CODES
+    # upload_file raises S3UploadFailedError, with the code of the ClientError in its message
+    return any('(%s)' % code in str(e) for code in ACL_REJECTION_CODES)
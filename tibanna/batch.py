@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import create_logger
+from .aws_utils import get_client
+from .base import SerializableObject
+from .vars import _tibanna, config, DYNAMODB_TABLE
+from .dd_utils import BatchWriter
+
+
+logger = create_logger(__name__)
+
+
+# default pacing of run_batch_workflows : StartExecution requests per second (a job makes two of them
+# if the cost updater is deployed), well below the StartExecution quota of a region, and parallel workers
+DEFAULT_SUBMISSION_RATE = 10.0
+DEFAULT_SUBMISSION_CONCURRENCY = 8
+
+
+# error codes that AWS services use to signal request throttling
+THROTTLING_ERROR_CODES = ['ThrottlingException',
+                          'Throttling',
+                          'TooManyRequestsException',
+                          'RequestLimitExceeded',
+                          'ProvisionedThroughputExceededException',
+                          'SlowDown']
+
+
+def is_throttling_error(e):
+    """whether e is a botocore ClientError caused by throttling"""
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code', '') in THROTTLING_ERROR_CODES
+    return False
+
+
+def call_with_backoff(func, *args, max_retries=8, base_delay=0.5, max_delay=30,
+                      rate_limiter=None, **kwargs):
+    """call func(*args, **kwargs), retrying with exponential backoff (full jitter)
+    if AWS responds with a throttling error. If a rate_limiter is given, a token
+    is taken before each call (retries included) and the rate_limiter is notified
+    of each throttling and each success so that it can adapt its rate.
+    Non-throttling errors are raised immediately."""
+    for attempt in range(max_retries + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            res = func(*args, **kwargs)
+        except Exception as e:
+            if not is_throttling_error(e) or attempt == max_retries:
+                raise e
+            if rate_limiter:
+                rate_limiter.throttled()
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logger.warning("throttled by AWS (%s), retrying in %.1f seconds" % (str(e), delay))
+            time.sleep(delay)
+        else:
+            if rate_limiter:
+                rate_limiter.succeeded()
+            return res
+
+
+class TokenBucket(object):
+    """thread-safe adaptive token bucket.
+    Tokens are refilled at `rate` per second up to `capacity`. Every throttling
+    halves the current rate (down to min_rate) and every success recovers it
+    additively toward the configured rate."""
+
+    def __init__(self, rate, capacity=None, min_rate=0.1, recovery=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be a positive number")
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.max_rate)
+        self.recovery = recovery if recovery is not None else self.max_rate / 20
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """block until a token is available and consume it"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self._sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.recovery)
+
+
+class BatchJobResult(SerializableObject):
+    def __init__(self, index, input_json, status='PENDING', jobid=None, run_name=None,
+                 exec_arn=None, url=None, error=None, error_type=None, elapsed=None,
+                 run_info=None):
+        self.index = index
+        # keep file names, but not the content of input dictionaries
+        self.input_json = input_json if isinstance(input_json, str) else None
+        self.status = status
+        self.jobid = jobid
+        self.run_name = run_name
+        self.exec_arn = exec_arn
+        self.url = url
+        self.error = error
+        self.error_type = error_type
+        self.elapsed = elapsed
+        self.run_info = run_info
+
+    def as_dict(self):
+        d = super().as_dict()
+        d.pop('run_info', None)
+        return d
+
+
+class BatchReport(SerializableObject):
+    def __init__(self, results=None, elapsed=None):
+        self.results = results or []
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        return [r for r in self.results if r.status in ['SUBMITTED', 'DRYRUN']]
+
+    @property
+    def failed(self):
+        return [r for r in self.results if r.status == 'FAILED']
+
+    @property
+    def run_infos(self):
+        """run info (the returned value of run_workflow) of the successful submissions"""
+        return [r.run_info for r in self.succeeded]
+
+    def as_dict(self):
+        return {'n_submitted': len(self.succeeded),
+                'n_failed': len(self.failed),
+                'elapsed': self.elapsed,
+                'results': [r.as_dict() for r in self.results]}
+
+
+class BatchSubmitter(object):
+    """submit many workflows using a bounded pool of workers.
+    If rate is given, submissions are paced by an adaptive token bucket
+    (`rate` StartExecution requests per second, a job making two of them if the
+    cost updater is deployed) instead of fixed sleeps. Throttled AWS calls are
+    retried with backoff and errors are collected per job instead of aborting
+    the whole batch."""
+
+    def __init__(self, api, concurrency=1, rate=None, max_retries=8):
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        self.api = api
+        self.concurrency = concurrency
+        self.rate_limiter = TokenBucket(rate, capacity=concurrency) if rate else None
+        self.max_retries = max_retries
+
+    def submit_one(self, index, input_json, **kwargs):
+        result = BatchJobResult(index, input_json)
+        start = time.time()
+        try:
+            # the rate limiter is used by each start_execution call of run_workflow
+            run_info = self.api.run_workflow(input_json, open_browser=False,
+                                             rate_limiter=self.rate_limiter,
+                                             max_retries=self.max_retries, **kwargs)
+        except Exception as e:
+            logger.error("submission %d failed: %s" % (index, str(e)))
+            result.update(status='FAILED', error=str(e), error_type=type(e).__name__)
+        else:
+            result.update(status='DRYRUN' if kwargs.get('dryrun') else 'SUBMITTED',
+                          jobid=run_info.get('jobid'),
+                          run_name=run_info[_tibanna].get('run_name'),
+                          exec_arn=run_info[_tibanna].get('exec_arn'),
+                          url=run_info[_tibanna].get('url'),
+                          run_info=run_info)
+        result.elapsed = round(time.time() - start, 3)
+        return result
+
+    def submit(self, input_json_list, **kwargs):
+        """submit all the input jsons and return a BatchReport.
+        kwargs are passed to run_workflow (e.g. sfn, env, sleep, verbose, dryrun).
+        The jobs are registered to dynamoDB in batches."""
+        start = time.time()
+        with BatchWriter(DYNAMODB_TABLE) as dd_writer:
+            kwargs['dd_writer'] = dd_writer
+            if self.concurrency == 1:
+                results = [self.submit_one(i, input_json, **kwargs)
+                           for i, input_json in enumerate(input_json_list)]
+            else:
+                # initialize the default boto3 session in the main thread,
+                # since its lazy creation is not thread-safe.
+                get_client('stepfunctions', region_name=config.aws_region)
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    futures = [executor.submit(self.submit_one, i, input_json, **kwargs)
+                               for i, input_json in enumerate(input_json_list)]
+                    results = [f.result() for f in futures]
+        return BatchReport(results, elapsed=round(time.time() - start, 3))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""opt-in call cache : a job whose workflow, inputs, parameters, environment and
+container image are identical to those of a previously successful job reuses the
+outputs of that job instead of launching an instance.
+
+The cache key is a sha256 hash over the canonical form of the run json
+(without the job-specific fields such as jobid, start time, output targets and logs),
+together with the digests of the workflow files and the ETags of the input objects.
+Container images are hashed by their name, so use a digest-pinned image
+(e.g. ``image@sha256:...``) to make the cache sensitive to image updates.
+
+The index is a set of small json objects ``<prefix><hash>.json`` in the cache bucket,
+each pointing to the outputs of the job that first produced the result."""
+import re
+import json
+import copy
+import hashlib
+import time
+from urllib.request import urlopen
+from . import create_logger
+from .aws_utils import get_client
+from .utils import does_key_exist, read_s3, put_object_s3
+from .nnested_array import flatten
+from .object_sizes import get_object_etag
+
+
+CALL_CACHE_PREFIX = '.tibanna_cache/'
+CALL_CACHE_VERSION = 1
+
+
+logger = create_logger(__name__)
+
+
+class CallCacheMiss(Exception):
+    """raised internally when a cached result cannot be reused for a job"""
+    pass
+
+
+class CallCache(object):
+
+    def __init__(self, bucket, prefix=CALL_CACHE_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def index_key(self, cache_key):
+        return self.prefix + cache_key + '.json'
+
+    # hashing
+
+    def key(self, runjson):
+        """return the cache key for a run json dict (as created by Execution.create_run_json_dict)
+        or None if any of the workflow files or input objects cannot be resolved"""
+        try:
+            job = runjson['Job']
+            d = {'version': CALL_CACHE_VERSION,
+                 'App': job['App'],
+                 'workflow_files': self.workflow_file_digests(job['App']),
+                 'Input': copy.deepcopy(job['Input']),
+                 'singularity': runjson.get('config', {}).get('singularity', False)}
+            for category in ['Input_files_data', 'Secondary_files_data']:
+                for f in d['Input'][category].values():
+                    f['etag'] = self.object_digests(f['dir'], f['path'])
+        except Exception as e:
+            logger.warning("call cache disabled for this job : %s" % str(e))
+            return None
+        return hashlib.sha256(canonical_json(d).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def object_digest(bucket, key):
+        # a fresh ETag : a cached one could be that of an object overwritten since (false cache hit)
+        return get_object_etag(bucket, key)
+
+    def object_digests(self, bucket, path):
+        """ETag(s) of the input object(s), keeping the (nested) list structure of path"""
+        if isinstance(path, list):
+            return [self.object_digests(bucket, p) for p in path]
+        return self.object_digest(bucket, path)
+
+    def workflow_file_digests(self, app):
+        """digests of the main and child workflow files (s3 ETag or sha256 of the content)"""
+        for lang in ['cwl', 'wdl', 'snakemake']:
+            url = app.get(lang + '_url')
+            if url:
+                main = app.get('main_' + lang)
+                others = [_ for _ in (app.get('other_%s_files' % lang) or '').split(',') if _]
+                return {f: self.url_digest(url.rstrip('/') + '/' + f) for f in [main] + others}
+        return {}
+
+    def url_digest(self, url):
+        if url.startswith('s3://'):
+            bucket, key = re.sub('^s3://', '', url).split('/', 1)
+            return self.object_digest(bucket, key)
+        with urlopen(url) as res:
+            return hashlib.sha256(res.read()).hexdigest()
+
+    # index
+
+    def lookup(self, cache_key):
+        """return the index entry for the cache key, or None"""
+        if not cache_key or not does_key_exist(self.bucket, self.index_key(cache_key), quiet=True):
+            return None
+        return json.loads(read_s3(self.bucket, self.index_key(cache_key)))
+
+    def record(self, cache_key, prj):
+        """add a successful job (AwsemPostRunJson object) to the index.
+        Return the entry, or None if the outputs of the job cannot be reused"""
+        try:
+            entry = {'version': CALL_CACHE_VERSION,
+                     'jobid': prj.Job.JOBID,
+                     'log_bucket': prj.Job.Log.log_bucket_directory,
+                     'outputs': recorded_outputs(prj.Job.Output),
+                     'Output files': prj.Job.Output.as_dict().get('Output files', {})}
+        except CallCacheMiss as e:
+            logger.info("job %s is not added to the call cache : %s" % (prj.Job.JOBID, str(e)))
+            return None
+        put_object_s3(json.dumps(entry, indent=4), self.index_key(cache_key), self.bucket, public=False)
+        return entry
+
+    # reuse
+
+    def reuse(self, entry, runjson, encrypt_s3_upload=False, kms_key_id=None):
+        """copy the outputs of a cached job to the output targets of a new job
+        and write a synthetic postrun json and the job_started/success markers.
+        Return False if the cached outputs cannot be mapped to the new targets."""
+        jobid = runjson['Job']['JOBID']
+        log_bucket = runjson['config']['log_bucket']
+        try:
+            copies, output_files = planned_copies(entry, runjson['Job']['Output'])
+        except CallCacheMiss as e:
+            logger.info("cached result %s is not reused for job %s : %s" % (entry['jobid'], jobid, str(e)))
+            return False
+        s3 = get_client('s3')
+        extra_args = dict()
+        if encrypt_s3_upload:
+            extra_args['ServerSideEncryption'] = 'aws:kms'
+            if kms_key_id:
+                extra_args['SSEKMSKeyId'] = kms_key_id
+        try:
+            for src_bucket, src_key, bucket, key in copies:
+                s3.copy({'Bucket': src_bucket, 'Key': src_key}, bucket, key, ExtraArgs=extra_args)
+        except Exception as e:
+            # e.g. the cached outputs have been deleted - the job is run as usual
+            logger.warning("failed to copy cached outputs of job %s : %s" % (entry['jobid'], str(e)))
+            return False
+
+        prj = copy.deepcopy(runjson)
+        prj['config']['cached_from'] = entry['jobid']
+        prj['Job']['Output']['Output files'] = output_files
+        prj['Job'].update({'end_time': time.strftime("%Y%m%d-%H:%M:%S-%Z"),
+                           'status': '0',
+                           'instance_id': ''})
+        put = dict(bucket=log_bucket, public=prj['config'].get('public_postrun_json', False),
+                   encrypt_s3_upload=encrypt_s3_upload, kms_key_id=kms_key_id)
+        put_object_s3(json.dumps(prj, indent=4), jobid + '.postrun.json', **put)
+        put_object_s3("outputs reused from job %s (call cache)\n" % entry['jobid'], jobid + '.log', **put)
+        put_object_s3('', jobid + '.job_started', **put)
+        put_object_s3('', jobid + '.success', **put)
+        return True
+
+
+def canonical_json(d):
+    return json.dumps(d, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def source_name(path):
+    return re.sub('^/data1/((shell|out)/)*', '', path)
+
+
+def parse_simple_target(target_value, output_bucket):
+    """return (bucket, key) for a target value that points to a single object
+    (same rules as awsf3.target.Target.parse_target_value). key may end with '/' (prefix)."""
+    if isinstance(target_value, dict):
+        if target_value.get('unzip') or 'object_prefix' in target_value:
+            raise CallCacheMiss("unzip or object_prefix targets are not supported")
+        return target_value.get('bucket_name', output_bucket), target_value.get('object_key', '')
+    if target_value.startswith('s3://'):
+        bucket, key = re.sub('^s3://', '', target_value).split('/', 1)
+        return bucket, key
+    return output_bucket, target_value
+
+
+def recorded_outputs(prj_out):
+    """where the outputs of a finished job were uploaded, per output target key
+    {<argname>: {'bucket', 'key', 'path', 'secondary': [{'bucket', 'key', 'path'}]}}"""
+    output_files = prj_out.output_files
+    outputs = dict()
+    for k, target_value in prj_out.output_target.items():
+        if k.startswith('file://'):
+            raise CallCacheMiss("custom (file://) output targets are not supported")
+        # conditional alternative argnames (WDL)
+        argname = next((a for a in [k] + prj_out.alt_cond_output_argnames.get(k, []) if a in output_files), None)
+        if not argname:
+            raise CallCacheMiss("output %s was not produced" % k)
+        of = output_files[argname]
+        if (of.class_ and of.class_ != 'File') or not of.target:
+            raise CallCacheMiss("output %s is not a single uploaded file" % argname)
+        bucket, key = parse_simple_target(target_value, prj_out.output_bucket_directory) \
+            if target_value else (prj_out.output_bucket_directory, of.target)
+        if key.endswith('/'):
+            raise CallCacheMiss("output %s was uploaded to a prefix" % argname)
+        secondary = []
+        for tv in prj_out.secondary_output_target.get(k, []):
+            if not isinstance(tv, str) or tv.startswith('s3://'):
+                raise CallCacheMiss("secondary output targets must be object keys")
+        for sf in of.secondaryFiles or []:
+            secondary.append({'bucket': prj_out.output_bucket_directory, 'key': sf.target, 'path': sf.path})
+        outputs[k] = {'bucket': bucket, 'key': of.target, 'path': of.path,
+                                      'argname': argname, 'secondary': secondary}
+    return outputs
+
+
+def planned_copies(entry, output):
+    """map the recorded outputs of a cached job to the output targets of a new job (Output of a run json).
+    Return a list of (src_bucket, src_key, bucket, key) and the 'Output files' of the new job."""
+    output_bucket = output['output_bucket_directory']
+    output_files = copy.deepcopy(entry['Output files'])
+    copies = []
+    for k, target_value in output['output_target'].items():
+        if k not in entry['outputs']:
+            raise CallCacheMiss("output target %s is not in the cached result" % k)
+        rec = entry['outputs'][k]
+        if target_value:
+            bucket, key = parse_simple_target(target_value, output_bucket)
+            if key.endswith('/'):
+                key += source_name(rec['path'])
+        else:
+            bucket, key = output_bucket, source_name(rec['path'])
+        copies.append((rec['bucket'], rec['key'], bucket, key))
+        output_files[rec['argname']]['target'] = key
+        secondary_targets = output.get('secondary_output_target', {}).get(k, [])
+        if not isinstance(secondary_targets, list):
+            secondary_targets = [secondary_targets]
+        for tv in flatten(secondary_targets):
+            if not isinstance(tv, str) or tv.startswith('s3://'):
+                raise CallCacheMiss("secondary output targets must be object keys")
+        for i, sf in enumerate(rec['secondary']):
+            # same matching rule as awsf3.target.SecondaryTargetList.reorder_by_source
+            skey = next((tv for tv in secondary_targets if tv[-3:] == sf['path'][-3:]), source_name(sf['path']))
+            copies.append((sf['bucket'], sf['key'], output_bucket, skey))
+            output_files[rec['argname']]['secondaryFiles'][i]['target'] = skey
+    return copies, output_files
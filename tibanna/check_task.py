@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
-import boto3
 import json
 import copy
 from . import create_logger
+from .aws_utils import get_client
 from .cw_utils import TibannaResource
 from datetime import datetime, timedelta
 from dateutil.tz import tzutc
@@ -14,9 +14,16 @@ from .utils import (
 from .awsem import (
     AwsemPostRunJson
 )
+from .call_cache import CallCache
+from .task_token import register_task_token
+from .job_status import read_job_status
+from .polling import poll_job
+from .status_checker import check_jobs
+from .packing import host_instance
 from .exceptions import (
     StillRunningException,
     EC2StartingException,
+    EC2LaunchException,
     AWSEMJobErrorException,
     EC2UnintendedTerminationException,
     EC2IdleException,
@@ -35,6 +42,15 @@ logger = create_logger(__name__)
 
 
 def check_task(input_json):
+    if 'task_token' in input_json:
+        # WaitForCompletionAwsem state of the step function (wait_for_completion_event)
+        return register_task_token(input_json['input'], input_json['task_token'])
+    if 'poll' in input_json:
+        # CheckTaskAwsem state of the polling loop of the step function
+        return CheckTask(input_json).poll()
+    if 'jobs' in input_json:
+        # a batch of jobs (e.g. from a sweeper schedule or a Map state), only reported
+        return check_jobs(input_json['jobs'], log_bucket=input_json.get('log_bucket'))
     return CheckTask(input_json).run()
 
 
@@ -45,7 +61,22 @@ class CheckTask(object):
     def __init__(self, input_json):
         self.input_json = copy.deepcopy(input_json)
 
-    def run(self):
+    def poll(self):
+        """same as run, but a job that is not over is returned with its next poll (see polling)
+        instead of raising EC2StartingException or StillRunningException"""
+        poll = self.input_json.pop('poll')
+        try:
+            return self.run()
+        except EC2StartingException:
+            state = 'starting'
+        except StillRunningException:
+            state = 'running'
+        res = copy.deepcopy(self.input_json)
+        res['poll'] = poll_job(dict(self.input_json, poll=poll), state)
+        logger.info("job %s %s, next check in %d seconds" % (res['jobid'], state, res['poll']['interval']))
+        return res
+
+    def run(self, use_job_status=True):
         # s3 bucket that stores the output
         bucket_name = self.input_json['config']['log_bucket']
         instance_id = self.input_json['config'].get('instance_id', '')
@@ -59,14 +90,45 @@ class CheckTask(object):
 
         public_postrun_json = self.input_json['config'].get('public_postrun_json', False)
 
+        # the status document of the job gives its state with a single GET, instead of a HEAD per marker
+        job_status = self.read_job_status(bucket_name, jobid) if use_job_status else None
+
+        packed_into = self.input_json['config'].get('packed_into')
+        if packed_into and not instance_id:
+            # a packed job runs on the instance of its primary job
+            instance_id = job_status.get('instance_id', '') if job_status else ''
+            if not instance_id:
+                instance_id, launch_failed = self.host_instance(packed_into)
+                if launch_failed:
+                    raise EC2LaunchException("the instance of job %s (packed into job %s) failed to launch"
+                                             % (jobid, packed_into))
+
+        def has_ended(phase, marker):
+            if job_status:
+                return job_status['phase'] == phase
+            return does_key_exist(bucket_name, marker)
+
+        def instance_lost(errmsg):
+            if job_status:
+                # the job may have been killed, or may have failed outside of the container,
+                # which the status document does not tell
+                return self.run(use_job_status=False)
+            logger.error(errmsg)
+            self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json) # We need to record the end time
+            raise EC2UnintendedTerminationException(errmsg)
+
         # check to see ensure this job has started else fail
-        if not does_key_exist(bucket_name, job_started):
+        if not job_status and not does_key_exist(bucket_name, job_started):
+            if packed_into and not instance_id:
+                raise EC2StartingException("the instance of job %s (packed into job %s) is not launched yet"
+                                           % (jobid, packed_into))
             start_time = PARSE_AWSEM_TIME(self.input_json['config']['start_time'])
             now = datetime.now(tzutc())
             # terminate the instance if EC2 is not booting for more than 10 min.
             if start_time + timedelta(minutes=10) < now:
                 try:
-                    boto3.client('ec2').terminate_instances(InstanceIds=[instance_id])
+                    if not packed_into:  # the instance of a packed job is shared
+                        get_client('ec2').terminate_instances(InstanceIds=[instance_id])
                     self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json)
                 except:
                     pass  # most likely already terminated or never initiated
@@ -74,24 +136,24 @@ class CheckTask(object):
             raise EC2StartingException("Failed to find jobid %s, ec2 is probably still booting" % jobid)
 
         # check to see if job has been aborted (by user or admin)
-        if does_key_exist(bucket_name, job_aborted):
+        if has_ended('aborted', job_aborted):
             try:
                 self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json)
                 # Instance should already be terminated here. Sending a second signal just in case
-                boto3.client('ec2').terminate_instances(InstanceIds=[instance_id]) 
+                self.terminate_instance(instance_id)
             except Exception as e:
                 logger.warning("error occurred while handling postrun json but continuing. %s" % str(e))
             raise JobAbortedException("job aborted")
 
         # check to see if job has error, report if so
-        if does_key_exist(bucket_name, job_error):
+        if has_ended('failed', job_error):
             try:
                 self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json)
             except Exception as e:
                 logger.warning("error occurred while handling postrun json but continuing. %s" % str(e))
             
             # Instance should already be terminated here. Sending a second signal just in case
-            boto3.client('ec2').terminate_instances(InstanceIds=[instance_id]) 
+            self.terminate_instance(instance_id)
             
             eh = AWSEMErrorHandler()
             if 'custom_errors' in self.input_json['args']:
@@ -105,39 +167,41 @@ class CheckTask(object):
                 raise AWSEMJobErrorException(eh.general_awsem_error_msg(jobid))
 
         # check to see if job has completed
-        if does_key_exist(bucket_name, job_success):
-            self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json)
+        if has_ended('succeeded', job_success):
+            prj = self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json)
             print("completed successfully")
+            if self.input_json['config'].get('cached_from'):
+                return self.input_json  # outputs were reused, no instance was launched
             # Instance should already be terminated here. Sending a second signal just in case
-            boto3.client('ec2').terminate_instances(InstanceIds=[instance_id]) 
+            self.terminate_instance(instance_id)
+            if self.input_json['config'].get('call_cache_key'):
+                self.add_to_call_cache(prj)
             return self.input_json
 
         # checking if instance is terminated for no reason
         if instance_id:  # skip test for instance_id by not giving it to self.input_json
             try:
-                res = boto3.client('ec2').describe_instances(InstanceIds=[instance_id])
+                res = get_client('ec2').describe_instances(InstanceIds=[instance_id])
             except Exception as e:
                 if 'InvalidInstanceID.NotFound' in str(e):
-                    self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json) # We need to record the end time
-                    raise EC2UnintendedTerminationException("EC2 is no longer found for job %s - please rerun." % jobid)
+                    return instance_lost("EC2 is no longer found for job %s - please rerun." % jobid)
                 else:
                     raise e
             if not res['Reservations']:
-                self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json) # We need to record the end time
-                raise EC2UnintendedTerminationException("EC2 is no longer found for job %s - please rerun." % jobid)
+                return instance_lost("EC2 is no longer found for job %s - please rerun." % jobid)
             else:
                 ec2_state = res['Reservations'][0]['Instances'][0]['State']['Name']
                 if ec2_state in ['stopped', 'shutting-down', 'terminated']:
-                    errmsg = "EC2 is terminated unintendedly for job %s - please rerun." % jobid
-                    logger.error(errmsg)
-                    self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json) # We need to record the end time
-                    raise EC2UnintendedTerminationException(errmsg)
+                    return instance_lost("EC2 is terminated unintendedly for job %s - please rerun." % jobid)
 
             # check CPU utilization for the past hour
             filesystem = '/dev/nvme1n1'  # doesn't matter for cpu utilization
             end = datetime.now(tzutc())
             start = end - timedelta(hours=1)
-            jobstart_time = boto3.client('s3').get_object(Bucket=bucket_name, Key=job_started).get('LastModified')
+            if job_status and job_status.get('started_at'):
+                jobstart_time = PARSE_AWSEM_TIME(job_status['started_at'])
+            else:
+                jobstart_time = get_client('s3').get_object(Bucket=bucket_name, Key=job_started).get('LastModified')
             if jobstart_time + timedelta(hours=1) < end:
                 try:
                     cw_res = self.TibannaResource(instance_id, filesystem, start, end).as_dict()
@@ -151,6 +215,31 @@ class CheckTask(object):
         # if none of the above
         raise StillRunningException("job %s still running" % jobid)
 
+    @staticmethod
+    def host_instance(primary_jobid):
+        try:
+            return host_instance(primary_jobid)
+        except Exception as e:
+            logger.warning("cannot get the instance of job %s : %s" % (primary_jobid, str(e)))
+            return '', False
+
+    @staticmethod
+    def read_job_status(bucket_name, jobid):
+        try:
+            return read_job_status(bucket_name, jobid)
+        except Exception as e:
+            logger.warning("cannot read the status document of job %s, checking the markers : %s" % (jobid, str(e)))
+            return None
+
+    def terminate_instance(self, instance_id):
+        """terminate the instance of the job, unless the instance is shared with other jobs
+        (packed jobs) or waits for the next job of a warm pool, in which case the instance
+        terminates itself"""
+        cfg = self.input_json['config']
+        if not instance_id or cfg.get('packed_jobs') or cfg.get('packed_into') or cfg.get('warm_pool'):
+            return
+        get_client('ec2').terminate_instances(InstanceIds=[instance_id])
+
     def terminate_idle_instance(self, jobid, instance_id, cpu, ebs_read):
         
         # Don't check for idle instance if we don't collect any metrics
@@ -165,7 +254,7 @@ class CheckTask(object):
                     bucket_name = self.input_json['config']['log_bucket']
                     public_postrun_json = self.input_json['config'].get('public_postrun_json', False)
                     self.handle_postrun_json(bucket_name, jobid, self.input_json, public_read=public_postrun_json) # We need to record the end time
-                    boto3.client('ec2').terminate_instances(InstanceIds=[instance_id])
+                    get_client('ec2').terminate_instances(InstanceIds=[instance_id])
                 except Exception as e:
                     errmsg = (f"Nothing has been running for the past hour for job {jobid}",
                               f", but instance could not be terminated. Error: {str(e)}")
@@ -183,9 +272,15 @@ class CheckTask(object):
             raise Exception("Postrun json not found at %s" % postrunjson_location)
         postrunjsoncontent = json.loads(read_s3(bucket_name, postrunjson))
         prj = AwsemPostRunJson(**postrunjsoncontent)
-        prj.Job.update(instance_id=input_json['config'].get('instance_id', ''))
-        prj.Job.update(end_time=datetime.now(tzutc()).strftime(AWSEM_TIME_STAMP_FORMAT))
-        self.handle_metrics(prj)
+        if input_json['config'].get('instance_id') or not input_json['config'].get('packed_into'):
+            prj.Job.update(instance_id=input_json['config'].get('instance_id', ''))
+        if input_json['config'].get('instance_rank') and prj.config:
+            # the instance may have read the run json before the launched instance type was added
+            prj.config.update(instance_rank=input_json['config']['instance_rank'],
+                              instance_price=input_json['config'].get('instance_price'))
+        if not input_json['config'].get('cached_from'):
+            prj.Job.update(end_time=datetime.now(tzutc()).strftime(AWSEM_TIME_STAMP_FORMAT))
+            self.handle_metrics(prj)
         logger.debug("inside funtion handle_postrun_json")
         logger.debug("content=\n" + json.dumps(prj.as_dict(), indent=4))
         # upload postrun json file back to s3
@@ -204,6 +299,14 @@ class CheckTask(object):
             raise "error in updating postrunjson %s" % str(e)
         # add postrun json to the input json
         self.add_postrun_json(prj, input_json, RESPONSE_JSON_CONTENT_INCLUSION_LIMIT)
+        return prj
+
+    def add_to_call_cache(self, prj):
+        cfg = self.input_json['config']
+        try:
+            CallCache(cfg.get('call_cache_bucket') or cfg['log_bucket']).record(cfg['call_cache_key'], prj)
+        except Exception as e:
+            logger.warning("failed to add job %s to the call cache. %s" % (prj.Job.JOBID, str(e)))
 
     def add_postrun_json(self, prj, input_json, limit):
         prjd = prj.as_dict()
@@ -220,10 +323,12 @@ class CheckTask(object):
 
     def handle_metrics(self, prj):
         try:
+            saved_store = self.TibannaResource.read_store(prj.config.log_bucket, prj.Job.JOBID + '.metrics/')
             resources = self.TibannaResource(prj.Job.instance_id,
                                              prj.Job.filesystem,
                                              prj.Job.start_time_as_datetime,
-                                             prj.Job.end_time_as_datetime)
+                                             prj.Job.end_time_as_datetime,
+                                             saved_store=saved_store)
 
         except Exception as e:
             raise MetricRetrievalException("error getting metrics: %s" % str(e))
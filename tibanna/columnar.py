@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""column-wise writer and reader of the tables of the metrics report
+(metrics.tsv, top_cpu.tsv and top_mem.tsv).
+
+The tsv format is unchanged : a header line, then a line per interval, the
+first column being the interval. Instead of writing (parsing) cell by cell,
+the tables are handled a block of lines at a time : the writer formats a line
+at once with a template and writes a block in one go; the reader splits a block
+into its cells at once and converts each column with float over the whole
+column (cell by cell only for a column that has non-numeric cells) into an
+array('d'), rather than a list of float objects.
+
+A table can also be written with a binary sidecar (``<file>.bin``) : a json
+header line ({'version':, 'names':, 'n':}) followed by the index and the columns
+as float64 (nan for the missing or non-numeric cells), little-endian,
+zlib-compressed. load_table reads the sidecar of a tsv file if there is one."""
+import os
+import sys
+import json
+import math
+import zlib
+from array import array
+from itertools import zip_longest
+
+
+TABLE_SIDECAR_VERSION = 1
+TABLE_SIDECAR_SUFFIX = '.bin'
+# zlib level of the sidecar : the columns of floats hardly compress more at higher levels
+TABLE_SIDECAR_COMPRESSION = 1
+# number of lines formatted (parsed) at once by write_table (read_table)
+TABLE_WRITE_ROWS = 256
+
+
+def to_float(cell):
+    try:
+        return float(cell)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def as_floats(values):
+    """array('d') of the values, nan for those that are not numbers"""
+    try:
+        return array('d', map(float, values))
+    except (TypeError, ValueError):
+        return array('d', map(to_float, values))
+
+
+def split_columns(contents, delimiter='\t'):
+    """(header, cells of each column) of a table; the cells missing at the end of a short line are None"""
+    header, _, body = contents.rstrip('\n').partition('\n')
+    header = header.split(delimiter)
+    if not body:
+        return header, [[] for _ in header]
+    # all the cells at once, a column being every len(header)-th cell
+    cells = body.replace('\n', delimiter).split(delimiter)
+    n = body.count('\n') + 1
+    if len(cells) == n * len(header):
+        return header, [cells[j::len(header)] for j in range(len(header))]
+    rows = [line.split(delimiter) for line in body.split('\n')]
+    columns = [list(cells) for cells in zip_longest(*rows)]
+    return header, columns[:len(header)] + [[None] * n for _ in range(len(header) - len(columns))]
+
+
+def write_table(filename, index_name, index, columns, delimiter='\t', missing='-', sidecar=False):
+    """write a table : index is the first column (e.g. the intervals), columns is a list of
+    (name, values). A column shorter than the index is padded with missing, a longer one is cut.
+    Returns filename."""
+    n = len(index)
+    # a line is formatted at once (str of each cell), TABLE_WRITE_ROWS lines at a time
+    line = delimiter.join(['%s'] * (len(columns) + 1)).__mod__
+    with open(filename, 'w') as fo:
+        fo.write(delimiter.join([index_name] + [name for name, _ in columns]) + '\n')
+        for start in range(0, n, TABLE_WRITE_ROWS):
+            end = min(start + TABLE_WRITE_ROWS, n)
+            block = [index[start:end]]
+            for _, values in columns:
+                column = values[start:end]
+                if len(column) < end - start:
+                    column = list(column) + [missing] * (end - start - len(column))
+                block.append(column)
+            fo.write('\n'.join(map(line, zip(*block))) + '\n')
+    if sidecar:
+        write_sidecar(filename + TABLE_SIDECAR_SUFFIX, index_name, index, columns)
+    return filename
+
+
+def read_table(contents, delimiter='\t'):
+    """(names, index, {name: array('d')}) of a table written by write_table, names being
+    the header without the index column, nan for the cells that are not numbers"""
+    header, _, body = contents.rstrip('\n').partition('\n')
+    header = header.split(delimiter)
+    arrays = [array('d') for _ in header]
+    lines = body.split('\n') if body else []
+    # TABLE_WRITE_ROWS lines at a time, so that only a block of cells is kept as strings
+    for start in range(0, len(lines), TABLE_WRITE_ROWS):
+        _, columns = split_columns(delimiter.join(header) + '\n' + '\n'.join(lines[start:start + TABLE_WRITE_ROWS]),
+                                   delimiter)
+        for a, column in zip(arrays, columns):
+            a.extend(as_floats(column))
+    names = header[1:]
+    return names, arrays[0], dict(zip(names, arrays[1:]))
+
+
+def write_sidecar(filename, index_name, index, columns):
+    n = len(index)
+    names = [index_name] + [name for name, _ in columns]
+    arrays = [as_floats(index)]
+    for name, values in columns:
+        a = as_floats(values[:n])
+        a.extend([math.nan] * (n - len(a)))
+        arrays.append(a)
+    body = []
+    for a in arrays:
+        if sys.byteorder == 'big':
+            a.byteswap()
+        body.append(a.tobytes())
+    header = {'version': TABLE_SIDECAR_VERSION, 'names': names, 'n': n}
+    with open(filename, 'wb') as fo:
+        fo.write(zlib.compress(json.dumps(header).encode('utf-8') + b'\n' + b''.join(body), TABLE_SIDECAR_COMPRESSION))
+    return filename
+
+
+def read_sidecar(data):
+    """the table of a sidecar (see read_table), or None if it was written by another version"""
+    header_line, body = zlib.decompress(data).split(b'\n', 1)
+    header = json.loads(header_line.decode('utf-8'))
+    if header.get('version') != TABLE_SIDECAR_VERSION:
+        return None
+    n = header['n']
+    arrays = []
+    for i in range(len(header['names'])):
+        a = array('d')
+        a.frombytes(body[i * n * 8:(i + 1) * n * 8])
+        if sys.byteorder == 'big':
+            a.byteswap()
+        arrays.append(a)
+    names = header['names'][1:]
+    return names, arrays[0], dict(zip(names, arrays[1:]))
+
+
+def load_table(filename, delimiter='\t'):
+    """the table of a tsv file (see read_table), from its sidecar if it has one"""
+    if os.path.exists(filename + TABLE_SIDECAR_SUFFIX):
+        with open(filename + TABLE_SIDECAR_SUFFIX, 'rb') as f:
+            table = read_sidecar(f.read())
+        if table:
+            return table
+    with open(filename) as f:
+        return read_table(f.read(), delimiter)
@@ -1,7 +1,5 @@
 # -*- coding: utf-8 -*-
 import os
-import boto3
-import botocore
 import json
 import time
 import copy
@@ -14,10 +12,10 @@ from dateutil.tz import tzutc
 from uuid import uuid4, UUID
 from types import ModuleType
 from . import create_logger
+from .aws_utils import get_client
 from .vars import (
     _tibanna,
-    AWS_ACCOUNT_NUMBER,
-    AWS_REGION,
+    config,
     TIBANNA_DEFAULT_STEP_FUNCTION_NAME,
     STEP_FUNCTION_ARN,
     EXECUTION_ARN,
@@ -33,7 +31,8 @@ from .vars import (
     RUN_TASK_LAMBDA_NAME,
     CHECK_TASK_LAMBDA_NAME,
     UPDATE_COST_LAMBDA_NAME,
-    S3_ENCRYT_KEY_ID
+    S3_ENCRYT_KEY_ID,
+    PARSE_AWSEM_TIME
 )
 from .utils import (
     _tibanna_settings,
@@ -48,7 +47,8 @@ from .utils import (
 )
 from .ec2_utils import (
     UnicornInput,
-    upload_workflow_to_s3
+    upload_workflow_to_s3,
+    cleanup_launch_templates
 )
 from .pricing_utils import (
     get_cost,
@@ -58,6 +58,12 @@ from .pricing_utils import (
     get_cost_estimate_from_tsv
 )
 from .job import Job
+from .predictor import ModelStore, build_models, read_postrunjsons
+from .batch import BatchSubmitter, call_with_backoff, DEFAULT_SUBMISSION_RATE, DEFAULT_SUBMISSION_CONCURRENCY
+from .plan import Planner
+from .packing import JobPacker
+from .status_checker import check_jobs
+from .job_status import read_job_status, mark_job_aborted, JOB_END_PHASES
 from .ami import AMI
 from ._version import __version__
 # from botocore.errorfactory import ExecutionAlreadyExists
@@ -65,7 +71,8 @@ from .stepfunction import StepFunctionUnicorn
 from .stepfunction_cost_updater import StepFunctionCostUpdater
 from .awsem import AwsemRunJson, AwsemPostRunJson
 from .exceptions import (
-    MetricRetrievalException
+    MetricRetrievalException,
+    BatchSubmissionException
 )
 from . import dd_utils
 
@@ -135,7 +142,7 @@ class API(object):
 
     def randomize_run_name(self, run_name, sfn):
         arn = EXECUTION_ARN(run_name, sfn)
-        client = boto3.client('stepfunctions', region_name=AWS_REGION)
+        client = get_client('stepfunctions', region_name=config.aws_region)
         try:
             response = client.describe_execution(
                     executionArn=arn
@@ -156,10 +163,16 @@ class API(object):
 
     def run_workflow(self, input_json, sfn=None,
                      env=None, jobid=None, sleep=3, verbose=True,
-                     open_browser=True, dryrun=False):
+                     open_browser=True, dryrun=False, rate_limiter=None, max_retries=0,
+                     dd_writer=None, call_cache=False):
         '''
         input_json is either a dict or a file
         accession is unique name that we be part of run id
+        call_cache=True reuses the outputs of a previous successful job with identical
+        workflow, inputs and parameters instead of launching an instance (same as config.call_cache)
+        rate_limiter (TokenBucket) and max_retries are used to retry
+        start_execution with backoff upon throttling (used by run_batch_workflows)
+        dd_writer (dd_utils.BatchWriter) is used to register jobs to dynamoDB in batches
         '''
         if isinstance(input_json, dict):
             data = copy.deepcopy(input_json)
@@ -176,13 +189,15 @@ class API(object):
             else:
                 jobid = create_jobid()
         data['jobid'] = jobid
+        if call_cache:
+            data['config']['call_cache'] = True
 
         if not sfn:
             sfn = self.default_stepfunction_name
         if not env:
             env = self.default_env
-        client = boto3.client('stepfunctions', region_name=AWS_REGION)
-        base_url = 'https://console.aws.amazon.com/states/home?region=' + AWS_REGION + '#/executions/details/'
+        client = get_client('stepfunctions', region_name=config.aws_region)
+        base_url = 'https://console.aws.amazon.com/states/home?region=' + config.aws_region + '#/executions/details/'
         # build from appropriate input json
         # assume run_type and and run_id
         if 'run_name' in data['config']:
@@ -215,10 +230,13 @@ class API(object):
         response = None
         if not dryrun:
             try:
-                response = client.start_execution(
+                response = call_with_backoff(
+                    client.start_execution,
                     stateMachineArn=STEP_FUNCTION_ARN(sfn),
                     name=run_name,
                     input=aws_input,
+                    max_retries=max_retries,
+                    rate_limiter=rate_limiter
                 )
                 time.sleep(sleep)
             except Exception as e:
@@ -230,13 +248,16 @@ class API(object):
                     "sfn_arn": data[_tibanna]['exec_arn'],
                     "log_bucket": data['config']['log_bucket'],
                     "job_id": data['jobid'],
-                    "aws_region": AWS_REGION
+                    "aws_region": config.aws_region
                 }
                 costupdater_input = json.dumps(costupdater_input)
-                costupdater_response = client.start_execution(
+                costupdater_response = call_with_backoff(
+                    client.start_execution,
                     stateMachineArn=STEP_FUNCTION_ARN(sfn + "_costupdater"),
                     name=run_name,
                     input=costupdater_input,
+                    max_retries=max_retries,
+                    rate_limiter=rate_limiter
                 )
                 time.sleep(sleep)
             except Exception as e:
@@ -246,7 +267,7 @@ class API(object):
                     raise e
 
         # adding execution info to dynamoDB for fast search by awsem job id
-        Job.add_to_dd(jobid, run_name, sfn, data['config']['log_bucket'], verbose=verbose)
+        Job.add_to_dd(jobid, run_name, sfn, data['config']['log_bucket'], verbose=verbose, dd_writer=dd_writer)
         data[_tibanna]['response'] = response
         if verbose:
             # print some info
@@ -257,21 +278,89 @@ class API(object):
             logger.info("EXECUTION ARN = %s" % data[_tibanna]['exec_arn'])
             if 'cloudwatch_dashboard' in data['config'] and data['config']['cloudwatch_dashboard']:
                 cw_db_url = 'https://console.aws.amazon.com/cloudwatch/' + \
-                    'home?region=%s#dashboards:name=awsem-%s' % (AWS_REGION, jobid)
+                    'home?region=%s#dashboards:name=awsem-%s' % (config.aws_region, jobid)
                 logger.info("Cloudwatch Dashboard = %s" % cw_db_url)
             if open_browser and shutil.which('open') is not None and not dryrun:
                 subprocess.call(["open", data[_tibanna]['url']])
         return data
 
     def run_batch_workflows(self, input_json_list, sfn=None,
-                     env=None, sleep=3, verbose=True, open_browser=True, dryrun=False):
-        """given a list of input json, run multiple workflows"""
-        run_infos = []
-        for input_json in input_json_list:
-            run_info = self.run_workflow(input_json, env=env, sfn=sfn, sleep=sleep, verbose=verbose,
-                       open_browser=False, dryrun=dryrun)
-            run_infos.append(run_info)
-        return run_infos
+                     env=None, sleep=None, verbose=True, open_browser=True, dryrun=False,
+                     concurrency=DEFAULT_SUBMISSION_CONCURRENCY, rate=DEFAULT_SUBMISSION_RATE,
+                     max_retries=8, pack=False, return_report=False):
+        """given a list of input json, run multiple workflows.
+        The jobs are submitted by `concurrency` workers, paced by an adaptive rate limiter
+        of `rate` StartExecution requests per second. If sleep is given, the rate limiter
+        is not used and each start_execution is followed by a sleep of `sleep` seconds instead
+        (e.g. sleep=3, concurrency=1 for the pacing of earlier versions).
+        Throttled requests are retried up to max_retries times.
+        If pack is set, compatible small jobs (with cpu and mem specified) share
+        instances (see tibanna.packing).
+        Returns the list of run infos (returned values of run_workflow). All the jobs are
+        submitted even if some fail, then a BatchSubmissionException (with the BatchReport
+        as e.report) is raised if any failed.
+        If return_report is set, returns a BatchReport with per-job results and errors instead,
+        without raising."""
+        if sleep is not None:
+            rate = None
+        jobs = JobPacker().pack(input_json_list) if pack else input_json_list
+        submitter = BatchSubmitter(self, concurrency=concurrency, rate=rate, max_retries=max_retries)
+        report = submitter.submit(jobs, env=env, sfn=sfn, verbose=verbose, dryrun=dryrun,
+                                  sleep=sleep or 0)
+        if pack:
+            for res in report.results:
+                if isinstance(input_json_list[res.index], str):
+                    res.input_json = input_json_list[res.index]
+        if verbose:
+            logger.info("%d jobs submitted, %d failed (%.1f seconds)" %
+                        (len(report.succeeded), len(report.failed), report.elapsed))
+        for res in report.failed:
+            logger.error("failed submission %d (%s): %s" % (res.index, res.input_json or '', res.error))
+        if return_report:
+            return report
+        if report.failed:
+            raise BatchSubmissionException(report)
+        return report.run_infos
+
+    def plan(self, input_jsons, hours=1.0, concurrency=32, verbose=True):
+        """plan the instance types, EBS sizes and estimated costs of many jobs without submitting them.
+        input_jsons is a list of input json files or dictionaries, or a directory of input json files.
+        hours is the assumed run time of each job. Returns a PlanReport."""
+        report = Planner(hours=hours, concurrency=concurrency).plan(input_jsons)
+        if verbose:
+            totals = report.totals
+            logger.info("%d jobs planned, %d failed (%.1f seconds). Total estimated cost $%.2f for %s hour(s) per job" %
+                        (totals['n_planned'], totals['n_failed'], report.elapsed,
+                         totals['total_estimated_cost'], str(hours)))
+        return report
+
+    def build_resource_models(self, log_bucket=None, app_name=None, postrunjson_dir=None, output_dir=None,
+                              max_jobs=500, min_jobs=1, verbose=True):
+        """fit the resource models of apps on the metrics of their past jobs (see predictor).
+        The postrun jsons are read from postrunjson_dir if specified, or else from log_bucket
+        (the most recent max_jobs jobs). The models are saved in output_dir if specified, or else
+        in log_bucket, where they are used by the jobs that use benchmark.
+        Returns {app_name: ResourceModel}."""
+        if postrunjson_dir:
+            postrunjsons = [os.path.join(postrunjson_dir, f) for f in sorted(os.listdir(postrunjson_dir))
+                            if f.endswith('.postrun.json')]
+        elif log_bucket:
+            postrunjsons = read_postrunjsons(log_bucket, max_jobs=max_jobs)
+        else:
+            raise Exception("either log_bucket or postrunjson_dir must be specified")
+        if output_dir:
+            store = ModelStore(directory=output_dir)
+        elif log_bucket:
+            store = ModelStore(bucket=log_bucket, encrypt_s3_upload=bool(S3_ENCRYT_KEY_ID),
+                               kms_key_id=S3_ENCRYT_KEY_ID)
+        else:
+            raise Exception("either log_bucket or output_dir must be specified")
+        models = build_models(postrunjsons, app_name=app_name, min_jobs=min_jobs)
+        for model in models.values():
+            store.put(model)
+            if verbose:
+                logger.info("resource model of %s : %d jobs" % (model.app_name, model.n_jobs))
+        return models
 
     def check_status(self, exec_arn=None, job_id=None):
         """checking status of an execution.
@@ -288,6 +377,13 @@ class API(object):
         """
         return Job(exec_arn=exec_arn, job_id=job_id).check_output()
 
+    def check_jobs(self, jobs, log_bucket=None, concurrency=16):
+        """states of many jobs at once, with a few S3 listings of the log bucket and
+        describe_instances calls for the whole batch (see status_checker).
+        jobs is a list of job ids (with log_bucket) or of run_task outputs.
+        Returns {jobid: {'state':, 'instance_id':, 'instance_state':, 'markers':}}"""
+        return check_jobs(jobs, log_bucket=log_bucket, concurrency=concurrency)
+
     def info(self, job_id):
         '''returns content from dynamodb for a given job id in a dictionary form'''
         return Job.info(job_id)
@@ -303,7 +399,7 @@ class API(object):
         job = Job(exec_arn=exec_arn, job_id=job_id, sfn=sfn)
         if job.check_status() == 'RUNNING':
             # kill awsem ec2 instance
-            ec2 = boto3.client('ec2')
+            ec2 = get_client('ec2')
             res = ec2.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': ['awsem-' + job.job_id]}])
             if not res['Reservations']:
                 raise Exception("instance not available - if you just submitted the job, try again later")
@@ -317,11 +413,14 @@ class API(object):
                 put_object_s3('', job.job_id + '.aborted', job.log_bucket,
                               encrypt_s3_upload=True if S3_ENCRYT_KEY_ID else False,
                               kms_key_id=S3_ENCRYT_KEY_ID)
+                mark_job_aborted(job.log_bucket, job.job_id,
+                                 encrypt_s3_upload=True if S3_ENCRYT_KEY_ID else False,
+                                 kms_key_id=S3_ENCRYT_KEY_ID)
                 logger.info("Successfully sent abort signal")
             else:
                 # kill step function execution
                 logger.info("terminating step function execution")
-                sf = boto3.client('stepfunctions')
+                sf = get_client('stepfunctions')
                 resp_sf = sf.stop_execution(executionArn=job.exec_arn, error="Aborted")
                 logger.info("Successfully terminated step function execution: " + str(resp_sf))
 
@@ -329,7 +428,7 @@ class API(object):
         """killing all the running jobs"""
         if not sfn:
             sfn = self.default_stepfunction_name
-        client = boto3.client('stepfunctions')
+        client = get_client('stepfunctions')
         stateMachineArn = STEP_FUNCTION_ARN(sfn)
         res = client.list_executions(stateMachineArn=stateMachineArn, statusFilter='RUNNING')
         while True:
@@ -345,7 +444,7 @@ class API(object):
 
     def log(self, exec_arn=None, job_id=None, exec_name=None, sfn=None,
             postrunjson=False, runjson=False, top=False, top_latest=False,
-            inputjson=False, logbucket=None, quiet=False):
+            inputjson=False, status=False, logbucket=None, quiet=False):
         if postrunjson:
             suffix = '.postrun.json'
         elif runjson:
@@ -356,16 +455,18 @@ class API(object):
             suffix = '.top_latest'
         elif inputjson:
             suffix = '.input.json'
+        elif status:
+            suffix = '.status.json'
         else:
             suffix = '.log'
         if not sfn:
             sfn = self.default_stepfunction_name
-        sf = boto3.client('stepfunctions')
+        sf = get_client('stepfunctions')
         if not exec_arn and exec_name:
             exec_arn = EXECUTION_ARN(exec_name, sfn)
         job = Job(exec_arn=exec_arn, job_id=job_id, sfn=sfn)
         try:
-            res_s3 = boto3.client('s3').get_object(Bucket=job.log_bucket, Key=job.job_id + suffix)
+            res_s3 = get_client('s3').get_object(Bucket=job.log_bucket, Key=job.job_id + suffix)
         except Exception as e:
             if 'NoSuchKey' in str(e):
                 if not quiet:
@@ -378,6 +479,12 @@ class API(object):
             return(res_s3['Body'].read().decode('utf-8', 'backslashreplace'))
         return None
 
+    def job_status(self, job_id, sfn=None):
+        """the status document of a job written by the instance (phase, exit status, time stamps,
+        bytes downloaded/uploaded, last activity), or None if there is none (yet)"""
+        statusstr = self.log(job_id=job_id, sfn=sfn, status=True, quiet=True)
+        return json.loads(statusstr) if statusstr else None
+
     def stat(self, sfn=None, status=None, verbose=False, n=None, job_ids=None):
         """print out executions with details (-v)
         status can be one of 'RUNNING'|'SUCCEEDED'|'FAILED'|'TIMED_OUT'|'ABORTED'
@@ -390,15 +497,14 @@ class API(object):
         if status and job_ids:
             raise Exception("Status filter cannot be specified when job_ids are specified.")
         if verbose:
-            print("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}".format('jobid', 'status', 'name',
-                                                                      'execution_start_time', 'execution_stop_time',
-                                                                      'instance_id', 'instance_start_time', 'instance_type',
-                                                                      'instance_status', 'ip', 'key',
-                                                                      'password'))
+            print("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}".format('jobid', 'status', 'name',
+                                                                          'execution_start_time', 'execution_stop_time',
+                                                                          'instance_id', 'instance_start_time', 'instance_type',
+                                                                          'instance_status', 'job_phase', 'ip', 'key'))
         else:
             print("{}\t{}\t{}\t{}\t{}".format('jobid', 'status', 'name', 'execution_start_time', 'execution_stop_time'))
-        client = boto3.client('stepfunctions')
-        ec2 = boto3.client('ec2')
+        client = get_client('stepfunctions')
+        ec2 = get_client('ec2')
 
         def parse_exec_desc_and_ec2_desc(exec_arn, verbose, job_id=None):
             # collecting execution stats
@@ -443,12 +549,19 @@ class API(object):
                 password = '-'
 
             instance_start_time = '-'
+            job_phase = '-'
             if verbose and job_id:
                 try:
                     job = Job(exec_arn=exec_arn, job_id=job_id, sfn=self.default_stepfunction_name)
-                    # We use the creation date of <job_id>.job_started as proxy for the EC2 creation date
-                    res_s3 = boto3.client('s3').get_object(Bucket=job.log_bucket, Key=job.job_id + ".job_started")
-                    instance_start_time_ts = res_s3['LastModified'].timestamp()
+                    # the status document of the job has both the phase and the start time of the job
+                    job_status = read_job_status(job.log_bucket, job.job_id)
+                    if job_status and job_status.get('started_at'):
+                        job_phase = job_status['phase']
+                        instance_start_time_ts = PARSE_AWSEM_TIME(job_status['started_at']).timestamp()
+                    else:
+                        # We use the creation date of <job_id>.job_started as proxy for the EC2 creation date
+                        res_s3 = get_client('s3').get_object(Bucket=job.log_bucket, Key=job.job_id + ".job_started")
+                        instance_start_time_ts = res_s3['LastModified'].timestamp()
                     instance_start_time = datetime.fromtimestamp(instance_start_time_ts).strftime("%Y-%m-%d %H:%M")
                 except Exception as e:
                     instance_start_time = 'NA'
@@ -456,9 +569,9 @@ class API(object):
 
             parsed_stat = (job_id, status, name, execution_start_time, execution_stop_time,
                            instance_id, instance_start_time, instance_type, instance_status,
-                           instance_ip, keyname, password)
+                           job_phase, instance_ip, keyname, password)
             if verbose:
-                print("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}".format(*parsed_stat))
+                print("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}".format(*parsed_stat))
             else:
                 print("{}\t{}\t{}\t{}\t{}".format(*parsed_stat[0:5]))
 
@@ -500,7 +613,7 @@ class API(object):
 
     def list_sfns(self, numbers=False):
         """list all step functions, optionally with a summary (-n)"""
-        st = boto3.client('stepfunctions')
+        st = get_client('stepfunctions')
         res = st.list_state_machines(
             maxResults=1000
         )
@@ -549,7 +662,8 @@ class API(object):
     def rerun(self, exec_arn=None, job_id=None, sfn=None,
               override_config=None, app_name_filter=None,
               instance_type=None, shutdown_min=None, ebs_size=None, ebs_type=None, ebs_iops=None, ebs_throughput=None,
-              overwrite_input_extra=None, key_name=None, name=None, use_spot=None, do_not_use_spot=None):
+              overwrite_input_extra=None, key_name=None, name=None, use_spot=None, do_not_use_spot=None,
+              dd_writer=None):
         """rerun a specific job
         override_config : dictionary for overriding config (keys are the keys inside config)
             e.g. override_config = { 'instance_type': 't2.micro' }
@@ -561,7 +675,7 @@ class API(object):
         if not exec_arn and job_id:
             input_json_template = json.loads(self.log(job_id=job_id, inputjson=True))
         else:
-            client = boto3.client('stepfunctions')
+            client = get_client('stepfunctions')
             res = client.describe_execution(executionArn=exec_arn)
             input_json_template = json.loads(res['input'])
         # filter by app_name
@@ -602,7 +716,7 @@ class API(object):
         if override_config:
             for k, v in iter(override_config.items()):
                 input_json_template['config'][k] = v
-        return(self.run_workflow(input_json_template, sfn=sfn))
+        return(self.run_workflow(input_json_template, sfn=sfn, dd_writer=dd_writer))
 
     def rerun_many(self, sfn=None, stopdate='13Feb2018', stophour=13,
                    stopminute=0, offset=0, sleeptime=5, status='FAILED',
@@ -625,19 +739,20 @@ class API(object):
         stophour = stophour + offset
         stoptime = stopdate + ' ' + str(stophour) + ':' + str(stopminute)
         stoptime_in_datetime = datetime.strptime(stoptime, '%d%b%Y %H:%M').replace(tzinfo=timezone.utc)
-        client = boto3.client('stepfunctions')
+        client = get_client('stepfunctions')
         sflist = client.list_executions(stateMachineArn=STEP_FUNCTION_ARN(sfn), statusFilter=status)
         k = 0
-        for exc in sflist['executions']:
-            if exc['stopDate'].replace(tzinfo=None) > stoptime_in_datetime:
-                k = k + 1
-                self.rerun(exc['executionArn'], sfn=sfn,
-                           override_config=override_config, app_name_filter=app_name_filter,
-                           instance_type=instance_type, shutdown_min=shutdown_min, ebs_size=ebs_size,
-                           ebs_type=ebs_type, ebs_iops=ebs_iops, ebs_throughput=ebs_throughput,
-                           overwrite_input_extra=overwrite_input_extra, key_name=key_name, name=name,
-                           use_spot=use_spot, do_not_use_spot=do_not_use_spot)
-                time.sleep(sleeptime)
+        with dd_utils.BatchWriter(DYNAMODB_TABLE) as dd_writer:
+            for exc in sflist['executions']:
+                if exc['stopDate'].replace(tzinfo=None) > stoptime_in_datetime:
+                    k = k + 1
+                    self.rerun(exc['executionArn'], sfn=sfn,
+                               override_config=override_config, app_name_filter=app_name_filter,
+                               instance_type=instance_type, shutdown_min=shutdown_min, ebs_size=ebs_size,
+                               ebs_type=ebs_type, ebs_iops=ebs_iops, ebs_throughput=ebs_throughput,
+                               overwrite_input_extra=overwrite_input_extra, key_name=key_name, name=name,
+                               use_spot=use_spot, do_not_use_spot=do_not_use_spot, dd_writer=dd_writer)
+                    time.sleep(sleeptime)
 
     def env_list(self, name):
         # don't set this as a global, since not all tasks require it
@@ -661,7 +776,7 @@ class API(object):
             the sid: 'Allow use of the key'
         """
         # adjust KMS key policy to allow this role to use s3 key
-        kms_client = boto3.client('kms')
+        kms_client = get_client('kms')
         policy = kms_client.get_key_policy(KeyId=kms_key_id, PolicyName='default')
         policy = json.loads(policy['Policy'])
         for statement in policy['Statement']:
@@ -686,7 +801,7 @@ class API(object):
         if not S3_ENCRYT_KEY_ID:
             return
 
-        kms_client = boto3.client('kms')
+        kms_client = get_client('kms')
         policy = kms_client.get_key_policy(KeyId=S3_ENCRYT_KEY_ID, PolicyName='default')
         policy = json.loads(policy['Policy'])
         for statement in policy['Statement']:
@@ -742,7 +857,7 @@ class API(object):
 
         # add role
         logger.info('name=%s' % name)
-        role_arn_prefix = 'arn:aws:iam::' + AWS_ACCOUNT_NUMBER + ':role/'
+        role_arn_prefix = 'arn:aws:iam::' + config.aws_account_number + ':role/'
         role_arn = role_arn_prefix + tibanna_iam.role_name(name)
         logger.info("role_arn=" + role_arn)
         extra_config['Role'] = role_arn
@@ -754,13 +869,13 @@ class API(object):
         if name not in self.do_not_delete:
             try:
                 if quiet:
-                    res = boto3.client('lambda').get_function(FunctionName=full_function_name)
+                    res = get_client('lambda').get_function(FunctionName=full_function_name)
                     logger.info("deleting existing lambda")
-                    res = boto3.client('lambda').delete_function(FunctionName=full_function_name)
+                    res = get_client('lambda').delete_function(FunctionName=full_function_name)
                 else:
-                    boto3.client('lambda').get_function(FunctionName=full_function_name)
+                    get_client('lambda').get_function(FunctionName=full_function_name)
                     logger.info("deleting existing lambda")
-                    boto3.client('lambda').delete_function(FunctionName=full_function_name)
+                    get_client('lambda').delete_function(FunctionName=full_function_name)
             except Exception as e:
                 if 'Function not found' in str(e):
                     pass
@@ -798,7 +913,7 @@ class API(object):
         This function is called automatically by deploy_tibanna or deploy_unicorn
         Use it only when the IAM permissions need to be reset"""
         logger.info("setting up tibanna usergroup environment on AWS...")
-        if not AWS_ACCOUNT_NUMBER or not AWS_REGION:
+        if not config.aws_account_number or not config.aws_region:
             logger.info("Please set and export environment variable AWS_ACCOUNT_NUMBER and AWS_REGION!")
             exit(1)
         if not buckets:
@@ -812,7 +927,7 @@ class API(object):
         else:
             bucket_names = None
         if bucket_names and not do_not_delete_public_access_block:
-            client = boto3.client('s3')
+            client = get_client('s3')
             for b in bucket_names:
                 logger.info("Deleting public access block for bucket %s" % b)
                 try:
@@ -893,14 +1008,14 @@ class API(object):
         groupname_prefix = 'tibanna_'
         if self.lambda_type:
             groupname_prefix += self.lambda_type + '_'
-        boto3.client('iam').add_user_to_group(
+        get_client('iam').add_user_to_group(
             GroupName=groupname_prefix + usergroup,
             UserName=user
         )
 
     def users(self):
         """list all users along with their associated tibanna user groups"""
-        client = boto3.client('iam')
+        client = get_client('iam')
         marker = None
         while True:
             if marker:
@@ -921,10 +1036,12 @@ class API(object):
                 break
 
     def create_stepfunction(self, dev_suffix=None,
-                            region_name=AWS_REGION,
-                            aws_acc=AWS_ACCOUNT_NUMBER,
+                            region_name=None,
+                            aws_acc=None,
                             usergroup=None,
                             costupdater=False):
+        region_name = region_name or config.aws_region
+        aws_acc = aws_acc or config.aws_account_number
         if not aws_acc or not region_name:
             logger.info("Please set and export environment variable AWS_ACCOUNT_NUMBER and AWS_REGION!")
             exit(1)
@@ -934,7 +1051,7 @@ class API(object):
         else:
             sfndef = self.StepFunction(dev_suffix, region_name, aws_acc, usergroup)
         # if this encouters an existing step function with the same name, delete
-        sfn = boto3.client('stepfunctions', region_name=region_name)
+        sfn = get_client('stepfunctions', region_name=region_name)
         retries = 12  # wait 10 seconds between retries for total of 120s
         for i in range(retries):
             try:
@@ -973,35 +1090,45 @@ class API(object):
         return True if does_key_exist(log_bucket, job_id + '.metrics/lock', quiet=True) else False
 
     def plot_metrics(self, job_id, sfn=None, directory='.', open_browser=True, force_upload=False,
-                     update_html_only=False, endtime='', filesystem='/dev/nvme1n1', instance_id=''):
-        ''' retrieve instance_id and plots metrics '''
+                     update_html_only=False, endtime='', filesystem='/dev/nvme1n1', instance_id='', sidecar=False):
+        ''' retrieve instance_id and plots metrics
+        sidecar: if True, the tsv files of the report come with a binary copy (<file>.bin),
+                 read rather than the tsv files when the report data is generated again '''
         if not sfn:
             sfn = self.default_stepfunction_name
-        postrunjsonstr = self.log(job_id=job_id, sfn=sfn, postrunjson=True, quiet=True)
-        if postrunjsonstr:
-            postrunjson = AwsemPostRunJson(**json.loads(postrunjsonstr))
-            job = postrunjson.Job
-            if hasattr(job, 'end_time_as_datetime') and job.end_time_as_datetime:
-                job_complete = True
-            else:
-                job_complete = False
-            log_bucket = postrunjson.config.log_bucket
-            instance_type = job.instance_type or 'unknown'
+        job_status = self.job_status(job_id, sfn=sfn)
+        if job_status and job_status.get('instance_id') and job_status.get('started_at'):
+            # the status document of the job has all that is needed
+            job = None
+            log_bucket = job_status['log_bucket']
+            instance_type = job_status.get('instance_type') or 'unknown'
+            job_complete = job_status['phase'] in JOB_END_PHASES
         else:
-            runjsonstr = self.log(job_id=job_id, sfn=sfn, runjson=True, quiet=True)
-            job_complete = False
-            if runjsonstr:
-                runjson = AwsemRunJson(**json.loads(runjsonstr))
-                job = runjson.Job
-                log_bucket = runjson.config.log_bucket
-                instance_type = runjson.config.instance_type or 'unknown'
-                # Multiple types were specified, but the run json does not know which one was actually picked
-                # In this case we just show all of them in the metrics report
-                if isinstance(instance_type, list):
-                    instance_type = ','.join(instance_type)
+            postrunjsonstr = self.log(job_id=job_id, sfn=sfn, postrunjson=True, quiet=True)
+            if postrunjsonstr:
+                postrunjson = AwsemPostRunJson(**json.loads(postrunjsonstr))
+                job = postrunjson.Job
+                if hasattr(job, 'end_time_as_datetime') and job.end_time_as_datetime:
+                    job_complete = True
+                else:
+                    job_complete = False
+                log_bucket = postrunjson.config.log_bucket
+                instance_type = job.instance_type or 'unknown'
             else:
-                raise Exception("Neither postrun json nor run json can be retrieved." +
-                                "Check job_id or step function?")
+                runjsonstr = self.log(job_id=job_id, sfn=sfn, runjson=True, quiet=True)
+                job_complete = False
+                if runjsonstr:
+                    runjson = AwsemRunJson(**json.loads(runjsonstr))
+                    job = runjson.Job
+                    log_bucket = runjson.config.log_bucket
+                    instance_type = runjson.config.instance_type or 'unknown'
+                    # Multiple types were specified, but the run json does not know which one was actually picked
+                    # In this case we just show all of them in the metrics report
+                    if isinstance(instance_type, list):
+                        instance_type = ','.join(instance_type)
+                else:
+                    raise Exception("Neither postrun json nor run json can be retrieved." +
+                                    "Check job_id or step function?")
         # report already on s3 with a lock
         if self.check_metrics_plot(job_id, log_bucket) and \
            self.check_metrics_lock(job_id, log_bucket) and \
@@ -1012,49 +1139,57 @@ class API(object):
             if open_browser:
                 webbrowser.open(METRICS_URL(log_bucket, job_id))
             return None
-        # report not already on s3 with a lock
-        starttime = job.start_time_as_datetime
-        if not endtime:
-            if hasattr(job, 'end_time_as_datetime') and job.end_time_as_datetime:
-                endtime = job.end_time_as_datetime
-            else:
+        if job is None:
+            starttime = PARSE_AWSEM_TIME(job_status['started_at'])
+            if not endtime and job_status.get('ended_at'):
+                endtime = PARSE_AWSEM_TIME(job_status['ended_at'])
+            if not endtime:
                 endtime = datetime.now(timezone.utc)
-        if hasattr(job, 'filesystem') and job.filesystem:
-            filesystem = job.filesystem
+            filesystem = job_status.get('filesystem') or filesystem
+            instance_id = instance_id or job_status['instance_id']
         else:
-            filesystem = filesystem
-        if not instance_id:
-            if hasattr(job, 'instance_id') and job.instance_id:
-                instance_id = job.instance_id
+            starttime = job.start_time_as_datetime
+            if not endtime:
+                if hasattr(job, 'end_time_as_datetime') and job.end_time_as_datetime:
+                    endtime = job.end_time_as_datetime
+                else:
+                    endtime = datetime.now(timezone.utc)
+            if hasattr(job, 'filesystem') and job.filesystem:
+                filesystem = job.filesystem
             else:
-                ddres = dict()
-                try:
-                    dd = boto3.client('dynamodb')
-                    ddres = dd.query(TableName=DYNAMODB_TABLE,
-                                     KeyConditions={'Job Id': {'AttributeValueList': [{'S': job_id}],
-                                                               'ComparisonOperator': 'EQ'}})
-                except Exception as e:
-                    pass
-                if 'Items' in ddres:
-                    instance_id = ddres['Items'][0].get('instance_id', {}).get('S', '')
-                if not instance_id:
-                    ec2 = boto3.client('ec2')
-                    res = ec2.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': ['awsem-' + job_id]}])
-                    if res['Reservations']:
-                        instance_id = res['Reservations'][0]['Instances'][0]['InstanceId']
-                        instance_status = res['Reservations'][0]['Instances'][0]['State']['Name']
-                        if instance_status in ['terminated', 'shutting-down']:
-                            job_complete = True  # job failed
-                        else:
-                            job_complete = False  # still running
-                    else:
-                        # waiting 10 min to be sure the istance is starting
-                        if (datetime.now(timezone.utc) - starttime) / timedelta(minutes=1) < 5:
-                            raise Exception("the instance is still setting up. " +
-                                            "Wait a few seconds/minutes and try again.")
+                filesystem = filesystem
+            if not instance_id:
+                if hasattr(job, 'instance_id') and job.instance_id:
+                    instance_id = job.instance_id
+                else:
+                    ddres = dict()
+                    try:
+                        dd = get_client('dynamodb')
+                        ddres = dd.query(TableName=DYNAMODB_TABLE,
+                                         KeyConditions={'Job Id': {'AttributeValueList': [{'S': job_id}],
+                                                                   'ComparisonOperator': 'EQ'}})
+                    except Exception as e:
+                        pass
+                    if 'Items' in ddres:
+                        instance_id = ddres['Items'][0].get('instance_id', {}).get('S', '')
+                    if not instance_id:
+                        ec2 = get_client('ec2')
+                        res = ec2.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': ['awsem-' + job_id]}])
+                        if res['Reservations']:
+                            instance_id = res['Reservations'][0]['Instances'][0]['InstanceId']
+                            instance_status = res['Reservations'][0]['Instances'][0]['State']['Name']
+                            if instance_status in ['terminated', 'shutting-down']:
+                                job_complete = True  # job failed
+                            else:
+                                job_complete = False  # still running
                         else:
-                            raise Exception("instance id not available for this run. Try manually providing " + \
-                                            "it using the instance_id parameter (--instance-id option)")
+                            # waiting 10 min to be sure the istance is starting
+                            if (datetime.now(timezone.utc) - starttime) / timedelta(minutes=1) < 5:
+                                raise Exception("the instance is still setting up. " +
+                                                "Wait a few seconds/minutes and try again.")
+                            else:
+                                raise Exception("instance id not available for this run. Try manually providing " + \
+                                                "it using the instance_id parameter (--instance-id option)")
         # plotting
         if update_html_only:
             self.TibannaResource.update_html(log_bucket, job_id + '.metrics/')
@@ -1065,9 +1200,12 @@ class API(object):
                 if(cost_estimate == 0.0): # Cost estimate is not yet in tsv -> compute it
                     cost_estimate, cost_estimate_type = self.cost_estimate(job_id=job_id)
 
-                M = self.TibannaResource(instance_id, filesystem, starttime, endtime, cost_estimate = cost_estimate, cost_estimate_type=cost_estimate_type)
+                # the metrics retrieved by the previous report, if any
+                saved_store = self.TibannaResource.read_store(log_bucket, job_id + '.metrics/')
+                M = self.TibannaResource(instance_id, filesystem, starttime, endtime, cost_estimate = cost_estimate, cost_estimate_type=cost_estimate_type,
+                                         saved_store=saved_store)
                 top_content = self.log(job_id=job_id, top=True)
-                M.plot_metrics(instance_type, directory, top_content=top_content)
+                M.plot_metrics(instance_type, directory, top_content=top_content, sidecar=sidecar)
             except Exception as e:
                 raise MetricRetrievalException(e)
             # upload files
@@ -1132,7 +1270,7 @@ class API(object):
 
     def does_dynamo_table_exist(self, tablename):
         try:
-            res = boto3.client('dynamodb').describe_table(
+            res = get_client('dynamodb').describe_table(
                 TableName=tablename
             )
             if res:
@@ -1149,7 +1287,7 @@ class API(object):
         if self.does_dynamo_table_exist(tablename):
             logger.info("dynamodb table %s already exists. skip creating db" % tablename)
         else:
-            response = boto3.client('dynamodb').create_table(
+            response = get_client('dynamodb').create_table(
                 TableName=tablename,
                 AttributeDefinitions=[
                     {
@@ -1182,6 +1320,15 @@ class API(object):
             return True
         return False
 
+    def cleanup_launch_templates(self, older_than_hours=24, dryrun=False, verbose=True):
+        """delete the launch templates that no job has used for older_than_hours hours
+        and the old job-specific versions of the other launch templates.
+        Returns the list of deleted launch template names."""
+        deleted = cleanup_launch_templates(older_than_hours=older_than_hours, dryrun=dryrun)
+        if verbose:
+            logger.info("%s %d launch template(s)" % ('would delete' if dryrun else 'deleted', len(deleted)))
+        return deleted
+
     def cleanup(self, user_group_name, suffix='', ignore_errors=True, do_not_remove_iam_group=False,
                 purge_history=False, verbose=False):
 
@@ -1204,7 +1351,7 @@ class API(object):
         if verbose:
             logger.info("deleting step function %s" % sfn)
         try:
-            boto3.client('stepfunctions').delete_state_machine(stateMachineArn=STEP_FUNCTION_ARN(sfn))
+            get_client('stepfunctions').delete_state_machine(stateMachineArn=STEP_FUNCTION_ARN(sfn))
         except Exception as e:
             handle_error("Failed to cleanup step function: %s" % str(e))
 
@@ -1213,12 +1360,12 @@ class API(object):
             logger.info("deleting step function %s" % sfn_costupdater)
         try:
             # This does not produce an exception, if the step function does not exist
-            boto3.client('stepfunctions').delete_state_machine(stateMachineArn=STEP_FUNCTION_ARN(sfn_costupdater))
+            get_client('stepfunctions').delete_state_machine(stateMachineArn=STEP_FUNCTION_ARN(sfn_costupdater))
         except Exception as e:
             handle_error("Failed to cleanup step function: %s" % str(e))
 
         # delete lambdas
-        lambda_client = boto3.client('lambda')
+        lambda_client = get_client('lambda')
         for lmb in self.lambda_names:
             if verbose:
                 logger.info("deleting lambda functions %s" % lmb + lambda_suffix)
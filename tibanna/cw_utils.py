@@ -1,23 +1,41 @@
-import boto3, os
+import os
 from . import create_logger
+from .aws_utils import get_client
 from .utils import (
     upload,
     read_s3,
-    put_object_s3
+    put_object_s3,
+    does_key_exist
 )
 from .top import Top
+from .downsample import lttb
+from .columnar import write_table, read_table, read_sidecar, load_table, split_columns, TABLE_SIDECAR_SUFFIX
+from .metrics_store import (
+    MetricsStore,
+    get_metrics_store,
+    METRICS_FETCH_CONCURRENCY,
+    METRICS_STORE_FILENAME
+)
 from .vars import (
-    AWS_REGION,
+    config,
     METRICS_COLLECTION_INTERVAL,
     S3_ENCRYT_KEY_ID
 )
 from datetime import datetime, timezone, timedelta
+from array import array
 import json, math
 
 
 logger = create_logger(__name__)
 
 
+# files of the metrics report (besides metrics.html and the tsv files)
+METRICS_SUMMARY_FILENAME = 'metrics_summary.json'
+METRICS_DATA_FILENAME = 'metrics_data.json'
+# points of a series plotted in the metrics report (the tsv files have all of them)
+METRICS_REPORT_MAX_POINTS = 1000
+
+
 class TibannaResource(object):
     """class handling cloudwatch metrics for cpu / memory /disk space
     and top command metrics for cpu and memory per process.
@@ -30,14 +48,18 @@ class TibannaResource(object):
     def convert_timestamp_to_datetime(cls, timestamp):
         return datetime.strptime(timestamp, cls.timestamp_format).replace(tzinfo=timezone.utc)
 
-    def __init__(self, instance_id, filesystem, starttime, endtime=datetime.now(timezone.utc), cost_estimate = 0.0, cost_estimate_type = "NA"):
+    def __init__(self, instance_id, filesystem, starttime, endtime=datetime.now(timezone.utc), cost_estimate = 0.0, cost_estimate_type = "NA",
+                 concurrency=METRICS_FETCH_CONCURRENCY, saved_store=None):
         """All the Cloudwatch metrics are retrieved and stored at the initialization.
         :param instance_id: e.g. 'i-0167a6c2d25ce5822'
         :param filesystem: e.g. "/dev/xvdb", "/dev/nvme1n1"
+        :param concurrency: number of GetMetricData windows fetched at the same time (see metrics_store)
+        :param saved_store: metrics store saved by an earlier report (see read_store),
+                            only the metrics after its high-water mark are retrieved
         """
         self.instance_id = instance_id
         self.filesystem = filesystem
-        self.client = boto3.client('cloudwatch', region_name=AWS_REGION)
+        self.client = get_client('cloudwatch', region_name=config.aws_region)
         # get resource metrics
         nTimeChunks = (endtime - starttime) / timedelta(days=1)
         # self.total_minutes = (endtime - starttime) / timedelta(minutes=1)
@@ -54,66 +76,44 @@ class TibannaResource(object):
         self.list_files = []
         self.cost_estimate = cost_estimate
         self.cost_estimate_type = cost_estimate_type
+        self.concurrency = concurrency
+        self.starttime = starttime
+        self.endtime = endtime
+        # all the metrics of the run, shared with the other TibannaResource objects of the same instance
+        self.store = get_metrics_store(self.client, instance_id, starttime, endtime, concurrency=concurrency,
+                                       saved=saved_store)
         self.get_metrics(nTimeChunks)
 
     def get_metrics(self, nTimeChunks=1):
-        """calculate max/min metrics across all time chunks.
-        AWS allows only 1440 data points at a time
-        which corresponds to 24 hours at 1min interval,
-        so we have to split them into chunks.
+        """calculate max/min metrics across the whole run, from the metrics store.
+        (nTimeChunks is not used any more; kept for backward compatibility)
         """
-        max_mem_used_MB_chunks = []
-        min_mem_available_MB_chunks = []
-        max_cpu_utilization_percent_chunks = []
-        max_disk_space_utilization_percent_chunks = []
-        max_disk_space_used_GB_chunks = []
-        max_ebs_read_chunks = []
-        for i in range(0, nTimeChunks):
-            self.starttime = self.starttimes[i]
-            self.endtime = self.endtimes[i]
-            max_mem_used_MB_chunks.append(self.max_memory_used())
-            min_mem_available_MB_chunks.append(self.min_memory_available())
-            max_cpu_utilization_percent_chunks.append(self.max_cpu_utilization())
-            max_disk_space_utilization_percent_chunks.append(self.max_disk_space_utilization())
-            max_disk_space_used_GB_chunks.append(self.max_disk_space_used())
-            max_ebs_read_chunks.append(self.max_ebs_read())
-        self.max_mem_used_MB = self.choose_max(max_mem_used_MB_chunks)
-        self.min_mem_available_MB = self.choose_min(min_mem_available_MB_chunks)
+        summary = self.store.summary(self.starttime, self.endtime)
+        self.max_mem_used_MB = self.choose_max([summary['mem_used']['max']])
+        self.min_mem_available_MB = self.choose_min([summary['mem_available']['min']])
         if self.max_mem_used_MB and self.min_mem_available_MB!='':
             self.total_mem_MB = self.max_mem_used_MB + self.min_mem_available_MB
-            self.max_mem_utilization_percent = self.max_mem_used_MB / self.total_mem_MB * 100
+            self.max_mem_utilization_percent = summary['max_mem_utilization_percent']
         else:
             self.total_mem_MB = ''
             self.max_mem_utilization_percent = ''
-        self.max_cpu_utilization_percent = self.choose_max(max_cpu_utilization_percent_chunks)
-        self.max_disk_space_utilization_percent = self.choose_max(max_disk_space_utilization_percent_chunks)
-        self.max_disk_space_used_GB = self.choose_max(max_disk_space_used_GB_chunks)
+        self.max_cpu_utilization_percent = self.choose_max([summary['cpu_usage_active']['max']])
+        self.max_disk_space_utilization_percent = self.choose_max([summary['disk_used_percent']['max']])
+        self.max_disk_space_used_GB = self.choose_max([summary['disk_used']['max']])
         # this following one is used to detect file copying while CPU utilization is near zero
-        self.max_ebs_read_bytes = self.choose_max(max_ebs_read_chunks)
+        self.max_ebs_read_bytes = self.choose_max([summary['diskio_read_bytes']['max']])
 
-    def plot_metrics(self, instance_type, directory='.', top_content=''):
-        """plot full metrics across all time chunks.
-        AWS allows only 1440 data points at a time
-        which corresponds to 24 hours at 1min interval,
-        so we have to split them into chunks.
+    def plot_metrics(self, instance_type, directory='.', top_content='', sidecar=False):
+        """plot full metrics across the whole run, from the metrics store.
         :param top_content: content of the <job_id>.top in the str format, used for plotting top metrics.
+        :param sidecar: if True, the tsv files come with a binary copy (<file>.bin, see columnar)
         """
-        max_mem_utilization_percent_chunks_all_pts = []
-        max_mem_used_MB_chunks_all_pts = []
-        min_mem_available_MB_chunks_all_pts = []
-        max_cpu_utilization_percent_chunks_all_pts = []
-        max_disk_space_utilization_percent_chunks_all_pts = []
-        max_disk_space_used_GB_chunks_all_pts = []
-        for i in range(0, self.nTimeChunks):
-            self.starttime = self.starttimes[i]
-            self.endtime = self.endtimes[i]
-            # saving all points for the chunck
-            max_mem_utilization_percent_chunks_all_pts.append(self.max_memory_utilization_all_pts())
-            max_mem_used_MB_chunks_all_pts.append(self.max_memory_used_all_pts())
-            min_mem_available_MB_chunks_all_pts.append(self.min_memory_available_all_pts())
-            max_cpu_utilization_percent_chunks_all_pts.append(self.max_cpu_utilization_all_pts())
-            max_disk_space_utilization_percent_chunks_all_pts.append(self.max_disk_space_utilization_all_pts())
-            max_disk_space_used_GB_chunks_all_pts.append(self.max_disk_space_used_all_pts())
+        max_mem_utilization_percent_chunks_all_pts = [self.max_memory_utilization_all_pts()]
+        max_mem_used_MB_chunks_all_pts = [self.max_memory_used_all_pts()]
+        min_mem_available_MB_chunks_all_pts = [self.min_memory_available_all_pts()]
+        max_cpu_utilization_percent_chunks_all_pts = [self.max_cpu_utilization_all_pts()]
+        max_disk_space_utilization_percent_chunks_all_pts = [self.max_disk_space_utilization_all_pts()]
+        max_disk_space_used_GB_chunks_all_pts = [self.max_disk_space_used_all_pts()]
         # writing values as tsv
         input_dict ={
             'max_mem_used_MB': max_mem_used_MB_chunks_all_pts,
@@ -124,11 +124,15 @@ class TibannaResource(object):
             'max_cpu_utilization_percent': max_cpu_utilization_percent_chunks_all_pts
         }
 
-        self.list_files.extend(self.write_top_tsvs(directory, top_content))
-        self.list_files.append(self.write_tsv(directory, **input_dict))
+        tsv_files = self.write_top_tsvs(directory, top_content, sidecar=sidecar)
+        tsv_files.append(self.write_tsv(directory, sidecar=sidecar, **input_dict))
+        self.list_files.extend(tsv_files)
+        if sidecar:
+            self.list_files.extend(f + TABLE_SIDECAR_SUFFIX for f in tsv_files)
         self.list_files.append(self.write_metrics(instance_type, directory))
-        # writing html
-        self.list_files.append(self.write_html(instance_type, directory))
+        self.list_files.append(self.write_store(directory))
+        # writing html (the page goes last)
+        self.list_files.extend(self.write_html(instance_type, directory))
 
     def upload(self, bucket, prefix='', lock=True):
         logger.debug("list_files: " + str(self.list_files))
@@ -182,6 +186,8 @@ class TibannaResource(object):
         del(d['end'])
         del(d['nTimeChunks'])
         del(d['list_files'])
+        del(d['concurrency'])
+        del(d['store'])
         return(d)
 
     # def as_table(self):
@@ -212,118 +218,30 @@ class TibannaResource(object):
 
     # functions that returns all points
     def max_memory_utilization_all_pts(self):
-        res = self.client.get_metric_statistics(
-            Namespace='CWAgent',
-            MetricName='mem_used_percent',
-            Dimensions=[{
-                'Name': 'InstanceId', 'Value': self.instance_id
-            }],
-            Period=METRICS_COLLECTION_INTERVAL,
-            Statistics=['Maximum'],
-            StartTime=self.starttime,
-            EndTime=self.endtime,
-            Unit='Percent'
-        )
-        pts = [(r['Maximum'], r['Timestamp']) for r in res['Datapoints']]
-        return[p[0] for p in sorted(pts, key=lambda x: x[1])]
+        return self.metric_points('mem_used_percent')
 
     def max_memory_used_all_pts(self):
-        res = self.client.get_metric_statistics(
-            Namespace='CWAgent',
-            MetricName='mem_used',
-            Dimensions=[{
-                'Name': 'InstanceId', 'Value': self.instance_id
-            }],
-            Period=METRICS_COLLECTION_INTERVAL,
-            Statistics=['Maximum'],
-            StartTime=self.starttime,
-            EndTime=self.endtime,
-            Unit='Bytes'
-        )
-        pts = [(r['Maximum']/math.pow(1024, 2), r['Timestamp']) for r in res['Datapoints']] # get values in MB
-        return[p[0] for p in sorted(pts, key=lambda x: x[1])]
+        return self.metric_points('mem_used')  # MB
 
     def min_memory_available_all_pts(self):
-        res = self.client.get_metric_statistics(
-            Namespace='CWAgent',
-            MetricName='mem_available',
-            Dimensions=[{
-                'Name': 'InstanceId', 'Value': self.instance_id
-            }],
-            Period=METRICS_COLLECTION_INTERVAL,
-            Statistics=['Minimum'],
-            StartTime=self.starttime,
-            EndTime=self.endtime,
-            Unit='Bytes'
-        )
-        pts = [(r['Minimum']/math.pow(1024, 2), r['Timestamp']) for r in res['Datapoints']] # get values in MB
-        return[p[0] for p in sorted(pts, key=lambda x: x[1])]
+        return self.metric_points('mem_available')  # MB
 
     def max_cpu_utilization_all_pts(self):
-        res = self.client.get_metric_statistics(
-            Namespace='CWAgent',
-            MetricName='cpu_usage_active',
-            Dimensions=[{
-                'Name': 'InstanceId', 'Value': self.instance_id
-            }],
-            Period=METRICS_COLLECTION_INTERVAL,
-            Statistics=['Maximum'],
-            StartTime=self.starttime,
-            EndTime=self.endtime,
-            Unit='Percent'
-        )
-        pts = [(r['Maximum'], r['Timestamp']) for r in res['Datapoints']]
-        return[p[0] for p in sorted(pts, key=lambda x: x[1])]
+        return self.metric_points('cpu_usage_active')
 
     def max_disk_space_utilization_all_pts(self):
-        res = self.client.get_metric_statistics(
-            Namespace='CWAgent',
-            MetricName='disk_used_percent',
-            Dimensions=[{
-              'Name': 'InstanceId', 'Value': self.instance_id
-            }],
-            Period=METRICS_COLLECTION_INTERVAL,
-            Statistics=['Maximum'],
-            StartTime=self.starttime,
-            EndTime=self.endtime,
-            Unit='Percent'
-        )
-        pts = [(r['Maximum'], r['Timestamp']) for r in res['Datapoints']]
-        return[p[0] for p in sorted(pts, key=lambda x: x[1])]
+        return self.metric_points('disk_used_percent')
 
     def max_disk_space_used_all_pts(self):
-        res = self.client.get_metric_statistics(
-            Namespace='CWAgent',
-            MetricName='disk_used',
-            Dimensions=[{
-              'Name': 'InstanceId', 'Value': self.instance_id
-            }],
-            Period=METRICS_COLLECTION_INTERVAL,
-            Statistics=['Maximum'],
-            StartTime=self.starttime,
-            EndTime=self.endtime,
-            Unit='Bytes'
-        )
-        pts = [(r['Maximum']/math.pow(1024, 3), r['Timestamp']) for r in res['Datapoints']] # we want it in GB
-        return[p[0] for p in sorted(pts, key=lambda x: x[1])]
+        return self.metric_points('disk_used')  # GB
 
     def max_ebs_read_used_all_pts(self):
-        res = self.client.get_metric_statistics(
-            Namespace='CWAgent',
-            MetricName='diskio_read_bytes',
-            Dimensions=[{
-                'Name': 'InstanceId', 'Value': self.instance_id
-            }],
-            Period=METRICS_COLLECTION_INTERVAL,
-            Statistics=['Average'],
-            StartTime=self.starttime,
-            EndTime=self.endtime,
-            Unit='Bytes'
-        )
-        pts = [(r['Average'], r['Timestamp']) for r in res['Datapoints']]
-        return[p[0] for p in sorted(pts, key=lambda x: x[1])]
+        return self.metric_points('diskio_read_bytes')
+
+    def metric_points(self, metric_id):
+        """values of a metric between self.starttime and self.endtime, sorted by time"""
+        return self.store.values(metric_id, self.starttime, self.endtime)
 
-    
     @staticmethod
     def extract_metrics_data(file_contents):
       """
@@ -335,110 +253,112 @@ class TibannaResource(object):
       columns, data = [], {}
       columns_js, data_js = "[]", "[]"
 
-      for idx, line in enumerate(file_contents.rstrip().split('\n')):
-          if idx == 0:
-              for k,col in enumerate(line.split('\t')):
-                  columns.append(col)
-                  data[col] = []
-          else:
-              for k, col in enumerate(line.split('\t')):
+      header, cells = split_columns(file_contents.rstrip())
+      for col, values in zip(header, cells):
+          columns.append(col)
+          values = [v for v in values if v is not None]
+          try:
+              array('d', map(float, values)) # check if they're all numbers, still add them as strings though
+          except ValueError:
+              numbers = []
+              for v in values:
                   try:
-                      float(col) # check if it's a number, still add it as string though
-                      data[columns[k]].append(col)
+                      float(v)
+                      numbers.append(v)
                   except ValueError:
-                      logger.info("Cannot convert %s to float in column %s" % (col, columns[k]))
-                      continue
+                      logger.info("Cannot convert %s to float in column %s" % (v, col))
+              values = numbers
+          data[col] = values
 
       columns.pop(0) # Remove the 'interval' column
       if len(columns)>0:
-          columns_js = "["+(",".join(columns))+"]"
-          data_js = "["
-          for col in columns:
-              data_js += "[" + (",".join(data[col])) + "],"
-          data_js = data_js[:-1] # remove the last ,
-          data_js += "]"
+          columns_js = "[" + ",".join(columns) + "]"
+          data_js = "[" + ",".join("[" + ",".join(data[col]) + "]" for col in columns) + "]"
 
       return columns_js, columns, data_js, data
 
     @staticmethod
-    def format_metrics_tsv_data(metrics_data):
-        max_mem_used_MB = [str(k) for k in metrics_data['max_mem_used_MB']]
-        max_mem_used_MB_js = "[" + (",".join(max_mem_used_MB)) + "]"
-        min_mem_available_MB = [str(k) for k in metrics_data['min_mem_available_MB']]
-        min_mem_available_MB_js = "[" + (",".join(min_mem_available_MB)) + "]"
-        max_disk_space_used_GB = [str(k) for k in metrics_data['max_disk_space_used_GB']]
-        max_disk_space_used_GB_js = "[" + (",".join(max_disk_space_used_GB)) + "]"
+    def unquote(name):
+        """column name of a top tsv without its double quotes"""
+        if len(name) > 1 and name.startswith('"') and name.endswith('"'):
+            return name[1:-1].replace('""', '"')
+        return name
+
+    @staticmethod
+    def downsample_series(intervals, values, max_points=METRICS_REPORT_MAX_POINTS):
+        """[[interval, value]] of the points of a series kept by LTTB (points without a value are left out)"""
+        pts = [(x, y) for x, y in zip(intervals, values) if not math.isnan(y)]
+        kept = lttb([p[0] for p in pts], [p[1] for p in pts], max_points)
+        return [[pts[i][0], pts[i][1]] for i in kept]
 
-        max_mem_utilization_percent = [str(k) for k in metrics_data['max_mem_utilization_percent']]
-        max_mem_utilization_percent_js = "[" + (",".join(max_mem_utilization_percent)) + "]"
-        max_disk_space_utilization_percent = [str(k) for k in metrics_data['max_disk_space_utilization_percent']]
-        max_disk_space_utilization_percent_js = "[" + (",".join(max_disk_space_utilization_percent)) + "]"
-        max_cpu_utilization_percent = [str(k) for k in metrics_data['max_cpu_utilization_percent']]
-        max_cpu_utilization_percent_js = "[" + (",".join(max_cpu_utilization_percent)) + "]"
+    @classmethod
+    def downsample_top(cls, top_table, max_points=METRICS_REPORT_MAX_POINTS):
+        """the rows of a top table kept by LTTB over the total of the processes at each interval"""
+        names, intervals, data = top_table
+        columns = [[0 if math.isnan(v) else v for v in data[name]] for name in names]
+        totals = [sum(row) for row in zip(*columns)] if columns else [0] * len(intervals)
+        kept = lttb(intervals, totals, max_points)
+        return {'columns': [cls.unquote(name) for name in names],
+                'intervals': [intervals[i] for i in kept],
+                'data': [[column[i] for i in kept] for column in columns]}
+
+    @classmethod
+    def report_data(cls, metrics_table, top_cpu_table, top_mem_table, max_points=METRICS_REPORT_MAX_POINTS):
+        """content of metrics_data.json : the series of the report, downsampled to max_points each.
+        The tables are those of metrics.tsv, top_cpu.tsv and top_mem.tsv (see columnar.read_table),
+        which have the full resolution data."""
+        names, intervals, data = metrics_table
+        return {'interval': METRICS_COLLECTION_INTERVAL,
+                'n_intervals': len(intervals),
+                'metrics': {name: cls.downsample_series(intervals, data[name], max_points) for name in names},
+                'top_cpu': cls.downsample_top(top_cpu_table, max_points),
+                'top_mem': cls.downsample_top(top_mem_table, max_points)}
 
-        return (
-            max_mem_used_MB_js,
-            min_mem_available_MB_js,
-            max_disk_space_used_GB_js,
-            max_mem_utilization_percent_js,
-            max_disk_space_utilization_percent_js,
-            max_cpu_utilization_percent_js,
-        )
+    @staticmethod
+    def report_summary(title, instance_type, max_mem_used_MB, min_mem_available_MB, max_disk_space_used_GB,
+                       max_mem_utilization_percent, max_cpu_utilization_percent, max_disk_space_utilization_percent,
+                       cost, estimated_cost, cost_estimate_type, start_time, end_time, total_time):
+        """content of metrics_summary.json : the tables of the report (all the values as strings)"""
+        summary = {'title': title, 'instance_type': instance_type,
+                   'max_mem_used_MB': max_mem_used_MB, 'min_mem_available_MB': min_mem_available_MB,
+                   'max_disk_space_used_GB': max_disk_space_used_GB,
+                   'max_mem_utilization_percent': max_mem_utilization_percent,
+                   'max_cpu_utilization_percent': max_cpu_utilization_percent,
+                   'max_disk_space_utilization_percent': max_disk_space_utilization_percent,
+                   'cost': cost, 'estimated_cost': estimated_cost, 'cost_estimate_type': cost_estimate_type,
+                   'start_time': start_time, 'end_time': end_time, 'total_time': total_time}
+        return {k: str(v) for k, v in summary.items()}
 
     # functions to create reports and html
     def write_html(self, instance_type, directory):
+        """write the report : the page, its summary and its (downsampled) data.
+        metrics.tsv, top_cpu.tsv and top_mem.tsv must be in directory.
+        Returns the list of the files written."""
         self.check_mkdir(directory)
-        filename = directory + '/' + 'metrics.html'
         cost_estimate = '---' if self.cost_estimate == 0.0 else "{:.5f}".format(self.cost_estimate)
-        
-        metrics_contents = ""
-        with open(directory + '/' + 'metrics.tsv') as f:
-          metrics_contents = f.read()
-        (
-            metrics_col_js,
-            metrics_col,
-            metrics_data_js,
-            metrics_data,
-        ) = self.extract_metrics_data(metrics_contents)
-        
-        (
-          max_mem_used_MB_js,
-          min_mem_available_MB_js,
-          max_disk_space_used_GB_js,
-          max_mem_utilization_percent_js,
-          max_disk_space_utilization_percent_js,
-          max_cpu_utilization_percent_js,
-        ) = self.format_metrics_tsv_data(metrics_data)
-        
-        top_cpu_contents = ""
-        with open(directory + '/' + 'top_cpu.tsv') as f:
-          top_cpu_contents = f.read()
-        cpu_columns_js, cpu_columns, cpu_data_js, cpu_data = self.extract_metrics_data(top_cpu_contents)
-
-        top_mem_contents = ""
-        with open(directory + '/' + 'top_mem.tsv') as f:
-          top_mem_contents = f.read()
-        mem_columns_js, mem_columns, mem_data_js, mem_data = self.extract_metrics_data(top_mem_contents)
-
-        with open(filename, 'w') as fo:
-            fo.write(self.create_html() % (self.report_title, instance_type,
-                             str(self.max_mem_used_MB), str(self.min_mem_available_MB), str(self.max_disk_space_used_GB),
-                             str(self.max_mem_utilization_percent), str(self.max_cpu_utilization_percent),
-                             str(self.max_disk_space_utilization_percent),
-                             '---', # cost placeholder for now
-                             cost_estimate, self.cost_estimate_type,
-                             str(self.start), str(self.end), str(self.end - self.start),
-                             METRICS_COLLECTION_INTERVAL,
-                             max_mem_used_MB_js, min_mem_available_MB_js, max_disk_space_used_GB_js,
-                             max_mem_utilization_percent_js, max_disk_space_utilization_percent_js, max_cpu_utilization_percent_js,
-                             cpu_columns_js, cpu_data_js,
-                             mem_columns_js, mem_data_js
-                            )
-                    )
-        return(filename)
+        summary = self.report_summary(self.report_title, instance_type,
+                                      self.max_mem_used_MB, self.min_mem_available_MB, self.max_disk_space_used_GB,
+                                      self.max_mem_utilization_percent, self.max_cpu_utilization_percent,
+                                      self.max_disk_space_utilization_percent,
+                                      '---', # cost placeholder for now
+                                      cost_estimate, self.cost_estimate_type,
+                                      self.start, self.end, self.end - self.start)
+        data = self.report_data(*[load_table(directory + '/' + name)
+                                  for name in ['metrics.tsv', 'top_cpu.tsv', 'top_mem.tsv']])
+        files = []
+        for name, content in [(METRICS_SUMMARY_FILENAME, json.dumps(summary)),
+                              (METRICS_DATA_FILENAME, json.dumps(data, separators=(',', ':'))),
+                              ('metrics.html', self.create_html())]:
+            with open(directory + '/' + name, 'w') as fo:
+                fo.write(content)
+            files.append(directory + '/' + name)
+        return files
 
     @classmethod
     def update_html(cls, bucket, prefix, directory='.', upload_new=True):
+        """rewrite the summary of a report (e.g. with the cost, once it is known).
+        A report created before the summary and data were separated from the page
+        gets them, and the new page, as well."""
         # reading tabel parameters from metrics_report.tsv
         read_file = read_s3(bucket, os.path.join(prefix, 'metrics_report.tsv'))
         d = {} # read the values into d
@@ -460,87 +380,76 @@ class TibannaResource(object):
         cost_estimate_type = d['Estimated_Cost_Type'] if 'Estimated_Cost_Type' in d else "NA"
         instance = d['Instance_Type'] if 'Instance_Type' in d else '---'
 
-        metrics_contents = read_s3(bucket, os.path.join(prefix, 'metrics.tsv'))
-        (
-            metrics_col_js,
-            cpu_metrics_col,
-            metrics_data_js,
-            metrics_data,
-        ) = TibannaResource.extract_metrics_data(metrics_contents)
-        
-        (
-          max_mem_used_MB_js,
-          min_mem_available_MB_js,
-          max_disk_space_used_GB_js,
-          max_mem_utilization_percent_js,
-          max_disk_space_utilization_percent_js,
-          max_cpu_utilization_percent_js,
-        ) = TibannaResource.format_metrics_tsv_data(metrics_data)
-
-        top_cpu_contents = read_s3(bucket, os.path.join(prefix, 'top_cpu.tsv'))
-        cpu_columns_js, cpu_columns, cpu_data_js, cpu_data = TibannaResource.extract_metrics_data(top_cpu_contents)
-
-        top_mem_contents = read_s3(bucket, os.path.join(prefix, 'top_mem.tsv'))
-        mem_columns_js, mem_columns, mem_data_js, mem_data = TibannaResource.extract_metrics_data(top_mem_contents)
-
-        # writing
-        html_content = cls.create_html() % (cls.report_title, instance,
-                             d['Maximum_Memory_Used_Mb'], d['Minimum_Memory_Available_Mb'], d['Maximum_Disk_Used_Gb'],
-                             d['Maximum_Memory_Utilization'], d['Maximum_CPU_Utilization'], d['Maximum_Disk_Utilization'],
-                             cost,
-                             estimated_cost, cost_estimate_type,
-                             str(starttime), str(endtime), str(endtime-starttime),
-                             METRICS_COLLECTION_INTERVAL,
-                             max_mem_used_MB_js, min_mem_available_MB_js, max_disk_space_used_GB_js,
-                             max_mem_utilization_percent_js, max_disk_space_utilization_percent_js, max_cpu_utilization_percent_js,
-                             cpu_columns_js, cpu_data_js,
-                             mem_columns_js, mem_data_js
-                            )
-        s3_key = os.path.join(prefix, 'metrics.html')
-        if S3_ENCRYT_KEY_ID:
-            put_object_s3(content=html_content, key=s3_key, bucket=bucket,
-                          encrypt_s3_upload=True, kms_key_id=S3_ENCRYT_KEY_ID)
-        else:
-            put_object_s3(content=html_content, key=s3_key, bucket=bucket)
+        summary = cls.report_summary(cls.report_title, instance,
+                                     d['Maximum_Memory_Used_Mb'], d['Minimum_Memory_Available_Mb'], d['Maximum_Disk_Used_Gb'],
+                                     d['Maximum_Memory_Utilization'], d['Maximum_CPU_Utilization'], d['Maximum_Disk_Utilization'],
+                                     cost,
+                                     estimated_cost, cost_estimate_type,
+                                     starttime, endtime, endtime - starttime)
+        contents = [(METRICS_SUMMARY_FILENAME, json.dumps(summary))]
+        if not does_key_exist(bucket, os.path.join(prefix, METRICS_DATA_FILENAME), quiet=True):
+            data = cls.report_data(*[cls.read_table_s3(bucket, os.path.join(prefix, name))
+                                     for name in ['metrics.tsv', 'top_cpu.tsv', 'top_mem.tsv']])
+            contents.append((METRICS_DATA_FILENAME, json.dumps(data, separators=(',', ':'))))
+            contents.append(('metrics.html', cls.create_html()))
+        for name, content in contents:
+            s3_key = os.path.join(prefix, name)
+            if S3_ENCRYT_KEY_ID:
+                put_object_s3(content=content, key=s3_key, bucket=bucket,
+                              encrypt_s3_upload=True, kms_key_id=S3_ENCRYT_KEY_ID)
+            else:
+                put_object_s3(content=content, key=s3_key, bucket=bucket)
 
     @staticmethod
-    def write_top_tsvs(directory, top_content):
+    def write_top_tsvs(directory, top_content, sidecar=False):
         TibannaResource.check_mkdir(directory)
         top_obj = Top(top_content)
         top_obj.digest()
         cpu_filename = directory + '/' + 'top_cpu.tsv'
         mem_filename = directory + '/' + 'top_mem.tsv'
-        top_obj.write_to_csv(cpu_filename, delimiter='\t', metric='cpu', colname_for_timestamps='interval', base=1)
-        top_obj.write_to_csv(mem_filename, delimiter='\t', metric='mem', colname_for_timestamps='interval', base=1)
+        top_obj.write_to_csv(cpu_filename, delimiter='\t', metric='cpu', colname_for_timestamps='interval', base=1,
+                             sidecar=sidecar)
+        top_obj.write_to_csv(mem_filename, delimiter='\t', metric='mem', colname_for_timestamps='interval', base=1,
+                             sidecar=sidecar)
         return [cpu_filename, mem_filename]
 
-    def write_tsv(self, directory, **kwargs): # kwargs, key: (chunks_all_pts, interval), interval is 1 or 5 min
+    def write_tsv(self, directory, sidecar=False, **kwargs): # kwargs, key: chunks_all_pts
+        """write metrics.tsv (and its binary sidecar metrics.tsv.bin if sidecar)"""
         self.check_mkdir(directory)
         filename = directory + '/' + 'metrics.tsv'
-        with open(filename, 'w') as fo:
-            # preparing data and writing header
-            data_unpacked = []
-            for i, (key, arg) in enumerate(kwargs.items()):
-                if i == 0:
-                    fo.write('interval\t' + key)
-                else:
-                    fo.write('\t' + key)
-                tmp = []
-                [tmp.extend(a) for a in arg]
-                data_unpacked.append(tmp[:])
-                
-            fo.write('\n')
-            # writing table
-            for i in range(len(data_unpacked[0])):
-                fo.write(str(i + 1))
-                for data in data_unpacked:
-                    try:
-                        fo.write('\t' + str(data[i]))
-                    except:
-                        fo.write('\t' + '-')
-                fo.write('\n')
+        columns = [(key, [v for chunk in arg for v in chunk]) for key, arg in kwargs.items()]
+        intervals = range(1, len(columns[0][1]) + 1)
+        return write_table(filename, 'interval', intervals, columns, sidecar=sidecar)
+
+    def write_store(self, directory):
+        self.check_mkdir(directory)
+        filename = directory + '/' + METRICS_STORE_FILENAME
+        with open(filename, 'wb') as fo:
+            fo.write(self.store.to_bytes())
         return(filename)
 
+    @staticmethod
+    def read_store(bucket, prefix):
+        """metrics store saved with the report under prefix, or None"""
+        try:
+            res = get_client('s3').get_object(Bucket=bucket, Key=os.path.join(prefix, METRICS_STORE_FILENAME))
+            return MetricsStore.from_bytes(res['Body'].read())
+        except Exception as e:
+            logger.debug("no metrics store under %s : %s" % (prefix, str(e)))
+            return None
+
+    @staticmethod
+    def read_table_s3(bucket, key):
+        """table of a tsv file on s3 (see columnar.read_table), from its sidecar if it has one"""
+        try:
+            res = get_client('s3').get_object(Bucket=bucket, Key=key + TABLE_SIDECAR_SUFFIX)
+            table = read_sidecar(res['Body'].read())
+            if table:
+                return table
+        except Exception as e:
+            logger.debug("no sidecar for %s : %s" % (key, str(e)))
+        return read_table(read_s3(bucket, key))
+
     def write_metrics(self, instance_type, directory):
         self.check_mkdir(directory)
         filename = directory + '/' + 'metrics_report.tsv'
@@ -602,7 +511,7 @@ class TibannaResource(object):
                 }
                 table {
                   font-family: "Source Sans Pro", sans-serif;
-                  width: 40%%;
+                  width: 40%;
                   border-collapse: collapse;
                 }
                 .right {
@@ -629,11 +538,11 @@ class TibannaResource(object):
                 div {
                   display: block;
                   height: 500px;
-                  width: 100%%;
+                  width: 100%;
                 }
                 .logo {
                   max-height: 81px;
-                  width: 100%%;
+                  width: 100%;
                   background-color: #20445E;
                   display: flex;
                   align-items: center;
@@ -642,7 +551,7 @@ class TibannaResource(object):
                   margin-left: auto;
                   margin-right: auto;
                   height: auto;
-                  width: 85%%;
+                  width: 85%;
                   background-color: #2C6088;
                 }
                 .barplot {
@@ -701,7 +610,7 @@ class TibannaResource(object):
                 <!-- Body tag is where we will append our SVG and SVG objects-->
                 <body>
                     <div class="logo">
-                      <h1>%s</h1>
+                      <h1 id="title"></h1>
                     </div></br></br>
                   <section>
                     </br>
@@ -711,7 +620,7 @@ class TibannaResource(object):
                       </tr>
                       <tr>
                         <td class="left">EC2 Instance Type</td>
-                        <td class="center">%s</td>
+                        <td class="center" id="instance_type"></td>
                       </tr>
                     </table>
                     </br></br>
@@ -721,35 +630,35 @@ class TibannaResource(object):
                       </tr>
                       <tr>
                         <td class="left">Maximum Memory Used [Mb]</td>
-                        <td class="center">%s</td>
+                        <td class="center" id="max_mem_used_MB"></td>
                       </tr>
                       <tr>
                         <td class="left">Minimum Memory Available [Mb]</td>
-                        <td class="center">%s</td>
+                        <td class="center" id="min_mem_available_MB"></td>
                       </tr>
                       <tr>
                         <td class="left">Maximum Disk Used (/data1) [Gb]</td>
-                        <td class="center">%s</td>
+                        <td class="center" id="max_disk_space_used_GB"></td>
                       </tr>
                       <tr>
-                        <td class="left">Maximum Memory Utilization [%%]</td>
-                        <td class="center">%s</td>
+                        <td class="left">Maximum Memory Utilization [%]</td>
+                        <td class="center" id="max_mem_utilization_percent"></td>
                       </tr>
                       <tr>
-                        <td class="left">Maximum CPU Utilization [%%]</td>
-                        <td class="center">%s</td>
+                        <td class="left">Maximum CPU Utilization [%]</td>
+                        <td class="center" id="max_cpu_utilization_percent"></td>
                       </tr>
                       <tr>
-                        <td class="left">Maximum Disk Utilization (/data1) [%%]</td>
-                        <td class="center">%s</td>
+                        <td class="left">Maximum Disk Utilization (/data1) [%]</td>
+                        <td class="center" id="max_disk_space_utilization_percent"></td>
                       </tr>
                       <tr>
                         <td class="left">Cost</td>
-                        <td class="center">%s</td>
+                        <td class="center" id="cost"></td>
                       </tr>
                       <tr>
                         <td class="left">Cost (estimated) (USD)</td>
-                        <td class="center">%s (%s)</td>
+                        <td class="center"><span id="estimated_cost"></span> (<span id="cost_estimate_type"></span>)</td>
                       </tr>
                     </table>
                     </br></br>
@@ -760,11 +669,13 @@ class TibannaResource(object):
                         <th class="left">Total Time</th>
                       </tr>
                       <tr>
-                        <td class="left">%s</td>
-                        <td class="left">%s</td>
-                        <td class="left">%s</td>
+                        <td class="left" id="start_time"></td>
+                        <td class="left" id="end_time"></td>
+                        <td class="left" id="total_time"></td>
                       </tr>
                     </table>
+                    </br>
+                    <p class="center">Full resolution data : <a href="metrics.tsv">metrics.tsv</a>, <a href="top_cpu.tsv">top_cpu.tsv</a>, <a href="top_mem.tsv">top_mem.tsv</a></p>
                   </section>
                   </br></br>
                   <section>
@@ -813,8 +724,6 @@ class TibannaResource(object):
                 //  window.addEventListener('resize', onResize);
                 //}
 
-                const TIME_SCALING_FACTOR=Math.round(%s/60);
-
                 /* Functions definition */
                 function make_x_gridlines(x, n) {
                   var n_l = 0
@@ -844,7 +753,10 @@ class TibannaResource(object):
                   return d3.axisLeft(y)
                         .ticks(n_l)
                 }
-                function percent_plot(data_array, div) { // data_array = [data_mem, data_disk, data_cpu]
+                function as_minutes(points, minutes_per_interval) { // points = [[interval, y], ..]
+                  return points.map(function(p) { return [p[0] * minutes_per_interval, p[1]] })
+                }
+                function percent_plot(data_array, div, x_max) { // data_array = [data_mem, data_disk, data_cpu]
                   // Get div dimensions
                   var div_width = document.getElementById(div).offsetWidth
                     , div_height = document.getElementById(div).offsetHeight;
@@ -852,45 +764,23 @@ class TibannaResource(object):
                   var margin = {top: 40, right: 150, bottom: 100, left: 150}
                     , width = div_width - margin.left - margin.right // Use the window's width
                     , height = div_height - margin.top - margin.bottom; // Use the window's height
-                  // Dataset as y values
+                  // Dataset as [time (min), y] points
                   data_mem = data_array[0]
                   data_disk = data_array[1]
                   data_cpu = data_array[2]
-                  // The number of datapoints
-                  var n_data = data_mem.length;
-                  var n = 0
-                  if (n_data < 5) {
-                    n = 5
-                  } else {
-                    n = n_data
-                  }
-                  var n_cpu = data_cpu.length;
-                  // X scale will use the index of our data
+                  // X scale will use the time of our data
                   var xScale = d3.scaleLinear()
-                      .domain([0, TIME_SCALING_FACTOR * n]) // input
+                      .domain([0, x_max]) // input
                       .range([0, width]); // output
-                  // X scale for CPU utilization
-                  var xScale_cpu = d3.scaleLinear()
-                      .domain([0, TIME_SCALING_FACTOR * n_cpu]) // input
-                      .range([0, width*(n_cpu)/(n)]); // output
                   // Y scale will use the randomly generate number
                   var yScale = d3.scaleLinear()
                       .domain([0, 100]) // input
                       .range([height, 0]); // output
                   // d3's line generator
                   var line = d3.line()
-                      .x(function(d, i) { return TIME_SCALING_FACTOR * (xScale(i)+xScale(1)); }) // set the x values for the line generator
-                      .y(function(d) { return yScale(d.y); }) // set the y values for the line generator
+                      .x(function(d) { return xScale(d[0]); }) // set the x values for the line generator
+                      .y(function(d) { return yScale(d[1]); }) // set the y values for the line generator
                       //.curve(d3.curveMonotoneX) // apply smoothing to the line
-                  // d3's line generator for CPU utilization
-                  var line_cpu = d3.line()
-                      .x(function(d, i) { return TIME_SCALING_FACTOR * (xScale_cpu(i)+xScale_cpu(1)); }) // set the x values for the line generator
-                      .y(function(d) { return yScale(d.y); }) // set the y values for the line generator
-                      //.curve(d3.curveMonotoneX) // apply smoothing to the line
-                  // An array of objects of length N. Each object has key -> value pair, the key being "y" and the value is a random number
-                  var dataset_mem = d3.range(n_data).map(function(d) { return {"y": data_mem[d] } })
-                  var dataset_disk = d3.range(n_data).map(function(d) { return {"y": data_disk[d] } })
-                  var dataset_cpu = d3.range(n_cpu).map(function(d) { return {"y": data_cpu[d] } })
                   // Add the SVG to the page
                   var svg = d3.select("#" + div).append("svg")
                       .attr("width", width + margin.left + margin.right)
@@ -901,7 +791,7 @@ class TibannaResource(object):
                   svg.append("g")
                       .attr("class", "grid")
                       .attr("transform", "translate(0," + height + ")")
-                      .call(make_x_gridlines(xScale, n)
+                      .call(make_x_gridlines(xScale, x_max)
                           .tickSize(-height)
                           .tickFormat("")
                       )
@@ -923,22 +813,22 @@ class TibannaResource(object):
                       .call(d3.axisLeft(yScale)); // Create an axis component with d3.axisLeft
                   // Append the path, bind the data, and call the line generator
                   svg.append("path")
-                      .datum(dataset_mem) // Binds data to the line
+                      .datum(data_mem) // Binds data to the line
                       .attr("class", "line") // Assign a class for styling
                       .style("stroke", "blue")
                       .attr("d", line); // Calls the line generator
                   // Append the path, bind the data, and call the line generator
                   svg.append("path")
-                      .datum(dataset_disk) // Binds data to the line
+                      .datum(data_disk) // Binds data to the line
                       .attr("class", "line") // Assign a class for styling
                       .style("stroke", "green")
                       .attr("d", line); // Calls the line generator
                   // Append the path, bind the data, and call the line generator
                   svg.append("path")
-                      .datum(dataset_cpu) // Binds data to the line
+                      .datum(data_cpu) // Binds data to the line
                       .attr("class", "line") // Assign a class for styling
                       .style("stroke", "purple")
-                      .attr("d", line_cpu); // Calls the line generator
+                      .attr("d", line); // Calls the line generator
                   svg.append("text")
                       .attr("transform", "translate(" + (width / 2) + " ," + (height + margin.bottom - margin.bottom / 2) + ")")
                       .style("text-anchor", "middle")
@@ -949,9 +839,9 @@ class TibannaResource(object):
                       .attr("x",0 - (height / 2))
                       .attr("dy", "1em")
                       .style("text-anchor", "middle")
-                      .text('Percentage [%%]');
+                      .text('Percentage [%]');
                 }
-                function line_plot(data, div, axis_label) {
+                function line_plot(data, div, axis_label, x_max) { // data = [[time (min), y], ..]
                   // Get div dimensions
                   var div_width = document.getElementById(div).offsetWidth
                     , div_height = document.getElementById(div).offsetHeight;
@@ -959,29 +849,20 @@ class TibannaResource(object):
                   var margin = {top: 20, right: 150, bottom: 100, left: 150}
                     , width = div_width - margin.left - margin.right // Use the window's width
                     , height = div_height - margin.top - margin.bottom; // Use the window's height
-                  // The number of datapoints
-                  var n_data = data.length;
-                  var n = 0
-                  if (n_data < 5) {
-                    n = 5
-                  } else {
-                    n = n_data
-                  }
-                  // X scale will use the index of our data
+                  var y_max = d3.max(data, function(d) { return d[1]; })
+                  // X scale will use the time of our data
                   var xScale = d3.scaleLinear()
-                      .domain([0, TIME_SCALING_FACTOR * n]) // input
+                      .domain([0, x_max]) // input
                       .range([0, width]); // output
                   // Y scale will use the randomly generate number
                   var yScale = d3.scaleLinear()
-                      .domain([0, d3.max(data)]) // input
+                      .domain([0, y_max]) // input
                       .range([height, 0]); // output
                   // d3's line generator
                   var line = d3.line()
-                      .x(function(d, i) { return TIME_SCALING_FACTOR * (xScale(i)+xScale(1)); }) // set the x values for the line generator
-                      .y(function(d) { return yScale(d.y); }) // set the y values for the line generator
+                      .x(function(d) { return xScale(d[0]); }) // set the x values for the line generator
+                      .y(function(d) { return yScale(d[1]); }) // set the y values for the line generator
                       //.curve(d3.curveMonotoneX) // apply smoothing to the line
-                  // An array of objects of length N. Each object has key -> value pair, the key being "y" and the value is a random number
-                  var dataset = d3.range(n_data).map(function(d) { return {"y": data[d] } })
                   // Add the SVG to the page
                   var svg = d3.select("#" + div).append("svg")
                       .attr("width", width + margin.left + margin.right)
@@ -992,14 +873,14 @@ class TibannaResource(object):
                   svg.append("g")
                       .attr("class", "grid")
                       .attr("transform", "translate(0," + height + ")")
-                      .call(make_x_gridlines(xScale, n)
+                      .call(make_x_gridlines(xScale, x_max)
                           .tickSize(-height)
                           .tickFormat("")
                       )
                   // Add the Y gridlines
                   svg.append("g")
                       .attr("class", "grid")
-                      .call(make_y_gridlines(yScale, d3.max(data))
+                      .call(make_y_gridlines(yScale, y_max)
                           .tickSize(-width)
                           .tickFormat("")
                       )
@@ -1014,7 +895,7 @@ class TibannaResource(object):
                       .call(d3.axisLeft(yScale)); // Create an axis component with d3.axisLeft
                   // Append the path, bind the data, and call the line generator
                   svg.append("path")
-                      .datum(dataset) // Binds data to the line
+                      .datum(data) // Binds data to the line
                       .attr("class", "line") // Assign a class for styling
                       .attr("d", line); // Calls the line generator
                   svg.append("text")
@@ -1033,7 +914,7 @@ class TibannaResource(object):
                                       'pink', 'mediumslateblue', 'maroon', 'orange',
                                       'gray', 'palegreen', 'mediumvioletred', 'deepskyblue',
                                       'rosybrown', 'lightgrey', 'indigo', 'cornflowerblue']
-                function bar_plot(data_array, div, axis_label) {
+                function bar_plot(top, div, axis_label) { // top = {columns:, intervals:, data: [[y of the column at each interval], ..]}
                   // Get div dimensions
                   var div_width = document.getElementById(div).offsetWidth
                     , div_height = document.getElementById(div).offsetHeight;
@@ -1041,23 +922,24 @@ class TibannaResource(object):
                   var margin = {top: 20, right: 150, bottom: 100, left: 150}
                     , width = div_width - margin.left - margin.right // Use the window's width
                     , height = div_height - margin.top - margin.bottom; // Use the window's height
+                  var data_array = top.data
+                  var intervals = top.intervals
                   // number of different colors (also number of columns to visualize together)
                   var n_cols = data_array.length
                   // The number of datapoints
-                  var n_data = data_array[0].length;
-                  var n = 0
-                  if (n_data < 5) {
-                    n = 5
-                  } else {
-                    n = n_data
-                  }
+                  var n_data = intervals.length;
+                  var n = Math.max(n_data ? intervals[n_data - 1] : 0, 5)
                   // sum for each timepoint, to calculate y scale
-                  sum_array = d3.range(n_data).map(function(d) {
+                  var sum_array = d3.range(n_data).map(function(d) {
                       var sum = 0
-                      for( col=0; col<n_cols; col++) sum += data_array[col][d]
+                      for( var col=0; col<n_cols; col++) sum += data_array[col][d]
                       return sum
                   })
-                  // X scale will use the index of our data
+                  // each bar goes up to the next interval shown (the data may be downsampled)
+                  var bar_width = d3.range(n_data).map(function(d) {
+                      return (d + 1 < n_data ? intervals[d + 1] : intervals[d] + 1) - intervals[d]
+                  })
+                  // X scale will use the interval of our data
                   var xScale = d3.scaleLinear()
                       .domain([0, n]) // input
                       .range([0, width])  // output
@@ -1065,7 +947,6 @@ class TibannaResource(object):
                   var yScale = d3.scaleLinear()
                       .domain([0, d3.max(sum_array)]) // input
                       .range([height, 0]); // output
-                  // An array of objects of length N. Each object has key -> value pair, the key being "y" and the value is a random number
                   // Add the SVG to the page
                   var svg = d3.select("#" + div).append("svg")
                       .attr("width", width + margin.left + margin.right)
@@ -1096,28 +977,23 @@ class TibannaResource(object):
                   svg.append("g")
                       .attr("class", "y axis")
                       .call(d3.axisLeft(yScale)); // Create an axis component with d3.axisLeft
-                  // Add rectangles, bind the data
-                  var data_array_cum = data_array  // dimension and index 0 should be the same
+                  // Add rectangles, bind the data, each column stacked on the previous ones
+                  var prev_y = d3.range(n_data).map(function(d) { return 0 })
                   for( var col=0; col<n_cols; col++) {
-                      if(col == 0) {
-                          data_array_cum[col] = d3.range(n_data).map(function(d) { return data_array[col][d] })
-                          var dataset = d3.range(n_data).map(function(d) { return {"prev_y": 0, "y": data_array_cum[col][d]} })
-                      }
-                      if(col > 0) {
-                          data_array_cum[col] = d3.range(n_data).map(function(d) { return data_array_cum[col-1][d] + data_array[col][d] })
-                          var dataset = d3.range(n_data).map(function(d) { return {"prev_y": data_array_cum[col-1][d], "y": data_array_cum[col][d]} })
-                      }
-                      //var dataset = d3.range(n_data).map(function(d) { return {"dy": data_array[col][d], "y": data_array_cum[col][d]} })
-                      svg.selectAll(".bar")
+                      var dataset = d3.range(n_data).map(function(d) {
+                          return {"x": intervals[d], "width": bar_width[d], "prev_y": prev_y[d], "y": prev_y[d] + data_array[col][d]}
+                      })
+                      prev_y = dataset.map(function(d) { return d.y })
+                      svg.selectAll(".bar" + col)
                           .data(dataset)
                           .enter()
                           .append('rect')
                           .attr("class", "bar" + col)
                           .attr("fill", barplot_colors[col])
-                          .attr('x', function(d, i) { return xScale(i) + xScale(1) - xScale(0.5); })
+                          .attr('x', function(d) { return xScale(d.x - 0.5); })
                           .attr('y', function(d) { return yScale(d.y); })
                           .attr('height', function(d) { return yScale(d.prev_y) - yScale(d.y); })
-                          .attr('width', xScale(1));
+                          .attr('width', function(d) { return xScale(d.width); });
                   }
                   svg.append("text")
                       .attr("transform", "translate(" + (width / 2) + " ," + (height + margin.bottom - margin.bottom / 2) + ")")
@@ -1165,22 +1041,35 @@ class TibannaResource(object):
                   }
                 }
                 /* Reading data and Plotting */
-                line_plot(%s, 'chart_max_mem', 'Memory used [Mb]');
-                line_plot(%s, 'chart_min_mem', 'Memory available [Mb]');
-                line_plot(%s, 'chart_disk', 'Disk space used [Gb]');
+                // the summary and the data of the report are next to the page
+                var no_cache = '?t=' + Date.now()
+                d3.json('metrics_summary.json' + no_cache).then(function(summary) {
+                  for (var key in summary) {
+                    var elem = document.getElementById(key)
+                    if (elem) elem.textContent = summary[key]
+                  }
+                  document.title = summary.title
+                });
+                d3.json('metrics_data.json' + no_cache).then(function(data) {
+                  var minutes_per_interval = data.interval / 60
+                  var x_max = Math.max(data.n_intervals, 5) * minutes_per_interval
+                  var metrics = {}
+                  for (var key in data.metrics) metrics[key] = as_minutes(data.metrics[key], minutes_per_interval)
+                  line_plot(metrics.max_mem_used_MB || [], 'chart_max_mem', 'Memory used [Mb]', x_max);
+                  line_plot(metrics.min_mem_available_MB || [], 'chart_min_mem', 'Memory available [Mb]', x_max);
+                  line_plot(metrics.max_disk_space_used_GB || [], 'chart_disk', 'Disk space used [Gb]', x_max);
 
-                var resources_utilization = [%s, %s, %s];
-                percent_plot(resources_utilization, 'chart_percent');
+                  var resources_utilization = [metrics.max_mem_utilization_percent || [],
+                                               metrics.max_disk_space_utilization_percent || [],
+                                               metrics.max_cpu_utilization_percent || []];
+                  percent_plot(resources_utilization, 'chart_percent', x_max);
 
-                var cpu_columns = %s;
-                var cpu_data = %s;
-                bar_plot(cpu_data, 'bar_chart_cpu', 'Total CPU (%%) [100%% = 1 CPU]');
-                bar_plot_legend(cpu_columns, 'bar_chart_cpu_legend');
+                  bar_plot(data.top_cpu, 'bar_chart_cpu', 'Total CPU (%) [100% = 1 CPU]');
+                  bar_plot_legend(data.top_cpu.columns, 'bar_chart_cpu_legend');
 
-                var mem_columns = %s;
-                var mem_data = %s;
-                bar_plot(mem_data, 'bar_chart_mem', 'Total Mem (%% total available memory)');
-                bar_plot_legend(mem_columns, 'bar_chart_mem_legend');
+                  bar_plot(data.top_mem, 'bar_chart_mem', 'Total Mem (% total available memory)');
+                  bar_plot_legend(data.top_mem.columns, 'bar_chart_mem_legend');
+                });
 
                 </script>\
             """
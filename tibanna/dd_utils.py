@@ -1,5 +1,9 @@
-import boto3
+import random
+import threading
+import time
 from . import create_logger
+from .aws_utils import get_client
+from .vars import config
 
 
 logger = create_logger(__name__)
@@ -12,7 +16,7 @@ def item2dict(item):
 
 def does_dynamo_table_exist(tablename):
     try:
-        res = boto3.client('dynamodb').describe_table(
+        res = get_client('dynamodb').describe_table(
             TableName=tablename
         )
         if res:
@@ -30,7 +34,7 @@ def create_dynamo_table(tablename, keyname):
     if does_dynamo_table_exist(tablename):
         logger.info("dynamodb table %s already exists. skip creating db" % tablename)
     else:
-        response = boto3.client('dynamodb').create_table(
+        response = get_client('dynamodb').create_table(
             TableName=tablename,
             AttributeDefinitions=[
                 {
@@ -53,7 +57,7 @@ def get_items(table_name, primary_key, filter_key, filter_value, additional_keys
     return all the values of primary_key and additional_keys.
     in the format of a list of dictionaries containing
     primary_key: value1, additional_key1: value2, additional_key2: value3, ...'''
-    dd = boto3.client('dynamodb')
+    dd = get_client('dynamodb')
 
     if not additional_keys:
         additional_keys = []
@@ -84,11 +88,31 @@ def get_items(table_name, primary_key, filter_key, filter_value, additional_keys
     return entries
 
 
+def batch_get_items(table_name, primary_key, values, max_retries=8, base_delay=0.1):
+    '''the items whose primary_key is one of values (strings), 100 per batch_get_item call,
+    as a dictionary {value: item (as a regular dictionary)}. Missing items are skipped.'''
+    dd = get_client('dynamodb')
+    values = list(dict.fromkeys(values))
+    items = dict()
+    for i in range(0, len(values), 100):
+        request = {table_name: {'Keys': [{primary_key: {'S': v}} for v in values[i:i + 100]]}}
+        for attempt in range(max_retries + 1):
+            res = dd.batch_get_item(RequestItems=request)
+            for item in res.get('Responses', {}).get(table_name, []):
+                item = item2dict(item)
+                items[item[primary_key]] = item
+            request = res.get('UnprocessedKeys') or {}
+            if not request:
+                break
+            time.sleep(random.uniform(0, base_delay * 2 ** attempt))
+    return items
+
+
 def delete_items(table_name, primary_key, item_list, verbose=True):
     '''item_list is a list of dictionaries in the format of
     key1: value1, key2: value2, ...
     there has to be a primary key always.'''
-    dd = boto3.client('dynamodb')
+    dd = get_client('dynamodb')
     for item in item_list:
         res2 = dd.delete_item(
             TableName=table_name,
@@ -96,3 +120,109 @@ def delete_items(table_name, primary_key, item_list, verbose=True):
         )
     if verbose:
         logger.info("%d entries deleted from dynamodb." % len(item_list))
+
+
+class BatchWriter(object):
+    """buffered writer that puts items to a dynamoDB table with BatchWriteItem.
+    Items (dynamoDB-style dictionaries) are buffered and written in chunks of
+    batch_size (max 25, the BatchWriteItem limit). The buffer is also flushed
+    when an item has been waiting for more than max_delay seconds, so that the
+    entries are available soon after the jobs start. Unprocessed items are
+    retried with exponential backoff.
+    usage)
+      with BatchWriter(table_name) as writer:
+          writer.put(item)
+    """
+
+    def __init__(self, table_name, batch_size=25, max_delay=1.0, max_retries=8, base_delay=0.1):
+        self.table_name = table_name
+        self.batch_size = min(batch_size, 25)
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.n_written = 0
+        self.n_failed = 0
+        self._buffer = []
+        self._oldest = None
+        self._table_exists = None
+        self._lock = threading.Lock()  # protects the buffer
+        self._write_lock = threading.Lock()  # serializes writes
+        self._stop = threading.Event()
+        self._timer = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """start a background thread that flushes items waiting for more than max_delay seconds"""
+        if self.max_delay and not self._timer:
+            self._stop.clear()
+            self._timer = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._timer.start()
+
+    def close(self):
+        if self._timer:
+            self._stop.set()
+            self._timer.join()
+            self._timer = None
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._stop.wait(self.max_delay / 2):
+            with self._lock:
+                stale = self._oldest is not None and time.time() - self._oldest >= self.max_delay
+            if stale:
+                self.flush()
+
+    def put(self, item):
+        with self._lock:
+            self._buffer.append(item)
+            if self._oldest is None:
+                self._oldest = time.time()
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush(full_batches_only=True)
+
+    def flush(self, full_batches_only=False):
+        """write the buffered items, in chunks of batch_size"""
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    if not self._buffer or full_batches_only and len(self._buffer) < self.batch_size:
+                        break
+                    chunk = self._buffer[:self.batch_size]
+                    del self._buffer[:self.batch_size]
+                    self._oldest = time.time() if self._buffer else None
+                self._write(chunk)
+
+    def _write(self, items):
+        if self._table_exists is None:
+            try:
+                self._table_exists = does_dynamo_table_exist(self.table_name)
+            except Exception as e:
+                logger.error("Not adding to dynamo table: %s" % e)
+                self._table_exists = False
+        if not self._table_exists:
+            self.n_failed += len(items)
+            return
+        dd = get_client('dynamodb', region_name=config.aws_region)
+        requests = {self.table_name: [{'PutRequest': {'Item': item}} for item in items]}
+        for attempt in range(self.max_retries + 1):
+            try:
+                res = dd.batch_write_item(RequestItems=requests)
+            except Exception as e:
+                logger.error("Encountered exception writing a batch to dynamoDB: %s" % e)
+                res = {'UnprocessedItems': requests}
+            n_unprocessed = len(res.get('UnprocessedItems', {}).get(self.table_name, []))
+            self.n_written += len(requests[self.table_name]) - n_unprocessed
+            if not n_unprocessed:
+                return
+            requests = res['UnprocessedItems']
+            if attempt < self.max_retries:
+                time.sleep(random.uniform(0, self.base_delay * 2 ** attempt))
+        logger.error("%d items could not be added to dynamoDB" % n_unprocessed)
+        self.n_failed += n_unprocessed
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""downsampling of the series plotted in the metrics report.
+
+Largest-Triangle-Three-Buckets (LTTB, Steinarsson 2013) keeps the first and the
+last points and, for each of the buckets in between, the point that forms the
+largest triangle with the point kept in the previous bucket and the average of
+the next bucket. Unlike taking every n-th point, the peaks and drops of a
+series stay visible."""
+
+
+def lttb(xs, ys, threshold):
+    """indices of the (at most threshold) points of the series (xs, ys) kept by LTTB.
+    xs must be sorted."""
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    indices = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # the bucket of this point and the next bucket
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if end < next_end:
+            avg_x = sum(xs[end:next_end]) / (next_end - end)
+            avg_y = sum(ys[end:next_end]) / (next_end - end)
+        else:  # the next bucket is the last point
+            avg_x, avg_y = xs[n - 1], ys[n - 1]
+        ax, ay = xs[a], ys[a]
+        max_area = -1
+        for j in range(start, end):
+            # twice the area of the triangle (a, j, average of the next bucket)
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                a_next = j
+        indices.append(a_next)
+        a = a_next
+    indices.append(n - 1)
+    return indices
@@ -4,21 +4,18 @@ import time
 import os
 import base64
 import logging
-import boto3
-import botocore
 import copy
+import hashlib
 import re
-import random
-import string
 from . import create_logger
-from datetime import datetime, timedelta
+from .aws_utils import get_client
+from datetime import datetime, timedelta, timezone
 from .utils import (
     does_key_exist,
     create_jobid
 )
 from .vars import (
-    AWS_REGION,
-    S3_ACCESS_ARN,
+    config,
     TIBANNA_REPO_NAME,
     TIBANNA_REPO_BRANCH,
     AMI_PER_REGION,
@@ -27,6 +24,9 @@ from .vars import (
     TIBANNA_AWSF_DIR,
     DEFAULT_AWSF_IMAGE,
     S3_ENCRYT_KEY_ID,
+    LAUNCH_TEMPLATE_PREFIX,
+    LAUNCH_TEMPLATE_VERSION_MAX_AGE,
+    LAUNCH_TEMPLATE_VERSION_CLEANUP_INTERVAL
 )
 from .job import Jobs
 from .exceptions import (
@@ -40,15 +40,32 @@ from .exceptions import (
     UnsupportedCWLVersionException
 )
 from .base import SerializableObject
+from .instance_type_cache import (
+    InstanceTypeCache,
+    benchmark_instance_list,
+    PRICE_CACHE_PREFIX,
+    PRICE_CACHE_TTL
+)
+from .pricing_utils import get_ec2_prices, get_instance_price, rank_instance_types
+from .object_sizes import get_object_sizes, list_objects
+from .warm_pool import WarmPool, WARM_POOL_IDLE_MIN, is_compatible
+from .launch_plan import LaunchPlan, LAUNCH_RETRY_BUDGET
+from .predictor import get_resource_model, PREDICTION_MARGIN, PREDICTOR_MIN_JOBS
+from .launch_timer import LaunchTimer
+from .task_token import COMPLETION_CHECK_INTERVAL
+from .polling import POLL_MIN_INTERVAL, POLL_MAX_INTERVAL
 from .nnested_array import flatten, run_on_nested_arrays1
 from ._version import __version__
-from Benchmark import run as B
-from Benchmark.classes import get_instance_types, instance_list
-from Benchmark.byteformat import B2GB
 
 NONSPOT_EC2_PARAM_LIST = ['TagSpecifications', 'InstanceInitiatedShutdownBehavior',
                           'MaxCount', 'MinCount', 'DisableApiTermination']
 
+# a new instance may not be described right away : describe_instances is retried after
+# INSTANCE_INFO_BASE_DELAY seconds, doubled up to INSTANCE_INFO_MAX_DELAY, for up to INSTANCE_INFO_TIMEOUT seconds
+INSTANCE_INFO_BASE_DELAY = 0.5
+INSTANCE_INFO_MAX_DELAY = 4
+INSTANCE_INFO_TIMEOUT = 60
+
 
 logger = create_logger(__name__)
 
@@ -85,8 +102,10 @@ class UnicornInput(SerializableObject):
         cfg.fill_language_options(args.language, getattr(args, 'singularity', False))
         cfg.fill_other_fields(args.app_name)
         # sanity check
-        if args.app_name and args.app_name in B.app_name_function_map:
+        if args.app_name and args.app_name in benchmark_app_names():
             pass  # use benchmarking
+        elif args.app_name and cfg.use_benchmark and has_resource_model(cfg, args.app_name):
+            pass  # use the resource model of the past jobs of the app
         else:
             if not cfg.ebs_size:
                 cfg.ebs_size = 10  # if not set by user or benchmark, just use 10GB as default
@@ -327,6 +346,30 @@ class Config(SerializableObject):
             self.ebs_size_as_is = False
         if not hasattr(self, 'disable_metrics_collection'): 
             self.disable_metrics_collection = False
+        if not hasattr(self, 'call_cache'):  # reuse the outputs of an identical successful job
+            self.call_cache = False
+        if not hasattr(self, 'packed_jobs'):  # [{'jobid':, 'cpu':, 'mem':}] of the jobs sharing the instance
+            self.packed_jobs = []
+        if not hasattr(self, 'packed_into'):  # jobid of the job whose instance runs this job
+            self.packed_into = ''
+        if not hasattr(self, 'warm_pool'):  # name of the warm pool of instances to run this job
+            self.warm_pool = ''
+        if not hasattr(self, 'warm_pool_idle_min'):  # minutes an instance waits in the pool for a new job
+            self.warm_pool_idle_min = WARM_POOL_IDLE_MIN
+        if not hasattr(self, 'wait_for_completion_event'):  # the instance notifies the step function when the job ends
+            self.wait_for_completion_event = False
+        if not hasattr(self, 'completion_check_interval'):  # seconds between checks if no event arrives
+            self.completion_check_interval = COMPLETION_CHECK_INTERVAL
+        if not hasattr(self, 'poll_min_interval'):  # shortest interval (seconds) between two checks of the job
+            self.poll_min_interval = POLL_MIN_INTERVAL
+        if not hasattr(self, 'poll_max_interval'):  # longest interval (seconds) between two checks of the job
+            self.poll_max_interval = POLL_MAX_INTERVAL
+        if not hasattr(self, 'use_resource_model'):  # use the model of the past jobs of the app instead of Benchmark
+            self.use_resource_model = True
+        if not hasattr(self, 'prediction_margin'):  # safety margin of the resources predicted by the model
+            self.prediction_margin = PREDICTION_MARGIN
+        if not hasattr(self, 'instance_candidates'):  # [{'instance_type':, 'rank':, 'price':}], filled in later
+            self.instance_candidates = []
         if not hasattr(self, 'ami_id'):
             self.ami_id = "" # will be assigned instance architecture specific later
         if not hasattr(self, 'ami_per_region'):
@@ -359,42 +402,162 @@ class Config(SerializableObject):
 
 class Execution(object):
 
-    def __init__(self, input_dict, dryrun=False):
+    def __init__(self, input_dict, dryrun=False, launch_plan=None):
         self.dryrun = dryrun  # for testing purpose
+        self.timer = LaunchTimer()
+        self.run_json_pending = False  # the run json is uploaded while the launch template is created
+        self.launch_template_name = None
+        self.launch_template_version = '$Latest'
         self.unicorn_input = UnicornInput(input_dict)
         self.jobid = self.unicorn_input.jobid
         self.args = self.unicorn_input.args
         self.cfg = self.unicorn_input.cfg
 
+        # a previous run_task of the job could not launch an instance
+        self.resumed = launch_plan is not None
+        if self.resumed:
+            self.restore_launch_plan(launch_plan)
+            return
+        self.launch_plan = LaunchPlan(self.jobid)
+
         # get benchmark if available
-        self.input_size_in_bytes = self.get_input_size_in_bytes()
+        self.input_size_in_bytes = self.timer.timed('input_size', self.get_input_size_in_bytes)
         if self.cfg.use_benchmark:
-            self.benchmark = self.get_benchmarking(self.input_size_in_bytes)
+            self.benchmark = self.timer.timed('benchmark', self.get_benchmarking, self.input_size_in_bytes)
             logger.debug('self.benchmark = ' + str(self.benchmark))
         else:
             logger.debug('self.cfg.use_benchmark = ' + str(self.cfg.use_benchmark))
         logger.debug('self.cfg.as_dict() = ' + str(self.cfg.as_dict()))
-        self.create_instance_type_list()
+        self.timer.timed('instance_types', self.create_instance_type_list)
         self.update_config_ebs_size()
 
+    def restore_launch_plan(self, launch_plan):
+        """take the config, the candidate instance types and the run json from the launch plan
+        instead of sizing the inputs, running the benchmark and ranking the instance types"""
+        logger.info("resuming the launch of job %s after %d attempts" % (self.jobid, launch_plan.attempts))
+        self.launch_plan = launch_plan
+        self.cfg.update(launch_plan.config)
+        self.input_size_in_bytes = launch_plan.input_size_in_bytes or {}
+        self.instance_type_list = launch_plan.instance_type_list
+        self.instance_type_infos = launch_plan.instance_type_infos
+        self.instance_prices = launch_plan.instance_prices or {}
+        self.runjson = launch_plan.runjson
+
+    def save_launch_plan(self):
+        """save the launch plan for the next run_task of the job"""
+        if self.dryrun:
+            return
+        self.launch_plan.update(config=self.cfg.as_dict(), runjson=self.runjson,
+                                instance_type_list=self.instance_type_list,
+                                instance_type_infos=self.instance_type_infos,
+                                instance_prices=self.instance_prices,
+                                input_size_in_bytes=self.input_size_in_bytes)
+        try:
+            self.launch_plan.save(self.cfg.log_bucket, encrypt_s3_upload=self.cfg.encrypt_s3_upload,
+                                  kms_key_id=self.cfg.kms_key_id)
+        except Exception as e:
+            # the next run_task starts from scratch
+            logger.warning("cannot save the launch plan of job %s : %s" % (self.jobid, str(e)))
+
     @property
     def input_dict(self):
         return self.unicorn_input.as_dict()
 
     def prelaunch(self, profile=None):
-        self.check_dependency(**self.args.dependency)
-        runjson = self.create_run_json_dict()
-        self.upload_run_json(runjson)
-        self.userdata = self.create_userdata(profile=profile)
+        if self.resumed:
+            # the dependencies were checked and the run json was uploaded by a previous run_task
+            self.cached = False
+            self.userdata = self.create_userdata(profile=profile)
+            return
+        self.timer.timed('check_dependency', self.check_dependency, **self.args.dependency)
+        runjson = self.runjson = self.create_run_json_dict()
+        self.cached = False
+        if self.cfg.call_cache:
+            runjson['config']['call_cache_key'] = self.cfg.call_cache_key = self.call_cache.key(runjson)
+        if self.cfg.call_cache or self.packed or self.cfg.warm_pool:
+            # the job may run without a new instance, so the run json must be there now
+            self.timer.timed('upload_run_json', self.upload_run_json, runjson)
+        else:
+            self.run_json_pending = True
+        if self.cfg.call_cache:
+            self.cached = self.timer.timed('call_cache', self.reuse_cached_result, runjson)
+        if not self.cached and not self.packed:
+            self.userdata = self.create_userdata(profile=profile)
+
+    @property
+    def packed(self):
+        """True if this job runs on the instance of another job"""
+        return bool(self.cfg.packed_into)
 
     def launch(self):
-        self.instance_id = self.launch_and_get_instance_id()
-        self.cfg.update(self.get_instance_info())
-        self.add_instance_id_to_dynamodb()
+        if self.cached or self.packed:
+            # no instance is launched for a cached result or a packed job
+            self.instance_id = ''
+            self.cfg.update({'instance_id': '', 'instance_ip': '', 'availability_zone': '',
+                             'start_time': self.get_start_time()})
+            if self.packed and not self.dryrun:
+                # the job table tells which job's instance to check (see status_checker)
+                self.update_dynamodb(packed_into=self.cfg.packed_into)
+            return
+        self.launched_instance_type = ''
+        self.instance_id = self.timer.timed('warm_pool', self.hand_off_to_warm_pool) if self.cfg.warm_pool else ''
+        if not self.instance_id:
+            self.instance_id = self.launch_and_get_instance_id()
+        instance_info, _ = self.timer.concurrently(('get_instance_info', self.get_instance_info),
+                                                   ('update_dynamodb', self.add_instance_id_to_dynamodb))
+        self.cfg.update(instance_info)
+        self.cfg.update(self.get_instance_rank_and_price())
+        if self.resumed:
+            try:
+                self.timer.timed('delete_launch_plan', self.launch_plan.delete, self.cfg.log_bucket)
+            except Exception as e:
+                logger.warning("cannot delete the launch plan of job %s : %s" % (self.jobid, str(e)))
+
+    def get_instance_rank_and_price(self):
+        """rank (in config.instance_candidates) and hourly price of the instance type that was launched"""
+        for candidate in self.cfg.instance_candidates:
+            if candidate['instance_type'] == self.launched_instance_type:
+                price = candidate['price']
+                if self.instance_prices:
+                    # price in the availability zone of the instance, and on-demand after retry_without_spot
+                    price = get_instance_price(self.instance_prices.get(self.launched_instance_type),
+                                               self.cfg.spot_instance, self.cfg.availability_zone)
+                return {'instance_rank': candidate['rank'], 'instance_price': price}
+        return {}
+
+    def hand_off_to_warm_pool(self):
+        """hand the job to a compatible idle instance of the warm pool, if any.
+        Returns the instance id ('' if the job needs a new instance)"""
+        if self.dryrun:
+            return ''
+        pool = WarmPool(self.cfg.warm_pool, self.cfg.log_bucket,
+                        encrypt_s3_upload=self.cfg.encrypt_s3_upload, kms_key_id=self.cfg.kms_key_id)
+        try:
+            instance = pool.hand_off(self.jobid, lambda i: is_compatible(i, self.instance_type_list, self.cfg))
+        except Exception as e:
+            logger.warning("cannot use warm pool %s : %s" % (self.cfg.warm_pool, str(e)))
+            return ''
+        if not instance:
+            return ''
+        logger.info("job %s is handed to instance %s of warm pool %s" %
+                    (self.jobid, instance['instance_id'], self.cfg.warm_pool))
+        self.launched_instance_type = instance['instance_type']
+        return instance['instance_id']
 
     def postlaunch(self):
+        if self.cached or self.packed:
+            self.cfg.launch_timing = self.timer.as_dict()
+            return
         if self.cfg.cloudwatch_dashboard:
-            self.create_cloudwatch_dashboard('awsem-' + self.jobid)
+            self.timer.timed('cloudwatch_dashboard', self.create_cloudwatch_dashboard, 'awsem-' + self.jobid)
+        self.cfg.launch_timing = self.timer.as_dict()
+        logger.info("launch timing : " + json.dumps(self.cfg.launch_timing))
+        # record the launch timing and the chosen instance type in the run json
+        self.runjson['config'].update(launch_timing=self.cfg.launch_timing)
+        if getattr(self.cfg, 'instance_rank', None):
+            self.runjson['config'].update(instance_rank=self.cfg.instance_rank,
+                                          instance_price=self.cfg.instance_price)
+        self.upload_run_json(self.runjson)
 
     def create_instance_type_list(self):
         instance_type = self.cfg.instance_type
@@ -413,7 +576,8 @@ class Execution(object):
         # user specified mem and cpu - use the benchmark package to retrieve instance types
         elif self.cfg.mem and self.cfg.cpu:
             mem = self.cfg.mem if self.cfg.mem_as_is else self.cfg.mem + 1
-            list0 = get_instance_types(self.cfg.cpu, mem, instance_list(exclude_t=False))
+            from Benchmark.classes import get_instance_types
+            list0 = get_instance_types(self.cfg.cpu, mem, benchmark_instance_list())
             current_list = [i['instance_type'] for i in instance_type_dlist]
             nonredundant_list = [i for i in list0 if i['instance_type'] not in current_list]
             instance_type_dlist.extend(nonredundant_list)
@@ -423,20 +587,14 @@ class Execution(object):
             instance_type_dlist.append(self.benchmark)
 
         # Augment the list with the corresponding AMI ID and EBS_optimized flag
-        ec2 = boto3.client('ec2')
         current_instance_types = [i['instance_type'] for i in instance_type_dlist]
         ami_ebs_info = {}
-        results = ec2.describe_instance_types(
-            InstanceTypes=current_instance_types
-        )
-        for result in results['InstanceTypes']:
-            instance_type = result['InstanceType']
-            is_ebs_optimized = result['EbsInfo']['EbsOptimizedSupport'] != 'unsupported'
+        for instance_type, info in self.describe_instance_types(current_instance_types).items():
             ami_ebs_info[instance_type] = {
-                'EBS_optimized': is_ebs_optimized
+                'EBS_optimized': info['EBS_optimized']
             }
-            arch = result['ProcessorInfo']['SupportedArchitectures'][0]
-            default_ami = self.cfg.ami_per_region['Arm'].get(AWS_REGION, '') if arch == 'arm64' else self.cfg.ami_per_region['x86'].get(AWS_REGION, '')
+            arch = info['arch']
+            default_ami = self.cfg.ami_per_region['Arm'].get(config.aws_region, '') if arch == 'arm64' else self.cfg.ami_per_region['x86'].get(config.aws_region, '')
             if self.cfg.ami_id:
                 # if a user supplied an ami_id, it will be used for every instance. 
                 # will be problematic if the instance list contains x86 and Arm instances
@@ -445,7 +603,7 @@ class Execution(object):
             elif default_ami:
                 ami_ebs_info[instance_type]['ami_id'] = default_ami
             else:
-                raise Exception(f"No AMI found for {result['InstanceType']} ({arch}) in {AWS_REGION}")
+                raise Exception(f"No AMI found for {instance_type} ({arch}) in {config.aws_region}")
         for instance in instance_type_dlist:
             it = instance['instance_type']
             instance['ami_id'] = ami_ebs_info[it]['ami_id']
@@ -457,15 +615,42 @@ class Execution(object):
 
         if len(instance_type_dlist) == 0:
             raise Exception("There are no EC2 instances that match the provided configuration.")
-        
+
+        # rank the instance types chosen by mem and cpu by price, keep the order of the user otherwise
+        if not self.cfg.instance_type and self.cfg.mem and self.cfg.cpu:
+            self.instance_prices = self.get_instance_prices([i['instance_type'] for i in instance_type_dlist])
+            candidates = rank_instance_types(instance_type_dlist, self.cfg.cpu, mem, self.instance_prices,
+                                             self.cfg.spot_instance, self.cfg.availability_zone)
+            ranks = {c['instance_type']: c['rank'] for c in candidates}
+            instance_type_dlist.sort(key=lambda i: ranks[i['instance_type']])
+        else:
+            self.instance_prices = {}
+            candidates = [{'instance_type': i['instance_type'], 'rank': rank, 'price': None}
+                          for rank, i in enumerate(instance_type_dlist, 1)]
+        self.cfg.instance_candidates = candidates
+
         self.instance_type_list = [i['instance_type'] for i in instance_type_dlist]
         self.instance_type_infos = {i['instance_type']: i for i in instance_type_dlist}
 
+    def describe_instance_types(self, instance_types):
+        return instance_type_cache.describe(instance_types, config.aws_region, bucket=self.cfg.log_bucket,
+                                            encrypt_s3_upload=self.cfg.encrypt_s3_upload,
+                                            kms_key_id=self.cfg.kms_key_id)
+
+    def get_instance_prices(self, instance_types):
+        """price table of the instance types (see pricing_utils.get_ec2_prices), empty in dryrun"""
+        if self.dryrun:
+            return {}
+        return instance_price_cache.describe(instance_types, config.aws_region, bucket=self.cfg.log_bucket,
+                                             encrypt_s3_upload=self.cfg.encrypt_s3_upload,
+                                             kms_key_id=self.cfg.kms_key_id)
+
     @property
     def total_input_size_in_gb(self):
         if not hasattr(self, 'input_size_in_bytes'):
             raise Exception("Cannot calculate total input size " +
                             "- run get_input_size_in_bytes() first")
+        from Benchmark.byteformat import B2GB
         try:
             return B2GB(sum([sum(flatten([v])) for s, v in self.input_size_in_bytes.items()]))
         except:
@@ -500,19 +685,33 @@ class Execution(object):
             secondary_files_as_input = {k+'_secondary': v for k, v in self.args.secondary_files.items()
                                         if is_not_empty(v['object_key'])}
             input_plus_secondary_files.update(secondary_files_as_input)
+        # all the sizes are retrieved at once (in parallel)
+        objects = [(f['bucket_name'], key) for f in input_plus_secondary_files.values()
+                   for key in flatten([f['object_key']])]
+        sizes = self.get_file_sizes(objects)
         for argname, f in iter(input_plus_secondary_files.items()):
             bucket = f['bucket_name']
             if isinstance(f['object_key'], list):
                 size = flatten(run_on_nested_arrays1(f['object_key'],
-                                                     get_file_size,
-                                                     **{'bucket': bucket}))
+                                                     lambda key: sizes[(bucket, key)]))
             else:
-                size = get_file_size(f['object_key'], bucket)
+                size = sizes[(bucket, f['object_key'])]
             input_size_in_bytes.update({str(argname): size})
         logger.debug(str({"input_size_in_bytes": input_size_in_bytes}))
         return input_size_in_bytes
 
+    def get_file_sizes(self, objects):
+        """{(bucket, key): size} for a list of (bucket, key)"""
+        return get_object_sizes(objects)
+
+    def get_file_size(self, key, bucket):
+        return get_file_size(key, bucket)
+
     def get_benchmarking(self, input_size_in_bytes):
+        prediction = self.predict_resources()
+        if prediction:
+            return prediction
+        from Benchmark import run as B
         benchmark_parameters = copy.deepcopy(self.args.input_parameters)
         benchmark_parameters.update(self.args.additional_benchmarking_parameters)
         try:
@@ -532,22 +731,72 @@ class Execution(object):
         else:
             return {'instance_type': '', 'EBS_optimized': '', 'ebs_size': 0}
 
+    def get_resource_model(self, app_name):
+        return get_resource_model(self.cfg.log_bucket, app_name)
+
+    def predict_resources(self):
+        """resources of the job predicted by the model of the past jobs of the app (see predictor),
+        in the format of get_benchmarking. cpu and mem (if neither instance_type nor cpu and mem are given)
+        and ebs_throughput (if not given) are set in the config. None if there is no usable model."""
+        if not self.cfg.use_resource_model or not self.args.app_name:
+            return None
+        input_size_in_gb = self.total_input_size_in_gb
+        if input_size_in_gb is None:
+            return None
+        try:
+            model = self.get_resource_model(self.args.app_name)
+        except Exception as e:
+            logger.warning("cannot read the resource model of %s : %s" % (self.args.app_name, str(e)))
+            return None
+        if not model or model.n_jobs < PREDICTOR_MIN_JOBS:
+            return None
+        prediction = model.predict(input_size_in_gb, margin=self.cfg.prediction_margin)
+        logger.info("resources predicted from %d jobs of %s : %s" % (model.n_jobs, self.args.app_name, prediction))
+        if not self.cfg.instance_type and not (self.cfg.cpu and self.cfg.mem):
+            if not prediction['cpu'] or not prediction['mem']:
+                return None
+            self.cfg.cpu, self.cfg.mem = prediction['cpu'], prediction['mem']
+        if prediction['ebs_throughput'] and not self.cfg.ebs_throughput and self.cfg.ebs_type == 'gp3':
+            self.cfg.ebs_throughput = prediction['ebs_throughput']
+        self.cfg.resource_prediction = dict(prediction, input_gb=input_size_in_gb, n_jobs=model.n_jobs,
+                                            margin=self.cfg.prediction_margin)
+        return {'instance_type': '', 'EBS_optimized': '', 'ebs_size': prediction['ebs_size'] or 0}
+
     def get_start_time(self):
         return time.strftime("%Y%m%d-%H:%M:%S-%Z")
 
     def launch_and_get_instance_id(self):
-        os.environ['AWS_DEFAULT_REGION'] = AWS_REGION 
-        invalid_launch_template_retries = 0
-
-        self.create_launch_template()
+        os.environ['AWS_DEFAULT_REGION'] = config.aws_region 
+        self.launch_deadline = time.time() + LAUNCH_RETRY_BUDGET
+
+        # the instance reads the run json, which is uploaded while the launch template is created
+        phases = [('create_launch_template', self.create_launch_template)]
+        if self.run_json_pending:
+            phases.append(('upload_run_json', lambda: self.upload_run_json(self.runjson)))
+        self.timer.concurrently(*phases)
+        self.run_json_pending = False
+        try:
+            return self.create_fleet_until_launched()
+        finally:
+            # the version has the user data of the job, which may include credentials
+            self.timer.timed('delete_launch_template_version', self.delete_launch_template_version)
 
+    def create_fleet_until_launched(self):
+        invalid_launch_template_retries = 0
         while True:
-            fleet_result = self.create_fleet()
+            if not self.fleet_overrides():
+                # all the (instance type, subnet) pairs recently had no capacity
+                if not self.wait_for_capacity():
+                    self.save_launch_plan()
+                    raise EC2InstanceLimitWaitException("Instance limit exception - no capacity for any of the "
+                                                        "instance types - wait and retry later.")
+                continue
+            fleet_result = self.timer.timed('create_fleet', self.create_fleet)
             logger.info(f"Result from create_fleet command: {json.dumps(fleet_result)}")
             
             if 'Instances' in fleet_result and len(fleet_result['Instances']) > 0:
-                self.delete_launch_template()
                 instance_id = fleet_result['Instances'][0]['InstanceIds'][0]
+                self.launched_instance_type = fleet_result['Instances'][0].get('InstanceType', '')
                 return instance_id
             
             elif 'Errors' in fleet_result and len(fleet_result['Errors']) > 0:
@@ -557,7 +806,7 @@ class Execution(object):
 
                 num_unique_errors = len(set(error_codes))
 
-                self.delete_fleet(fleet_result['FleetId'])
+                self.timer.timed('delete_fleet', self.delete_fleet, fleet_result['FleetId'])
 
                 if 'InvalidLaunchTemplate' in error_codes and invalid_launch_template_retries < 5:
                     invalid_launch_template_retries += 1
@@ -566,31 +815,30 @@ class Execution(object):
                     continue
 
                 elif 'InvalidLaunchTemplate' in error_codes and invalid_launch_template_retries >= 5:
-                    self.delete_launch_template()
                     raise Exception(f"InvalidLaunchTemplate. Result from create_fleet command: {json.dumps(fleet_result)}")
 
                 elif num_unique_errors == 1 and 'InvalidFleetConfiguration' in error_codes:
                     # This error code includes the "Your requested instance type (xxx) is not supported in your requested Availability Zone (xxx)" error
                     # In this case there must be an issue with the general setup, otherwise we would get additional error codes, e.g., InsufficientInstanceCapacity
-                    self.delete_launch_template()
                     raise Exception(f"Invalid fleet configuration. Result from create_fleet command: {json.dumps(fleet_result)}")
                 
                 elif 'InsufficientInstanceCapacity' in error_codes or 'InstanceLimitExceeded' in error_codes or 'UnfulfillableCapacity' in error_codes:
                     # We ignore the 'InvalidFleetConfiguration' error here
                     behavior = self.cfg.behavior_on_capacity_limit
                     if behavior == 'fail':
-                        self.delete_launch_template()
                         msg = "Instance limit exception - use 'behavior_on_capacity_limit' option to change the behavior to wait_and_retry, or retry_without_spot. Errors: "
                         msg += "; ".join(error_msgs)
                         raise EC2InstanceLimitException(msg)
                     elif behavior == 'wait_and_retry' or behavior == 'other_instance_types': # 'other_instance_types' is there for backwards compatibility
-                        self.delete_launch_template()
+                        excluded = self.exclude_pairs_without_capacity(fleet_result['Errors'])
+                        if self.wait_for_capacity(rotate=excluded):
+                            continue
+                        self.save_launch_plan()
                         msg = "Instance limit exception - wait and retry later. Errors: "
                         msg += "; ".join(error_msgs)
                         raise EC2InstanceLimitWaitException(msg)
                     elif behavior == 'retry_without_spot':
                         if not self.cfg.spot_instance:
-                            self.delete_launch_template()
                             msg = "'behavior_on_capacity_limit': 'retry_without_spot' works only with 'spot_instance' : true. Errors: "
                             msg += "; ".join(error_msgs)
                             raise Exception(msg)
@@ -600,17 +848,51 @@ class Execution(object):
                             # to avoid 'retry_without_spot works only with spot' error in the next round
                             self.cfg.behavior_on_capacity_limit = 'fail'
                             logger.info("trying without spot...")
+                            # the launch template of on-demand instances has no spot options
+                            self.timer.timed('delete_launch_template_version', self.delete_launch_template_version)
+                            self.timer.timed('create_launch_template', self.create_launch_template)
                             continue
 
                 else:
-                    self.delete_launch_template()
                     raise Exception(f"Unexpected result from create_fleet command: {json.dumps(fleet_result)}")
 
             else:
-                self.delete_launch_template()
-                self.delete_fleet(fleet_result['FleetId'])
+                self.timer.timed('delete_fleet', self.delete_fleet, fleet_result['FleetId'])
                 raise Exception(f"Unexpected result from create_fleet command: {json.dumps(fleet_result)}")
 
+    def exclude_pairs_without_capacity(self, errors):
+        """temporarily exclude the (instance type, subnet) pairs of the InsufficientInstanceCapacity errors
+        of create_fleet. Other capacity errors (e.g. the vCPU limit of the account) only cause a wait.
+        Returns the number of pairs that were excluded."""
+        self.launch_plan.attempts += 1
+        excluded = 0
+        for error in errors:
+            if error.get('ErrorCode') != 'InsufficientInstanceCapacity':
+                continue
+            overrides = error.get('LaunchTemplateAndOverrides', {}).get('Overrides', {})
+            if overrides.get('InstanceType'):
+                logger.info("no capacity for %s in %s" % (overrides['InstanceType'],
+                                                          overrides.get('SubnetId') or 'any subnet'))
+                self.launch_plan.exclude(overrides['InstanceType'], overrides.get('SubnetId', ''))
+                excluded += 1
+        return excluded
+
+    def wait_for_capacity(self, rotate=False):
+        """wait before the next launch attempt (decorrelated jitter), or not at all if pairs without
+        capacity were just excluded (rotate) and other pairs are left. Returns False without waiting
+        if all the pairs are excluded or if the launch would not be retried before the retry budget
+        of this run_task is spent : the step function retries run_task later."""
+        if not self.fleet_overrides():
+            return False
+        if rotate:
+            return True
+        delay = self.launch_plan.next_delay()
+        if time.time() + delay > self.launch_deadline:
+            return False
+        logger.info("retrying the launch in %d seconds" % delay)
+        self.timer.timed('wait_for_capacity', time.sleep, delay)
+        return True
+
     def create_run_json_dict(self):
         args = self.args
         cfg = self.cfg
@@ -717,7 +999,7 @@ class Execution(object):
             if self.cfg.kms_key_id:
                 upload_args['SSEKMSKeyId'] = self.cfg.kms_key_id
         try:
-            s3 = boto3.client('s3')
+            s3 = get_client('s3')
         except Exception as e:
             raise Exception("boto3 client error: Failed to connect to s3 : %s" % str(e))
         try:
@@ -725,6 +1007,24 @@ class Execution(object):
         except Exception as e:
             raise Exception("boto3 client error: Failed to upload run.json %s to s3: %s" % (jsonkey, str(e)))
 
+    @property
+    def call_cache(self):
+        from .call_cache import CallCache
+        return CallCache(getattr(self.cfg, 'call_cache_bucket', '') or self.cfg.log_bucket)
+
+    def reuse_cached_result(self, runjson):
+        """if an identical job succeeded before, copy its outputs to the output targets
+        of this job and mark this job as successful. Return True if the cached result is used"""
+        entry = self.call_cache.lookup(self.cfg.call_cache_key)
+        if not entry:
+            return False
+        if not self.call_cache.reuse(entry, runjson, encrypt_s3_upload=self.cfg.encrypt_s3_upload,
+                                     kms_key_id=self.cfg.kms_key_id):
+            return False
+        logger.info("reusing the outputs of job %s (call cache)" % entry['jobid'])
+        self.cfg.cached_from = entry['jobid']
+        return True
+
     def create_userdata(self, profile=None):
         """Create a userdata script to pass to the instance. The userdata script is run_workflow.$JOBID.sh.
         profile is a dictionary { access_key: , secret_key: }
@@ -750,9 +1050,13 @@ class Execution(object):
         if cfg.password:
             str += " -p {}".format(cfg.password)
         if profile:
-            str += " -a {access_key} -s {secret_key} -r {region}".format(region=AWS_REGION, **profile)
+            str += " -a {access_key} -s {secret_key} -r {region}".format(region=config.aws_region, **profile)
         if hasattr(cfg, 'singularity') and cfg.singularity:
             str += " -g"
+        if cfg.warm_pool:
+            str += " -w"
+        if cfg.packed_jobs:
+            str += " -P " + ','.join('%s:%s:%s' % (j['jobid'], j['cpu'], j['mem']) for j in cfg.packed_jobs)
         str += "\n"
         logger.debug("userdata: \n" + str)
 
@@ -762,113 +1066,135 @@ class Execution(object):
         base64_message = base64_bytes.decode('ascii')
         return base64_message
 
-    def delete_launch_template(self):
+    def delete_launch_template_version(self):
+        """delete the job-specific version of the shared launch template, once the fleet is created"""
+        if not self.launch_template_name or not str(self.launch_template_version).isdigit():
+            return
         try:
-            # Existing launch templates can't be overwritten. Therefore, delete
-            # exsting ones first
-            ec2 = boto3.client('ec2')
-            ec2.delete_launch_template(
+            get_client('ec2').delete_launch_template_versions(
                 DryRun=self.dryrun,
                 LaunchTemplateName=self.launch_template_name,
+                Versions=[str(self.launch_template_version)]
             )
         except Exception as e:
-            logger.info("No existing launch template found.")
-
+            # left to delete_old_launch_template_versions
+            logger.warning(f"Could not delete version {self.launch_template_version} "
+                           f"of launch template {self.launch_template_name}: {str(e)}")
+        self.launch_template_version = '$Latest'
 
     def create_launch_template(self):
-        """Create a launch template everytime we run a workflow. There is no other
-        way to specify the necessary EC2 configurations"""
-        ec2 = boto3.client('ec2')
-        lt_id = ''.join(random.choices(string.ascii_lowercase, k=8))
-        self.launch_template_name = f'TibannaLaunchTemplate_{lt_id}'
-
-        # ImageId, InstanceType and SubnetId will be set during the create-fleet operation
-        launch_template_data ={
-            'IamInstanceProfile': {'Arn': S3_ACCESS_ARN},
-            'UserData': self.userdata,
+        """Launch templates are shared by the jobs with the same EC2 configuration
+        (IAM profile, volume types, metadata and spot options, etc.) and named after
+        a hash of that configuration. The job-specific part (user data, EBS size and tags)
+        is added as a new version of the template, which is used by create_fleet
+        and deleted right after (see delete_launch_template_version)."""
+        base_data, version_data = self.launch_template_data()
+        self.launch_template_name = launch_template_name(base_data)
+        for i in range(2):
+            if self.launch_template_name not in known_launch_templates:
+                create_base_launch_template(self.launch_template_name, base_data, dryrun=self.dryrun)
+            try:
+                self.launch_template_version = create_launch_template_version(self.launch_template_name,
+                                                                              version_data, self.jobid,
+                                                                              dryrun=self.dryrun)
+                break
+            except Exception as e:
+                if i == 0 and aws_error_code(e) == 'VersionLimitExceeded':
+                    # the versions of the jobs that could not delete theirs
+                    delete_old_launch_template_versions(self.launch_template_name)
+                    continue
+                # the template may have been removed by cleanup_launch_templates
+                known_launch_templates.discard(self.launch_template_name)
+                if i == 1 or 'NotFound' not in str(e):
+                    raise Exception(f"Could not create launch template: {str(e)}")
+        if int(self.launch_template_version) % LAUNCH_TEMPLATE_VERSION_CLEANUP_INTERVAL == 0:
+            delete_old_launch_template_versions(self.launch_template_name)
+
+    def launch_template_data(self):
+        """returns the launch template data shared by the jobs with the same configuration
+        and the job-specific data that is added as a template version.
+        ImageId, InstanceType and SubnetId will be set during the create-fleet operation"""
+        if self.cfg.ebs_throughput and self.cfg.ebs_type == 'gp3':
+            if self.cfg.ebs_throughput < 125 or self.cfg.ebs_throughput > 1000:
+                message = "Invalid EBS throughput. Specify a value between 125 and 1000."
+                raise EC2LaunchException(message)
+        if self.cfg.ebs_size >= 16000:
+            message = "EBS size limit (16TB) exceeded: (attempted size: %s)" % self.cfg.ebs_size
+            raise EC2LaunchException(message)
+
+        data_volume = {'DeleteOnTermination': True, 'VolumeType': self.cfg.ebs_type}
+        if self.cfg.ebs_iops:    # io1 type, specify iops
+            data_volume['Iops'] = self.cfg.ebs_iops
+        if self.cfg.ebs_throughput and self.cfg.ebs_type == 'gp3':
+            data_volume['Throughput'] = self.cfg.ebs_throughput
+        block_device_mappings = [
+            {
+                'DeviceName': '/dev/sdb',
+                'Ebs': data_volume
+            },
+            {
+                'DeviceName': '/dev/sda1',
+                'Ebs':
+                    {
+                        'DeleteOnTermination': True,
+                        'VolumeSize': self.cfg.root_ebs_size,
+                        'VolumeType': 'gp3'
+                    }
+            }
+        ]
+        base_data = {
+            'IamInstanceProfile': {'Arn': config.s3_access_arn},
             'InstanceInitiatedShutdownBehavior': 'terminate',
             'DisableApiTermination': False,
-            'BlockDeviceMappings': [
-                {
-                    'DeviceName': '/dev/sdb',
-                    'Ebs': 
-                        {
-                            'DeleteOnTermination': True,
-                            'VolumeSize': self.cfg.ebs_size,
-                            'VolumeType': self.cfg.ebs_type
-                        }
-                },
-                {
-                    'DeviceName': '/dev/sda1',
-                    'Ebs': 
-                        {
-                            'DeleteOnTermination': True,
-                            'VolumeSize': self.cfg.root_ebs_size,
-                            'VolumeType': 'gp3'
-                        }
-                }
-            ],
+            'BlockDeviceMappings': block_device_mappings,
             'MetadataOptions': {
                 'HttpTokens': 'required',
                 'HttpEndpoint': 'enabled',
                 'HttpPutResponseHopLimit': 2
-            },
-            'TagSpecifications': [
-                {
-                    'ResourceType': 'instance',
-                    'Tags': [
-                        {"Key": "Name", "Value": "awsem-" + self.jobid},
-                        {"Key": "Type", "Value": "awsem"}
-                    ]
-                }
-            ]
+            }
         }
 
         if self.cfg.key_name:
-            launch_template_data.update({'KeyName': self.cfg.key_name})
+            base_data.update({'KeyName': self.cfg.key_name})
         if self.cfg.EBS_optimized is True:
-            launch_template_data.update({"EbsOptimized": True})
-        if self.cfg.ebs_iops:    # io1 type, specify iops
-            launch_template_data["BlockDeviceMappings"][0]["Ebs"]['Iops'] = self.cfg.ebs_iops
-        if self.cfg.ebs_throughput and self.cfg.ebs_type == 'gp3':
-            if self.cfg.ebs_throughput < 125 or self.cfg.ebs_throughput > 1000:
-                message = "Invalid EBS throughput. Specify a value between 125 and 1000."
-                raise EC2LaunchException(message)
-            launch_template_data["BlockDeviceMappings"][0]["Ebs"]['Throughput'] = self.cfg.ebs_throughput
-        if self.cfg.ebs_size >= 16000:
-            message = "EBS size limit (16TB) exceeded: (attempted size: %s)" % self.cfg.ebs_size
-            raise EC2LaunchException(message)
-
-        
+            base_data.update({"EbsOptimized": True})
         if self.cfg.availability_zone:
-            launch_template_data.update({'Placement': {'AvailabilityZone': self.cfg.availability_zone}})
+            base_data.update({'Placement': {'AvailabilityZone': self.cfg.availability_zone}})
         if self.cfg.security_group:
-            launch_template_data.update({'SecurityGroupIds': [self.cfg.security_group]})
+            base_data.update({'SecurityGroupIds': [self.cfg.security_group]})
 
         if self.cfg.spot_instance:
             spot_options = {'SpotInstanceType': 'one-time',
                             'InstanceInterruptionBehavior': 'terminate'}
             if self.cfg.spot_duration:
                 spot_options['BlockDurationMinutes'] = self.cfg.spot_duration
-            launch_template_data.update(
-                {'InstanceMarketOptions': 
+            base_data.update(
+                {'InstanceMarketOptions':
                     {'MarketType': 'spot','SpotOptions': spot_options}
                 }
             )
 
-        try:
-            ec2.create_launch_template(
-                DryRun=self.dryrun,
-                LaunchTemplateName=self.launch_template_name,
-                LaunchTemplateData=launch_template_data,
-            )
-        except Exception as e:
-            raise Exception(f"Could not create launch template: {str(e)}")
-
+        # block device mappings are replaced as a whole in a new version
+        version_block_device_mappings = copy.deepcopy(block_device_mappings)
+        version_block_device_mappings[0]['Ebs']['VolumeSize'] = self.cfg.ebs_size
+        version_data = {
+            'UserData': self.userdata,
+            'BlockDeviceMappings': version_block_device_mappings,
+            'TagSpecifications': [
+                {
+                    'ResourceType': 'instance',
+                    'Tags': [
+                        {"Key": "Name", "Value": "awsem-" + self.jobid},
+                        {"Key": "Type", "Value": "awsem"}
+                    ]
+                }
+            ]
+        }
+        return base_data, version_data
 
     def delete_fleet(self, fleet_id):
         '''Delete an existing fleet'''
-        ec2 = boto3.client('ec2')
+        ec2 = get_client('ec2')
         try:
             return ec2.delete_fleets(
                 DryRun=self.dryrun,
@@ -881,7 +1207,7 @@ class Execution(object):
 
     def create_fleet(self):
         '''Create an 'instant' type fleet with 1 instance'''
-        ec2 = boto3.client('ec2')
+        ec2 = get_client('ec2')
         try:
             fleet_spec = self.create_fleet_spec()
             fleet_result = ec2.create_fleet(**fleet_spec)
@@ -890,9 +1216,10 @@ class Execution(object):
             raise Exception(f"Unable to create fleet: {str(e)}")
 
 
-    def create_fleet_spec(self): # Factored out for easier testing
-
-        potential_ec2s = [] # Used as overrides in the launch template
+    def fleet_overrides(self):
+        """overrides of the launch template for the fleet request : all the combinations of the
+        candidate instance types and subnets, except the pairs that recently had no capacity"""
+        potential_ec2s = []
 
         subnets = False
         if self.cfg.subnet:
@@ -902,34 +1229,45 @@ class Execution(object):
                 subnets = self.cfg.subnet
 
         # Create all possible combinations of instance type / subnet
-        for instance_type in self.instance_type_list:
+        # instance_type_list is ranked, the first instance type has the highest priority (lowest number)
+        for rank, instance_type in enumerate(self.instance_type_list, 1):
             instance_info = self.instance_type_infos[instance_type]
             if subnets:
                 for subnet in subnets:
+                    if self.launch_plan.is_excluded(instance_type, subnet):
+                        continue
                     potential_ec2s.append({
                         "InstanceType": instance_type,
                         "SubnetId": subnet,
-                        "ImageId": instance_info['ami_id']
+                        "ImageId": instance_info['ami_id'],
+                        "Priority": float(rank)
                     })
-            else:
+            elif not self.launch_plan.is_excluded(instance_type):
                 potential_ec2s.append({
                     "InstanceType": instance_type,
-                    "ImageId": instance_info['ami_id']
+                    "ImageId": instance_info['ami_id'],
+                    "Priority": float(rank)
                 })
+        return potential_ec2s
+
+    def create_fleet_spec(self): # Factored out for easier testing
+
+        potential_ec2s = self.fleet_overrides() # Used as overrides in the launch template
         
         spec = {
             "DryRun": self.dryrun,
             "SpotOptions": {
-                "AllocationStrategy": "capacity-optimized",
+                # priorities are honored on a best-effort basis, capacity comes first
+                "AllocationStrategy": "capacity-optimized-prioritized",
                 "InstanceInterruptionBehavior": "terminate" # hibernate is an option here
             },
             "OnDemandOptions": {
-                "AllocationStrategy": "lowest-price" # prioritized is the other option, but then we need to assign prioritoes in the launch template
+                "AllocationStrategy": "prioritized"
             },
             "LaunchTemplateConfigs": [{
                 "LaunchTemplateSpecification": {
                     "LaunchTemplateName": self.launch_template_name,
-                    "Version": "$Latest" # There is only one version
+                    "Version": str(self.launch_template_version)
                 },
                 "Overrides": potential_ec2s,
                 
@@ -946,25 +1284,31 @@ class Execution(object):
 
 
     def get_instance_info(self):
-        # get public IP and availablity zone for the instance (This may not happen immediately)
+        """public IP and availability zone of the instance. A new instance may not be described
+        right away, so describe_instances is retried with a backoff for up to INSTANCE_INFO_TIMEOUT seconds."""
         try:
-            ec2 = boto3.client('ec2')
+            ec2 = get_client('ec2')
         except Exception as e:
             raise Exception("Can't create an ec2 client %s" % str(e))
-        while True:  # keep trying until you get the result.
-            time.sleep(1)  # wait for one second before trying again.
+        instance_ip = ''
+        availability_zone = ''
+        waited = 0
+        delay = INSTANCE_INFO_BASE_DELAY
+        while True:
             try:
-                # sometimes you don't get a description immediately
                 instance_desc_log = ec2.describe_instances(InstanceIds=[self.instance_id])
-                if 'PublicIpAddress' not in instance_desc_log['Reservations'][0]['Instances'][0]:
-                    instance_ip = ''
-                    availability_zone = ''
-                    break
-                instance_ip = instance_desc_log['Reservations'][0]['Instances'][0]['PublicIpAddress']
-                availability_zone = instance_desc_log['Reservations'][0]['Instances'][0]["Placement"]["AvailabilityZone"]
+                instance = instance_desc_log['Reservations'][0]['Instances'][0]
+                if 'PublicIpAddress' in instance:
+                    instance_ip = instance['PublicIpAddress']
+                    availability_zone = instance["Placement"]["AvailabilityZone"]
                 break
-            except:
-                continue
+            except Exception as e:
+                if waited + delay > INSTANCE_INFO_TIMEOUT:
+                    logger.warning("cannot describe instance %s : %s" % (self.instance_id, str(e)))
+                    break
+                time.sleep(delay)
+                waited += delay
+                delay = min(delay * 2, INSTANCE_INFO_MAX_DELAY)
         return({'instance_id': self.instance_id,
                 'instance_ip': instance_ip,
                 'availability_zone' : availability_zone,
@@ -983,7 +1327,10 @@ class Execution(object):
             raise DependencyStillRunningException("Dependency is still running: %s" % ','.join(job_statuses['running_jobs']))
 
     def add_instance_id_to_dynamodb(self):
-        dd = boto3.client('dynamodb')
+        self.update_dynamodb(instance_id=self.instance_id)
+
+    def update_dynamodb(self, **attributes):
+        dd = get_client('dynamodb')
         try:
             dd.update_item(
                 TableName=DYNAMODB_TABLE,
@@ -993,12 +1340,12 @@ class Execution(object):
                     }
                 },
                 AttributeUpdates={
-                    'instance_id': {
+                    name: {
                         'Value': {
-                            'S': self.instance_id
+                            'S': value
                         },
                         'Action': 'PUT'
-                    }
+                    } for name, value in attributes.items()
                 }
             )
         except:
@@ -1032,7 +1379,7 @@ class Execution(object):
                     ],
                     "period": 60,
                     "stat": "Average",
-                    "region": AWS_REGION,
+                    "region": config.aws_region,
                     "title": "Memory Used"
                  }
               },
@@ -1067,7 +1414,7 @@ class Execution(object):
                     ],
                     "period": 60,
                     "stat": "Average",
-                    "region": AWS_REGION,
+                    "region": config.aws_region,
                     "title": "Disk Space Utilization"
                  }
               },
@@ -1092,7 +1439,7 @@ class Execution(object):
                     ],
                     "period": 60,
                     "stat": "Average",
-                    "region": AWS_REGION,
+                    "region": config.aws_region,
                     "title": "Data Disk Space Used"
                  }
               },
@@ -1113,19 +1460,144 @@ class Execution(object):
                     ],
                     "period": 60,
                     "stat": "Average",
-                    "region": AWS_REGION,
+                    "region": config.aws_region,
                     "title": "CPU Utilization"
                  }
               }
            ]
         }
-        cw = boto3.client('cloudwatch', AWS_REGION)
+        cw = get_client('cloudwatch', config.aws_region)
         cw.put_dashboard(
             DashboardName=dashboard_name,
             DashboardBody=json.dumps(body)
         )
 
 
+def describe_instance_types(instance_types=None):
+    """return {instance_type: {'EBS_optimized': <bool>, 'arch': <first supported architecture>}}
+    for the given instance types (or for all instance types in the region if None)"""
+    ec2 = get_client('ec2')
+    kwargs = {'InstanceTypes': instance_types} if instance_types else {}
+    infos = dict()
+    for page in ec2.get_paginator('describe_instance_types').paginate(**kwargs):
+        for result in page['InstanceTypes']:
+            infos[result['InstanceType']] = {
+                'EBS_optimized': result['EbsInfo']['EbsOptimizedSupport'] != 'unsupported',
+                'arch': result['ProcessorInfo']['SupportedArchitectures'][0]
+            }
+    return infos
+
+
+# shared by the executions in the same process (e.g. warm lambda invocations)
+instance_type_cache = InstanceTypeCache(describe_instance_types)
+instance_price_cache = InstanceTypeCache(get_ec2_prices, ttl=PRICE_CACHE_TTL, prefix=PRICE_CACHE_PREFIX)
+
+
+# launch templates that are known to exist, shared by the executions in the same process
+known_launch_templates = set()
+
+
+def launch_template_name(launch_template_data):
+    """name of the shared launch template for the given (non-job-specific) launch template data"""
+    digest = hashlib.sha256(json.dumps(launch_template_data, sort_keys=True).encode('utf-8')).hexdigest()
+    return LAUNCH_TEMPLATE_PREFIX + digest[:32]
+
+
+def aws_error_code(e):
+    return getattr(e, 'response', {}).get('Error', {}).get('Code', '')
+
+
+def create_base_launch_template(name, launch_template_data, dryrun=False):
+    """create a launch template unless it already exists"""
+    try:
+        get_client('ec2').create_launch_template(
+            DryRun=dryrun,
+            LaunchTemplateName=name,
+            LaunchTemplateData=launch_template_data,
+            VersionDescription='base'
+        )
+    except Exception as e:
+        if aws_error_code(e) != 'InvalidLaunchTemplateName.AlreadyExistsException':
+            raise Exception(f"Could not create launch template: {str(e)}")
+    if not dryrun:
+        known_launch_templates.add(name)
+
+
+def create_launch_template_version(name, launch_template_data, description='', dryrun=False):
+    """add the job-specific launch template data as a new version on top of the base version
+    and return the version number"""
+    res = get_client('ec2').create_launch_template_version(
+        DryRun=dryrun,
+        LaunchTemplateName=name,
+        SourceVersion='1',
+        VersionDescription=description,
+        LaunchTemplateData=launch_template_data
+    )
+    return res['LaunchTemplateVersion']['VersionNumber']
+
+
+def delete_old_launch_template_versions(name, older_than=LAUNCH_TEMPLATE_VERSION_MAX_AGE):
+    """delete the job-specific versions of a launch template created more than
+    older_than seconds ago (the fleet of a job is created within seconds after its version,
+    which the job then deletes, so these are the versions of the jobs that could not).
+    Returns the list of deleted version numbers."""
+    ec2 = get_client('ec2')
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=older_than)
+    old_versions = []
+    try:
+        for page in ec2.get_paginator('describe_launch_template_versions').paginate(LaunchTemplateName=name):
+            for v in page['LaunchTemplateVersions']:
+                if not v['DefaultVersion'] and v['CreateTime'] < cutoff:
+                    old_versions.append(str(v['VersionNumber']))
+        # at most 200 versions per request
+        for i in range(0, len(old_versions), 200):
+            ec2.delete_launch_template_versions(LaunchTemplateName=name, Versions=old_versions[i:i + 200])
+    except Exception as e:
+        # cleaning up is not essential for the job
+        logger.warning(f"Could not delete old versions of launch template {name}: {str(e)}")
+    return old_versions
+
+
+def cleanup_launch_templates(older_than_hours=24, dryrun=False):
+    """delete the tibanna launch templates that have not been used by any job
+    (i.e. have no new version) for older_than_hours hours
+    and the job-specific versions of the other launch templates that are left behind.
+    Returns the list of deleted launch template names."""
+    ec2 = get_client('ec2')
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=older_than_hours)
+    deleted = []
+    filters = [{'Name': 'launch-template-name', 'Values': [LAUNCH_TEMPLATE_PREFIX + '*']}]
+    for page in ec2.get_paginator('describe_launch_templates').paginate(Filters=filters):
+        for lt in page['LaunchTemplates']:
+            name = lt['LaunchTemplateName']
+            latest = ec2.describe_launch_template_versions(LaunchTemplateName=name,
+                                                           Versions=['$Latest'])['LaunchTemplateVersions'][0]
+            if latest['CreateTime'] < cutoff:
+                logger.info(f"deleting launch template {name}")
+                if not dryrun:
+                    ec2.delete_launch_template(LaunchTemplateName=name)
+                    known_launch_templates.discard(name)
+                deleted.append(name)
+            elif not dryrun:
+                delete_old_launch_template_versions(name)
+    return deleted
+
+
+def has_resource_model(cfg, app_name):
+    """True if the app has a resource model of enough jobs in the log bucket"""
+    if not cfg.use_resource_model:
+        return False
+    model = get_resource_model(cfg.log_bucket, app_name)
+    return bool(model) and model.n_jobs >= PREDICTOR_MIN_JOBS
+
+
+def benchmark_app_names():
+    """names of the apps supported by the Benchmark package
+    (imported only when needed, since it is slow to import)"""
+    from Benchmark import run as B
+    return B.app_name_function_map
+
+
 def upload_workflow_to_s3(unicorn_input):
     """input is a UnicornInput object"""
     args = unicorn_input.args
@@ -1153,7 +1625,7 @@ def upload_workflow_to_s3(unicorn_input):
     extra_args = {}
     if cfg.encrypt_s3_upload:
         extra_args.update({"ServerSideEncryption": "aws:kms"})
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     for wf_file in wf_files:
         source = localdir + '/' + wf_file
         target = key_prefix + wf_file
@@ -1170,18 +1642,8 @@ def upload_workflow_to_s3(unicorn_input):
 
 
 def get_all_objects_in_prefix(bucketname, prefix):
-    lastkey = ''
-    while True:
-        response = boto3.client('s3').list_objects(
-            Bucket=bucketname,
-            Prefix=prefix,
-            Marker=lastkey,
-            MaxKeys=1000
-        )
-        if not response.get('Contents'):
-            break
-        lastkey = [item['Key'] for item in response['Contents']][-1]
-        for item in response['Contents']:
+    for contents in list_objects(bucketname, prefix):
+        for item in contents:
             yield item
 
 
@@ -1191,19 +1653,12 @@ def get_file_size(key, bucket, size_in_gb=False):
     unless size_in_gb = True
     '''
     logger.info("getting file or subfoler size")
-    meta = does_key_exist(bucket, key)
-    if not meta:
-        try:
-            size = 0
-            logger.info("trying to get total size of the prefix")
-            for item in get_all_objects_in_prefix(bucket, key):
-                size += item['Size']
-        except:
-            return None  # do not throw an error here - if lambda doens't have s3 access, pass.
-            # s3 bucket access permissions may be quite complex - e.g. some buckets may work only
-            # on EC2 instance, which means a lambda would not be able to get the file size.
-    else:
-        size = meta['ContentLength']
+    # None if the size is not available - if lambda doens't have s3 access, pass.
+    # s3 bucket access permissions may be quite complex - e.g. some buckets may work only
+    # on EC2 instance, which means a lambda would not be able to get the file size.
+    size = get_object_sizes([(bucket, key)])[(bucket, key)]
+    if size is None:
+        return None
     one_gb = 1073741824
     if size_in_gb:
         size = size / one_gb
@@ -142,3 +142,12 @@ class UnsupportedCWLVersionException(Exception):
 
 class JobAbortedException(Exception):
     pass
+
+
+class BatchSubmissionException(Exception):
+    """some jobs of a batch could not be submitted; report is the BatchReport of the whole batch"""
+    def __init__(self, report):
+        self.report = report
+        super().__init__("%d of %d submissions failed: %s" %
+                         (len(report.failed), len(report.results),
+                          '; '.join("%d (%s): %s" % (r.index, r.input_json or '', r.error) for r in report.failed)))
@@ -1,11 +1,10 @@
-import boto3
 import json
 import random
 from . import create_logger
+from .aws_utils import get_client
 from .vars import (
+    config,
     DYNAMODB_TABLE,
-    AWS_ACCOUNT_NUMBER,
-    AWS_REGION,
     LAMBDA_TYPE,
     SFN_TYPE,
     RUN_TASK_LAMBDA_NAME,
@@ -21,14 +20,20 @@ logger = create_logger(__name__)
 
 class IAM(object):
 
-    account_id = AWS_ACCOUNT_NUMBER
-    region = AWS_REGION
     lambda_type = LAMBDA_TYPE  # lambda_type : '' for unicorn, 'pony' for pony, 'zebra' for zebra
     sfn_type = SFN_TYPE  # sfn type : 'unicorn' for unicorn, 'pony' for pony, 'zebra' for zebra
     run_task_lambda_name = RUN_TASK_LAMBDA_NAME
     check_task_lambda_name = CHECK_TASK_LAMBDA_NAME
     update_cost_lambda_name = UPDATE_COST_LAMBDA_NAME
 
+    @property
+    def account_id(self):
+        return config.aws_account_number
+
+    @property
+    def region(self):
+        return config.aws_region
+
     def __init__(self, user_group_tag, bucket_names='', no_randomize=True):
         """policy prefix for user group
         lambda_type : '' for unicorn, 'pony' for pony, 'zebra' for zebra
@@ -58,7 +63,8 @@ class IAM(object):
         self.bucket_names = bucket_names
 
         # iam client/resource
-        self.client = boto3.client('iam')
+        self.client = get_client('iam')
+        import boto3
         self.iam = boto3.resource('iam')
 
     @property
@@ -73,7 +79,7 @@ class IAM(object):
     def policy_types(self):
         return ['bucket', 'termination', 'list', 'cloudwatch', 'passrole', 'lambdainvoke',
                 'cloudwatch_metric', 'cw_dashboard', 'dynamodb', 'ec2_desc',
-                'executions', 'pricing', 'vpc', 'kms', 'kms_ami']
+                'executions', 'pricing', 'task_token', 'vpc', 'kms', 'kms_ami']
 
     def policy_arn(self, policy_type):
         return 'arn:aws:iam::' + self.account_id + ':policy/' + self.policy_name(policy_type)
@@ -107,6 +113,7 @@ class IAM(object):
                     'dynamodb': 'dynamodb',
                     'ec2_desc': 'ec2_desc',
                     'pricing': 'pricing',
+                    'task_token': 'sfn_task_token',
                     'executions': 'executions',
                     'vpc': 'vpc_access',
                     'kms': 'kms_key_for_s3',
@@ -130,6 +137,7 @@ class IAM(object):
                        'dynamodb': self.policy_dynamodb,
                        'ec2_desc': self.policy_ec2_desc,
                        'pricing': self.policy_pricing,
+                       'task_token': self.policy_task_token,
                        'executions': self.policy_executions,
                        'vpc': self.policy_vpc_access,
                        'kms': self.policy_kms_access,
@@ -170,13 +178,13 @@ class IAM(object):
         # returns a dictionary with role_type as keys
         # adding vpc access to only check_task since run_task has full ec2 access
         run_task_custom_policy_types = base + ['list', 'cloudwatch', 'passrole', 'dynamodb',
-                                               'executions', 'cw_dashboard']
+                                               'executions', 'cw_dashboard', 'pricing']
         if AMI_KMS_KEY_ID:  # AMI is KMS-encrypted; run_task launches the fleet so it needs key access
             run_task_custom_policy_types.append('kms_ami')
         check_task_custom_policy_types = base + ['cloudwatch_metric', 'cloudwatch', 'ec2_desc',
-                                                 'termination', 'dynamodb', 'pricing', 'vpc']
+                                                 'termination', 'dynamodb', 'pricing', 'task_token', 'vpc']
         update_cost_custom_policy_types = base + ['executions', 'dynamodb', 'pricing', 'vpc']
-        arnlist = {'ec2': [self.policy_arn(_) for _ in base + ['cloudwatch_metric', 'ec2_desc']] +
+        arnlist = {'ec2': [self.policy_arn(_) for _ in base + ['cloudwatch_metric', 'ec2_desc', 'task_token']] +
                           ['arn:aws:iam::aws:policy/AmazonEC2ContainerRegistryReadOnly'] +
                           ['arn:aws:iam::aws:policy/CloudWatchAgentServerPolicy'],
                    # 'stepfunction': [self.policy_arn(_) for _ in ['lambdainvoke']],
@@ -440,7 +448,8 @@ class IAM(object):
                     "Effect": "Allow",
                     "Action": [
                         "cloudwatch:PutMetricData",
-                        "cloudwatch:GetMetricStatistics"
+                        "cloudwatch:GetMetricStatistics",
+                        "cloudwatch:GetMetricData"
                     ],
                     "Resource": "*"
                 }
@@ -473,6 +482,7 @@ class IAM(object):
                     "Effect": "Allow",
                     "Action": [
                         "dynamodb:DescribeTable",
+                        "dynamodb:BatchGetItem",
                         "dynamodb:PutItem",
                         "dynamodb:Query",
                         "dynamodb:UpdateItem"
@@ -521,6 +531,25 @@ class IAM(object):
         }
         return policy
 
+    @property
+    def policy_task_token(self):
+        # the instance and check_task resume the executions waiting for the end of a job
+        policy = {
+            "Version": "2012-10-17",
+            "Statement": [
+                {
+                    "Effect": "Allow",
+                    "Action": [
+                        "states:SendTaskSuccess",
+                        "states:SendTaskFailure",
+                        "states:SendTaskHeartbeat"
+                    ],
+                    "Resource": "*"
+                }
+            ]
+        }
+        return policy
+
     def role_policy_document(self, service):
         '''service: 'ec2', 'lambda' or 'states' '''
         AssumeRolePolicyDocument = {
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""cache of instance type metadata (EBS-optimized support and architecture)
+used by Execution.create_instance_type_list.
+
+The metadata rarely changes, so instead of calling ec2.describe_instance_types
+for every job it is kept at two levels :
+ - in the process (reused by warm lambda invocations)
+ - as a json snapshot ``<prefix><region>.json`` in the log bucket, shared by all
+   lambda containers and CLI users of the same bucket.
+Both levels expire after INSTANCE_TYPE_CACHE_TTL seconds
+(env ``TIBANNA_INSTANCE_TYPE_CACHE_TTL``, 0 disables the cache) and a snapshot
+written by a different cache version is ignored. Only the instance types that
+are not in the cache are requested from the EC2 API.
+The same cache keeps the price table used to rank the candidate instance types
+(``<PRICE_CACHE_PREFIX><region>.json``), with a shorter lifetime
+(env ``TIBANNA_PRICE_CACHE_TTL``) since spot prices change."""
+import os
+import json
+import time
+import threading
+from . import create_logger
+from .utils import read_s3, put_object_s3
+
+
+INSTANCE_TYPE_CACHE_PREFIX = '.tibanna_cache/instance_types/'
+INSTANCE_TYPE_CACHE_VERSION = 1
+INSTANCE_TYPE_CACHE_TTL = int(os.environ.get('TIBANNA_INSTANCE_TYPE_CACHE_TTL', 7 * 24 * 3600))
+PRICE_CACHE_PREFIX = '.tibanna_cache/prices/'
+PRICE_CACHE_TTL = int(os.environ.get('TIBANNA_PRICE_CACHE_TTL', 3600))
+
+
+logger = create_logger(__name__)
+
+
+class InstanceTypeCache(object):
+    """fetch is a function that takes a list of instance types and returns
+    {instance_type: <metadata>}, e.g. {instance_type: {'EBS_optimized': <bool>, 'arch': <str>}}"""
+
+    def __init__(self, fetch, ttl=INSTANCE_TYPE_CACHE_TTL, prefix=INSTANCE_TYPE_CACHE_PREFIX):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.prefix = prefix
+        self.regions = dict()  # {region: {'created': <time of the oldest entry>, 'infos': {..}, 'snapshots': set()}}
+        self._lock = threading.Lock()
+
+    def snapshot_key(self, region):
+        return self.prefix + region + '.json'
+
+    def clear(self):
+        with self._lock:
+            self.regions = dict()
+
+    def describe(self, instance_types, region, bucket=None, encrypt_s3_upload=False, kms_key_id=None):
+        """return the metadata of the instance types (same format as fetch), reading the
+        snapshot in bucket and calling fetch only for the instance types that are not cached.
+        The lock is held only to look up and update the cache, not during the S3 and EC2 calls,
+        so that concurrent callers do not wait for each other (two of them may then fetch the
+        same instance types)."""
+        if self.ttl <= 0:
+            return self.fetch(instance_types)
+        with self._lock:
+            cached = self._region(region)
+            missing = [it for it in instance_types if it not in cached['infos']]
+            read_snapshot = bool(missing and bucket and bucket not in cached['snapshots'])
+            if read_snapshot:
+                cached['snapshots'].add(bucket)
+        if read_snapshot:
+            snapshot = self.load_snapshot(region, bucket)
+            with self._lock:
+                cached = self._region(region)
+                if snapshot:
+                    self.merge_snapshot(cached, snapshot)
+                missing = [it for it in instance_types if it not in cached['infos']]
+        fetched = dict()
+        if missing:
+            fetched = self.fetch(missing)
+            with self._lock:
+                cached = self._region(region)
+                cached['infos'].update(fetched)
+                if cached['created'] is None:
+                    cached['created'] = time.time()
+                content = self.snapshot_content(cached, region) if bucket else None
+            if content:
+                self.save_snapshot(content, region, bucket, encrypt_s3_upload, kms_key_id)
+        with self._lock:
+            infos = self._region(region)['infos']
+            res = {it: infos[it] for it in instance_types if it in infos}
+        res.update(fetched)
+        return {it: res[it] for it in instance_types if it in res}
+
+    def _region(self, region):
+        cached = self.regions.get(region)
+        if not cached or (cached['created'] and self.expired(cached['created'])):
+            cached = self.regions[region] = {'created': None, 'infos': dict(), 'snapshots': set()}
+        return cached
+
+    def expired(self, created):
+        return time.time() - created > self.ttl
+
+    def load_snapshot(self, region, bucket):
+        """the snapshot in bucket, or None if there is none or if it is outdated"""
+        try:
+            snapshot = json.loads(read_s3(bucket, self.snapshot_key(region)))
+        except Exception as e:
+            logger.debug("no instance type snapshot in %s : %s" % (bucket, str(e)))
+            return None
+        if snapshot.get('version') != INSTANCE_TYPE_CACHE_VERSION or snapshot.get('region') != region \
+           or self.expired(snapshot.get('created', 0)):
+            logger.debug("ignoring outdated instance type snapshot in %s" % bucket)
+            return None
+        return snapshot
+
+    @staticmethod
+    def merge_snapshot(cached, snapshot):
+        for it, info in snapshot.get('instance_types', {}).items():
+            cached['infos'].setdefault(it, info)
+        if cached['created'] is None or snapshot['created'] < cached['created']:
+            cached['created'] = snapshot['created']
+
+    @staticmethod
+    def snapshot_content(cached, region):
+        return json.dumps({'version': INSTANCE_TYPE_CACHE_VERSION, 'region': region,
+                           'created': cached['created'], 'instance_types': cached['infos']}, sort_keys=True)
+
+    def save_snapshot(self, content, region, bucket, encrypt_s3_upload=False, kms_key_id=None):
+        try:
+            put_object_s3(content, self.snapshot_key(region), bucket, public=False,
+                          encrypt_s3_upload=encrypt_s3_upload, kms_key_id=kms_key_id)
+        except Exception as e:
+            # the snapshot is only an optimization
+            logger.warning("cannot save instance type snapshot to %s : %s" % (bucket, str(e)))
+
+
+_benchmark_instance_list = None
+
+
+def benchmark_instance_list():
+    """Benchmark.classes.instance_list(exclude_t=False), parsed once per process.
+    The elements are copied, since create_instance_type_list modifies them."""
+    global _benchmark_instance_list
+    if _benchmark_instance_list is None:
+        from Benchmark.classes import instance_list
+        _benchmark_instance_list = instance_list(exclude_t=False)
+    return [dict(i) for i in _benchmark_instance_list]
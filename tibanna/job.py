@@ -1,12 +1,12 @@
-import boto3
 import json
 from datetime import datetime, timezone
 from . import create_logger
+from .aws_utils import get_client
 from tibanna import dd_utils
 from .vars import (
+    config,
     STEP_FUNCTION_ARN,
     EXECUTION_ARN,
-    AWS_REGION,
     DYNAMODB_TABLE
 )
 
@@ -56,7 +56,7 @@ class Job(object):
     @property
     def client_sfn(self):
         if not self._client_sfn:
-            self._client_sfn = boto3.client('sfn', region=AWS_REGION)
+            self._client_sfn = get_client('stepfunctions', region_name=config.aws_region)
         return self._client_sfn
 
     def check_costupdater_status(self):
@@ -130,7 +130,7 @@ class Job(object):
     @staticmethod
     def get_log_bucket_from_job_id_and_sfn_wo_dd(job_id, sfn):
         stateMachineArn = STEP_FUNCTION_ARN(sfn)
-        sf = boto3.client('stepfunctions')
+        sf = get_client('stepfunctions')
         logbucket = None  # should be resolved below
         logger.warning(f'Could not get job metadata from DynamoDB - falling back to sfn {stateMachineArn}')
         res = sf.list_executions(stateMachineArn=stateMachineArn)
@@ -158,7 +158,7 @@ class Job(object):
 
     @staticmethod
     def get_job_id_from_exec_arn(exec_arn):
-        sf = boto3.client('stepfunctions')
+        sf = get_client('stepfunctions')
         desc = sf.describe_execution(executionArn=exec_arn)
         return str(json.loads(desc['input'])['jobid'])
 
@@ -174,7 +174,7 @@ class Job(object):
 
     @staticmethod
     def stepfunction_exists(sfn_name):
-        sf = boto3.client('stepfunctions')
+        sf = get_client('stepfunctions')
         try:
             sf.describe_state_machine(stateMachineArn=STEP_FUNCTION_ARN(sfn_name))
             return True
@@ -219,7 +219,7 @@ class Job(object):
         """
         stateMachineArn = STEP_FUNCTION_ARN(sfn)
         try:
-            sf = boto3.client("stepfuntions", region_name=AWS_REGION)
+            sf = get_client('stepfunctions', region_name=config.aws_region)
             res = sf.list_executions(stateMachineArn=stateMachineArn)
             while True:
                 if 'executions' not in res or not res['executions']:
@@ -245,7 +245,7 @@ class Job(object):
 
     @staticmethod
     def describe_exec(exec_arn):
-        sf = boto3.client('stepfunctions', region_name=AWS_REGION)
+        sf = get_client('stepfunctions', region_name=config.aws_region)
         return sf.describe_execution(executionArn=exec_arn)
 
     @staticmethod
@@ -253,7 +253,7 @@ class Job(object):
         '''return raw content from dynamodb for a given job id'''
         for _ in range(3):  # retry this just in case
             try:
-                dd = boto3.client('dynamodb')
+                dd = get_client('dynamodb')
                 ddres = dd.query(TableName=DYNAMODB_TABLE,
                                  KeyConditions={'Job Id': {'AttributeValueList': [{'S': job_id}],
                                                            'ComparisonOperator': 'EQ'}})
@@ -279,9 +279,37 @@ class Job(object):
             return None
 
     @staticmethod
-    def add_to_dd(job_id, execution_name, sfn, logbucket, verbose=True):
-        time_stamp = datetime.strftime(datetime.now(timezone.utc), '%Y%m%d-%H:%M:%S-UTC')
-        dydb = boto3.client('dynamodb', region_name=AWS_REGION)
+    def dd_item(job_id, execution_name, sfn, logbucket, time_stamp=None):
+        """dynamoDB item that registers a job"""
+        if not time_stamp:
+            time_stamp = datetime.strftime(datetime.now(timezone.utc), '%Y%m%d-%H:%M:%S-UTC')
+        return {
+            'Job Id': {
+                'S': job_id
+            },
+            'Execution Name': {
+                'S': execution_name
+            },
+            'Step Function': {
+                'S': sfn
+            },
+            'Log Bucket': {
+                'S': logbucket
+            },
+            'Time Stamp': {
+                'S': time_stamp
+            }
+        }
+
+    @staticmethod
+    def add_to_dd(job_id, execution_name, sfn, logbucket, verbose=True, dd_writer=None):
+        """add a job to dynamoDB. If dd_writer (dd_utils.BatchWriter) is given,
+        the item is buffered and written in batches."""
+        item = Job.dd_item(job_id, execution_name, sfn, logbucket)
+        if dd_writer:
+            dd_writer.put(item)
+            return
+        dydb = get_client('dynamodb', region_name=config.aws_region)
         try:
             # first check the table exists
             dydb.describe_table(TableName=DYNAMODB_TABLE)
@@ -290,23 +318,6 @@ class Job(object):
             return
         for _ in range(5):  # try to add to dynamo 5 times
             try:
-                item ={
-                    'Job Id': {
-                        'S': job_id
-                    },
-                    'Execution Name': {
-                        'S': execution_name
-                    },
-                    'Step Function': {
-                        'S': sfn
-                    },
-                    'Log Bucket': {
-                        'S': logbucket
-                    },
-                    'Time Stamp': {
-                        'S': time_stamp
-                    }
-                }
                 if verbose:
                     logger.info("Trying to add the following item to dynamoDB: " + str(item))
 
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""the status document of a job (``<jobid>.status.json`` in the log bucket).
+
+The instance (awsf3 ``update_job_status``) rewrites the document at each phase
+change of the job and every minute (cron), with a single put_object, so that the
+state of a job can be read with one GET instead of a HEAD per marker file.
+The marker files (``.job_started``, ``.success``, ``.error``, ``.aborted``) are
+still written as before, for compatibility with older versions.
+
+e.g.
+{"jobid": "abc", "log_bucket": "logbucket", "phase": "running", "exit_status": null,
+ "instance_id": "i-1", "instance_type": "t3.medium", "filesystem": "/dev/nvme1n1",
+ "started_at": "20260101-10:00:00-UTC", "ended_at": null, "updated_at": "20260101-10:21:00-UTC",
+ "last_activity": "20260101-10:20:51-UTC", "phases": {"started": "20260101-10:00:00-UTC", ...},
+ "bytes_downloaded": 1048576, "bytes_uploaded": 0}"""
+import json
+import time
+from . import create_logger
+from .utils import read_s3, put_object_s3
+from .vars import AWSEM_TIME_STAMP_FORMAT
+
+
+# phases of a job, in order
+JOB_PHASES = ['started', 'downloading', 'running', 'uploading', 'succeeded', 'failed', 'aborted']
+JOB_END_PHASES = ['succeeded', 'failed', 'aborted']
+
+
+logger = create_logger(__name__)
+
+
+def job_status_key(jobid):
+    return jobid + '.status.json'
+
+
+def now_stamp():
+    return time.strftime(AWSEM_TIME_STAMP_FORMAT, time.gmtime())
+
+
+def new_job_status(jobid, log_bucket, **kwargs):
+    status = {'jobid': jobid, 'log_bucket': log_bucket, 'phase': None, 'exit_status': None,
+              'instance_id': '', 'instance_type': '', 'filesystem': '',
+              'started_at': None, 'ended_at': None, 'updated_at': None, 'last_activity': None,
+              'phases': dict(), 'bytes_downloaded': 0, 'bytes_uploaded': 0}
+    status.update(kwargs)
+    return status
+
+
+def set_phase(status, phase, exit_status=None, timestamp=None):
+    """move the job to phase (no-op if it is already in that phase, except for the exit status)"""
+    if phase not in JOB_PHASES:
+        raise Exception("invalid job phase %s : must be one of %s" % (phase, ', '.join(JOB_PHASES)))
+    timestamp = timestamp or now_stamp()
+    if status['phase'] != phase:
+        status['phase'] = phase
+        status['phases'][phase] = timestamp
+        if not status.get('started_at'):
+            status['started_at'] = timestamp
+        if phase in JOB_END_PHASES:
+            status['ended_at'] = timestamp
+    if exit_status is not None:
+        status['exit_status'] = exit_status
+    return status
+
+
+def read_job_status(log_bucket, jobid):
+    """the status document of a job, or None if the instance has not written one
+    (e.g. still booting, or an older version of tibanna)"""
+    try:
+        return json.loads(read_s3(log_bucket, job_status_key(jobid)))
+    except Exception as e:
+        if 'NoSuchKey' in str(e) or 'Not Found' in str(e) or '404' in str(e):
+            return None
+        raise e
+
+
+def write_job_status(status, encrypt_s3_upload=False, kms_key_id=None):
+    status['updated_at'] = now_stamp()
+    put_object_s3(json.dumps(status, indent=4), job_status_key(status['jobid']), status['log_bucket'],
+                  public=False, encrypt_s3_upload=encrypt_s3_upload, kms_key_id=kms_key_id)
+    return status
+
+
+def mark_job_aborted(log_bucket, jobid, encrypt_s3_upload=False, kms_key_id=None):
+    """set the phase of a killed job in its status document, if it has one"""
+    status = read_job_status(log_bucket, jobid)
+    if status and status['phase'] not in JOB_END_PHASES:
+        write_job_status(set_phase(status, 'aborted'), encrypt_s3_upload=encrypt_s3_upload, kms_key_id=kms_key_id)
+    return status
@@ -1,12 +1,12 @@
 from tibanna.check_task import check_task
-from tibanna.vars import AWS_REGION
+from tibanna.vars import config as tibanna_config
 
 config = {
     'function_name': 'check_task_awsem',
     'function_module': 'service',
     'function_handler': 'handler',
     'handler': 'service.handler',
-    'region': AWS_REGION,
+    'region': tibanna_config.aws_region,
     'runtime': 'python3.11',
     'role': 'tibanna_lambda_init_role',
     'description': 'check status of AWSEM run by interegating appropriate files on S3 ',
@@ -1,5 +1,5 @@
 from tibanna.run_task import run_task
-from tibanna.vars import AWS_REGION
+from tibanna.vars import config as tibanna_config
 
 
 config = {
@@ -7,7 +7,7 @@ config = {
     'function_module': 'service',
     'function_handler': 'handler',
     'handler': 'service.handler',
-    'region': AWS_REGION,
+    'region': tibanna_config.aws_region,
     'runtime': 'python3.11',
     'role': 'tibanna_lambda_init_role',
     'description': 'launch an ec2 instance',
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""state of the launch of a job, kept across the retries of run_task.
+
+When no instance can be launched because of a capacity error and
+behavior_on_capacity_limit is wait_and_retry, run_task retries the launch itself
+for up to LAUNCH_RETRY_BUDGET seconds: the (instance type, subnet) pairs that
+returned InsufficientInstanceCapacity are excluded from the fleet requests for
+CAPACITY_EXCLUSION_SEC seconds and the other pairs are requested right away,
+and other capacity errors are retried after a short decorrelated-jitter backoff.
+Longer waits are left to the retries of the step function, so that the lambda
+is not kept running while it sleeps.
+
+If the job still has no instance, the launch plan (the config with the candidate
+instance types and the EBS size, the run json, the excluded pairs and the backoff
+delay) is saved as ``<jobid>.launch_plan.json`` in the log bucket before
+EC2InstanceLimitWaitException is raised. The step function retries run_task with
+the same input, and the next run_task starts from the plan instead of sizing the
+inputs, running the benchmark and ranking the instance types again. The plan is
+deleted once an instance is launched."""
+import json
+import random
+import time
+from . import create_logger
+from .base import SerializableObject
+from .utils import read_s3, put_object_s3, delete_keys
+
+
+LAUNCH_PLAN_VERSION = 1
+# a (instance type, subnet) pair without capacity is not requested again for this many seconds
+CAPACITY_EXCLUSION_SEC = 600
+# decorrelated jitter : each wait is drawn between LAUNCH_RETRY_BASE and 3 times the previous wait,
+# capped at LAUNCH_RETRY_CAP seconds
+LAUNCH_RETRY_BASE = 2
+LAUNCH_RETRY_CAP = 10
+# maximum time (seconds) run_task spends retrying a launch, the step function retries run_task after that
+LAUNCH_RETRY_BUDGET = 30
+
+
+logger = create_logger(__name__)
+
+
+class LaunchPlan(SerializableObject):
+
+    def __init__(self, jobid, config=None, runjson=None, instance_type_list=None, instance_type_infos=None,
+                 instance_prices=None, input_size_in_bytes=None, excluded=None, retry_delay=0, attempts=0,
+                 version=LAUNCH_PLAN_VERSION, **kwargs):
+        self.jobid = jobid
+        self.config = config
+        self.runjson = runjson
+        self.instance_type_list = instance_type_list
+        self.instance_type_infos = instance_type_infos
+        self.instance_prices = instance_prices
+        self.input_size_in_bytes = input_size_in_bytes
+        self.excluded = excluded or {}  # {'<instance_type>/<subnet>': <time until which the pair is excluded>}
+        self.retry_delay = retry_delay  # previous wait (seconds)
+        self.attempts = attempts  # number of fleet requests that failed for lack of capacity
+        self.version = version
+
+    @staticmethod
+    def key(jobid):
+        return jobid + '.launch_plan.json'
+
+    @classmethod
+    def load(cls, bucket, jobid):
+        """the launch plan saved by a previous run_task of the job, None if there is none"""
+        if not bucket or not jobid:
+            return None
+        try:
+            plan = cls(**json.loads(read_s3(bucket, cls.key(jobid))))
+        except Exception as e:
+            logger.debug("no launch plan for job %s : %s" % (jobid, str(e)))
+            return None
+        if plan.version != LAUNCH_PLAN_VERSION or plan.jobid != jobid or not plan.config:
+            return None
+        return plan
+
+    def save(self, bucket, encrypt_s3_upload=False, kms_key_id=None):
+        put_object_s3(json.dumps(self.as_dict(), sort_keys=True), self.key(self.jobid), bucket, public=False,
+                      encrypt_s3_upload=encrypt_s3_upload, kms_key_id=kms_key_id)
+
+    def delete(self, bucket):
+        delete_keys([self.key(self.jobid)], bucket)
+
+    # capacity
+
+    @staticmethod
+    def pair(instance_type, subnet=''):
+        return instance_type + '/' + (subnet or '')
+
+    def exclude(self, instance_type, subnet='', seconds=CAPACITY_EXCLUSION_SEC):
+        self.excluded[self.pair(instance_type, subnet)] = time.time() + seconds
+
+    def is_excluded(self, instance_type, subnet=''):
+        return self.excluded.get(self.pair(instance_type, subnet), 0) > time.time()
+
+    def next_expiry(self):
+        """time at which the first excluded pair can be requested again (now if there is none)"""
+        now = time.time()
+        self.excluded = {k: v for k, v in self.excluded.items() if v > now}
+        return min(self.excluded.values()) if self.excluded else now
+
+    def next_delay(self):
+        """decorrelated-jitter backoff delay (seconds) before the next launch attempt"""
+        self.retry_delay = min(LAUNCH_RETRY_CAP,
+                               random.uniform(LAUNCH_RETRY_BASE, max(LAUNCH_RETRY_BASE, self.retry_delay * 3)))
+        return self.retry_delay
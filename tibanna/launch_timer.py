@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""per-phase timing of the launch of a job.
+
+run_task goes through several phases (sizing the inputs, benchmark, uploading
+the run json, creating the launch template and the fleet, waiting for the
+instance description, etc.). LaunchTimer records the wall time of each phase
+and the number of AWS calls made during the phase, per operation (see
+aws_utils.set_call_counter). A phase that is entered several times (e.g.
+create_fleet after a capacity error) accumulates its time and calls.
+
+The summary (as_dict) is added to the config of the run json and of the output
+of run_task as ``launch_timing``."""
+import time
+import threading
+from contextlib import contextmanager
+from .aws_utils import set_call_counter, ThreadPoolExecutor
+
+
+class LaunchTimer(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = dict()  # {name: {'seconds':, 'count':, 'aws_calls': {'<service>.<operation>': n}}}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """time the block and count the AWS calls made by the current thread in the block,
+        including the tasks it runs in an aws_utils.ThreadPoolExecutor"""
+        counter = dict()
+        previous = set_call_counter(counter)
+        start = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - start
+            # the calls of a nested phase count for the nested phase only
+            set_call_counter(previous)
+            self.add(name, seconds, counter)
+
+    def add(self, name, seconds, aws_calls=None):
+        with self._lock:
+            p = self.phases.setdefault(name, {'seconds': 0.0, 'count': 0, 'aws_calls': {}})
+            p['seconds'] += seconds
+            p['count'] += 1
+            for op, n in (aws_calls or {}).items():
+                p['aws_calls'][op] = p['aws_calls'].get(op, 0) + n
+
+    def timed(self, name, func, *args, **kwargs):
+        with self.phase(name):
+            return func(*args, **kwargs)
+
+    def concurrently(self, *phases):
+        """run the phases [(name, func)] in parallel threads and return their results in order.
+        The exception of the first failed phase is raised after all of them are done."""
+        with ThreadPoolExecutor(max_workers=max(1, len(phases))) as executor:
+            futures = [executor.submit(self.timed, name, func) for name, func in phases]
+        return [f.result() for f in futures]
+
+    def as_dict(self):
+        with self._lock:
+            phases = {name: {'seconds': round(p['seconds'], 3), 'count': p['count'],
+                             'aws_calls': dict(sorted(p['aws_calls'].items()))}
+                      for name, p in self.phases.items()}
+        total_calls = dict()
+        for p in phases.values():
+            for op, n in p['aws_calls'].items():
+                total_calls[op] = total_calls.get(op, 0) + n
+        return {'total_seconds': round(time.time() - self.start, 3),
+                'phases': phases,
+                'aws_calls': dict(sorted(total_calls.items()))}
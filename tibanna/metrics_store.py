@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""time series of the CloudWatch agent metrics of an instance, fetched once.
+
+MetricsStore holds the metrics of an instance over a window on a common time
+axis : a sorted list of timestamps and, per metric, an array of the values at
+these timestamps (nan where the metric has no point). The summary statistics
+(max, min, percentiles, memory utilization) are reductions over slices of these
+arrays, and the TSV writer of TibannaResource reads its series from them.
+
+The metrics are retrieved with GetMetricData : all the metric queries of a window
+go in one request, and the windows (as many days as the points per request
+allow) are fetched concurrently.
+
+The latest stores are kept in the process (METRICS_STORE_CACHE_SIZE), so that the
+TibannaResource objects built for the same job (e.g. by CheckTask.handle_metrics
+and then API.plot_metrics) share a single retrieval : a store is reused for any
+window of the same instance that it covers.
+
+A store is also saved with the metrics report (``<jobid>.metrics/metrics_store.bin``,
+see to_bytes). Its endtime is the high-water mark of the metrics retrieved so far :
+the next report of a running job fetches the metrics from there on only
+(minus METRICS_REFETCH_MARGIN, for the points that CloudWatch had not
+aggregated yet) and appends them to the saved store."""
+import sys
+import math
+import json
+import zlib
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from . import create_logger
+from .vars import METRICS_COLLECTION_INTERVAL
+
+
+# data points returned by a GetMetricData request (all queries together, up to 500 queries)
+GET_METRIC_DATA_MAX_POINTS = 100800
+# metrics of the CloudWatch agent (namespace CWAgent) retrieved for a job;
+# the values are divided by scale (e.g. bytes to MB)
+METRIC_QUERIES = [
+    {'id': 'mem_used_percent', 'MetricName': 'mem_used_percent', 'Stat': 'Maximum', 'Unit': 'Percent', 'scale': 1},
+    {'id': 'mem_used', 'MetricName': 'mem_used', 'Stat': 'Maximum', 'Unit': 'Bytes', 'scale': math.pow(1024, 2)},
+    {'id': 'mem_available', 'MetricName': 'mem_available', 'Stat': 'Minimum', 'Unit': 'Bytes',
+     'scale': math.pow(1024, 2)},
+    {'id': 'cpu_usage_active', 'MetricName': 'cpu_usage_active', 'Stat': 'Maximum', 'Unit': 'Percent', 'scale': 1},
+    {'id': 'disk_used_percent', 'MetricName': 'disk_used_percent', 'Stat': 'Maximum', 'Unit': 'Percent', 'scale': 1},
+    {'id': 'disk_used', 'MetricName': 'disk_used', 'Stat': 'Maximum', 'Unit': 'Bytes', 'scale': math.pow(1024, 3)},
+    {'id': 'diskio_read_bytes', 'MetricName': 'diskio_read_bytes', 'Stat': 'Average', 'Unit': 'Bytes', 'scale': 1},
+]
+# windows fetched at the same time
+METRICS_FETCH_CONCURRENCY = 8
+# stores kept in the process
+METRICS_STORE_CACHE_SIZE = 4
+# percentiles in the summary of a metric
+SUMMARY_PERCENTILES = [50, 95]
+# file of the store saved with the metrics report, and its format version
+METRICS_STORE_FILENAME = 'metrics_store.bin'
+METRICS_STORE_VERSION = 1
+# seconds before the high-water mark of a saved store that are fetched again
+METRICS_REFETCH_MARGIN = 600
+
+
+logger = create_logger(__name__)
+
+
+def as_utc(t):
+    return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+
+def percentile(sorted_values, q):
+    """q-th percentile (0-100) of a sorted list, with linear interpolation"""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * q / 100
+    lo, hi = math.floor(k), math.ceil(k)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class MetricsStore(object):
+
+    def __init__(self, instance_id, starttime, endtime, timestamps=None, columns=None):
+        self.instance_id = instance_id
+        self.starttime = as_utc(starttime)
+        self.endtime = as_utc(endtime)
+        self.timestamps = timestamps or []
+        self.columns = columns or {q['id']: array('d') for q in METRIC_QUERIES}
+
+    @classmethod
+    def from_points(cls, instance_id, starttime, endtime, points):
+        """points is {metric id: [(timestamp, value)]}; the metrics are aligned on all their timestamps"""
+        timestamps = sorted(set(as_utc(t) for pts in points.values() for t, _ in pts))
+        index = {t: i for i, t in enumerate(timestamps)}
+        columns = dict()
+        for q in METRIC_QUERIES:
+            column = array('d', [math.nan]) * len(timestamps)
+            for t, v in points.get(q['id'], []):
+                column[index[as_utc(t)]] = v
+            columns[q['id']] = column
+        return cls(instance_id, starttime, endtime, timestamps, columns)
+
+    @classmethod
+    def fetch(cls, client, instance_id, starttime, endtime, concurrency=METRICS_FETCH_CONCURRENCY):
+        windows = cls.windows(starttime, endtime)
+        logger.info("Retrieving metrics in %d GetMetricData window(s)" % len(windows))
+        points = {q['id']: [] for q in METRIC_QUERIES}
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(windows)))) as executor:
+            for window_points in executor.map(lambda w: cls.get_metric_data(client, instance_id, *w), windows):
+                for metric_id, pts in window_points.items():
+                    points[metric_id].extend(pts)
+        return cls.from_points(instance_id, starttime, endtime, points)
+
+    @staticmethod
+    def windows(starttime, endtime):
+        """(start, end) of the GetMetricData requests, each covering as many days as the points per request allow"""
+        points_per_query = GET_METRIC_DATA_MAX_POINTS // len(METRIC_QUERIES)
+        window = timedelta(days=max(1, int(points_per_query * METRICS_COLLECTION_INTERVAL // 86400)))
+        windows = []
+        while starttime < endtime:
+            windows.append((starttime, min(starttime + window, endtime)))
+            starttime += window
+        return windows
+
+    @staticmethod
+    def get_metric_data(client, instance_id, starttime, endtime):
+        """{metric id: [(timestamp, value)]} for a window, in a single request (plus its next pages)"""
+        queries = [{'Id': q['id'],
+                    'MetricStat': {'Metric': {'Namespace': 'CWAgent',
+                                              'MetricName': q['MetricName'],
+                                              'Dimensions': [{'Name': 'InstanceId', 'Value': instance_id}]},
+                                   'Period': METRICS_COLLECTION_INTERVAL,
+                                   'Stat': q['Stat'],
+                                   'Unit': q['Unit']},
+                    'ReturnData': True} for q in METRIC_QUERIES]
+        scales = {q['id']: q['scale'] for q in METRIC_QUERIES}
+        points = {q['id']: [] for q in METRIC_QUERIES}
+        kwargs = dict(MetricDataQueries=queries, StartTime=starttime, EndTime=endtime,
+                      ScanBy='TimestampAscending')
+        while True:
+            res = client.get_metric_data(**kwargs)
+            for r in res['MetricDataResults']:
+                points[r['Id']].extend((t, v / scales[r['Id']]) for t, v in zip(r['Timestamps'], r['Values']))
+            if not res.get('NextToken'):
+                break
+            kwargs['NextToken'] = res['NextToken']
+        return points
+
+    def merge(self, new):
+        """a store with the points of this store before new.starttime followed by those of new"""
+        first = bisect_left(self.timestamps, new.starttime)
+        columns = {metric_id: self.columns[metric_id][:first] + new.columns[metric_id]
+                   for metric_id in self.columns}
+        return MetricsStore(self.instance_id, self.starttime, new.endtime,
+                            self.timestamps[:first] + new.timestamps, columns)
+
+    def to_bytes(self):
+        """compressed columnar encoding : a json header line, then the timestamps
+        (int64 epoch seconds) and each column (float64), little-endian"""
+        header = {'version': METRICS_STORE_VERSION, 'instance_id': self.instance_id,
+                  'starttime': self.starttime.isoformat(), 'endtime': self.endtime.isoformat(),
+                  'n': len(self.timestamps), 'metrics': [q['id'] for q in METRIC_QUERIES]}
+        arrays = [array('q', [int(t.timestamp()) for t in self.timestamps])] + \
+                 [self.columns[q['id']] for q in METRIC_QUERIES]
+        body = []
+        for a in arrays:
+            if sys.byteorder == 'big':
+                a = array(a.typecode, a)
+                a.byteswap()
+            body.append(a.tobytes())
+        return zlib.compress(json.dumps(header).encode('utf-8') + b'\n' + b''.join(body))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """the store encoded by to_bytes, or None if it was written by another version
+        or with other metrics"""
+        data = zlib.decompress(data)
+        header_line, body = data.split(b'\n', 1)
+        header = json.loads(header_line.decode('utf-8'))
+        if header.get('version') != METRICS_STORE_VERSION or \
+                header.get('metrics') != [q['id'] for q in METRIC_QUERIES]:
+            return None
+        n = header['n']
+        arrays = []
+        for i, typecode in enumerate(['q'] + ['d'] * len(METRIC_QUERIES)):
+            a = array(typecode)
+            a.frombytes(body[i * n * 8:(i + 1) * n * 8])
+            if sys.byteorder == 'big':
+                a.byteswap()
+            arrays.append(a)
+        timestamps = [datetime.fromtimestamp(t, timezone.utc) for t in arrays[0]]
+        columns = {q['id']: a for q, a in zip(METRIC_QUERIES, arrays[1:])}
+        return cls(header['instance_id'], datetime.fromisoformat(header['starttime']),
+                   datetime.fromisoformat(header['endtime']), timestamps, columns)
+
+    def covers(self, instance_id, starttime, endtime):
+        return instance_id == self.instance_id and \
+            self.starttime <= as_utc(starttime) and as_utc(endtime) <= self.endtime
+
+    def window(self, starttime=None, endtime=None):
+        """(first, last) indices of the points from starttime (included) to endtime (excluded)"""
+        first = bisect_left(self.timestamps, as_utc(starttime)) if starttime else 0
+        last = bisect_left(self.timestamps, as_utc(endtime)) if endtime else len(self.timestamps)
+        return first, last
+
+    def values(self, metric_id, starttime=None, endtime=None):
+        """values of a metric in a window, sorted by time"""
+        first, last = self.window(starttime, endtime)
+        return [v for v in self.columns[metric_id][first:last] if not math.isnan(v)]
+
+    def summary(self, starttime=None, endtime=None):
+        """{metric id: {'max':, 'min':, 'p50':, 'p95':}} in a window (None for a metric without points),
+        with 'max_mem_utilization_percent' (maximum memory used over the total memory)"""
+        summary = dict()
+        for q in METRIC_QUERIES:
+            values = sorted(self.values(q['id'], starttime, endtime))
+            stats = {'max': values[-1] if values else None, 'min': values[0] if values else None}
+            for p in SUMMARY_PERCENTILES:
+                stats['p%d' % p] = percentile(values, p)
+            summary[q['id']] = stats
+        max_mem_used, min_mem_available = summary['mem_used']['max'], summary['mem_available']['min']
+        if max_mem_used and min_mem_available is not None:
+            summary['max_mem_utilization_percent'] = max_mem_used / (max_mem_used + min_mem_available) * 100
+        else:
+            summary['max_mem_utilization_percent'] = None
+        return summary
+
+
+_stores = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_metrics_store(client, instance_id, starttime, endtime, concurrency=METRICS_FETCH_CONCURRENCY, saved=None):
+    """the store of the metrics of an instance from starttime to endtime (not later than now),
+    fetched unless a recent store of the instance covers the window.
+    saved is a store saved by an earlier report of the job, if any : only the metrics
+    after its high-water mark are fetched."""
+    starttime = as_utc(starttime)
+    endtime = min(as_utc(endtime), datetime.now(timezone.utc))
+    with _lock:
+        for key, store in reversed(_stores.items()):
+            if store.covers(instance_id, starttime, endtime):
+                _stores.move_to_end(key)
+                return store
+    if saved and saved.covers(instance_id, starttime, endtime):
+        store = saved
+    elif saved and saved.covers(instance_id, starttime, saved.endtime):
+        since = max(saved.starttime, saved.endtime - timedelta(seconds=METRICS_REFETCH_MARGIN))
+        logger.info("Retrieving the metrics after %s" % str(since))
+        store = saved.merge(MetricsStore.fetch(client, instance_id, since, endtime, concurrency=concurrency))
+    else:
+        store = MetricsStore.fetch(client, instance_id, starttime, endtime, concurrency=concurrency)
+    with _lock:
+        _stores[(instance_id, starttime, endtime)] = store
+        while len(_stores) > METRICS_STORE_CACHE_SIZE:
+            _stores.popitem(last=False)
+    return store
+
+
+def clear_metrics_stores():
+    with _lock:
+        _stores.clear()
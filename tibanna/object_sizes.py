@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""sizes of (many) S3 objects or prefixes ('folders'), e.g. the input files of a job.
+
+Objects are resolved on a thread pool. Keys that share a directory are resolved
+together with a single paginated list_objects_v2 listing instead of a head_object
+per key, as long as the listing stays dense enough (otherwise the remaining keys
+fall back to head_object). Sizes are remembered in the process for
+OBJECT_SIZE_TTL seconds, so that a rerun in a warm lambda (or an ``ebs_size``
+of e.g. "3x") does not ask S3 again for the same objects. An object overwritten
+in the meantime only makes the EBS size estimate off; ETags, which the call cache
+relies on, are not remembered and always come from a fresh head_object."""
+import time
+import threading
+from . import create_logger
+from .aws_utils import get_client, ThreadPoolExecutor
+
+
+# the size of an object learned from S3 is reused for this many seconds
+OBJECT_SIZE_TTL = 300
+# keys in the same directory are listed together if there are at least this many
+PREFIX_LISTING_MIN_KEYS = 5
+# a listing is abandoned if a page of (up to 1000) objects resolves fewer keys than this on average
+PREFIX_LISTING_MIN_KEYS_PER_PAGE = 50
+
+
+logger = create_logger(__name__)
+
+
+class ObjectSizeCache(object):
+    """{(bucket, key): size} with a time to live"""
+
+    def __init__(self, ttl=OBJECT_SIZE_TTL):
+        self.ttl = ttl
+        self.sizes = dict()
+        self._lock = threading.Lock()
+
+    def get(self, bucket, key):
+        """the size, or None if it is not known (or too old)"""
+        with self._lock:
+            size = self.sizes.get((bucket, key))
+        if size and time.time() - size[1] <= self.ttl:
+            return size[0]
+        return None
+
+    def put(self, bucket, key, size):
+        with self._lock:
+            self.sizes[(bucket, key)] = (size, time.time())
+
+    def clear(self):
+        with self._lock:
+            self.sizes = dict()
+
+
+# shared by the jobs in the same process (e.g. warm lambda invocations)
+object_size_cache = ObjectSizeCache()
+
+
+def get_object_etag(bucket, key):
+    """ETag of an object, always from a head_object (never from a cache, since the call cache
+    must see an object that was just overwritten). The size is remembered in object_size_cache."""
+    res = get_client('s3').head_object(Bucket=bucket, Key=key)
+    object_size_cache.put(bucket, key, res['ContentLength'])
+    return res['ETag'].strip('"')
+
+
+def list_objects(bucket, prefix, start_after=None):
+    """iterate over the pages of the objects under prefix (list_objects_v2)"""
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    for page in get_client('s3').get_paginator('list_objects_v2').paginate(**kwargs):
+        yield page.get('Contents', [])
+
+
+class ObjectSizeResolver(object):
+    """e.g. ObjectSizeResolver().sizes([(bucket, key1), (bucket, key2)])
+    returns {(bucket, key1): size1, (bucket, key2): size2}.
+    The size of a key that is not an object is the total size of the objects under that prefix,
+    and None if it cannot be retrieved (e.g. no permission), as in get_file_size."""
+
+    def __init__(self, concurrency=32, cache=object_size_cache):
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+
+    def sizes(self, objects):
+        sizes = dict()
+        groups = dict()  # {(bucket, directory): [keys]}
+        for bucket, key in set(objects):
+            size = self.cache.get(bucket, key)
+            if size is not None:
+                sizes[(bucket, key)] = size
+            else:
+                groups.setdefault((bucket, key[:key.rfind('/') + 1]), []).append(key)
+        tasks = []
+        for (bucket, directory), keys in groups.items():
+            if len(keys) >= PREFIX_LISTING_MIN_KEYS:
+                tasks.append((self.list_sizes, bucket, directory, sorted(keys)))
+            else:
+                tasks.extend((self.head_size, bucket, key) for key in keys)
+        if len(tasks) == 1:
+            results = [tasks[0][0](*tasks[0][1:])]
+        elif tasks:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(tasks))) as executor:
+                results = list(executor.map(lambda t: t[0](*t[1:]), tasks))
+        else:
+            results = []
+        for task, res in zip(tasks, results):
+            if task[0] == self.head_size:
+                sizes[(task[1], task[2])] = res
+            else:
+                sizes.update({(task[1], key): size for key, size in res.items()})
+        return sizes
+
+    def head_size(self, bucket, key):
+        try:
+            res = get_client('s3').head_object(Bucket=bucket, Key=key)
+        except Exception:
+            pass
+        else:
+            self.cache.put(bucket, key, res['ContentLength'])
+            return res['ContentLength']
+        try:
+            size = 0
+            for contents in list_objects(bucket, key):
+                size += sum(item['Size'] for item in contents)
+        except Exception:
+            return None  # e.g. no permission to the bucket from the lambda
+        self.cache.put(bucket, key, size)
+        return size
+
+    def list_sizes(self, bucket, directory, keys):
+        """sizes of the (sorted) keys in the same directory from one listing.
+        Every object is added to the size of each key that it starts with, unless the key is an object itself."""
+        keyset = set(keys)
+        exact = dict()
+        prefix_sizes = {key: 0 for key in keys}
+        max_pages = max(1, len(keys) // PREFIX_LISTING_MIN_KEYS_PER_PAGE)
+        last_key = None
+        done = False
+        try:
+            # start right before the first key
+            for n_pages, contents in enumerate(list_objects(bucket, directory, start_after=keys[0][:-1])):
+                for item in contents:
+                    last_key = item['Key']
+                    matched = False
+                    for i in range(max(1, len(directory)), len(last_key) + 1):
+                        if last_key[:i] in keyset:
+                            prefix_sizes[last_key[:i]] += item['Size']
+                            matched = True
+                    if last_key in keyset:
+                        exact[last_key] = item['Size']
+                    if not matched and last_key > keys[-1]:
+                        done = True
+                        break
+                if done or n_pages + 1 >= max_pages:
+                    break
+            else:
+                done = True
+        except Exception as e:
+            logger.debug("cannot list %s/%s : %s" % (bucket, directory, str(e)))
+            return {key: self.head_size(bucket, key) for key in keys}
+        sizes = dict()
+        for key in keys:
+            if key in exact:
+                sizes[key] = exact[key]
+                self.cache.put(bucket, key, exact[key])
+            elif done or (last_key is not None and key < last_key and not last_key.startswith(key)):
+                sizes[key] = prefix_sizes[key]
+                self.cache.put(bucket, key, prefix_sizes[key])
+            else:
+                # the listing was too sparse to get to this key
+                sizes[key] = self.head_size(bucket, key)
+        return sizes
+
+
+def get_object_sizes(objects, concurrency=32):
+    """{(bucket, key): size} for a list of (bucket, key)"""
+    return ObjectSizeResolver(concurrency=concurrency).sizes(objects)
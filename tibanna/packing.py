@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""packing of several small jobs onto one (larger) instance.
+
+Compatible jobs (same architecture, log bucket, awsf image, spot and EBS options, network settings etc.)
+that specify cpu and mem are grouped by first-fit decreasing into bins of at most
+max_cpu vCPUs, max_mem GB and max_jobs jobs. The first job of a bin (the primary job)
+launches an instance with the total cpu, memory and EBS size of the bin and lists all
+the jobs of the bin in config.packed_jobs; the other jobs get config.packed_into
+(the job id of the primary job) and do not launch an instance.
+
+On the instance, each job runs in its own awsf container, limited to its cpu and memory,
+with its own data directory. Each job still has its own step function execution,
+log, postrun json and .success/.error files, so CheckTask and the other API
+functions work per job. Instance-level metrics are shared by the jobs of a bin.
+The instance of a packed job is the one recorded in the job table for its primary
+job (see host_instance)."""
+import copy
+from . import create_logger
+from .plan import Planner
+from .job import Job
+from .utils import create_jobid
+from .vars import EXECUTION_ARN
+
+
+logger = create_logger(__name__)
+
+
+# config fields that must be identical for the jobs that share an instance
+PACK_CONFIG_FIELDS = ['log_bucket', 'awsf_image', 'spot_instance', 'spot_duration', 'behavior_on_capacity_limit',
+                      'ebs_type', 'ebs_iops', 'ebs_throughput', 'root_ebs_size', 'EBS_optimized',
+                      'subnet', 'security_group', 'availability_zone', 'key_name', 'password',
+                      'ami_id', 'ami_per_region', 'encrypt_s3_upload', 'kms_key_id',
+                      'disable_metrics_collection', 'shutdown_min', 'public_postrun_json', 'singularity']
+# step function execution statuses of a primary job that will not launch an instance any more
+LAUNCH_FAILED_STATUSES = ['FAILED', 'TIMED_OUT', 'ABORTED']
+# WDL tasks need the default docker network, which is not available to the jobs on a shared instance
+PACK_LANGUAGES = ['cwl_v1', 'shell', 'snakemake']
+
+
+class JobPacker(object):
+
+    def __init__(self, max_cpu=16, max_mem=64, max_jobs=8, concurrency=32):
+        self.max_cpu = max_cpu
+        self.max_mem = max_mem
+        self.max_jobs = max_jobs
+        self.planner = Planner(concurrency=concurrency)
+
+    def pack(self, input_jsons):
+        """returns the input dicts of the given input jsons (files or dicts) in the same order,
+        with job ids and the packing fields filled in. An input json that cannot be read
+        is returned as it is and is not packed."""
+        input_dicts = [copy.deepcopy(self.planner.load(_)) for _ in input_jsons]
+        for d in input_dicts:
+            if d is not None and not d.get('jobid'):
+                d['jobid'] = create_jobid()
+        self.planner.prefetch([d for d in input_dicts if d])
+        groups = dict()
+        for i, d in enumerate(input_dicts):
+            if d is None:
+                input_dicts[i] = input_jsons[i]  # reported by its own submission
+                continue
+            job, cfg = self.planner.plan_job(d)
+            if self.packable(d, cfg):
+                key = self.compatibility_key(cfg, self.arch(job.instance_type))
+                groups.setdefault(key, []).append((i, cfg.cpu, cfg.mem, job.ebs_size))
+        for jobs in groups.values():
+            for bin in self.first_fit(jobs):
+                if len(bin) > 1:
+                    self.fill_bin([input_dicts[i] for i, _, _, _ in bin], bin)
+        return input_dicts
+
+    def packable(self, input_dict, cfg):
+        if cfg is None or cfg.instance_type or not cfg.cpu or not cfg.mem:
+            return False
+        if cfg.call_cache or cfg.warm_pool or cfg.packed_into or cfg.packed_jobs:
+            return False
+        if input_dict.get('args', {}).get('dependency'):
+            return False
+        if cfg.language not in PACK_LANGUAGES:
+            return False
+        return cfg.cpu <= self.max_cpu and cfg.mem <= self.max_mem
+
+    def arch(self, instance_type):
+        return self.planner.instance_type_infos.get(instance_type, {}).get('arch')
+
+    @staticmethod
+    def compatibility_key(cfg, arch):
+        """jobs with the same key can share an instance"""
+        return str([arch] + [getattr(cfg, field, None) for field in PACK_CONFIG_FIELDS])
+
+    def first_fit(self, jobs):
+        """first-fit decreasing bin packing of [(index, cpu, mem, ebs_size)].
+        Each bin keeps the input order of its jobs."""
+        bins = []
+        for job in sorted(jobs, key=lambda j: (j[2], j[1]), reverse=True):
+            for bin in bins:
+                if len(bin) < self.max_jobs and sum(j[1] for j in bin) + job[1] <= self.max_cpu \
+                   and sum(j[2] for j in bin) + job[2] <= self.max_mem:
+                    bin.append(job)
+                    break
+            else:
+                bins.append([job])
+        return [sorted(bin) for bin in bins]
+
+    @staticmethod
+    def fill_bin(input_dicts, bin):
+        primary = input_dicts[0]
+        packed_jobs = [{'jobid': d['jobid'], 'cpu': cpu, 'mem': mem}
+                       for d, (_, cpu, mem, _) in zip(input_dicts, bin)]
+        primary['config'].update({'cpu': sum(j[1] for j in bin),
+                                  'mem': sum(j[2] for j in bin),
+                                  # each job has its own docker overhead
+                                  'ebs_size': sum(j[3] for j in bin),
+                                  'ebs_size_as_is': True,
+                                  'packed_jobs': packed_jobs})
+        for d in input_dicts[1:]:
+            d['config']['packed_into'] = primary['jobid']
+        logger.info("jobs %s are packed onto the instance of job %s" %
+                    (', '.join(d['jobid'] for d in input_dicts[1:]), primary['jobid']))
+
+
+def pack(input_jsons, max_cpu=16, max_mem=64, max_jobs=8):
+    return JobPacker(max_cpu=max_cpu, max_mem=max_mem, max_jobs=max_jobs).pack(input_jsons)
+
+
+def host_instance(primary_jobid):
+    """(instance id, launch failed) of the instance of a primary job, which its packed jobs share.
+    The instance id is added to the job table once the instance is launched; until then,
+    the launch failed if the step function execution of the primary job is over."""
+    info = Job.info(primary_jobid) or {}
+    if info.get('instance_id'):
+        return info['instance_id'], False
+    if not info.get('Execution Name'):
+        return '', False
+    exec_arn = EXECUTION_ARN(info['Execution Name'], info.get('Step Function', ''))
+    return '', Job.describe_exec(exec_arn)['status'] in LAUNCH_FAILED_STATUSES
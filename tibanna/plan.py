@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""offline launch planner : instance types, EBS sizes and estimated costs of many jobs,
+without submitting anything.
+
+The planner runs the same logic as run_task (UnicornInput -> Execution ->
+create_instance_type_list / update_config_ebs_size) and get_cost_estimate,
+but input sizes, instance type descriptions and prices are fetched once for
+the whole plan (in parallel) instead of once per job."""
+import os
+import glob
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from . import create_logger
+from .base import SerializableObject
+from .ec2_utils import Execution, describe_instance_types, get_file_size
+from .object_sizes import get_object_sizes
+from .nnested_array import flatten
+from .pricing_utils import (
+    get_cost_estimate,
+    get_ec2_ondemand_price,
+    get_ec2_spot_price,
+    get_ebs_storage_price,
+    get_ebs_iops_price,
+    get_ebs_throughput_price,
+    get_ebs_io2_iops_prices
+)
+
+
+logger = create_logger(__name__)
+
+
+PLAN_TIME_STAMP_FORMAT = '%Y%m%d-%H:%M:%S-UTC'
+PLAN_TSV_COLUMNS = ['input_json', 'jobid', 'app_name', 'status', 'instance_type', 'n_instance_types',
+                    'ebs_size', 'ebs_type', 'spot_instance', 'input_size_in_gb', 'hourly_price',
+                    'estimated_cost', 'error']
+
+
+class PlanExecution(Execution):
+    """Execution that takes input sizes and instance type descriptions from a Planner"""
+
+    def __init__(self, input_dict, planner):
+        self.planner = planner
+        super().__init__(input_dict, dryrun=True)
+
+    def get_file_sizes(self, objects):
+        return {(bucket, key): self.planner.file_size(bucket, key) for bucket, key in objects}
+
+    def describe_instance_types(self, instance_types):
+        return {it: self.planner.instance_type_infos[it] for it in instance_types
+                if it in self.planner.instance_type_infos}
+
+
+class PlannedJob(SerializableObject):
+    def __init__(self, input_json=None, jobid=None, app_name=None, status='PLANNED',
+                 instance_type=None, instance_type_list=None, ebs_size=None, ebs_type=None,
+                 spot_instance=False, input_size_in_gb=None, hourly_price=None,
+                 estimated_cost=None, error=None):
+        self.input_json = input_json
+        self.jobid = jobid
+        self.app_name = app_name
+        self.status = status  # PLANNED or FAILED
+        self.instance_type = instance_type
+        self.instance_type_list = instance_type_list
+        self.ebs_size = ebs_size
+        self.ebs_type = ebs_type
+        self.spot_instance = spot_instance
+        self.input_size_in_gb = input_size_in_gb
+        self.hourly_price = hourly_price
+        self.estimated_cost = estimated_cost
+        self.error = error
+
+    def as_row(self):
+        d = self.as_dict()
+        d['n_instance_types'] = len(self.instance_type_list or [])
+        return ['' if d.get(c) is None else str(d[c]) for c in PLAN_TSV_COLUMNS]
+
+
+class PlanReport(object):
+    def __init__(self, jobs, hours, elapsed=None):
+        self.jobs = jobs
+        self.hours = hours
+        self.elapsed = elapsed
+
+    @property
+    def planned(self):
+        return [j for j in self.jobs if j.status == 'PLANNED']
+
+    @property
+    def failed(self):
+        return [j for j in self.jobs if j.status == 'FAILED']
+
+    @property
+    def totals(self):
+        instance_types = dict()
+        for j in self.planned:
+            instance_types[j.instance_type] = instance_types.get(j.instance_type, 0) + 1
+        return {'n_jobs': len(self.jobs),
+                'n_planned': len(self.planned),
+                'n_failed': len(self.failed),
+                'hours_per_job': self.hours,
+                'total_ebs_size': sum(j.ebs_size or 0 for j in self.planned),
+                'total_input_size_in_gb': sum(j.input_size_in_gb or 0 for j in self.planned),
+                'total_estimated_cost': sum(j.estimated_cost or 0 for j in self.planned),
+                'n_jobs_without_cost_estimate': len([j for j in self.planned if j.estimated_cost is None]),
+                'instance_types': instance_types}
+
+    def as_dict(self):
+        return {'totals': self.totals, 'elapsed': self.elapsed,
+                'jobs': [j.as_dict() for j in self.jobs]}
+
+    def as_tsv(self):
+        lines = ['\t'.join(PLAN_TSV_COLUMNS)]
+        for j in self.jobs:
+            lines.append('\t'.join(j.as_row()))
+        totals = self.totals
+        lines.append('\t'.join(['TOTAL', '', '', '%d/%d' % (totals['n_planned'], totals['n_jobs']), '', '',
+                                str(totals['total_ebs_size']), '', '', str(totals['total_input_size_in_gb']), '',
+                                str(totals['total_estimated_cost']), '']))
+        return '\n'.join(lines) + '\n'
+
+    def write_tsv(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.as_tsv())
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=4)
+
+
+class Planner(object):
+    """plan many jobs. hours is the assumed run time of each job (for the cost estimate)"""
+    PlanExecution = PlanExecution
+
+    def __init__(self, hours=1.0, concurrency=32):
+        self.hours = hours
+        self.concurrency = max(1, concurrency)
+        self.file_sizes = dict()
+        self.instance_type_infos = dict()
+        self.prices = dict()
+        self.costs = dict()
+        self._lock = threading.Lock()
+
+    def plan(self, input_jsons):
+        """input_jsons is a list of input json files and/or dictionaries,
+        or a directory that contains input json files"""
+        start = time.time()
+        if isinstance(input_jsons, str) and os.path.isdir(input_jsons):
+            input_jsons = sorted(glob.glob(os.path.join(input_jsons, '*.json')))
+        inputs = [(_ if isinstance(_, str) else None, self.load(_)) for _ in input_jsons]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            self.prefetch([d for _, d in inputs if d])
+            planned = [self.plan_job(d, name) for name, d in inputs]
+            self.prefetch_prices(executor, planned)
+        for job, cfg in planned:
+            if cfg:
+                self.add_cost(job, cfg)
+        jobs = [job for job, _ in planned]
+        return PlanReport(jobs, self.hours, elapsed=time.time() - start)
+
+    @staticmethod
+    def load(input_json):
+        if isinstance(input_json, dict):
+            return input_json
+        try:
+            with open(input_json) as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning("cannot read input json %s : %s" % (input_json, str(e)))
+            return None
+
+    # data fetched once per plan
+
+    def prefetch(self, input_dicts):
+        objects = set()  # (bucket, key)
+        for d in input_dicts:
+            for category in ['input_files', 'secondary_files']:
+                for f in d.get('args', {}).get(category, {}).values():
+                    for key in flatten([f.get('object_key')]):
+                        if key:
+                            objects.add((f.get('bucket_name'), key))
+        self.file_sizes.update(get_object_sizes(objects, concurrency=self.concurrency))
+        self.instance_type_infos.update(describe_instance_types())
+
+    def file_size(self, bucket, key):
+        if (bucket, key) not in self.file_sizes:
+            with self._lock:
+                self.file_sizes[(bucket, key)] = get_file_size(key, bucket)
+        return self.file_sizes[(bucket, key)]
+
+    def prefetch_prices(self, executor, planned):
+        price_keys = set()
+        for job, cfg in planned:
+            if cfg:
+                price_keys.update(self.price_keys(job.instance_type, cfg))
+        price_keys = list(price_keys)
+        prices = executor.map(self.fetch_price, price_keys)
+        self.prices.update(zip(price_keys, prices))
+
+    @staticmethod
+    def price_keys(instance_type, cfg):
+        """(price name in aws_price_overwrite of get_cost_estimate, argument) of the prices needed for a job"""
+        keys = [('ec2_spot_price' if cfg.spot_instance else 'ec2_ondemand_price', instance_type),
+                ('ebs_root_storage_price', 'gp3')]
+        if cfg.ebs_type != 'gp3':
+            keys.append(('ebs_storage_price', cfg.ebs_type))
+        if cfg.ebs_type == 'gp3' and cfg.ebs_throughput:
+            keys.append(('ebs_throughput_price', cfg.ebs_type))
+        if cfg.ebs_type in ['io1', 'gp3'] and cfg.ebs_iops:
+            keys.append(('ebs_iops_price', cfg.ebs_type))
+        if cfg.ebs_type == 'io2' and cfg.ebs_iops:
+            keys.append(('ebs_io2_iops_prices', cfg.ebs_type))
+        return keys
+
+    @staticmethod
+    def fetch_price(price_key):
+        name, arg = price_key
+        functions = {'ec2_spot_price': get_ec2_spot_price,
+                     'ec2_ondemand_price': get_ec2_ondemand_price,
+                     'ebs_root_storage_price': get_ebs_storage_price,
+                     'ebs_storage_price': get_ebs_storage_price,
+                     'ebs_throughput_price': get_ebs_throughput_price,
+                     'ebs_iops_price': get_ebs_iops_price,
+                     'ebs_io2_iops_prices': lambda _: get_ebs_io2_iops_prices()}
+        try:
+            return functions[name](arg)
+        except Exception as e:
+            logger.warning("cannot retrieve %s for %s : %s" % (name, arg, str(e)))
+            return None
+
+    # per job
+
+    def plan_job(self, input_dict, name=None):
+        """return a PlannedJob and the filled-in config of the job (None if planning failed)"""
+        if not input_dict:
+            return PlannedJob(input_json=name, status='FAILED', error='cannot read input json'), None
+        try:
+            execution = self.PlanExecution(input_dict, self)
+        except Exception as e:
+            return PlannedJob(input_json=name, jobid=input_dict.get('jobid'), status='FAILED', error=str(e)), None
+        cfg = execution.cfg
+        job = PlannedJob(input_json=name, jobid=execution.jobid, app_name=execution.args.app_name,
+                         instance_type=execution.instance_type_list[0],
+                         instance_type_list=execution.instance_type_list,
+                         ebs_size=cfg.ebs_size, ebs_type=cfg.ebs_type, spot_instance=cfg.spot_instance,
+                         input_size_in_gb=execution.total_input_size_in_gb)
+        return job, cfg
+
+    def add_cost(self, job, cfg):
+        overwrite = dict()
+        for name, arg in self.price_keys(job.instance_type, cfg):
+            if self.prices.get((name, arg)) is None:
+                return  # no cost estimate without prices
+            overwrite[name] = self.prices[(name, arg)]
+        job.hourly_price = overwrite.get('ec2_spot_price', overwrite.get('ec2_ondemand_price'))
+        # jobs with the same instance type and EBS settings have the same cost
+        cost_key = (job.instance_type, cfg.spot_instance, cfg.spot_duration, cfg.root_ebs_size,
+                    cfg.ebs_type, cfg.ebs_size, cfg.ebs_iops, cfg.ebs_throughput)
+        if cost_key not in self.costs:
+            start = datetime.now(timezone.utc)
+            end = start + timedelta(hours=self.hours)
+            prj = self.postrun_json(job, cfg, start.strftime(PLAN_TIME_STAMP_FORMAT),
+                                    end.strftime(PLAN_TIME_STAMP_FORMAT))
+            self.costs[cost_key], _ = get_cost_estimate(prj, aws_price_overwrite=overwrite)
+        job.estimated_cost = self.costs[cost_key]
+
+    @staticmethod
+    def postrun_json(job, cfg, start_time, end_time):
+        from .awsem import AwsemPostRunJson
+        prj = AwsemPostRunJson(Job={'JOBID': job.jobid, 'start_time': start_time, 'end_time': end_time,
+                                    'instance_type': job.instance_type}, strict=False)
+        prj.config = cfg
+        return prj
+
+
+def plan(input_jsons, hours=1.0, concurrency=32):
+    return Planner(hours=hours, concurrency=concurrency).plan(input_jsons)
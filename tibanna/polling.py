@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""adaptive polling of the jobs by the unicorn step function.
+
+The CheckTaskAwsem state is part of a Wait/Choice loop. While the job is not
+over, check_task returns the job with ``poll`` ({'state':, 'interval':,
+'n_checks':}) and the step function waits ``poll.interval`` seconds before the
+next check. The interval is short while the instance boots and grows with the
+elapsed time of the job, or, if the resource model of the app predicts the run
+time, halves towards the predicted end. It is bounded by ``poll_min_interval``
+and ``poll_max_interval`` of the config."""
+from datetime import datetime
+from dateutil.tz import tzutc
+from .vars import PARSE_AWSEM_TIME
+
+
+# default bounds (seconds) of the interval between two checks of a job
+POLL_MIN_INTERVAL = 30
+POLL_MAX_INTERVAL = 1800
+# without a predicted run time, a running job is checked again after this fraction of its elapsed time
+POLL_ELAPSED_FRACTION = 0.1
+
+
+def next_poll_interval(state, elapsed, predicted_runtime=None,
+                       min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+    """seconds until the next check of a job that is 'starting' or 'running' since elapsed seconds.
+    predicted_runtime (seconds) is the run time predicted for the job, if any."""
+    max_interval = max(min_interval, max_interval)
+    if state == 'starting':
+        interval = min_interval
+    elif predicted_runtime and elapsed < predicted_runtime:
+        interval = (predicted_runtime - elapsed) / 2
+    else:
+        interval = elapsed * POLL_ELAPSED_FRACTION
+    return int(min(max(interval, min_interval), max_interval))
+
+
+def poll_job(input_json, state, now=None):
+    """the next poll of a job (check_task input) that is not over"""
+    cfg = input_json['config']
+    now = now or datetime.now(tzutc())
+    try:
+        elapsed = max((now - PARSE_AWSEM_TIME(cfg['start_time'])).total_seconds(), 0)
+    except Exception:
+        elapsed = 0
+    predicted_runtime = (cfg.get('resource_prediction') or {}).get('runtime')
+    interval = next_poll_interval(state, elapsed,
+                                  predicted_runtime=predicted_runtime * 60 if predicted_runtime else None,
+                                  min_interval=cfg.get('poll_min_interval') or POLL_MIN_INTERVAL,
+                                  max_interval=cfg.get('poll_max_interval') or POLL_MAX_INTERVAL)
+    n_checks = (input_json.get('poll') or {}).get('n_checks', 0) + 1
+    return {'state': state, 'interval': interval, 'n_checks': n_checks}
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""resource models of apps, fitted on the metrics of their past jobs.
+
+Each finished job has a postrun json with the maximum memory, CPU utilization,
+disk space and EBS read bytes of its instance (Job.Metrics), its start and end
+times and the size of its input directory (Job.total_input_size). For each app, the model fits every
+resource as a linear function of the input size (least squares, with a
+non-negative slope) and adds the largest under-prediction of the fit, so that the
+model covers all the past jobs. A prediction is the model value times
+(1 + margin).
+
+Models are built with build_models from postrun jsons (files, dicts or the
+postrun jsons of a log bucket) and kept in a ModelStore, either a local
+directory or ``<prefix><app_name>.json`` in a log bucket. Execution uses the
+model of the app in the log bucket instead of Benchmark when use_benchmark is on
+and the model has at least PREDICTOR_MIN_JOBS jobs."""
+import os
+import re
+import json
+import math
+import time
+import threading
+from . import create_logger
+from .aws_utils import ThreadPoolExecutor
+from .utils import read_s3, put_object_s3
+from .vars import METRICS_COLLECTION_INTERVAL, PARSE_AWSEM_TIME
+from .instance_type_cache import benchmark_instance_list
+from .object_sizes import list_objects
+
+
+RESOURCE_MODEL_PREFIX = '.tibanna_models/'
+RESOURCE_MODEL_VERSION = 1
+# default safety margin of the predictions (0.2 = 20% more than the model)
+PREDICTION_MARGIN = 0.2
+PREDICTOR_MIN_JOBS = 3
+# models read from a log bucket are reused for this many seconds in the same process
+RESOURCE_MODEL_CACHE_TTL = 600
+# resources of a model : cpu (vCPUs used), mem (GB), disk (GB of the data EBS), throughput (MiB/s of EBS read),
+# runtime (minutes)
+RESOURCES = ['cpu', 'mem', 'disk', 'throughput', 'runtime']
+# gp3 volumes have this throughput (MiB/s) without provisioning,
+# and at most GP3_MAX_THROUGHPUT with the baseline 3000 IOPS (0.25 MiB/s per IOPS)
+GP3_BASELINE_THROUGHPUT = 125
+GP3_MAX_THROUGHPUT = 750
+
+
+logger = create_logger(__name__)
+
+
+def parse_size_in_gb(size):
+    """size in GB of a human-readable size printed by du -h (e.g. '1.5G', '300M', '0')"""
+    if size is None or size == '':
+        return None
+    if isinstance(size, (int, float)):
+        return float(size)
+    m = re.match(r'^\s*([0-9.]+)\s*([KMGTP]?)', str(size).upper())
+    if not m:
+        return None
+    exponent = {'': -3, 'K': -2, 'M': -1, 'G': 0, 'T': 1, 'P': 2}[m.group(2)]
+    return float(m.group(1)) * math.pow(1024, exponent)
+
+
+def job_record(postrunjson, vcpus=None):
+    """{'app_name':, 'input_gb':, 'cpu':, 'mem':, 'disk':, 'throughput':, 'runtime':} of a postrun json (dict),
+    None if the job has no metrics. vcpus is {instance_type: number of vCPUs}."""
+    job = postrunjson.get('Job', {})
+    metrics = job.get('Metrics') or {}
+    app_name = (job.get('App') or {}).get('App_name')
+    input_gb = parse_size_in_gb(job.get('total_input_size'))
+    if not app_name or input_gb is None or not metrics.get('max_mem_used_MB'):
+        return None
+    if vcpus is None:
+        vcpus = {i['instance_type']: i['cpu'] for i in benchmark_instance_list()}
+
+    def number(field):
+        value = metrics.get(field)
+        return float(value) if isinstance(value, (int, float)) else None
+    record = {'app_name': app_name, 'input_gb': input_gb,
+              'mem': number('max_mem_used_MB') / 1024,
+              'disk': number('max_disk_space_used_GB'),
+              'cpu': None, 'throughput': None, 'runtime': None}
+    cpu_percent = number('max_cpu_utilization_percent')
+    if cpu_percent is not None and job.get('instance_type') in vcpus:
+        record['cpu'] = cpu_percent / 100 * vcpus[job['instance_type']]
+    read_bytes = number('max_ebs_read_bytes')
+    if read_bytes is not None:
+        # bytes read per collection interval
+        record['throughput'] = read_bytes / METRICS_COLLECTION_INTERVAL / math.pow(1024, 2)
+    try:
+        record['runtime'] = (PARSE_AWSEM_TIME(job['end_time']) -
+                             PARSE_AWSEM_TIME(job['start_time'])).total_seconds() / 60
+    except Exception:
+        pass  # not finished, or an unknown time format
+    return record
+
+
+def fit(points):
+    """least-squares line through [(x, y)] with a non-negative slope, and the largest
+    under-prediction of the line (residual) : {'intercept':, 'slope':, 'residual':, 'n':}"""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x if var_x else 0.0
+    if slope < 0:
+        slope = 0.0
+    intercept = mean_y - slope * mean_x
+    residual = max(y - (intercept + slope * x) for x, y in points)
+    return {'intercept': intercept, 'slope': slope, 'residual': max(residual, 0.0), 'n': n}
+
+
+class ResourceModel(object):
+
+    def __init__(self, app_name, fits=None, n_jobs=0, max_input_gb=0, created=None, version=RESOURCE_MODEL_VERSION):
+        self.app_name = app_name
+        self.fits = fits or {}  # {resource: fit}
+        self.n_jobs = n_jobs
+        self.max_input_gb = max_input_gb
+        self.created = created or time.time()
+        self.version = version
+
+    @classmethod
+    def from_records(cls, app_name, records):
+        fits = dict()
+        for resource in RESOURCES:
+            points = [(r['input_gb'], r[resource]) for r in records if r.get(resource) is not None]
+            if points:
+                fits[resource] = fit(points)
+        return cls(app_name, fits=fits, n_jobs=len(records),
+                   max_input_gb=max([r['input_gb'] for r in records] or [0]))
+
+    def as_dict(self):
+        return {'app_name': self.app_name, 'fits': self.fits, 'n_jobs': self.n_jobs,
+                'max_input_gb': self.max_input_gb, 'created': self.created, 'version': self.version}
+
+    def value(self, resource, input_gb):
+        f = self.fits.get(resource)
+        if not f:
+            return None
+        return f['intercept'] + f['slope'] * input_gb + f['residual']
+
+    def predict(self, input_gb, margin=PREDICTION_MARGIN):
+        """{'cpu':, 'mem':, 'ebs_size':, 'ebs_throughput':, 'runtime':} for a job with input_gb GB of input.
+        cpu, mem, ebs_size and runtime (minutes) are None if the model has no data for them, and
+        ebs_throughput is None if the gp3 baseline throughput is enough."""
+        if input_gb > 2 * self.max_input_gb:
+            logger.warning("the input (%.1f GB) is much larger than the inputs of the past jobs of %s (up to %.1f GB)"
+                           % (input_gb, self.app_name, self.max_input_gb))
+
+        def value(resource):
+            v = self.value(resource, input_gb)
+            return None if v is None else v * (1 + margin)
+        cpu, mem, disk, throughput, runtime = [value(r) for r in RESOURCES]
+        prediction = {'cpu': max(1, math.ceil(cpu)) if cpu is not None else None,
+                      'mem': math.ceil(mem * 10) / 10 if mem is not None else None,
+                      'ebs_size': max(1, math.ceil(disk)) if disk is not None else None,
+                      'ebs_throughput': None,
+                      'runtime': math.ceil(runtime) if runtime is not None else None}
+        if throughput is not None and throughput > GP3_BASELINE_THROUGHPUT:
+            prediction['ebs_throughput'] = min(math.ceil(throughput), GP3_MAX_THROUGHPUT)
+        return prediction
+
+
+class ModelStore(object):
+    """resource models in a local directory or in a log bucket"""
+
+    def __init__(self, bucket=None, directory=None, prefix=RESOURCE_MODEL_PREFIX,
+                 encrypt_s3_upload=False, kms_key_id=None):
+        if not bucket and not directory:
+            raise Exception("ModelStore needs a bucket or a directory")
+        self.bucket = bucket
+        self.directory = directory
+        self.prefix = prefix
+        self.encrypt_s3_upload = encrypt_s3_upload
+        self.kms_key_id = kms_key_id
+
+    def key(self, app_name):
+        return self.prefix + app_name + '.json'
+
+    def get(self, app_name):
+        """the model of the app, None if there is none"""
+        try:
+            if self.directory:
+                with open(os.path.join(self.directory, self.key(app_name))) as f:
+                    d = json.load(f)
+            else:
+                d = json.loads(read_s3(self.bucket, self.key(app_name)))
+        except Exception as e:
+            logger.debug("no resource model for %s : %s" % (app_name, str(e)))
+            return None
+        if d.get('version') != RESOURCE_MODEL_VERSION:
+            return None
+        return ResourceModel(**d)
+
+    def put(self, model):
+        content = json.dumps(model.as_dict(), indent=4, sort_keys=True)
+        if self.directory:
+            path = os.path.join(self.directory, self.key(model.app_name))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write(content)
+        else:
+            put_object_s3(content, self.key(model.app_name), self.bucket, public=False,
+                          encrypt_s3_upload=self.encrypt_s3_upload, kms_key_id=self.kms_key_id)
+
+
+def build_models(postrunjsons, app_name=None, min_jobs=1):
+    """{app_name: ResourceModel} from postrun jsons (dicts or file names), optionally for one app only"""
+    vcpus = {i['instance_type']: i['cpu'] for i in benchmark_instance_list()}
+    records = dict()
+    for prj in postrunjsons:
+        if isinstance(prj, str):
+            with open(prj) as f:
+                prj = json.load(f)
+        record = job_record(prj, vcpus)
+        if record and (not app_name or record['app_name'] == app_name):
+            records.setdefault(record['app_name'], []).append(record)
+    return {app: ResourceModel.from_records(app, app_records)
+            for app, app_records in records.items() if len(app_records) >= min_jobs}
+
+
+def read_postrunjsons(bucket, max_jobs=500, concurrency=32):
+    """the postrun jsons of the most recent max_jobs jobs in a log bucket"""
+    keys = []
+    for contents in list_objects(bucket, ''):
+        keys.extend(c for c in contents if c['Key'].endswith('.postrun.json') and '/' not in c['Key'])
+    keys = [c['Key'] for c in sorted(keys, key=lambda c: c['LastModified'], reverse=True)[:max_jobs]]
+
+    def read(key):
+        try:
+            return json.loads(read_s3(bucket, key))
+        except Exception as e:
+            logger.debug("cannot read %s : %s" % (key, str(e)))
+            return None
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return [prj for prj in executor.map(read, keys) if prj]
+
+
+_model_cache = dict()  # {(bucket, app_name): (time, model)}
+_model_cache_lock = threading.Lock()
+
+
+def get_resource_model(bucket, app_name, ttl=RESOURCE_MODEL_CACHE_TTL):
+    """the model of the app in the log bucket (None if there is none), cached in the process"""
+    with _model_cache_lock:
+        cached = _model_cache.get((bucket, app_name))
+    if cached and time.time() - cached[0] < ttl:
+        return cached[1]
+    model = ModelStore(bucket=bucket).get(app_name)
+    with _model_cache_lock:
+        _model_cache[(bucket, app_name)] = (time.time(), model)
+    return model
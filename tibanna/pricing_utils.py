@@ -3,10 +3,9 @@ import json
 import time
 import os
 import logging
-import boto3
-import botocore
 import re
 from . import create_logger
+from .aws_utils import get_client
 from datetime import datetime, timedelta, timezone
 from .utils import (
     does_key_exist,
@@ -14,7 +13,7 @@ from .utils import (
     put_object_s3
 )
 from .vars import (
-    AWS_REGION,
+    config,
     AWS_REGION_NAMES
 )
 from .exceptions import (
@@ -26,6 +25,7 @@ logger = create_logger(__name__)
 
 
 def get_cost(postrunjson, job_id):
+    from botocore.exceptions import ClientError
 
     job = postrunjson.Job
 
@@ -48,8 +48,8 @@ def get_cost(postrunjson, job_id):
                     }
 
     try:
-        billingres = boto3.client('ce').get_cost_and_usage(**billing_args)
-    except botocore.exceptions.ClientError as e:
+        billingres = get_client('ce').get_cost_and_usage(**billing_args)
+    except ClientError as e:
         logger.warning("%s. Please try to deploy the latest version of Tibanna." % e)
         return 0.0
 
@@ -63,11 +63,14 @@ def get_cost_estimate(postrunjson, ebs_root_type = "gp3", aws_price_overwrite =
     This allows historical cost estimates. It is also used for testing. It is a dictionary with keys:
     ec2_spot_price, ec2_ondemand_price, ebs_root_storage_price, ebs_storage_price,
     ebs_iops_price (gp3, io1), ebs_io2_iops_prices, ebs_throughput_price
+    Prices given in aws_price_overwrite are not retrieved from AWS.
     """
+    from botocore.exceptions import ClientError
 
     cfg = postrunjson.config
     job = postrunjson.Job
     estimated_cost = 0.0
+    overwrite = aws_price_overwrite or {}
 
     if(job.end_time == None):
         logger.warning("job.end_time not available. Cannot calculate estimated cost.")
@@ -75,130 +78,40 @@ def get_cost_estimate(postrunjson, ebs_root_type = "gp3", aws_price_overwrite =
 
     job_start = datetime.strptime(job.start_time, '%Y%m%d-%H:%M:%S-UTC').replace(tzinfo=timezone.utc)
     job_end = datetime.strptime(job.end_time, '%Y%m%d-%H:%M:%S-UTC').replace(tzinfo=timezone.utc)
-    job_duration = (job_end - job_start).seconds / 3600.0 # in hours
+    job_duration = (job_end - job_start).total_seconds() / 3600.0 # in hours
 
     if(not job.instance_type):
         logger.warning("Instance type is not available for cost estimation. Please try to deploy the latest version of Tibanna.")
         return 0.0, "NA"
 
     try:
-        pricing_client = boto3.client('pricing', region_name=AWS_REGION)
-
         # Get EC2 spot price
         if(cfg.spot_instance):
             if(cfg.spot_duration):
                 raise PricingRetrievalException("Pricing with spot_duration is not supported")
 
-            if(not job.instance_availablity_zone):
-                raise PricingRetrievalException("Instance availability zone is not available. You might have to deploy a newer version of Tibanna.")
-            
-            ec2_client=boto3.client('ec2',region_name=AWS_REGION)
-            prices=ec2_client.describe_spot_price_history(
-                InstanceTypes=[job.instance_type],
-                ProductDescriptions=['Linux/UNIX'],
-                AvailabilityZone=job.instance_availablity_zone,
-                MaxResults=1) # Most recent price is on top
-
-            if(len(prices['SpotPriceHistory']) == 0):
-                raise PricingRetrievalException("Spot price could not be retrieved")
-
-            ec2_spot_price = (float)(prices['SpotPriceHistory'][0]['SpotPrice'])
-
-            if((aws_price_overwrite is not None) and 'ec2_spot_price' in aws_price_overwrite):
-                ec2_spot_price = aws_price_overwrite['ec2_spot_price']
+            if 'ec2_spot_price' in overwrite:
+                ec2_spot_price = overwrite['ec2_spot_price']
+            else:
+                if(not job.instance_availablity_zone):
+                    raise PricingRetrievalException("Instance availability zone is not available. You might have to deploy a newer version of Tibanna.")
+                ec2_spot_price = get_ec2_spot_price(job.instance_type, job.instance_availablity_zone)
 
             estimated_cost = estimated_cost + ec2_spot_price * job_duration
 
         else: # EC2 onDemand Prices
-
-            prices = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=[
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'instanceType',
-                    'Value': job.instance_type
-                },
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'operatingSystem',
-                    'Value': 'Linux'
-                },
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'location',
-                    'Value': AWS_REGION_NAMES[AWS_REGION]
-                },
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'preInstalledSw',
-                    'Value': 'NA'
-                },
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'capacitystatus',
-                    'Value': 'used'
-                },
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'tenancy',
-                    'Value': 'Shared'
-                },
-            ])
-            price_list = prices["PriceList"]
-
-            if(not prices["PriceList"] or len(price_list) == 0):
-                raise PricingRetrievalException("We could not retrieve EC2 prices from Amazon")
-
-            if(len(price_list) > 1):
-                raise PricingRetrievalException("EC2 prices are ambiguous")
-
-            price_item = json.loads(price_list[0])
-            terms = price_item["terms"]
-            term = list(terms["OnDemand"].values())[0]
-            price_dimension = list(term["priceDimensions"].values())[0]
-            ec2_ondemand_price = (float)(price_dimension['pricePerUnit']["USD"])
-
-
-            if((aws_price_overwrite is not None) and 'ec2_ondemand_price' in aws_price_overwrite):
-                ec2_ondemand_price = aws_price_overwrite['ec2_ondemand_price']
+            if 'ec2_ondemand_price' in overwrite:
+                ec2_ondemand_price = overwrite['ec2_ondemand_price']
+            else:
+                ec2_ondemand_price = get_ec2_ondemand_price(job.instance_type)
 
             estimated_cost = estimated_cost + ec2_ondemand_price * job_duration
 
-
         # Get EBS pricing
-
-        prices = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=[
-            {
-                'Type': 'TERM_MATCH',
-                'Field': 'location',
-                'Value': AWS_REGION_NAMES[AWS_REGION]
-            },
-            {
-                'Field': 'volumeApiName',
-                'Type': 'TERM_MATCH',
-                'Value': ebs_root_type,
-            },
-            {
-                'Field': 'productFamily',
-                'Type': 'TERM_MATCH',
-                'Value': 'Storage',
-            },
-        ])
-        price_list = prices["PriceList"]
-
-        if(not prices["PriceList"] or len(price_list) == 0):
-            raise PricingRetrievalException("We could not retrieve EBS prices from Amazon")
-
-        if(len(price_list) > 1):
-            raise PricingRetrievalException("EBS prices are ambiguous")
-
-        price_item = json.loads(price_list[0])
-        terms = price_item["terms"]
-        term = list(terms["OnDemand"].values())[0]
-        price_dimension = list(term["priceDimensions"].values())[0]
-        ebs_root_storage_price = (float)(price_dimension['pricePerUnit']["USD"])
-
-        if((aws_price_overwrite is not None) and 'ebs_root_storage_price' in aws_price_overwrite):
-            ebs_root_storage_price = aws_price_overwrite['ebs_root_storage_price']
+        if 'ebs_root_storage_price' in overwrite:
+            ebs_root_storage_price = overwrite['ebs_root_storage_price']
+        else:
+            ebs_root_storage_price = get_ebs_storage_price(ebs_root_type)
 
         # add root EBS costs
         root_ebs_cost = ebs_root_storage_price * cfg.root_ebs_size * job_duration / (24.0*30.0)
@@ -211,78 +124,20 @@ def get_cost_estimate(postrunjson, ebs_root_type = "gp3", aws_price_overwrite =
 
             # Add throughput
             if(cfg.ebs_throughput):
-                prices = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=[
-                    {
-                        'Type': 'TERM_MATCH',
-                        'Field': 'location',
-                        'Value': AWS_REGION_NAMES[AWS_REGION]
-                    },
-                    {
-                        'Field': 'volumeApiName',
-                        'Type': 'TERM_MATCH',
-                        'Value': cfg.ebs_type,
-                    },
-                    {
-                        'Field': 'productFamily',
-                        'Type': 'TERM_MATCH',
-                        'Value': 'Provisioned Throughput',
-                    },
-                ])
-                price_list = prices["PriceList"]
-
-                if(not prices["PriceList"] or len(price_list) == 0):
-                    raise PricingRetrievalException("We could not retrieve EBS throughput prices from Amazon")
-
-                if(len(price_list) > 1):
-                    raise PricingRetrievalException("EBS throughput prices are ambiguous")
-
-                price_item = json.loads(price_list[0])
-                terms = price_item["terms"]
-                term = list(terms["OnDemand"].values())[0]
-                price_dimension = list(term["priceDimensions"].values())[0]
-                ebs_throughput_price = (float)(price_dimension['pricePerUnit']["USD"])/1000 # unit: mbps
-
-                if((aws_price_overwrite is not None) and 'ebs_throughput_price' in aws_price_overwrite):
-                    ebs_throughput_price = aws_price_overwrite['ebs_throughput_price']
+                if 'ebs_throughput_price' in overwrite:
+                    ebs_throughput_price = overwrite['ebs_throughput_price']
+                else:
+                    ebs_throughput_price = get_ebs_throughput_price(cfg.ebs_type)
 
                 free_tier = 125
                 ebs_throughput_cost = ebs_throughput_price * max(cfg.ebs_throughput - free_tier, 0) * job_duration / (24.0*30.0)
                 estimated_cost = estimated_cost + ebs_throughput_cost
 
         else:
-            prices = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=[
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'location',
-                    'Value': AWS_REGION_NAMES[AWS_REGION]
-                },
-                {
-                    'Field': 'volumeApiName',
-                    'Type': 'TERM_MATCH',
-                    'Value': cfg.ebs_type,
-                },
-                {
-                    'Field': 'productFamily',
-                    'Type': 'TERM_MATCH',
-                    'Value': 'Storage',
-                },
-            ])
-            price_list = prices["PriceList"]
-
-            if(not prices["PriceList"] or len(price_list) == 0):
-                raise PricingRetrievalException("We could not retrieve EBS prices from Amazon")
-
-            if(len(price_list) > 1):
-                raise PricingRetrievalException("EBS prices are ambiguous")
-
-            price_item = json.loads(price_list[0])
-            terms = price_item["terms"]
-            term = list(terms["OnDemand"].values())[0]
-            price_dimension = list(term["priceDimensions"].values())[0]
-            ebs_storage_price = (float)(price_dimension['pricePerUnit']["USD"])
-
-            if((aws_price_overwrite is not None) and 'ebs_storage_price' in aws_price_overwrite):
-                ebs_storage_price = aws_price_overwrite['ebs_storage_price']
+            if 'ebs_storage_price' in overwrite:
+                ebs_storage_price = overwrite['ebs_storage_price']
+            else:
+                ebs_storage_price = get_ebs_storage_price(cfg.ebs_type)
 
             add_ebs_cost = ebs_storage_price * cfg.ebs_size * job_duration / (24.0*30.0)
             estimated_cost = estimated_cost + add_ebs_cost
@@ -290,38 +145,10 @@ def get_cost_estimate(postrunjson, ebs_root_type = "gp3", aws_price_overwrite =
         ## IOPS PRICING
         # Add IOPS prices for io1 or gp3
         if( (cfg.ebs_type == "io1" or cfg.ebs_type == "gp3") and cfg.ebs_iops):
-            prices = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=[
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'location',
-                    'Value': AWS_REGION_NAMES[AWS_REGION]
-                },
-                {
-                    'Field': 'volumeApiName',
-                    'Type': 'TERM_MATCH',
-                    'Value': cfg.ebs_type,
-                },
-                {
-                    'Field': 'productFamily',
-                    'Type': 'TERM_MATCH',
-                    'Value': 'System Operation',
-                },
-            ])
-            price_list = prices["PriceList"]
-
-            if(not prices["PriceList"] or len(price_list) == 0):
-                raise PricingRetrievalException("We could not retrieve EBS prices from Amazon")
-            if(len(price_list) > 1):
-                raise PricingRetrievalException("EBS prices are ambiguous")
-
-            price_item = json.loads(price_list[0])
-            terms = price_item["terms"]
-            term = list(terms["OnDemand"].values())[0]
-            price_dimension = list(term["priceDimensions"].values())[0]
-            ebs_iops_price = (float)(price_dimension['pricePerUnit']["USD"])
-
-            if((aws_price_overwrite is not None) and 'ebs_iops_price' in aws_price_overwrite):
-                ebs_iops_price = aws_price_overwrite['ebs_iops_price']
+            if 'ebs_iops_price' in overwrite:
+                ebs_iops_price = overwrite['ebs_iops_price']
+            else:
+                ebs_iops_price = get_ebs_iops_price(cfg.ebs_type)
 
             if cfg.ebs_type == "gp3":
                 free_tier = 3000
@@ -332,40 +159,10 @@ def get_cost_estimate(postrunjson, ebs_root_type = "gp3", aws_price_overwrite =
             estimated_cost = estimated_cost + ebs_iops_cost
 
         elif (cfg.ebs_type == "io2" and cfg.ebs_iops):
-            prices = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=[
-                {
-                    'Type': 'TERM_MATCH',
-                    'Field': 'location',
-                    'Value': AWS_REGION_NAMES[AWS_REGION]
-                },
-                {
-                    'Field': 'volumeApiName',
-                    'Type': 'TERM_MATCH',
-                    'Value': cfg.ebs_type,
-                },
-                {
-                    'Field': 'productFamily',
-                    'Type': 'TERM_MATCH',
-                    'Value': 'System Operation',
-                },
-            ])
-            price_list = prices["PriceList"]
-
-            if(len(price_list) != 3):
-                raise PricingRetrievalException("EBS prices for io2 are incomplete")
-
-            ebs_io2_iops_prices = []
-            for price_entry in price_list:
-                price_item = json.loads(price_entry)
-                terms = price_item["terms"]
-                term = list(terms["OnDemand"].values())[0]
-                price_dimension = list(term["priceDimensions"].values())[0]
-                ebs_iops_price = (float)(price_dimension['pricePerUnit']["USD"])
-                ebs_io2_iops_prices.append(ebs_iops_price)
-            ebs_io2_iops_prices.sort(reverse=True)
-
-            if((aws_price_overwrite is not None) and 'ebs_io2_iops_prices' in aws_price_overwrite):
-                ebs_io2_iops_prices = aws_price_overwrite['ebs_io2_iops_prices']
+            if 'ebs_io2_iops_prices' in overwrite:
+                ebs_io2_iops_prices = overwrite['ebs_io2_iops_prices']
+            else:
+                ebs_io2_iops_prices = get_ebs_io2_iops_prices()
 
             # Pricing tiers are currently hardcoded. There wasn't a simple way to extract them from the pricing information
             tier0 = 32000
@@ -383,7 +180,7 @@ def get_cost_estimate(postrunjson, ebs_root_type = "gp3", aws_price_overwrite =
 
         return estimated_cost, estimation_type
 
-    except botocore.exceptions.ClientError as e:
+    except ClientError as e:
         logger.warning("Cost estimation error: %s. Please try to deploy the latest version of Tibanna." % e)
         return 0.0, "NA"
     except PricingRetrievalException as e:
@@ -394,6 +191,132 @@ def get_cost_estimate(postrunjson, ebs_root_type = "gp3", aws_price_overwrite =
         return 0.0, "NA"
 
 
+def get_price_list(filters):
+    """return the list of on-demand prices (USD) of the EC2 products matching the filters
+    (a dictionary of field: value) in the current region"""
+    pricing_client = get_client('pricing', region_name=config.aws_region)
+    filters = dict(filters, location=AWS_REGION_NAMES[config.aws_region])
+    prices = pricing_client.get_products(ServiceCode='AmazonEC2', Filters=[
+        {'Type': 'TERM_MATCH', 'Field': k, 'Value': v} for k, v in filters.items()
+    ])
+    price_list = []
+    for price_entry in prices["PriceList"]:
+        price_item = json.loads(price_entry)
+        terms = price_item["terms"]
+        term = list(terms["OnDemand"].values())[0]
+        price_dimension = list(term["priceDimensions"].values())[0]
+        price_list.append((float)(price_dimension['pricePerUnit']["USD"]))
+    return price_list
+
+
+def get_single_price(filters, product):
+    price_list = get_price_list(filters)
+    if not price_list:
+        raise PricingRetrievalException("We could not retrieve %s prices from Amazon" % product)
+    if len(price_list) > 1:
+        raise PricingRetrievalException("%s prices are ambiguous" % product)
+    return price_list[0]
+
+
+def get_ec2_ondemand_price(instance_type):
+    """hourly on-demand price of a Linux EC2 instance type"""
+    return get_single_price({'instanceType': instance_type, 'operatingSystem': 'Linux', 'preInstalledSw': 'NA',
+                             'capacitystatus': 'used', 'tenancy': 'Shared'}, 'EC2')
+
+
+def get_ec2_spot_price(instance_type, availability_zone=None):
+    """most recent hourly spot price of an EC2 instance type (the lowest one across
+    availability zones, if availability_zone is not specified)"""
+    kwargs = {'InstanceTypes': [instance_type], 'ProductDescriptions': ['Linux/UNIX']}
+    if availability_zone:
+        kwargs.update({'AvailabilityZone': availability_zone, 'MaxResults': 1})  # Most recent price is on top
+    else:
+        kwargs['StartTime'] = datetime.now(timezone.utc)
+    prices = get_client('ec2', region_name=config.aws_region).describe_spot_price_history(**kwargs)
+    if(len(prices['SpotPriceHistory']) == 0):
+        raise PricingRetrievalException("Spot price could not be retrieved")
+    return min((float)(p['SpotPrice']) for p in prices['SpotPriceHistory'])
+
+
+def get_ec2_prices(instance_types):
+    """price table of EC2 instance types used to rank the candidate instance types of a job :
+    {instance_type: {'ondemand': <hourly on-demand price or None>, 'spot': {availability_zone: <hourly spot price>}}}.
+    The current spot prices of all the instance types are retrieved with a single paginated request."""
+    prices = {it: {'ondemand': None, 'spot': {}} for it in instance_types}
+    for it in instance_types:
+        try:
+            prices[it]['ondemand'] = get_ec2_ondemand_price(it)
+        except Exception as e:
+            logger.debug("no on-demand price for %s : %s" % (it, str(e)))
+    try:
+        paginator = get_client('ec2', region_name=config.aws_region).get_paginator('describe_spot_price_history')
+        for page in paginator.paginate(InstanceTypes=list(instance_types), ProductDescriptions=['Linux/UNIX'],
+                                       StartTime=datetime.now(timezone.utc)):
+            for p in page['SpotPriceHistory']:
+                # the most recent price of each zone comes first
+                prices[p['InstanceType']]['spot'].setdefault(p['AvailabilityZone'], float(p['SpotPrice']))
+    except Exception as e:
+        logger.debug("no spot prices for %s : %s" % (str(instance_types), str(e)))
+    return prices
+
+
+def get_instance_price(prices, spot_instance=False, availability_zone=''):
+    """hourly price of an instance type from its entry in the price table of get_ec2_prices :
+    the spot price in availability_zone (the lowest one across zones if not specified) for spot instances,
+    the on-demand price otherwise. None if the price is not known."""
+    if not prices:
+        return None
+    if spot_instance:
+        spot = prices.get('spot', {})
+        if availability_zone:
+            return spot.get(availability_zone)
+        return min(spot.values()) if spot else None
+    return prices.get('ondemand')
+
+
+def rank_instance_types(instances, cpu, mem, prices, spot_instance=False, availability_zone=''):
+    """rank the candidate instances ([{'instance_type':, 'cpu':, 'mem_in_gb':, 'cost_in_usd':}]) of a job
+    that needs cpu vCPUs and mem GB memory. The cheapest instance type comes first (the price is taken
+    from the price table of get_ec2_prices, or from the benchmark cost_in_usd if it is not there) and
+    instance types with the same price are ordered by their unused vCPUs and memory (headroom).
+    Returns [{'instance_type':, 'rank':, 'price':}], ranks starting from 1."""
+    candidates = []
+    for instance in instances:
+        it = instance['instance_type']
+        price = get_instance_price(prices.get(it), spot_instance, availability_zone)
+        if price is None:
+            price = instance.get('cost_in_usd')
+        headroom = (instance.get('cpu', cpu) - cpu) / cpu + (instance.get('mem_in_gb', mem) - mem) / mem
+        candidates.append((float('inf') if price is None else price, headroom, it, price))
+    candidates.sort(key=lambda c: (c[0], c[1]))
+    return [{'instance_type': it, 'rank': rank, 'price': price}
+            for rank, (_, _, it, price) in enumerate(candidates, 1)]
+
+
+def get_ebs_storage_price(ebs_type):
+    """price of EBS storage per GB-month"""
+    return get_single_price({'volumeApiName': ebs_type, 'productFamily': 'Storage'}, 'EBS')
+
+
+def get_ebs_throughput_price(ebs_type):
+    """price of provisioned EBS throughput per MiB/s-month"""
+    return get_single_price({'volumeApiName': ebs_type, 'productFamily': 'Provisioned Throughput'},
+                            'EBS throughput') / 1000 # unit: mbps
+
+
+def get_ebs_iops_price(ebs_type):
+    """price of provisioned EBS IOPS per IOPS-month (io1, gp3)"""
+    return get_single_price({'volumeApiName': ebs_type, 'productFamily': 'System Operation'}, 'EBS')
+
+
+def get_ebs_io2_iops_prices():
+    """prices of provisioned io2 IOPS per IOPS-month for the three pricing tiers (highest first)"""
+    price_list = get_price_list({'volumeApiName': 'io2', 'productFamily': 'System Operation'})
+    if(len(price_list) != 3):
+        raise PricingRetrievalException("EBS prices for io2 are incomplete")
+    return sorted(price_list, reverse=True)
+
+
 def get_cost_estimate_from_tsv(log_bucket, job_id):
 
     s3_key = os.path.join(job_id + '.metrics/', 'metrics_report.tsv')
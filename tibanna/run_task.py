@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from .ec2_utils import Execution
+from .launch_plan import LaunchPlan
 from .vars import (
     TIBANNA_PROFILE_ACCESS_KEY,
     TIBANNA_PROFILE_SECRET_KEY
@@ -60,7 +61,9 @@ def run_task(input_json):
     else:
         profile = None
 
-    execution = Execution(input_json)
+    # the step function retries run_task with the same input if no instance could be launched
+    launch_plan = LaunchPlan.load(input_json.get('config', {}).get('log_bucket'), input_json.get('jobid'))
+    execution = Execution(input_json, launch_plan=launch_plan)
     execution.prelaunch(profile=profile)
     execution.launch()
     execution.postlaunch()
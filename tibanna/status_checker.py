@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""status of many jobs at once, for a sweeper schedule or a Map state.
+
+check_task looks at one job per invocation, with a head_object per marker
+(``.job_started``, ``.aborted``, ``.error``, ``.success``), a describe_instances and a
+get_object. JobStatusChecker takes a batch of jobs and resolves the markers of
+all of them with a few list_objects_v2 calls over each log bucket: the jobs are
+sorted and the bucket is listed once from the first job on, as long as the
+listing stays dense enough (otherwise the remaining jobs are listed one by one,
+with a single call each). The instances of all the jobs are described together
+with describe_instances filtered by instance id (a packed job is checked against
+the instance of its primary job).
+
+The checker only reports the states (see JOB_STATES); it does not terminate
+instances, update postrun jsons or fetch metrics as check_task does, so
+check_task still runs for the jobs that ended."""
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from dateutil.tz import tzutc
+from . import create_logger
+from .aws_utils import get_client
+from .object_sizes import list_objects
+from .dd_utils import batch_get_items
+from .vars import DYNAMODB_TABLE, PARSE_AWSEM_TIME
+
+
+# markers of the jobs in the log bucket (<jobid>.<marker>)
+JOB_MARKERS = ['job_started', 'aborted', 'error', 'success', 'postrun.json', 'spot_failure']
+JOB_STATES = ['starting', 'boot_timeout', 'running', 'succeeded', 'failed', 'aborted', 'instance_lost']
+# a job whose instance did not start it within this many minutes is not booting (as in check_task)
+BOOT_TIMEOUT_MIN = 10
+# the listing of a log bucket is abandoned if a page of (up to 1000) objects has markers of fewer jobs than this
+LISTING_MIN_JOBS_PER_PAGE = 20
+# instance ids per describe_instances filter
+DESCRIBE_INSTANCES_BATCH_SIZE = 200
+
+
+logger = create_logger(__name__)
+
+
+def split_marker(key):
+    """(jobid, marker) of a key of the log bucket, or (None, None)"""
+    for marker in JOB_MARKERS:
+        if key.endswith('.' + marker):
+            return key[:-len(marker) - 1], marker
+    return None, None
+
+
+class JobStatusChecker(object):
+
+    def __init__(self, concurrency=16):
+        self.concurrency = max(1, concurrency)
+
+    def check(self, jobs, log_bucket=None):
+        """jobs is a list of job ids (with log_bucket) or of check_task inputs (the outputs of run_task,
+        with jobid and config). Returns {jobid: {'state':, 'instance_id':, 'instance_state':, 'markers':}},
+        where markers is {marker: last modified time (ISO)}."""
+        jobs = [self.job_info(job, log_bucket) for job in jobs]
+        self.fill_instance_ids([j for j in jobs if j['instance_id'] is None])
+        markers = dict()
+        for bucket in set(j['log_bucket'] for j in jobs):
+            markers.update(self.list_markers(bucket, [j['jobid'] for j in jobs if j['log_bucket'] == bucket]))
+        instance_states = self.describe_instances([j['instance_id'] for j in jobs if j['instance_id']])
+        now = datetime.now(tzutc())
+        status = dict()
+        for j in jobs:
+            job_markers = markers.get(j['jobid'], {})
+            instance_state = instance_states.get(j['instance_id']) if j['instance_id'] else None
+            status[j['jobid']] = {'state': self.state(j, job_markers, instance_state, now),
+                                  'instance_id': j['instance_id'] or '',
+                                  'instance_state': instance_state or '',
+                                  'markers': {m: t.isoformat() for m, t in job_markers.items()}}
+        return status
+
+    @staticmethod
+    def job_info(job, log_bucket=None):
+        if isinstance(job, str):
+            if not log_bucket:
+                raise Exception("log_bucket is required for job %s" % job)
+            return {'jobid': job, 'log_bucket': log_bucket, 'instance_id': None, 'start_time': None,
+                    'packed_into': None}
+        cfg = job.get('config', {})
+        instance_id = cfg.get('instance_id')
+        if cfg.get('cached_from') and not instance_id:
+            instance_id = ''  # the job has no instance
+        elif cfg.get('packed_into') and not instance_id:
+            instance_id = None  # the job runs on the instance of its primary job
+        return {'jobid': job['jobid'], 'log_bucket': cfg.get('log_bucket') or log_bucket,
+                'instance_id': instance_id, 'start_time': cfg.get('start_time'),
+                'packed_into': cfg.get('packed_into')}
+
+    def fill_instance_ids(self, jobs):
+        """instance ids of the jobs given by job id only and of the packed jobs, from the job table.
+        A packed job runs on the instance of its primary job."""
+        if not jobs:
+            return
+        items = self.job_items([j['packed_into'] or j['jobid'] for j in jobs])
+        primaries = [item['packed_into'] for item in items.values()
+                     if item.get('packed_into') and not item.get('instance_id')]
+        items.update(self.job_items([p for p in primaries if p not in items]))
+        for j in jobs:
+            item = items.get(j['packed_into'] or j['jobid'], {})
+            if item.get('packed_into') and not item.get('instance_id'):
+                j['packed_into'] = item['packed_into']
+                item = items.get(item['packed_into'], {})
+            j['instance_id'] = item.get('instance_id', '')
+
+    @staticmethod
+    def job_items(jobids):
+        """{jobid: item of the job table}"""
+        if not jobids:
+            return dict()
+        try:
+            return batch_get_items(DYNAMODB_TABLE, 'Job Id', jobids)
+        except Exception as e:
+            logger.warning("cannot get the instance ids of the jobs : %s" % str(e))
+            return dict()
+
+    def list_markers(self, bucket, jobids):
+        """{jobid: {marker: last modified}} from one listing of the log bucket from the first job on,
+        and a listing per job for the jobs that the first listing did not reach"""
+        jobids = sorted(set(jobids))
+        jobidset = set(jobids)
+        markers = {jobid: dict() for jobid in jobids}
+        max_pages = max(1, len(jobids) // LISTING_MIN_JOBS_PER_PAGE)
+        last_key = None
+        done = False
+        try:
+            # start right before the first job
+            for n_pages, contents in enumerate(list_objects(bucket, '', start_after=jobids[0][:-1])):
+                for item in contents:
+                    last_key = item['Key']
+                    jobid, marker = split_marker(last_key)
+                    if jobid in jobidset:
+                        markers[jobid][marker] = item['LastModified']
+                    elif last_key > jobids[-1] + '.~':
+                        done = True
+                        break
+                if done or n_pages + 1 >= max_pages:
+                    break
+            else:
+                done = True
+        except Exception as e:
+            logger.debug("cannot list %s : %s" % (bucket, str(e)))
+            last_key = None
+        if not done:
+            # the listing was too sparse to get to these jobs
+            rest = [jobid for jobid in jobids if last_key is None or jobid + '.~' > last_key]
+            if rest:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(rest))) as executor:
+                    for jobid, job_markers in zip(rest, executor.map(lambda j: self.list_job_markers(bucket, j),
+                                                                      rest)):
+                        markers[jobid] = job_markers
+        return markers
+
+    def list_job_markers(self, bucket, jobid):
+        job_markers = dict()
+        for contents in list_objects(bucket, jobid + '.'):
+            for item in contents:
+                _jobid, marker = split_marker(item['Key'])
+                if _jobid == jobid:
+                    job_markers[marker] = item['LastModified']
+        return job_markers
+
+    def describe_instances(self, instance_ids):
+        """{instance_id: state name} of the instances that still exist"""
+        instance_ids = sorted(set(instance_ids))
+        states = dict()
+        paginator = get_client('ec2').get_paginator('describe_instances')
+        for i in range(0, len(instance_ids), DESCRIBE_INSTANCES_BATCH_SIZE):
+            # unlike InstanceIds, a filter does not fail on the instances that no longer exist
+            filters = [{'Name': 'instance-id', 'Values': instance_ids[i:i + DESCRIBE_INSTANCES_BATCH_SIZE]}]
+            for page in paginator.paginate(Filters=filters):
+                for reservation in page.get('Reservations', []):
+                    for instance in reservation.get('Instances', []):
+                        states[instance['InstanceId']] = instance['State']['Name']
+        return states
+
+    @staticmethod
+    def state(job, markers, instance_state, now):
+        # the same order as check_task
+        if 'job_started' not in markers:
+            if job['start_time'] and \
+                    PARSE_AWSEM_TIME(job['start_time']) + timedelta(minutes=BOOT_TIMEOUT_MIN) < now:
+                return 'boot_timeout'
+            return 'starting'
+        if 'aborted' in markers:
+            return 'aborted'
+        if 'error' in markers:
+            return 'failed'
+        if 'success' in markers:
+            return 'succeeded'
+        if job['instance_id'] and instance_state in [None, 'stopped', 'shutting-down', 'terminated']:
+            return 'instance_lost'
+        return 'running'
+
+
+def check_jobs(jobs, log_bucket=None, concurrency=16):
+    """{jobid: status} of a batch of jobs (see JobStatusChecker.check)"""
+    return JobStatusChecker(concurrency=concurrency).check(jobs, log_bucket=log_bucket)
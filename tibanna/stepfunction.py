@@ -1,4 +1,4 @@
-from .vars import AWS_REGION, AWS_ACCOUNT_NUMBER
+from .vars import config
 from .utils import create_tibanna_suffix
 
 
@@ -21,14 +21,21 @@ class StepFunctionUnicorn(object):
             "BackoffRate": 1.0
         },
         {
+            # run_task already retried for up to 30 seconds, rotating instance types and subnets.
+            # With full jitter, the retries are 150 seconds apart on average once the 300 second cap
+            # is reached, plus about 10 seconds of run_task : 3780 attempts of 160 seconds is 1 week
             "ErrorEquals": ["EC2InstanceLimitWaitException"],
-            "IntervalSeconds": 300,  # dropped since we now parametrize on subnets, instance types
-            "MaxAttempts": 2016,  # still try for 1 week
-            "BackoffRate": 1.0
+            "IntervalSeconds": 60,
+            "MaxAttempts": 3780,  # still try for 1 week
+            "BackoffRate": 2.0,
+            "MaxDelaySeconds": 300,
+            "JitterStrategy": "FULL"
         },
         lambda_error_retry_condition
     ]
 
+    # in the polling loop, check_task raises EC2StartingException and StillRunningException only if
+    # it is older than the step function, in which case the job is checked every 5 minutes as before
     sfn_check_task_retry_conditions = [
         {
             "ErrorEquals": ["EC2StartingException"],
@@ -47,12 +54,12 @@ class StepFunctionUnicorn(object):
 
     def __init__(self,
                  dev_suffix=None,
-                 region_name=AWS_REGION,
-                 aws_acc=AWS_ACCOUNT_NUMBER,
+                 region_name=None,
+                 aws_acc=None,
                  usergroup=None):
         self.dev_suffix = dev_suffix
-        self.region_name = region_name
-        self.aws_acc = aws_acc
+        self.region_name = region_name or config.aws_region
+        self.aws_acc = aws_acc or config.aws_account_number
         self.usergroup = usergroup
 
     @property
@@ -82,19 +89,110 @@ class StepFunctionUnicorn(object):
     def sfn_start_lambda(self):
         return 'RunTaskAwsem'
 
+    sfn_wait_for_completion_retry_conditions = [
+        {
+            # check_task could not store the task token
+            "ErrorEquals": ["States.TaskFailed"],
+            "IntervalSeconds": 60,
+            "MaxAttempts": 3,
+            "BackoffRate": 2
+        },
+        lambda_error_retry_condition
+    ]
+
+    # the job is checked right away after a completion event, and after an interval without one
+    sfn_check_completion_retry_conditions = [lambda_error_retry_condition]
+
     @property
     def sfn_state_defs(self):
+        check_task_arn = self.lambda_arn_prefix + "check_task_awsem" + self.lambda_suffix
         state_defs = {
             "RunTaskAwsem": {
                 "Type": "Task",
                 "Resource": self.lambda_arn_prefix + "run_task_awsem" + self.lambda_suffix,
                 "Retry": self.sfn_run_task_retry_conditions,
+                "Next": "CompletionMode"
+            },
+            "CompletionMode": {
+                "Type": "Choice",
+                "Choices": [
+                    {
+                        "And": [
+                            {"Variable": "$.config.wait_for_completion_event", "IsPresent": True},
+                            {"Variable": "$.config.wait_for_completion_event", "BooleanEquals": True}
+                        ],
+                        "Next": "WaitForCompletionAwsem"
+                    }
+                ],
+                "Default": "StartPollingAwsem"
+            },
+            # check_task returns the job with the interval before the next check (poll) until it is over
+            "StartPollingAwsem": {
+                "Type": "Pass",
+                "Result": {"state": "starting", "interval": 0, "n_checks": 0},
+                "ResultPath": "$.poll",
                 "Next": "CheckTaskAwsem"
             },
             "CheckTaskAwsem": {
                 "Type": "Task",
-                "Resource": self.lambda_arn_prefix + "check_task_awsem" + self.lambda_suffix,
+                "Resource": check_task_arn,
                 "Retry": self.sfn_check_task_retry_conditions,
+                "Next": "PollAwsem"
+            },
+            "PollAwsem": {
+                "Type": "Choice",
+                "Choices": [
+                    {
+                        "Variable": "$.poll",
+                        "IsPresent": True,
+                        "Next": "WaitAwsem"
+                    }
+                ],
+                "Default": "JobDoneAwsem"
+            },
+            "WaitAwsem": {
+                "Type": "Wait",
+                "SecondsPath": "$.poll.interval",
+                "Next": "CheckTaskAwsem"
+            },
+            "JobDoneAwsem": {
+                "Type": "Succeed"
+            },
+            # check_task stores the task token and the instance sends the task success when the job ends
+            "WaitForCompletionAwsem": {
+                "Type": "Task",
+                "Resource": "arn:aws:states:::lambda:invoke.waitForTaskToken",
+                "Parameters": {
+                    "FunctionName": check_task_arn,
+                    "Payload": {
+                        "input.$": "$",
+                        "task_token.$": "$$.Task.Token"
+                    }
+                },
+                "TimeoutSecondsPath": "$.config.completion_check_interval",
+                "ResultPath": None,
+                "Retry": self.sfn_wait_for_completion_retry_conditions,
+                "Catch": [
+                    {
+                        # no event (e.g. the instance is gone) : check the job anyway
+                        "ErrorEquals": ["States.Timeout"],
+                        "ResultPath": None,
+                        "Next": "CheckCompletionAwsem"
+                    }
+                ],
+                "Next": "CheckCompletionAwsem"
+            },
+            "CheckCompletionAwsem": {
+                "Type": "Task",
+                "Resource": check_task_arn,
+                "Retry": self.sfn_check_completion_retry_conditions,
+                "Catch": [
+                    {
+                        "ErrorEquals": ["EC2StartingException", "StillRunningException"],
+                        "ResultPath": None,
+                        "Next": "WaitForCompletionAwsem"
+                    }
+                ],
                 "End": True
             }
         }
@@ -1,6 +1,5 @@
 from .vars import (
-    AWS_REGION,
-    AWS_ACCOUNT_NUMBER,
+    config,
     SFN_TYPE,
     UPDATE_COST_LAMBDA_NAME
 )
@@ -12,12 +11,12 @@ class StepFunctionCostUpdater(object):
 
     def __init__(self,
                  dev_suffix=None,
-                 region_name=AWS_REGION,
-                 aws_acc=AWS_ACCOUNT_NUMBER,
+                 region_name=None,
+                 aws_acc=None,
                  usergroup=None):
         self.dev_suffix = dev_suffix
-        self.region_name = region_name
-        self.aws_acc = aws_acc
+        self.region_name = region_name or config.aws_region
+        self.aws_acc = aws_acc or config.aws_account_number
         self.usergroup = usergroup
 
     @property
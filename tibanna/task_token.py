@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""event-driven completion of jobs with step function task tokens.
+
+With ``wait_for_completion_event``, the unicorn step function does not poll
+check_task every 5 minutes while a job runs. The WaitForCompletionAwsem state
+invokes check_task with a task token (waitForTaskToken) and the execution pauses.
+check_task only stores the token as ``<jobid>.task_token`` in the log bucket.
+When the job ends, the instance (awsf3 ``notify_job_completion``) sends the
+task success with that token and the execution moves on to CheckCompletionAwsem,
+which checks the job as before. The event says only that the job should be
+checked, so a success is sent whatever the outcome of the job.
+
+If no event arrives within ``completion_check_interval`` seconds (e.g. the
+instance died), the wait times out and the job is checked anyway. A job that is
+still running goes back to waiting, with a new token. notify_job_completion can
+also be called by an S3 event handler for the ``.success`` / ``.error`` markers."""
+import json
+from . import create_logger
+from .utils import read_s3, put_object_s3, does_key_exist, delete_keys
+from .aws_utils import get_client
+
+
+# markers of a job that ended
+JOB_END_MARKERS = ['.success', '.error', '.aborted']
+# default interval (seconds) of the checks if no completion event arrives
+COMPLETION_CHECK_INTERVAL = 3600
+
+
+logger = create_logger(__name__)
+
+
+def task_token_key(jobid):
+    return jobid + '.task_token'
+
+
+def register_task_token(input_json, task_token):
+    """store the task token of the WaitForCompletionAwsem state of a job in the log bucket.
+    If the job already ended, the task success is sent right away."""
+    cfg = input_json['config']
+    jobid = input_json['jobid']
+    put_object_s3(task_token, task_token_key(jobid), cfg['log_bucket'], public=False,
+                  encrypt_s3_upload=cfg.get('encrypt_s3_upload', False), kms_key_id=cfg.get('kms_key_id'))
+    # the job may have ended before the token was registered
+    if any(does_key_exist(cfg['log_bucket'], jobid + marker, quiet=True) for marker in JOB_END_MARKERS):
+        logger.info("job %s already ended" % jobid)
+        send_task_success(task_token)
+    return {}
+
+
+def send_task_success(task_token):
+    """resume the step function execution waiting with task_token.
+    Returns False if the token is no longer valid (e.g. the wait timed out)."""
+    try:
+        get_client('stepfunctions').send_task_success(taskToken=task_token, output=json.dumps({}))
+    except Exception as e:
+        code = getattr(e, 'response', {}).get('Error', {}).get('Code', '')
+        if code in ['TaskTimedOut', 'TaskDoesNotExist', 'InvalidToken']:
+            logger.info("the task token is no longer valid : %s" % code)
+            return False
+        raise e
+    return True
+
+
+def notify_job_completion(log_bucket, jobid):
+    """send the task success for the registered task token of a job, if any.
+    Returns True if a waiting execution was resumed."""
+    key = task_token_key(jobid)
+    try:
+        task_token = read_s3(log_bucket, key)
+    except Exception as e:
+        logger.info("no task token for job %s : %s" % (jobid, str(e)))
+        return False
+    resumed = send_task_success(task_token)
+    delete_keys([key], log_bucket)
+    return resumed
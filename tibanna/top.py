@@ -1,5 +1,6 @@
 import datetime
 from . import create_logger
+from .columnar import write_table
 
 logger = create_logger(__name__)
 
@@ -211,7 +212,7 @@ class Top(object):
             return reduced_commands
 
     def write_to_csv(self, csv_file, metric='cpu', delimiter=',', colname_for_timestamps='timepoints',
-                     timestamp_start=None, timestamp_end=None, base=0):
+                     timestamp_start=None, timestamp_end=None, base=0, sidecar=False):
         """write metrics as csv file with commands as columns
         :param metric: 'cpu' or 'mem'
         :param delimiter: default ','
@@ -226,6 +227,7 @@ class Top(object):
                               Time points with no top records will be filled with 0.
                               If not specified, the last timestamp in the top commands will be used.
         :param base: default 0. If 0, minutes start with 0, if 1, minutes are 1-based (shifted by 1).
+        :param sidecar: if True, also write a binary copy of the table (<csv_file>.bin, see columnar)
         """
         metric_array = getattr(self, metric + 's')
         if self.timestamps:
@@ -238,25 +240,25 @@ class Top(object):
         else:  # default when timestamps is not available (empty object)
             timestamps_as_minutes = range(0, 5)
             last_minute = 5
-        with open(csv_file, 'w') as fo:
-            # header
-            # we have to escape any double quotes that are present in the cmd, before wrapping it in double quotes. Otherwise we 
-            # will get incorrect column counts when creating the metrics report.
-            fo.write(delimiter.join([colname_for_timestamps] + [Top.wrap_in_double_quotes(cmd.replace('"', '""')) for cmd in self.commands]))
-            fo.write('\n')
-            # contents
-            # skip timepoints earlier than timestamp_start
-            for i in range(0, len(timestamps_as_minutes)):
-                if timestamps_as_minutes[i] >= 0:
-                    break
-            for clock in range(0, last_minute + 1):
-                clock_shifted = clock + base
-                if i < len(timestamps_as_minutes) and timestamps_as_minutes[i] == clock:
-                    fo.write(delimiter.join([str(clock_shifted)] + [str(metric_array[cmd][i]) for cmd in self.commands]))
-                    i += 1
-                else:
-                    fo.write(delimiter.join([str(clock_shifted)] + ['0' for cmd in self.commands]))  # add 0 for timepoints not reported
-                fo.write('\n')
+        # we have to escape any double quotes that are present in the cmd, before wrapping it in double quotes. Otherwise we
+        # will get incorrect column counts when creating the metrics report.
+        colnames = [Top.wrap_in_double_quotes(cmd.replace('"', '""')) for cmd in self.commands]
+        # skip timepoints earlier than timestamp_start
+        for i in range(0, len(timestamps_as_minutes)):
+            if timestamps_as_minutes[i] >= 0:
+                break
+        # the record of each clock, None for timepoints not reported (filled with 0)
+        records = []
+        for clock in range(0, last_minute + 1):
+            if i < len(timestamps_as_minutes) and timestamps_as_minutes[i] == clock:
+                records.append(i)
+                i += 1
+            else:
+                records.append(None)
+        columns = [(colname, [0 if r is None else metric_array[cmd][r] for r in records])
+                   for colname, cmd in zip(colnames, self.commands)]
+        write_table(csv_file, colname_for_timestamps, range(base, last_minute + 1 + base), columns,
+                    delimiter=delimiter, sidecar=sidecar)
 
     def should_skip_process(self, process):
         """A predicate function to check if the process should be skipped (excluded).
@@ -313,19 +315,19 @@ class Top(object):
         :param timestamp_start: start timestamp in the same format (e.g. 01:20:45)
         In the above example, 3 will be the return value.
         """ 
-        dt = cls.as_datetime(timestamp)
-        dt_start = cls.as_datetime(timestamp_start)
-        # negative numbers are not supported by timedelta, so do each case separately
-        if dt > dt_start:
-            return round((dt - dt_start).seconds / 60)
-        else:
-            return -round((dt_start - dt).seconds / 60)
+        return cls.minutes_since(cls.as_datetime(timestamp), cls.as_datetime(timestamp_start))
+
+    @staticmethod
+    def minutes_since(dt, dt_start):
+        """datetime dt as minutes since datetime dt_start"""
+        return round((dt - dt_start).total_seconds() / 60)
 
     def timestamps_as_minutes(self, timestamp_start):
         """convert self.timestamps to a list of minutes since timestamp_start
         :param timestamp_start: timestamp in the same format (e.g. 01:23:45)
         """
-        return [self.as_minutes(t, timestamp_start) for t in self.timestamps]
+        dt_start = self.as_datetime(timestamp_start)
+        return [self.minutes_since(self.as_datetime(t), dt_start) for t in self.timestamps]
 
     @classmethod
     def as_datetime(cls, timestamp):
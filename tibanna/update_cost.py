@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
-import boto3
 import json
 import copy
 from . import create_logger
+from .aws_utils import get_client
 from datetime import datetime, timedelta
 from dateutil.tz import tzutc
 from .core import API
@@ -35,7 +35,7 @@ class UpdateCost(object):
         }
 
         try:
-            client = boto3.client('stepfunctions', region_name=aws_region)
+            client = get_client('stepfunctions', region_name=aws_region)
             unicorn_execution = client.describe_execution(executionArn=sfn_arn)
         except Exception as e:
             done["done"] = True
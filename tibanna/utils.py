@@ -1,14 +1,18 @@
 import random
 import string
-import boto3
 import os
 import mimetypes
 from uuid import uuid4, UUID
 from . import create_logger
+from .aws_utils import (
+    get_client,
+    put_object_with_acl,
+    upload_file_with_acl
+)
 from .vars import (
     _tibanna,
-    EXECUTION_ARN,
-    AWS_REGION
+    config,
+    EXECUTION_ARN
 )
 
 
@@ -47,7 +51,7 @@ def _tibanna_settings(settings_patch=None, force_inplace=False, env=''):
 
 def randomize_run_name(run_name, sfn):
     arn = EXECUTION_ARN(run_name, sfn)
-    client = boto3.client('stepfunctions', region_name=AWS_REGION)
+    client = get_client('stepfunctions', region_name=config.aws_region)
     try:
         response = client.describe_execution(
                 executionArn=arn
@@ -93,14 +97,14 @@ def create_tibanna_suffix(suffix, usergroup):
 
 
 def read_s3(bucket, object_name):
-    response = boto3.client('s3').get_object(Bucket=bucket, Key=object_name)
+    response = get_client('s3').get_object(Bucket=bucket, Key=object_name)
     logger.debug("response_from_read_s3:" +  str(response))
     return response['Body'].read().decode('utf-8', 'backslashreplace')
 
 
 def does_key_exist(bucket, object_name, quiet=False):
     try:
-        file_metadata = boto3.client('s3').head_object(Bucket=bucket, Key=object_name)
+        file_metadata = get_client('s3').head_object(Bucket=bucket, Key=object_name)
     except Exception as e:
         if not quiet:
             print("object %s not found on bucket %s" % (str(object_name), str(bucket)))
@@ -122,7 +126,7 @@ def upload(filepath, bucket, prefix='', public=True, encrypt_s3_upload=False, km
         acl = 'public-read'
     else:
         acl = 'private'
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     if encrypt_s3_upload:
         upload_extra_args = {'ServerSideEncryption': 'aws:kms'}
         if kms_key_id:
@@ -137,17 +141,9 @@ def upload(filepath, bucket, prefix='', public=True, encrypt_s3_upload=False, km
         if content_type is None:
             content_type = 'binary/octet-stream'
         upload_extra_args.update({'ContentType': content_type})
-        try:
-            upload_extra_args.update({'ACL': acl})
-            s3.upload_file(filepath, bucket, key, ExtraArgs=upload_extra_args)
-        except Exception as e:
-            upload_extra_args.update({'ACL': 'private'})
-            s3.upload_file(filepath, bucket, key, ExtraArgs=upload_extra_args)
+        upload_file_with_acl(s3, filepath, bucket, key, acl, upload_extra_args)
     else:
-        try:
-            s3.put_object(Body=b'', Bucket=bucket, Key=prefix, ACL=acl, **upload_extra_args)
-        except Exception as e:
-            s3.put_object(Body=b'', Bucket=bucket, Key=prefix, ACL='private', **upload_extra_args)
+        put_object_with_acl(s3, bucket, acl, Body=b'', Key=prefix, **upload_extra_args)
 
 
 def put_object_s3(content, key, bucket, public=True, encrypt_s3_upload=False, kms_key_id=None):
@@ -155,7 +151,7 @@ def put_object_s3(content, key, bucket, public=True, encrypt_s3_upload=False, km
         acl = 'public-read'
     else:
         acl = 'private'
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     content_type = mimetypes.guess_type(key)[0]
     if content_type is None:
         content_type = 'binary/octet-stream'
@@ -165,16 +161,12 @@ def put_object_s3(content, key, bucket, public=True, encrypt_s3_upload=False, km
             upload_extra_args['SSEKMSKeyId'] = kms_key_id
     else:
         upload_extra_args = {}
-    try:
-        s3.put_object(Body=content.encode('utf-8'), Bucket=bucket, Key=key, ACL=acl,
-                      ContentType=content_type, **upload_extra_args)
-    except Exception as e:
-        s3.put_object(Body=content.encode('utf-8'), Bucket=bucket, Key=key, ACL='private',
-                      ContentType=content_type, **upload_extra_args)
+    put_object_with_acl(s3, bucket, acl, Body=content.encode('utf-8'), Key=key,
+                        ContentType=content_type, **upload_extra_args)
 
 
 def retrieve_all_keys(prefix, bucket):
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     ContinuationToken=''
     keylist = []
     list_input = {'Bucket': bucket, 'Prefix': prefix}
@@ -191,7 +183,7 @@ def retrieve_all_keys(prefix, bucket):
 
 
 def delete_keys(keylist, bucket):
-    s3 = boto3.client('s3')
+    s3 = get_client('s3')
     max_n = 1000  # limit for number of objects to be deleted together
     i_curr = 0
     while(i_curr< len(keylist)):
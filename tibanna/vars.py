@@ -1,6 +1,4 @@
 import os
-import boto3
-import sys
 from datetime import datetime, timezone
 from ._version import __version__
 from . import create_logger
@@ -9,29 +7,78 @@ from . import create_logger
 logger = create_logger(__name__)
 
 
-if boto3.session.Session().get_credentials() is None:
-    logger.info('Please provide AWS credentials.')
-    sys.exit(-1)
-
+class TibannaConfig(object):
+    """AWS account and region info, resolved on first use rather than at import time
+    (resolving the account number requires a call to sts)"""
+
+    def __init__(self):
+        self._aws_account_number = None
+        self._aws_region = None
+
+    @property
+    def aws_account_number(self):
+        if not self._aws_account_number:
+            account = os.environ.get('AWS_ACCOUNT_NUMBER', '')
+            if not account:
+                try:
+                    import boto3
+                    account = boto3.client('sts').get_caller_identity().get('Account')
+                except Exception as e:
+                    raise Exception("Cannot obtain AWS account number. Please provide AWS credentials")
+            self._aws_account_number = account
+        return self._aws_account_number
+
+    @property
+    def aws_region(self):
+        if not self._aws_region:
+            region = os.environ.get('TIBANNA_AWS_REGION', '')
+            if not region:
+                # I'm a lambda
+                region = os.environ.get('AWS_REGION', '')  # reserved variable in lambda
+            # I'm a user
+            if not region:
+                try:
+                    import boto3
+                    region = boto3.session.Session().region_name  # for a user
+                except Exception as e:
+                    raise Exception("Cannot find AWS_REGION: %s" % e)
+            self._aws_region = region
+        return self._aws_region
+
+    @property
+    def s3_access_arn(self):
+        return 'arn:aws:iam::' + self.aws_account_number + ':instance-profile/' + AWS_S3_ROLE_NAME
+
+    @property
+    def base_arn(self):
+        return 'arn:aws:states:' + self.aws_region + ':' + self.aws_account_number + ':%s:%s'
+
+    @property
+    def base_exec_arn(self):
+        return 'arn:aws:states:' + self.aws_region + ':' + self.aws_account_number + ':execution:%s:%s'
+
+    def reset(self):
+        """forget the resolved values (e.g. after changing credentials or region)"""
+        self._aws_account_number = None
+        self._aws_region = None
+
+
+config = TibannaConfig()
+
+# module attributes that are resolved lazily through config, for backward compatibility
+_LAZY_ATTRIBUTES = {
+    'AWS_ACCOUNT_NUMBER': 'aws_account_number',
+    'AWS_REGION': 'aws_region',
+    'S3_ACCESS_ARN': 's3_access_arn',
+    'BASE_ARN': 'base_arn',
+    'BASE_EXEC_ARN': 'base_exec_arn'
+}
 
-# AWS account info
-AWS_ACCOUNT_NUMBER = os.environ.get('AWS_ACCOUNT_NUMBER', '')
-if not AWS_ACCOUNT_NUMBER:
-    try:
-        AWS_ACCOUNT_NUMBER = boto3.client('sts').get_caller_identity().get('Account')
-    except Exception as e:
-        raise Exception("Cannot obtain AWS account number. Please provide AWS credentials")
 
-AWS_REGION = os.environ.get('TIBANNA_AWS_REGION', '')
-if not AWS_REGION:
-    # I'm a lambda
-    AWS_REGION = os.environ.get('AWS_REGION', '')  # reserved variable in lambda
-    # I'm a user
-    if not AWS_REGION:
-        try:
-            AWS_REGION = boto3.session.Session().region_name  # for a user
-        except Exception as e:
-            raise Exception("Cannot find AWS_REGION: %s" % e)
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(config, _LAZY_ATTRIBUTES[name])
+    raise AttributeError("module %s has no attribute %s" % (__name__, name))
 
 
 # Tibanna AMI info
@@ -112,7 +159,6 @@ TIBANNA_AWSF_DIR = 'awsf3'
 
 # Tibanna roles
 AWS_S3_ROLE_NAME = os.environ.get('AWS_S3_ROLE_NAME', 'S3_access')
-S3_ACCESS_ARN = 'arn:aws:iam::' + AWS_ACCOUNT_NUMBER + ':instance-profile/' + AWS_S3_ROLE_NAME
 
 # Profile keys (optional) to use on AWSEM EC2
 TIBANNA_PROFILE_ACCESS_KEY = os.environ.get('TIBANNA_PROFILE_ACCESS_KEY', '')
@@ -155,6 +201,14 @@ DEFAULT_ROOT_EBS_SIZE = 10
 # Default awsf image
 DEFAULT_AWSF_IMAGE = '4dndcic/tibanna-awsf:' + __version__
 
+# Launch templates are shared by jobs with the same EC2 configuration;
+# each job adds a version, which it deletes once its fleet is created. A version that is left behind
+# is deleted after LAUNCH_TEMPLATE_VERSION_MAX_AGE seconds (checked every
+# LAUNCH_TEMPLATE_VERSION_CLEANUP_INTERVAL versions, or when the template reaches its version limit)
+LAUNCH_TEMPLATE_PREFIX = 'TibannaLaunchTemplate_'
+LAUNCH_TEMPLATE_VERSION_MAX_AGE = 300
+LAUNCH_TEMPLATE_VERSION_CLEANUP_INTERVAL = 100
+
 SFN_TYPE = 'unicorn'
 LAMBDA_TYPE = ''
 RUN_TASK_LAMBDA_NAME = 'run_task_awsem'
@@ -162,19 +216,17 @@ CHECK_TASK_LAMBDA_NAME = 'check_task_awsem'
 UPDATE_COST_LAMBDA_NAME = 'update_cost_awsem'
 
 # step function and execution ARN generators
-BASE_ARN = 'arn:aws:states:' + AWS_REGION + ':' + AWS_ACCOUNT_NUMBER + ':%s:%s'
-BASE_EXEC_ARN = 'arn:aws:states:' + AWS_REGION + ':' + AWS_ACCOUNT_NUMBER + ':execution:%s:%s'
 BASE_METRICS_URL = 'https://%s.s3.amazonaws.com/%s.metrics/metrics.html'
 
 METRICS_COLLECTION_INTERVAL = 120 # in seconds, same value as in cloudwatch_agent_config.json
 
 
 def STEP_FUNCTION_ARN(sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME):
-    return BASE_ARN % ('stateMachine', sfn)
+    return config.base_arn % ('stateMachine', sfn)
 
 
 def EXECUTION_ARN(exec_name, sfn=TIBANNA_DEFAULT_STEP_FUNCTION_NAME):
-    return BASE_EXEC_ARN % (sfn, exec_name)
+    return config.base_exec_arn % (sfn, exec_name)
 
 
 def METRICS_URL(log_bucket, job_id):
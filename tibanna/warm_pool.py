@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""warm pool of instances that run several jobs one after another.
+
+A job with config.warm_pool launches an instance as usual, but after the job
+the instance stays in the pool for warm_pool_idle_min minutes, waiting for
+a new job of the same pool, instead of shutting down. The pool lives in the
+log bucket under ``<prefix><pool>/`` :
+ - ``idle/<instance_id>.json`` : an idle instance (instance type, config and
+   heartbeat). The heartbeat is refreshed every WARM_POOL_HEARTBEAT seconds.
+ - ``assign/<instance_id>.json`` : the mailbox of an idle instance. run_task
+   hands a job to an idle instance by creating it with the job id, and the
+   instance closes it before it terminates. Both use conditional writes, so a
+   job is handed to at most one instance and never to a terminating one.
+The instance cleans the data directory (keeping the docker images) and runs
+the new job with the run json uploaded by run_task."""
+import json
+import time
+from . import create_logger
+from .aws_utils import get_client
+
+
+WARM_POOL_PREFIX = '.tibanna_pool/'
+WARM_POOL_IDLE_MIN = 10
+# an idle instance refreshes its heartbeat this often (seconds) and is ignored if it misses three
+WARM_POOL_HEARTBEAT = 60
+# an idle instance checks its mailbox this often (seconds)
+WARM_POOL_POLL_INTERVAL = 10
+# config fields that must be identical for a job to run on an idle instance
+# (the data EBS of the instance must also be at least as large as the ebs_size of the job)
+WARM_POOL_CONFIG_FIELDS = ['awsf_image', 'spot_instance', 'ebs_type', 'ebs_iops', 'ebs_throughput',
+                           'subnet', 'security_group', 'encrypt_s3_upload', 'kms_key_id',
+                           'disable_metrics_collection', 'singularity']
+CLOSED = 'closed'
+
+
+logger = create_logger(__name__)
+
+
+class WarmPool(object):
+
+    def __init__(self, name, bucket, encrypt_s3_upload=False, kms_key_id=None, prefix=WARM_POOL_PREFIX):
+        self.name = name
+        self.bucket = bucket
+        self.encrypt_s3_upload = encrypt_s3_upload
+        self.kms_key_id = kms_key_id
+        self.prefix = prefix + name + '/'
+
+    def key(self, kind, instance_id):
+        return self.prefix + kind + '/' + instance_id + '.json'
+
+    def put(self, key, content, create_only=False):
+        """put a json object. With create_only, returns False if the object already exists"""
+        kwargs = {'Bucket': self.bucket, 'Key': key, 'Body': json.dumps(content).encode('utf-8'),
+                  'ContentType': 'application/json'}
+        if self.encrypt_s3_upload:
+            kwargs['ServerSideEncryption'] = 'aws:kms'
+            if self.kms_key_id:
+                kwargs['SSEKMSKeyId'] = self.kms_key_id
+        if create_only:
+            kwargs['IfNoneMatch'] = '*'
+        try:
+            get_client('s3').put_object(**kwargs)
+        except Exception as e:
+            if create_only and error_code(e) in ['PreconditionFailed', 'ConditionalRequestConflict']:
+                return False
+            raise
+        return True
+
+    def get(self, key):
+        """a json object, None if it does not exist"""
+        try:
+            res = get_client('s3').get_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            if error_code(e) in ['NoSuchKey', '404']:
+                return None
+            raise
+        return json.loads(res['Body'].read().decode('utf-8'))
+
+    def delete(self, key):
+        get_client('s3').delete_object(Bucket=self.bucket, Key=key)
+
+    # run_task side
+
+    def idle_instances(self):
+        """idle instances with a recent heartbeat, the most recent first"""
+        instances = []
+        paginator = get_client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + 'idle/'):
+            for item in page.get('Contents', []):
+                try:
+                    instance = self.get(item['Key'])
+                except Exception as e:
+                    logger.debug("cannot read %s : %s" % (item['Key'], str(e)))
+                    continue
+                if instance and time.time() - instance.get('heartbeat', 0) < 3 * WARM_POOL_HEARTBEAT:
+                    instances.append(instance)
+        return sorted(instances, key=lambda i: i['heartbeat'], reverse=True)
+
+    def hand_off(self, jobid, accept):
+        """hand the job to an idle instance for which accept(instance) is True.
+        Returns the instance (dictionary) or None if no idle instance took the job."""
+        for instance in self.idle_instances():
+            if not accept(instance):
+                continue
+            if self.put(self.key('assign', instance['instance_id']), {'jobid': jobid, 'assigned': time.time()},
+                        create_only=True):
+                return instance
+            # the instance took another job or is terminating
+        return None
+
+    # instance side
+
+    def wait_for_job(self, instance_id, instance_type, config, idle_min=WARM_POOL_IDLE_MIN):
+        """called by an instance after a job. Returns the id of the next job,
+        or None if no job was handed to the instance for idle_min minutes"""
+        assign_key = self.key('assign', instance_id)
+        idle_key = self.key('idle', instance_id)
+        instance = {'instance_id': instance_id, 'instance_type': instance_type,
+                    'config': {field: config.get(field) for field in WARM_POOL_CONFIG_FIELDS + ['ebs_size']}}
+        self.delete(assign_key)  # mailbox of the previous job
+        deadline = time.time() + idle_min * 60
+        heartbeat = 0
+        try:
+            while True:
+                if time.time() - heartbeat >= WARM_POOL_HEARTBEAT:
+                    heartbeat = time.time()
+                    self.put(idle_key, dict(instance, heartbeat=heartbeat, until=deadline))
+                assigned = self.get(assign_key)
+                if assigned:
+                    return assigned.get('jobid')
+                if time.time() >= deadline and self.put(assign_key, {'jobid': None, 'status': CLOSED},
+                                                        create_only=True):
+                    return None
+                time.sleep(WARM_POOL_POLL_INTERVAL)
+        finally:
+            self.delete(idle_key)
+
+
+def error_code(e):
+    """error code of a botocore ClientError (None for other exceptions)"""
+    return getattr(e, 'response', {}).get('Error', {}).get('Code')
+
+
+def is_compatible(instance, instance_types, cfg):
+    """True if a job with the candidate instance types and config (Config) can run on an idle instance.
+    Jobs with ssh access (password or key_name, which are not in the run json) always get a new instance."""
+    if cfg.password or cfg.key_name or instance.get('instance_type') not in instance_types:
+        return False
+    config = instance.get('config', {})
+    if any(config.get(field) != getattr(cfg, field, None) for field in WARM_POOL_CONFIG_FIELDS):
+        return False
+    return (config.get('ebs_size') or 0) >= cfg.ebs_size